@@ -15,6 +15,7 @@ Usage: (from inside a multicrab_AnalysisType_vXYZ_TimeStamp directory)
 hplusMergeHistograms.py
 hplusMergeHistograms.py --includeTasks WZ --filesInEOS -v
 hplusMergeHistograms.py --filesInEOS --deleteMergedFilesFirst -s
+hplusMergeHistograms.py -j 8 --filesPerMerge 20
 
 Useful Links:
 https://twiki.cern.ch/twiki/bin/viewauth/CMS/HiggsChFullyHadronic
@@ -33,12 +34,14 @@ import tarfile
 import getpass
 import socket
 import time
+import tempfile
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
+import HiggsAnalysis.NtupleAnalysis.tools.fileMetadata as fileMetadata
 from HiggsAnalysis.NtupleAnalysis.tools.ShellStyles import *
 
 #================================================================================================
@@ -993,8 +996,9 @@ def sanityCheck(mergedFile, inputFiles):
     
 def delete(fileName, regexp, opts):
     '''
-    Delete a folder matching the regular expression "regexp"
-    from the fileName passed as argument.
+    Delete the folders matching the regular expression "regexp"
+    (or a list of regular expressions) from the fileName passed as argument.
+    The file is opened only once for all of them.
 
     To open a ROOT file on EOS (LXPLUS):
     TFile *f = TFile::Open("root://eoscms//eos/cms//store/user/attikis/CRAB3_TransferData/WZ_TuneCUETP8M1_13TeV-pythia8/crab_WZ/160921_141816/0000/histograms-WZ-1.root")
@@ -1008,6 +1012,8 @@ def delete(fileName, regexp, opts):
     Verbose("delete()", False)
     
     # Definitions
+    if isinstance(regexp, basestring):
+        regexp = [regexp]
     prefix = ""
     if opts.filesInEOS:
         prefix = GetXrdcpPrefix(opts)
@@ -1028,10 +1034,12 @@ def delete(fileName, regexp, opts):
             dir = fIN.GetDirectory(keyName)
             if dir:
                 fIN.cd(keyName)
-                Verbose("Deleting folder \"%s\" in file %s." % (regexp, fileName) )
-                delFolder(regexp)
+                for r in regexp:
+                    Verbose("Deleting folder \"%s\" in file %s." % (r, fileName) )
+                    delFolder(r)
                 fIN.cd()
-    delFolder(regexp)
+    for r in regexp:
+        delFolder(r)
     fIN.Close()
     return
 
@@ -1401,47 +1409,199 @@ def GetMergeCommand(mergeName, inputFiles, opts):
     #return " ".join(cmd)
 
 
-#@timeout(1) # 5 seconds timeout for this function
-def MergeFiles(mergeName, inputFiles, opts):
+def WriteFileMetadataIndex(mergeFiles, opts):
     '''
-    Merges ROOT files, either stored locally or on EOS.
+    Records the number of entries and the configInfo metadata of the merged
+    ROOT files in the file metadata index of the multicrab directory, so that
+    the analysis does not need to open the files for TChain.GetEntries().
+    Files in EOS are indexed on first use by the analysis instead.
     '''
-    Verbose("Attempting to merge:\n\t%s\n\tto\n\t%s." % ("\n\t".join(inputFiles), mergeName) )
+    Verbose("WriteFileMetadataIndex()")
+    if opts.filesInEOS or len(mergeFiles) == 0:
+        return
+    index = fileMetadata.MetadataIndex(os.path.join(os.getcwd(), fileMetadata.indexFileName))
+    # For-loop: All merged files
+    for i, f in enumerate(mergeFiles, 1):
+        PrintProgressBar("Write file metadata index", i-1, len(mergeFiles), os.path.basename(f))
+        index.get(f)
+        PrintProgressBar("Write file metadata index", i, len(mergeFiles), os.path.basename(f))
+    index.save()
+    FinishProgressBar()
+    return
 
-    if len(inputFiles) < 1:
-        raise Exception("Attempting to merge 0 files! Somethings was gone wrong!")
-    elif len(inputFiles) == 1:
-        if opts.filesInEOS:
-            prefix   = GetXrdcpPrefix(opts)
-            srcFile  = prefix + inputFiles[0]
-            if "fnal" in socket.gethostname():
-                srcFile  = srcFile.replace("/eos/uscms/", "") # do not use the FUSE mount
-            destFile = prefix + mergeName
-            
-            # Construct the command to be executed
-            cmd  = "xrdcp "
-            # Need to replace any existing output file?
-            if opts.overwrite:
-                cmd += "--force "
-            cmd += " %s %s" % (srcFile, destFile)
-            Verbose(cmd)
-            ret = Execute(cmd)
-            ret = 0
+
+#================================================================================================ 
+# Class Definition
+#================================================================================================ 
+class MergeJob:
+    '''
+    One merged ROOT file of a task: the input files, the merge command (hadd, cp or xrdcp)
+    and the timing of the merging and the cleaning
+    '''
+    def __init__(self, taskName, crabDir, mergeName, inputFiles, opts):
+        self.taskName   = taskName
+        self.crabDir    = crabDir
+        self.mergeName  = mergeName
+        self.inputFiles = inputFiles
+        self.cmd        = GetMergeCommand(mergeName, inputFiles, opts)
+        self.verbose    = opts.verbose
+        self.process    = None
+        self.logFile    = None
+        self.timeStart  = None
+        self.mergeTime  = 0.0
+        self.cleanTime  = 0.0
+        self.size       = None
+        return
+
+    def start(self):
+        '''
+        Starts the merge command as a subprocess, its output goes to a temporary file
+        '''
+        cmd = self.cmd
+        if isinstance(cmd, list):
+            Verbose(" ".join(cmd), True)
         else:
-            Verbose("cp %s %s" % (inputFiles[0], mergeName) )
-            if not opts.test:
-                shutil.copy(inputFiles[0], mergeName)
-                os.system("chmod u+r,g+r,o+r %s"%mergeName)
-            ret=0
-    else:
+            Verbose(cmd, True)
+        args = {"shell": not isinstance(cmd, list), "close_fds": True}
+        if not self.verbose:
+            self.logFile = tempfile.TemporaryFile()
+            args.update({"stdout": self.logFile, "stderr": subprocess.STDOUT})
+        self.timeStart = time.time()
+        self.process   = subprocess.Popen(cmd, **args)
+        return
+
+    def poll(self):
+        '''
+        Returns the exit code of the merge command, or None if it is still running
+        '''
+        ret = self.process.poll()
+        if ret is not None and self.mergeTime == 0.0:
+            self.mergeTime = time.time()-self.timeStart
+        return ret
+
+    def getOutput(self):
+        if self.logFile is None:
+            return ""
+        self.logFile.seek(0)
+        return self.logFile.read()
+
+    def close(self):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+        return
+
+
+#================================================================================================ 
+# Class Definition
+#================================================================================================ 
+class MergeScheduler:
+    '''
+    Runs the merge commands of all tasks as concurrent subprocesses, at most opts.jobs
+    at a time (and at most opts.maxStreams when reading the files from EOS with xrootd).
+
+    While the merges are running, each merged file is post-processed in this process
+    as soon as its merge has finished: the configInfo control histogram is checked,
+    the duplicate folders are deleted, the pileup histograms are written and (with
+    --deleteImmediately) the input files are deleted. PyROOT is used only from this
+    process, the subprocesses are plain hadd/cp/xrdcp commands.
+    '''
+    def __init__(self, opts):
+        self.opts     = opts
+        self.maxJobs  = max(1, opts.jobs)
         if opts.filesInEOS:
-            ret = hadd(opts, mergeName, inputFiles, GetXrdcpPrefix(opts) )
-            Verbose("Done %s (%s GB)." % (mergeName, GetFileSize(mergeName, opts) ), False )
-        else:
-            ret = hadd(opts, mergeName, inputFiles)    
-            Verbose("Done %s (%s GB)." % (mergeName, GetFileSize(mergeName, opts) ), False )
-            os.system("chmod u+r,g+r,o+r %s"%mergeName)
-    return ret
+            self.maxJobs = min(self.maxJobs, max(1, opts.maxStreams))
+        self.pending  = []
+        self.running  = []
+        self.finished = []
+        self.failed   = []
+        self.foldersToDelete = ["Generated", "Commit", "dataVersion"]
+        return
+
+    def add(self, job):
+        self.pending.append(job)
+        return
+
+    def run(self):
+        '''
+        Merges all scheduled files. Once a merge fails, no new merges are started.
+        Returns 0 if all merges succeeded, 1 otherwise.
+        '''
+        self.nTotal    = len(self.pending)
+        self.timeStart = time.time()
+        if self.nTotal == 0:
+            return 0
+        Verbose("Merging %d file(s) with %d parallel job(s)" % (self.nTotal, self.maxJobs), True)
+
+        while len(self.running) > 0 or (len(self.pending) > 0 and len(self.failed) == 0):
+            # Keep the pool full
+            while len(self.running) < self.maxJobs and len(self.pending) > 0 and len(self.failed) == 0:
+                job = self.pending.pop(0)
+                job.start()
+                self.running.append(job)
+                self._printProgress(job)
+
+            # Post-process the merges that have finished
+            done = [job for job in self.running if job.poll() is not None]
+            for job in done:
+                self.running.remove(job)
+                self._finish(job)
+                self._printProgress(job)
+            if len(done) == 0:
+                time.sleep(0.2)
+        FinishProgressBar()
+
+        if len(self.failed) > 0:
+            msg = "%d/%d merge(s) failed:\n\t%s" % (len(self.failed), self.nTotal, "\n\t".join([j.mergeName for j in self.failed]))
+            Print(ErrorStyle() + msg + NormalStyle(), True)
+            return 1
+        return 0
+
+    def _finish(self, job):
+        '''
+        Post-processing of a merged file
+        '''
+        ret = job.process.returncode
+        if ret != 0:
+            FinishProgressBar()
+            output = job.getOutput()
+            if output != "":
+                print output
+            Print("Merging %s failed with exit code %d" % (job.mergeName, ret), True)
+            job.close()
+            self.failed.append(job)
+            return
+        job.close()
+
+        if not self.opts.filesInEOS:
+            os.system("chmod u+r,g+r,o+r %s" % job.mergeName)
+        job.size = GetFileSize(job.mergeName, self.opts)
+        Verbose("Done %s (%s GB)." % (job.mergeName, job.size), False )
+
+        # Sanity check
+        CheckControlHisto(job.taskName, job.mergeName, job.inputFiles)
+
+        # Delete folders & add pile-up histos
+        time_start = time.time()
+        DeleteFolders(job.mergeName, self.foldersToDelete, self.opts)
+        WritePileupHistos(job.mergeName, self.opts)
+        job.cleanTime = time.time()-time_start
+
+        # Delete all input files after merging them
+        if self.opts.deleteImmediately:
+            DeleteFiles(job.taskName, job.mergeName, job.inputFiles, self.opts)
+
+        self.finished.append(job)
+        return
+
+    def _printProgress(self, job):
+        nDone   = len(self.finished) + len(self.failed)
+        sizeGB  = sum([j.size for j in self.finished if j.size != None])
+        elapsed = time.strftime("%H:%M:%S", time.gmtime(time.time()-self.timeStart))
+        suffix  = "%d/%d done, %d running, %d failed, %0.2f GB, %s [%s]" % (nDone, self.nTotal, len(self.running), len(self.failed), sizeGB, elapsed, os.path.basename(job.mergeName))
+        PrintProgressBar("Merge  ", nDone-1, self.nTotal, suffix.ljust(100))
+        return
+
 
 def PrintSummary(taskReports):
     '''
@@ -1730,10 +1890,7 @@ def DeleteFolders(filePath, foldersToDelete, opts):
         return
         
     Verbose("Will delete the following folders:\n\t%s\n\tfrom file %s" % ("\n\t".join(foldersToDelete), filePath) )
-    # For-loop: All folders to be deleted
-    for i, folder in enumerate(foldersToDelete, 1):
-        Verbose("Deleting folder \"%s\"" % (folder), i==1) 
-        delete(filePath, folder, opts)
+    delete(filePath, foldersToDelete, opts)
     return
 
 
@@ -1981,6 +2138,8 @@ def main(opts, args):
     mergeSizeMap = {}
     mergeTimeMap = {}
     cleanTime    = {}
+    taskFilesExist = {}
+    scheduler    = MergeScheduler(opts)
 
     # For-loop: All task names
     Verbose("Looping over all tasks in %s" % (opts.dirName), True)
@@ -2117,123 +2276,44 @@ def main(opts, args):
             else:
                 Verbose("%s, merge file  %s does not already exist. Will create it" % (taskName, mergeName) )
 
-            # Merge the ROOT files
-            #mergePath = "/".join(mergeName.split("/")[-1:]) #fits terminal, [-6:] is too big to fit
-            mergeFile = os.path.basename(mergeName)
-            nInputs   = len(inputFiles)
-            firstFile = os.path.basename(inputFiles[0])
-            lastFile  = os.path.basename(inputFiles[-1])
-            PrintProgressBar(taskName + ", Merge  ", index-1, len(filesSplit), "[" + mergeFile + " using %s file(s): %s to %s]" % (nInputs, firstFile, lastFile) )
-
-            # Time the merging process
-            time_start = time.time()
-            ret = -1
-            cmd = GetMergeCommand(mergeName, inputFiles, opts)
-#            try:
-            ret = MergeFiles(mergeName, inputFiles, opts)
-#            except TimeoutError, e:
-#                dt_timeout = time.time() - time_start
-#                print
-#                msg  = "Timed-out (%.2f seconds) trying to create %s using %s files(s): %s to %s" % (dt_timeout, mergeFile, nInputs, firstFile, lastFile)
-#                Print(msg, True)
-#                Print("Command invoked was:\n" +  " ".join(cmd), False)
-                #for c in cmd:
-                #   print c
-#                sys.exit()
-
-            time_end = time.time()
-            dtMerge = time_end-time_start
-            if ret != 0:
-                Verbose("MergeFiles() returned %s" % (ret))
-                return ret
-            else:
-                Verbose("MergeFiles() returned %s" % (ret) )
-                pass
+            # Schedule the merging of the ROOT files
+            scheduler.add(MergeJob(taskName, d, mergeName, inputFiles, opts))
 
-            # Get the file size
-            mergeFileSize = GetFileSize(mergeName, opts)
-            if len(filesSplit) > 1 and not mergeFileSize == None:
-                Verbose("Merged %s (%0.3f GB)." % (mergeName, mergeFileSize), False )
-
-            # Keep track of merged files
-            mergeFileMap[mergeName] = inputFiles
-            mergeSizeMap[mergeName] = mergeFileSize
-            mergeTimeMap[mergeName] = dtMerge
-
-            # Sanity check
-            CheckControlHisto(taskName, mergeName, inputFiles)
-
-            # Delete all input files after merging them
-            if opts.deleteImmediately:
-                DeleteFiles(taskName, mergeName, inputFiles, opts)
-
-            # Update Progress bar
-            PrintProgressBar(taskName + ", Merge  ", index, len(filesSplit), "[" + mergeFile + " using %s files: %s to %s]" % (len(inputFiles), firstFile, lastFile) )            
-            #PrintProgressBar(taskName + ", Merge  ", index, len(filesSplit), "[" + mergePath + "]")
-
-        # Flush stdout
-        FinishProgressBar()
         if taskName not in taskReports.keys():
-            taskReports[taskName] = Report( taskName, mergeFileMap, mergeSizeMap, mergeTimeMap, filesExist)
+            taskFilesExist[d] = filesExist
 
     if opts.test:
         return
 
+    # Merge the files of all tasks. Each merged file is cleaned (folders deleted, pileup histograms added) as soon as its merge has finished
+    ret = scheduler.run()
+
     # Append "delete" message
     deleteMsg = GetDeleteMessage(opts)
     Verbose("Merged files%s:" % (deleteMsg), False)
-    
-    foldersToDelete = ["Generated", "Commit", "dataVersion"]
-    # For-loop: All merged files
-    for index, key in enumerate(mergeFileMap.keys(), 0):
-        f = key
-        sourceFiles = mergeFileMap[key]
-        taskName = key.split("/")[0]
-        if opts.filesInEOS:
-            taskNameEOS = key.replace(GetEOSHomeDir(opts) + "/", "").split("/")[0]
-            taskName    = taskNameEOS.replace("-", "_")
-        Verbose("Merge file:\n\t%s" % (f), True)
-        Verbose("Source files:\n\t%s" % ("\n\t".join(sourceFiles)), False) 
 
-        if opts.filesPerMerge == 1:
-            PrintProgressBar(taskNameMapR[taskNameEOS] + ", Clean  ", 99, 100, "[Skipped because filesPerMerge=%s]" % (opts.filesPerMerge))
-            break
+    # For-loop: All merged files
+    for job in scheduler.finished:
+        mergeFileMap[job.mergeName] = job.inputFiles
+        cleanTime[job.crabDir] = cleanTime.get(job.crabDir, 0.0) + job.cleanTime
 
-        # Delete folders & Calculate the clean-time (in seconds)
-        Verbose("%s [from %d file(s)]" % (f, len(sourceFiles)), True)
-        time_start = time.time()
-        DeleteFolders(f, foldersToDelete, opts)
-        time_end = time.time()
-        dtClean  = (time_end-time_start)
-        
-        # Save the total clean time for this task
-        if taskName not in cleanTime.keys():
-            cleanTime[taskName] = dtClean 
-        else:
-            cleanTime[taskName] = cleanTime[taskName] + dtClean
-            
         # Delete files after merging?
-        if opts.delete and not opts.deleteImmediately:
-            DeleteFiles(taskName, f, sourceFiles, opts)
+        if ret == 0 and opts.delete and not opts.deleteImmediately:
+            DeleteFiles(job.taskName, job.mergeName, job.inputFiles, opts)
 
-        # Add pile-up histos
-        WritePileupHistos(f, opts)
+    if ret != 0:
+        return ret
 
-        # Update Progress bar
-        if opts.filesInEOS:
-            PrintProgressBar(taskNameMapR[taskNameEOS] + ", Clean ", index, len(mergeFileMap.keys()), "[" + os.path.basename(f) + "]")
-        else:
-            PrintProgressBar(taskName + ", Clean ", index, len(mergeFileMap.keys()), "[" + os.path.basename(f) + "]")            
+    # Create the reports of the merged tasks
+    for crabDir, filesExist in taskFilesExist.iteritems():
+        taskName = crabDir.replace("/", "")
+        jobs = [job for job in scheduler.finished if job.crabDir == crabDir]
+        taskReports[taskName] = Report( taskName, dict([(j.mergeName, j.inputFiles) for j in jobs]), dict([(j.mergeName, j.size) for j in jobs]), dict([(j.mergeName, j.mergeTime) for j in jobs]), filesExist)
+        taskReports[taskName].SetCleanTime( cleanTime.get(crabDir, 0.0) )
 
-    # Flush stdout
-    FinishProgressBar()
+    # Record the entry counts of the merged files
+    WriteFileMetadataIndex(mergeFileMap.keys(), opts)
 
-    # Calculate the total clean times
-    for taskName in taskReports.keys():
-        if opts.filesInEOS:
-            eos = taskNameMap[taskName].replace("-", "_")
-            if eos in cleanTime.keys():
-                taskReports[taskName].SetCleanTime( cleanTime[eos] )
 
     # Print summary table using reports
     PrintSummary(taskReports)
@@ -2268,6 +2348,8 @@ if __name__ == "__main__":
     SKIPVERIFY    = False
     MAXFILESIZE   = 2.0
     DELETEFIRST   = False
+    JOBS          = 1
+    MAXSTREAMS    = 4
 
     parser = OptionParser(usage="Usage: %prog [options]")
     # multicrab.addOptions(parser)
@@ -2322,6 +2404,12 @@ if __name__ == "__main__":
     parser.add_option("-m", "--maxFileSize", dest="maxFileSize", default=MAXFILESIZE, type="float",
                       help="The maximum file size (in GB) allowed for each merged ROOT file. [default: %s]" % (MAXFILESIZE))
 
+    parser.add_option("-j", "--jobs", dest="jobs", default=JOBS, type="int",
+                      help="Maximum number of merge (hadd) processes to run in parallel, over all tasks (1 merges one file at a time as before). [default: %s]" % (JOBS))
+
+    parser.add_option("--maxStreams", dest="maxStreams", default=MAXSTREAMS, type="int",
+                      help="Maximum number of parallel merges reading from EOS with xrootd (with --filesInEOS). [default: %s]" % (MAXSTREAMS))
+
     (opts, args) = parser.parse_args()
 
     if opts.dirName == "":
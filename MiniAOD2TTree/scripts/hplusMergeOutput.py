@@ -39,6 +39,7 @@ ROOT.gROOT.SetBatch(True)
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
+import HiggsAnalysis.NtupleAnalysis.tools.fileMetadata as fileMetadata
 from HiggsAnalysis.NtupleAnalysis.tools.ShellStyles import *
 
 #================================================================================================
@@ -1565,6 +1566,27 @@ def MergeFiles(mergeName, inputFiles, opts):
 
     return ret
 
+def WriteFileMetadataIndex(mergeFiles, opts):
+    '''
+    Records the number of entries and the configInfo metadata of the merged
+    ROOT files in the file metadata index of the multicrab directory, so that
+    the analysis does not need to open the files for TChain.GetEntries().
+    Files in EOS are indexed on first use by the analysis instead.
+    '''
+    Verbose("WriteFileMetadataIndex()")
+    if opts.filesInEOS or len(mergeFiles) == 0:
+        return
+    index = fileMetadata.MetadataIndex(os.path.join(os.getcwd(), fileMetadata.indexFileName))
+    # For-loop: All merged files
+    for i, f in enumerate(mergeFiles, 1):
+        PrintProgressBar("Write file metadata index", i-1, len(mergeFiles), os.path.basename(f))
+        index.get(f)
+        PrintProgressBar("Write file metadata index", i, len(mergeFiles), os.path.basename(f))
+    index.save()
+    FinishProgressBar()
+    return
+
+
 def PrintSummary(mcrabTask):
     '''
     Self explanatory
@@ -2253,6 +2275,12 @@ def main(opts, args):
     Verbose("Merging completed! Now to clean duplicate folders and write PU histos", True)
     mcrabTask = DeleteFoldersAndWritePU(mcrabTask)
 
+    # Record the entry counts of the merged files
+    mergeFiles = []
+    for crabTask in mcrabTask.GetCrabTaskObjects():
+        mergeFiles.extend(crabTask.GetMergedFiles())
+    WriteFileMetadataIndex(mergeFiles, opts)
+
     # Print summary table using reports
     PrintSummary(mcrabTask)
     return 0
@@ -4,16 +4,61 @@
 # Needed for checking how the analysis is affected if the trigger rate
 # is dropped to 0.9, 0.8 or 0.5 of the gathered integrated lumi
 # 01122016/S.Lehti
+#
+# The kept events are selected with a seeded hash of (run, lumi, event),
+# so the same events are kept in every run with the same seed. The
+# configInfo event counters are scaled with the fraction of events
+# actually kept. lumi.json is copied unchanged (the integrated luminosity
+# stays the same when the trigger rate is dropped), unless --scaleLumi is
+# given. The files are processed in parallel.
 
 import sys
 import os
 import re
-import random
+import json
+import multiprocessing
+from optparse import OptionParser
 import ROOT
 
+## configInfo histograms that count events (scaled with the kept fraction)
+_eventCountHistograms = ["SkimCounter", "topPtWeightAllEvents", "pileup", "pileup_up", "pileup_down"]
+
+## Compiled event selection, fills a TEntryList with the kept entries.
+# The hash is splitmix64 of the combined (seed, run, lumi, event), mapped to [0, 1).
+_selectionCode = """
+#include "TTree.h"
+#include "TBranch.h"
+#include "TEntryList.h"
+
+void hplusReduceRateSelect(TTree *tree, TEntryList *elist, double fraction, ULong64_t seed) {
+  UInt_t run = 0, lumi = 0;
+  ULong64_t event = 0;
+  TBranch *bRun = tree->GetBranch("run");
+  TBranch *bLumi = tree->GetBranch("lumi");
+  TBranch *bEvent = tree->GetBranch("event");
+  bRun->SetAddress(&run);
+  bLumi->SetAddress(&lumi);
+  bEvent->SetAddress(&event);
+  Long64_t nEntries = tree->GetEntries();
+  for (Long64_t i = 0; i < nEntries; ++i) {
+    bRun->GetEntry(i);
+    bLumi->GetEntry(i);
+    bEvent->GetEntry(i);
+    ULong64_t x = seed*0x9E3779B97F4A7C15ULL + run*0xBF58476D1CE4E5B9ULL + lumi*0x94D049BB133111EBULL + event;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    x = x ^ (x >> 31);
+    if (x / 18446744073709551616.0 < fraction)
+      elist->Enter(i);
+  }
+  tree->ResetBranchAddresses();
+}
+"""
+_selectionDeclared = False
+
 def usage():
     print
-    print "### Usage:   ",os.path.basename(sys.argv[0])," <multicrabdir> <fraction to be kept>"
+    print "### Usage:   ",os.path.basename(sys.argv[0])," [--seed N] [-j N] [--scaleLumi] <multicrabdir> <fraction to be kept>"
     print "### Example: ",os.path.basename(sys.argv[0])," multicrab_SignalAnalysis 0.8"
     print
     sys.exit()
@@ -40,21 +85,53 @@ def isdatadir(dIN):
         return True
     return False
 
-def reduce(dIN,subdir,dOUT,fraction):
+def selectEntries(tree, fraction, seed):
+    '''
+    Returns a TEntryList of the entries of the kept events
+    '''
+    global _selectionDeclared
+    if not _selectionDeclared:
+        ROOT.gInterpreter.Declare(_selectionCode)
+        _selectionDeclared = True
+    elist = ROOT.TEntryList("keptEvents", "keptEvents", tree)
+    ROOT.hplusReduceRateSelect(tree, elist, fraction, seed)
+    return elist
+
+def reduce(dIN,subdir,dOUT):
+    '''
+    Creates the output directory of a data dataset, returns the list of (input file, output file) pairs
+    '''
     print "Copying",os.path.basename(subdir)
     if not os.path.exists(os.path.join(dOUT,subdir)):
         os.mkdir(os.path.join(dOUT,subdir))
         os.mkdir(os.path.join(dOUT,subdir,"results"))
     files = execute("ls %s"%os.path.join(dIN,subdir,"results","histo*.root"))
-    for fIN in files:
-        fOUT = os.path.join(dOUT,subdir,"results",os.path.basename(fIN))
-        copyfile(fIN,fOUT,fraction)
-
-def copyfile(fnameIN,fnameOUT,fraction):
+    return [(fIN, os.path.join(dOUT,subdir,"results",os.path.basename(fIN))) for fIN in files]
 
+def copyfile(fnameIN,fnameOUT,fraction,seed):
+    '''
+    Copies a file keeping a fraction of the events, returns the numbers of (kept, all) events
+    '''
     fIN = ROOT.TFile.Open(fnameIN,"R")
     fOUT = ROOT.TFile.Open(fnameOUT,"RECREATE")
 
+    # Copy the kept events in bulk
+    nAll = 0
+    nKept = 0
+    treeIN = fIN.Get("Events")
+    if treeIN:
+        nAll = treeIN.GetEntries()
+        elist = selectEntries(treeIN, fraction, seed)
+        treeIN.SetEntryList(elist)
+        fOUT.cd()
+        treeOUT = treeIN.CopyTree("")
+        nKept = treeOUT.GetEntries()
+        treeOUT.Write()
+        #print "check Events",treeIN.GetEntries(),treeOUT.GetEntries()
+    keptFraction = 1.0
+    if nAll > 0:
+        keptFraction = float(nKept)/nAll
+
     fIN.cd()
     keys = fIN.GetListOfKeys()
     for i in range(len(keys)):
@@ -64,16 +141,6 @@ def copyfile(fnameIN,fnameOUT,fraction):
             fOUT.cd()
 
             if keyName == "Events":
-                treeIN = fIN.Get(keyName)
-                treeOUT = treeIN.CloneTree(0)
-
-                for i in range(treeIN.GetEntries()):
-                    if random.random() > fraction:
-                        continue
-                    treeIN.GetEntry(i)
-                    treeOUT.Fill()
-                    
-                #print "check Events",treeIN.GetEntries(),treeOUT.GetEntries()
                 continue
 
             if dir:
@@ -82,6 +149,9 @@ def copyfile(fnameIN,fnameOUT,fraction):
                 subKeys = dir.GetListOfKeys()
                 for skey in subKeys:
                     tobj = fIN.Get(os.path.join(keyName,skey.GetName()))
+                    # Keep the event counters consistent with the kept events
+                    if keyName == "configInfo" and skey.GetName() in _eventCountHistograms and isinstance(tobj, ROOT.TH1):
+                        tobj.Scale(keptFraction)
                     tobj.Write()
                 continue
                 
@@ -89,7 +159,11 @@ def copyfile(fnameIN,fnameOUT,fraction):
 
     fOUT.Close()
     fIN.Close()
-    
+    return (nKept, nAll)
+
+def _copyfileForPool(args):
+    return copyfile(*args)
+
 def execute(cmd):
     f = os.popen4(cmd)[1]
     ret=[]
@@ -98,15 +172,15 @@ def execute(cmd):
     f.close()
     return ret
 
-def main():
+def main(opts, args):
     
-    if len(sys.argv) < 3:
+    if len(args) < 2:
         usage()
 
     multicrabdir = ""
     fraction = 1.0
 
-    for arg in sys.argv[1:]:
+    for arg in args:
         if os.path.exists(arg) and os.path.isdir(arg):
             multicrabdir = arg
         else:
@@ -119,20 +193,65 @@ def main():
 
     if not os.path.exists(newmulticrabdir):
         os.mkdir(newmulticrabdir)
-    copy(os.path.join(multicrabdir,"lumi.json"),newmulticrabdir)
+    if not opts.scaleLumi:
+        copy(os.path.join(multicrabdir,"lumi.json"),newmulticrabdir)
 
     ls = execute("ls %s"%multicrabdir)
     subdirs = []
     for a in ls:
         if os.path.isdir(os.path.join(multicrabdir,a)):
             subdirs.append(a)
+    jobs = []
     for d in subdirs:
         if isdatadir(d):
-            reduce(multicrabdir,d,newmulticrabdir,fraction)
+            jobs.extend([(d, fIN, fOUT) for fIN, fOUT in reduce(multicrabdir,d,newmulticrabdir)])
         else:
             copy(os.path.join(multicrabdir,d),newmulticrabdir)
-            
 
-    
+    # Thin the data files
+    nProcesses = opts.nProcesses
+    if nProcesses == 0:
+        nProcesses = multiprocessing.cpu_count()
+    args = [(fIN, fOUT, fraction, opts.seed) for d, fIN, fOUT in jobs]
+    if nProcesses > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(nProcesses, len(jobs)))
+        results = pool.map(_copyfileForPool, args)
+        pool.close()
+        pool.join()
+    else:
+        results = [copyfile(*a) for a in args]
+
+    counts = {}
+    for (d, fIN, fOUT), (nKept, nAll) in zip(jobs, results):
+        (kept, all) = counts.get(d, (0, 0))
+        counts[d] = (kept+nKept, all+nAll)
+    for d in sorted(counts.keys()):
+        print "%s: kept %d/%d events" % (d, counts[d][0], counts[d][1])
+    if not opts.scaleLumi:
+        return
+
+    # Scale the luminosities of the data datasets with the kept fraction
+    f = open(os.path.join(multicrabdir,"lumi.json"))
+    lumis = json.load(f)
+    f.close()
+    for d, (kept, all) in counts.iteritems():
+        if d in lumis and all > 0:
+            lumis[d] = lumis[d]*float(kept)/all
+    f = open(os.path.join(newmulticrabdir,"lumi.json"), "w")
+    json.dump(lumis, f, sort_keys=True, indent=2)
+    f.close()
+
 if __name__ == "__main__":
-    main()
+    SEED       = 1
+    NPROCESSES = 1 # 0 for all cores
+
+    parser = OptionParser(usage="Usage: %prog [options] <multicrabdir> <fraction to be kept>")
+    parser.add_option("--seed", dest="seed", type=int, default=SEED,
+                      help="Seed of the event selection hash, the same seed keeps the same events [default: %s]" % (SEED) )
+    parser.add_option("-j", "--nProcesses", dest="nProcesses", type=int, default=NPROCESSES,
+                      help="Number of files copied in parallel (0 for all cores) [default: %s]" % (NPROCESSES) )
+    parser.add_option("--scaleLumi", dest="scaleLumi", action="store_true", default=False,
+                      help="Scale the data luminosities in lumi.json with the kept fraction (by default lumi.json is copied unchanged)")
+    (opts, args) = parser.parse_args()
+
+    main(opts, args)
@@ -9,6 +9,10 @@ import re
 import sys
 import socket
 import datetime
+import shutil
+import traceback
+import multiprocessing
+import Queue
 
 import ROOT
 ROOT.gROOT.SetBatch(True)
@@ -18,6 +22,7 @@ import datasets as datasetsTest
 import HiggsAnalysis.NtupleAnalysis.tools.dataset as dataset
 import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
 import HiggsAnalysis.NtupleAnalysis.tools.git as git
+import HiggsAnalysis.NtupleAnalysis.tools.fileMetadata as fileMetadata
 import HiggsAnalysis.NtupleAnalysis.tools.ShellStyles as ShellStyles
 
 #================================================================================================  
@@ -237,6 +242,116 @@ class Dataset:
     def getNAllEvents(self):
         return self._nAllEvents
 
+#================================================================================================
+# Class Definition
+#================================================================================================
+class PileupWeightProvider:
+    '''
+    Provides the data pileup spectra for the pileup reweighting of the MC datasets.
+
+    The spectra are summed over the data datasets once per run, instead of once
+    per processed dataset, and are kept keyed by the analyzer name and the
+    direction (nominal/plus/minus). Analyzers with the same direction and the
+    same set of data datasets share the summed histogram.
+    '''
+    def __init__(self, analyzers, datasetsData):
+        self._hPUs = {}      # (direction, data dataset names) -> summed histogram
+        self._contents = {}  # (direction, data dataset names) -> bin contents (incl. under/overflow)
+        self._keys = {}      # analyzer name -> (direction, data dataset names)
+        self._hFlat = None
+
+        for aname, analyzerIE in analyzers.iteritems():
+            direction = "nominal"
+            analyzer  = analyzerIE.getAnalyzer()
+
+            if hasattr(analyzer,"usePileupWeights"):
+                usePUweights = analyzer.__getattr__("usePileupWeights")
+                if not usePUweights:
+                    continue
+
+            if hasattr(analyzer, "PUWeightSystematicVariation"):
+                direction = getattr(analyzer, "PUWeightSystematicVariation")
+
+            dsetNames = tuple([d.getName() for d in datasetsData if analyzerIE.runForDataset_(d.getName())])
+            key = (direction, dsetNames)
+            self._keys[aname] = key
+            if key in self._hPUs:
+                continue
+
+            # For-loop: All data datasets
+            hPU = None
+            for dset in datasetsData:
+                if dset.getName() not in dsetNames:
+                    continue
+                if hPU is None:
+                    hPU = dset.getPileUp(direction).Clone()
+                else:
+                    hPU.Add(dset.getPileUp(direction))
+            if hPU == None:
+                raise Exception("Cannot determine PU spectrum for data!")
+
+            # Determine PU histo name postfix
+            if direction == "plus":
+                direction_postfix = "Up"
+            elif direction == "minus":
+                direction_postfix = "Down"
+            else:
+                direction_postfix = ""
+
+            # Set the histogram name
+            hPU.SetName("PileUpData"+direction_postfix)
+            hPU.SetDirectory(None)
+            self._hPUs[key] = hPU
+            self._contents[key] = [hPU.GetBinContent(k) for k in range(0, hPU.GetNbinsX()+2)]
+            Verbose("Saving PU direction \"%s\" for aname \"%s\". Mean = %s" % (direction, aname, hPU.GetMean() ), True)
+        return
+
+    def getDataPU(self, aname):
+        '''
+        Returns the data PU histogram of the analyzer, or a flat spectrum if
+        the analyzer does not use pileup weights. The returned histogram is
+        owned by the provider (clone it before handing it to the selector).
+        '''
+        if aname in self._keys:
+            return self._hPUs[self._keys[aname]]
+        if self._hFlat is None:
+            n = 100
+            self._hFlat = ROOT.TH1F("dummyPU","dummyPU",n,0,n)
+            self._hFlat.SetDirectory(None)
+            self._hFlat.SetName("PileUpData")
+            for k in range(n):
+                self._hFlat.Fill(k+1, 1.0/n)
+        return self._hFlat
+
+    def getNAllEventsPUWeighted(self, aname, hPUMC):
+        '''
+        Returns the number of all MC events after pileup reweighting.
+
+        With the per-bin weight w = data/mc * mc.Integral()/data.Integral(),
+        sum(w * mc) over the bins with mc > 0 reduces to the data contents
+        of those bins times the normalization factor, so only the cached data
+        contents and one pass over the MC contents are needed.
+        '''
+        hDataPU = self.getDataPU(aname)
+        if aname in self._keys:
+            dataContents = self._contents[self._keys[aname]]
+        else:
+            dataContents = [hDataPU.GetBinContent(k) for k in range(0, hDataPU.GetNbinsX()+2)]
+        factor = hPUMC.Integral() / hDataPU.Integral()
+        dataSum = sum([d for k, d in enumerate(dataContents) if hPUMC.GetBinContent(k) > 0.0])
+        return (factor * dataSum, factor)
+
+    def close(self):
+        for h in self._hPUs.values():
+            h.Delete()
+        if self._hFlat is not None:
+            self._hFlat.Delete()
+        self._hPUs = {}
+        self._contents = {}
+        self._keys = {}
+        self._hFlat = None
+        return
+
 #================================================================================================
 # Class Definition
 #================================================================================================
@@ -250,6 +365,10 @@ class Process:
         self._analyzers = {}
         self._maxEvents = maxEvents
         self.datasetsData = [] # used only for PU-reweighting
+        self._puProvider = None
+        self._metadataIndex = fileMetadata.MetadataIndex() # configInfo of the input files, read once per file
+        self._treeCache = {"maxSize": 0, "prefetch": False}
+        self._sharedSelections = False
         self._options = PSet()
         return
     
@@ -307,7 +426,7 @@ class Process:
         if files is None:
             files = datasetsTest.getFiles(name)
 
-        prec = dataset.DatasetPrecursor(name, files)
+        prec = dataset.DatasetPrecursor(name, files, self._metadataIndex)
         if dataVersion is None:
             dataVersion = prec.getDataVersion()
         #get pileup
@@ -356,6 +475,9 @@ class Process:
             del kwargs["whitelist"]
 
         dataset._optionDefaults["input"] = "histograms-*.root" #"miniaod2tree*.root"
+        # Metadata of the input files is kept in an index in the multicrab directory
+        self._metadataIndex.load(os.path.join(directory, fileMetadata.indexFileName))
+        kwargs["metadataIndex"] = self._metadataIndex
         dsetMgrCreator = dataset.readFromMulticrabCfg(directory=directory, *args, **kwargs)
         dsets = dsetMgrCreator.getDatasetPrecursors()
         # Check if data datasets included
@@ -366,7 +488,7 @@ class Process:
 
         # Create a manager with data datasets (to enable PU reweighting even if not running with data)
         if len(self.datasetsData) < 1:
-            dsetMgrCreator_tmp = dataset.readFromMulticrabCfg(directory=directory)
+            dsetMgrCreator_tmp = dataset.readFromMulticrabCfg(directory=directory, metadataIndex=self._metadataIndex)
             dsets_tmp = dsetMgrCreator_tmp.getDatasetPrecursors()
             for i, d in enumerate(dsets_tmp, 1):
                 if d.isData():
@@ -393,6 +515,7 @@ class Process:
                 self.Print("Ignoring dataset because of black/whitelist options: '%s' ..." % dset.getName(), True)
             else:
                 self.addDataset(dset.getName(), dset.getFileNames(), dataVersion=dset.getDataVersion(), lumiFile=dsetMgrCreator.getLumiFile())
+        self._metadataIndex.save()
         return
 
     def getDatasets(self):
@@ -452,7 +575,49 @@ class Process:
             return False
         return True
         
-    def run(self, proof=False, proofWorkers=None):
+    def run(self, proof=False, proofWorkers=None, workers=None, shards=None, treeCacheMaxSize=0, treeCachePrefetch=False, sharedSelections=False):
+        '''
+        Runs the analyzers over all datasets. With workers=N (N > 1) the
+        datasets are processed in N local worker processes instead of
+        one after another (ignored when running with PROOF).
+
+        With workers, large datasets can additionally be split into shards
+        that are processed concurrently and merged afterwards. The shards
+        are given like maxEvents, i.e. {"TT": 8, "QCD_HT": 4} or {"all": 4}.
+        Datasets (or shards) that fail are listed in the summary at the end,
+        and are not included in the total usage stats.
+
+        By default the TTreeCache has a fixed size of 10 MB and learns the
+        branches from the first entries. With treeCacheMaxSize > 0 the cache
+        is instead restricted to the branches the analyzers read, and sized
+        to hold one cluster of them, at most treeCacheMaxSize MB (e.g. 100).
+        With treeCachePrefetch the cache is filled asynchronously (useful
+        for remote files).
+
+        With sharedSelections the selection stages that have an identical
+        configuration in several analyzers (e.g. the tau and lepton
+        selections of the AnalysisBuilder variations) are evaluated once
+        per event and their result is shared between the analyzers. The
+        evaluations and reuses of each stage are printed at the end of
+        each dataset.
+        '''
+        if shards is None:
+            shards = {}
+        self._treeCache = {"maxSize": int(treeCacheMaxSize*1024*1024), "prefetch": treeCachePrefetch}
+        self._sharedSelections = sharedSelections
+        # The prefetching setting is global, restore it for the later TFiles of the session
+        asyncPrefetching = ROOT.gEnv.GetValue("TFile.AsyncPrefetching", 0)
+        if treeCachePrefetch:
+            ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1)
+        try:
+            return self._run(proof, proofWorkers, workers, shards)
+        finally:
+            ROOT.gEnv.SetValue("TFile.AsyncPrefetching", asyncPrefetching)
+
+    def _run(self, proof, proofWorkers, workers, shards):
+        '''
+        Implementation of run(), see there for the arguments
+        '''
         outputDir = self._outputPrefix+"_"+time.strftime("%y%m%d_%H%M%S")
         if self._outputPostfix != "":
             outputDir += "_"+self._outputPostfix
@@ -520,274 +685,594 @@ class Process:
         realTimeTotal = 0
         cpuTimeTotal = 0
         readMbytesTotal = 0
+        readMbytes = 0
         callsTotal = 0
+        failed = []
 
         # Print the datasets that will be run on!
         self.Print("Will process %d datasets in total:" % (len(self._datasets) ), True)
         for i, d in enumerate(self._datasets, 1):
             self.Print("%d) %s" % (i, sh_Note + d.getName() + sh_Normal), i==0)
 
+        # Sum the data PU spectra once for all datasets (shared with the workers)
+        self._puProvider = PileupWeightProvider(self._analyzers, self.datasetsData)
+
         # Process over datasets
-        ndset = 0
-        for i, dset in enumerate(self._datasets, 1):
-            hPUs = self._getDataPUhistos()
-            # Initialize
-            ndset += 1
-            inputList = ROOT.TList()
-            nanalyzers = 0
-            anames = []
-            usePUweights = False
-            useTopPtCorrection = False
-            nAllEventsPUWeighted = 0.0
-            for aname, analyzerIE in self._analyzers.iteritems():
-                if analyzerIE.runForDataset_(dset.getName()):
-                    nanalyzers += 1
-                    analyzer = analyzerIE.getAnalyzer()
-                    if hasattr(analyzer, "__call__"):
-                        analyzer = analyzer(dset.getDataVersion())
-                        if analyzer is None:
-                            raise Exception("Analyzer %s was specified as a function, but returned None" % aname)
-                        if not isinstance(analyzer, Analyzer):
-                            raise Exception("Analyzer %s was specified as a function, but returned object of %s instead of Analyzer" % (aname, analyzer.__class__.__name__))
-                    inputList.Add(ROOT.TNamed("analyzer_"+aname, analyzer.className_()+":"+analyzer.config_()))
-                    # ttbar status for top pt corrections
-                    ttbarStatus = "0"
-                    useTopPtCorrection = analyzer.exists("useTopPtWeights") and analyzer.__getattr__("useTopPtWeights")
-                    #useTopPtCorrection = useTopPtCorrection and dset.getName().startswith("TT")
-                    useTopPtCorrection = useTopPtCorrection and self.isTTbarDataset(dset)
-                    if useTopPtCorrection:
-                        ttbarStatus = "1"
-                    inputList.Add(ROOT.TNamed("isttbar", ttbarStatus))
-                    # intermediate H+ status for reweighting the NoNeutral samples
-                    intermediateStatus = "0"
-                    if dset.getName().find("IntermediateMassNoNeutral") > 0:
-                        intermediateStatus = "1"
-                    inputList.Add(ROOT.TNamed("isIntermediateNoNeutral", intermediateStatus))
-
-                    # Pileup reweighting
-                    self.Verbose("Getting pileup reweighting weights", True)
-                    (puAllEvents, puStatus) = self._parsePUweighting(dset, analyzer, aname, hPUs, inputList)
-                    nAllEventsPUWeighted += puAllEvents
-                    usePUweights = puStatus
-                    # Sum skim counters (from ttree)
-                    hSkimCounterSum = self._getSkimCounterSum(dset.getFileNames())
+        if workers is not None and workers > 1 and _proof is None:
+            (cpuTimeTotal, realTimeTotal, readMbytesTotal, readMbytes, failed) = self._runWorkers(outputDir, lumidata, workers, shards)
+        else:
+            for ndset, dset in enumerate(self._datasets, 1):
+                stats = self._processDataset(ndset, dset, outputDir, lumidata, _proof)
+                if stats is None:
+                    continue
+
+                # Print usage stats in user-friendly formatting
+                readMbytes = stats["readMbytes"]
+                self.PrintStats(stats["readCalls"], 0, stats["cpuTime"], stats["realTime"], readMbytes, stats["treeCache"])
+
+                # Time accumulation
+                realTimeTotal   += stats["realTime"]
+                cpuTimeTotal    += stats["cpuTime"]
+                readMbytesTotal += readMbytes
+
+        self._puProvider.close()
+        self._puProvider = None
+        self._metadataIndex.save()
+
+        # Total time stats
+        self.PrintStatsTotal(readMbytes, cpuTimeTotal, realTimeTotal, readMbytesTotal, failed)
+
+        # Inform user of location of results
+        self.Print("Results are in %s" % (sh_Success + outputDir + sh_Normal), True)
+        return outputDir
+
+    def _processDataset(self, ndset, dset, outputDir, lumidata, _proof=None, shard=None):
+        '''
+        Runs all analyzers over a single dataset and writes the results to
+        <outputDir>/<dataset>/res/histograms-<dataset>.root
+
+        If a shard is given (see _createShards), only the files or the entry range
+        of the shard are processed, and the results are written to the shard file
+        without configInfo (which is written once by _mergeShards).
+
+        Returns a dictionary with the usage stats (None if the dataset was skipped)
+        '''
+        if shard is None:
+            fileNames = dset.getFileNames()
+        else:
+            fileNames = shard["files"]
+        # Initialize
+        inputList = ROOT.TList()
+        hSkimCounterSum = None
+        nanalyzers = 0
+        anames = []
+        usePUweights = False
+        useTopPtCorrection = False
+        nAllEventsPUWeighted = 0.0
+        for aname, analyzerIE in self._analyzers.iteritems():
+            if analyzerIE.runForDataset_(dset.getName()):
+                nanalyzers += 1
+                analyzer = analyzerIE.getAnalyzer()
+                if hasattr(analyzer, "__call__"):
+                    analyzer = analyzer(dset.getDataVersion())
+                    if analyzer is None:
+                        raise Exception("Analyzer %s was specified as a function, but returned None" % aname)
+                    if not isinstance(analyzer, Analyzer):
+                        raise Exception("Analyzer %s was specified as a function, but returned object of %s instead of Analyzer" % (aname, analyzer.__class__.__name__))
+                inputList.Add(ROOT.TNamed("analyzer_"+aname, analyzer.className_()+":"+analyzer.config_()))
+                # ttbar status for top pt corrections
+                ttbarStatus = "0"
+                useTopPtCorrection = analyzer.exists("useTopPtWeights") and analyzer.__getattr__("useTopPtWeights")
+                #useTopPtCorrection = useTopPtCorrection and dset.getName().startswith("TT")
+                useTopPtCorrection = useTopPtCorrection and self.isTTbarDataset(dset)
+                if useTopPtCorrection:
+                    ttbarStatus = "1"
+                inputList.Add(ROOT.TNamed("isttbar", ttbarStatus))
+                # intermediate H+ status for reweighting the NoNeutral samples
+                intermediateStatus = "0"
+                if dset.getName().find("IntermediateMassNoNeutral") > 0:
+                    intermediateStatus = "1"
+                inputList.Add(ROOT.TNamed("isIntermediateNoNeutral", intermediateStatus))
+
+                # Pileup reweighting
+                self.Verbose("Getting pileup reweighting weights", True)
+                (puAllEvents, puStatus) = self._parsePUweighting(dset, analyzer, aname, inputList)
+                nAllEventsPUWeighted += puAllEvents
+                usePUweights = puStatus
+                # Sum skim counters (from ttree), same for all analyzers
+                if hSkimCounterSum is None:
+                    hSkimCounterSum = self._getSkimCounterSum(fileNames)
+                    if shard is not None and not shard["skimCounters"]:
+                        # Only one shard of an entry-range split carries the skim counters
+                        hSkimCounterSum.Reset()
                     inputList.Add(hSkimCounterSum)
-                    # Add name
-                    anames.append(aname)
-            if nanalyzers == 0:
-                self.Print("Skipping %s, no analyzers" % dset.getName(), True)
-                continue                            
-
-            self.Print("Processing dataset (%d/%d)" % (ndset, len(self._datasets) ))
-            align= "{:<23} {:<1} {:<60}"
-            info = {}
-            info["Dataset"] = dset.getName()
-            if dset.getDataVersion().isData():
-                lumivalue = "--- not available in lumi.json (or lumi.json not available) ---"
-                if dset.getName() in lumidata.keys():
-                    lumivalue = lumidata[dset.getName()]
-                info["Luminosity"] = str(lumivalue) + " fb-1"
-            info["UsePUweights"] = usePUweights
-            info["UseTopPtCorrection"] = useTopPtCorrection
-            for key in info:
-                self.Print(align.format(key, ":", info[key]), False)
-
-            # Create dir for dataset ROOTT files   
+                # Add name
+                anames.append(aname)
+        if nanalyzers == 0:
+            self.Print("Skipping %s, no analyzers" % dset.getName(), True)
+            return None
+
+        self.Print("Processing dataset (%d/%d)" % (ndset, len(self._datasets) ))
+        align= "{:<23} {:<1} {:<60}"
+        info = {}
+        info["Dataset"] = dset.getName()
+        if shard is not None:
+            info["Shard"] = shard["index"]
+        if dset.getDataVersion().isData():
+            lumivalue = "--- not available in lumi.json (or lumi.json not available) ---"
+            if dset.getName() in lumidata.keys():
+                lumivalue = lumidata[dset.getName()]
+            info["Luminosity"] = str(lumivalue) + " fb-1"
+        info["UsePUweights"] = usePUweights
+        info["UseTopPtCorrection"] = useTopPtCorrection
+        for key in info:
+            self.Print(align.format(key, ":", info[key]), False)
+
+        # Create dir for dataset ROOTT files   
+        if shard is None:
             resDir = os.path.join(outputDir, dset.getName(), "res")
             resFileName = os.path.join(resDir, "histograms-%s.root"%dset.getName())
             os.makedirs(resDir)
-
-            tchain = ROOT.TChain("Events")
-            # For-loop: All file names for dataset
-            for f in dset.getFileNames():
-                tchain.Add(f)
-            tchain.SetCacheLearnEntries(1000);
+        else:
+            resFileName = shard["fileName"]
+
+        tchain = ROOT.TChain("Events")
+        # For-loop: All file names for dataset
+        for f in fileNames:
+            tchain.Add(f)
+        tchain.SetCacheLearnEntries(1000);
+        if self._treeCache["maxSize"] > 0:
+            # SelectorImpl shrinks the cache to the branches enabled by the analyzers
+            tchain.SetCacheSize(self._treeCache["maxSize"])
+            inputList.Add(ROOT.TNamed("treeCacheMaxSize", str(self._treeCache["maxSize"])))
+        else:
             tchain.SetCacheSize(10000000) # Set cache size to 10 MB (somehow it is not automatically set contrary to ROOT docs)
 
-            tselector = ROOT.SelectorImpl()
+        tselector = ROOT.SelectorImpl()
 
-            # FIXME: TChain.GetEntries() is needed only to give a time
-            # estimate for the analysis. If this turns out to be slow,
-            # we could store the number of events along the file names
-            # (whatever is the method for that)
-            inputList.Add(ROOT.TNamed("entries", str(tchain.GetEntries())))
-            if dset.getDataVersion().isMC():
-                inputList.Add(ROOT.TNamed("isMC", "1"))
-            else:
-                inputList.Add(ROOT.TNamed("isMC", "0"))
-            inputList.Add(ROOT.TNamed("options", self._options.serialize_()))
-            inputList.Add(ROOT.TNamed("printStatus", "1"))
+        # The number of entries is needed only to give a time estimate
+        # for the analysis, take it from the entry-count index instead
+        # of TChain.GetEntries() (which opens every file of the chain)
+        if shard is not None and shard["entries"] > 0:
+            inputList.Add(ROOT.TNamed("entries", str(shard["entries"])))
+        else:
+            inputList.Add(ROOT.TNamed("entries", str(self._getNumberOfEntries(fileNames))))
+        if dset.getDataVersion().isMC():
+            inputList.Add(ROOT.TNamed("isMC", "1"))
+        else:
+            inputList.Add(ROOT.TNamed("isMC", "0"))
+        inputList.Add(ROOT.TNamed("options", self._options.serialize_()))
+        inputList.Add(ROOT.TNamed("printStatus", "1"))
+        if self._sharedSelections:
+            inputList.Add(ROOT.TNamed("sharedSelections", "1"))
+        else:
+            inputList.Add(ROOT.TNamed("sharedSelections", "0"))
 
-            if _proof is not None:
-                tchain.SetProof(True)
-                inputList.Add(ROOT.TNamed("PROOF_OUTPUTFILE_LOCATION", resFileName))
+        if _proof is not None:
+            tchain.SetProof(True)
+            inputList.Add(ROOT.TNamed("PROOF_OUTPUTFILE_LOCATION", resFileName))
+        else:
+            inputList.Add(ROOT.TNamed("OUTPUTFILE_LOCATION", resFileName))
+
+        tselector.SetInputList(inputList)
+
+        readBytesStart = ROOT.TFile.GetFileBytesRead()
+        readCallsStart = ROOT.TFile.GetFileReadCalls()
+        timeStart = time.time()
+        clockStart = time.clock()
+
+        # Determine how many events to run on for given dataset
+        if shard is not None and shard["entries"] > 0:
+            tchain.SetCacheEntryRange(shard["firstEntry"], shard["firstEntry"]+shard["entries"])
+            tchain.Process(tselector, "", shard["entries"], shard["firstEntry"])
+        elif len(self._maxEvents.keys()) > 0:
+            key = self._getMatchingKey(self._maxEvents, dset.getName())
+            if key == "":
+                tchain.Process(tselector)
             else:
-                inputList.Add(ROOT.TNamed("OUTPUTFILE_LOCATION", resFileName))
-
-            tselector.SetInputList(inputList)
-
-            readBytesStart = ROOT.TFile.GetFileBytesRead()
-            readCallsStart = ROOT.TFile.GetFileReadCalls()
-            timeStart = time.time()
-            clockStart = time.clock()
-
-            # Determine how many events to run on for given dataset
-            if len(self._maxEvents.keys()) > 0:
-                key = ""
-                for k in self._maxEvents.keys():
-                    if k.lower() == "all":
-                        key = k
-                        break
-                    maxEv_re = re.compile(k)
-                    match = maxEv_re.search(dset.getName())
-                    if match:
-                        key = k
-                        break
-                if key == "":
+                maxEvts  = self._maxEvents[key]
+                if maxEvts == -1:
                     tchain.Process(tselector)
                 else:
-                    maxEvts  = self._maxEvents[key]
-                    if maxEvts == -1:
-                        tchain.Process(tselector)
-                    else:
-                        tchain.SetCacheEntryRange(0, self._maxEvents[key])
-                        tchain.Process(tselector, "", self._maxEvents[key])
-            else:
-                tchain.Process(tselector)
-            if _debugMemoryConsumption:
-                print "    MEMDBG: TChain cache statistics:"
-                tchain.PrintCacheStats()
-            
-            # Obtain Nall events for top pt corrections
-            NAllEventsTopPt = 0
-            if useTopPtCorrection:
-                for inname in dset.getFileNames():
-                    fIN = ROOT.TFile.Open(inname)
-                    h = fIN.Get("configInfo/topPtWeightAllEvents")
-                    if h != None:
-                        binNumber = 2 # nominal
-                        if hasattr(analyzer, "topPtSystematicVariation"):
-                            variation = getattr(analyzer, "topPtSystematicVariation")
-                            if variation == "minus":
-                                binNumber = 0
-                            # FIXME: The bin is to be added to the ttrees
-                            #elif variation == "plus":
-                                #binNumber = 3
-                                #if not h.GetXaxis().GetBinLabel().endsWith("Plus"):
-                                    #raise Exception("This should not happen")
-                        if binNumber > 0:
-                            NAllEventsTopPt += h.GetBinContent(binNumber)
-                    else:
-                        raise Exception("Warning: Could not obtain N(AllEvents) for top pt reweighting")
-                    ROOT.gROOT.GetListOfFiles().Remove(fIN)
-                    fIN.Close()
-
-            # Write configInfo
-            fIN = ROOT.TFile.Open(dset.getFileNames()[0])
-            cinfo = fIN.Get("configInfo/configinfo")
-            tf = ROOT.TFile.Open(resFileName, "UPDATE")
-            configInfo = tf.Get("configInfo")
-            if configInfo == None:
-                configInfo = tf.mkdir("configInfo")
-            configInfo.cd()
-            dv = ROOT.TNamed("dataVersion", str(dset.getDataVersion()))
-            dv.Write()
-            dv.Delete()
-            cv = ROOT.TNamed("codeVersionAnalysis", git.getCommitId())
-            cv.Write()
-            cv.Delete()
-            if not cinfo == None:
-                # Add more information to configInfo
-                n = cinfo.GetNbinsX()
-                cinfo.SetBins(n+3, 0, n+3)
-                cinfo.GetXaxis().SetBinLabel(n+1, "isData")
-                cinfo.GetXaxis().SetBinLabel(n+2, "isPileupReweighted")
-                cinfo.GetXaxis().SetBinLabel(n+3, "isTopPtReweighted")
-                # Add "isData" column
-                if not dset.getDataVersion().isMC():
-                    cinfo.SetBinContent(n+1, cinfo.GetBinContent(1))
-                # Add "isPileupReweighted" column
-                if usePUweights:
-                    cinfo.SetBinContent(n+2, nAllEventsPUWeighted / nanalyzers)
-                # Add "isTopPtReweighted" column
-                if useTopPtCorrection:
-                    cinfo.SetBinContent(n+3, NAllEventsTopPt)
-                # Write
-                cinfo.Write()
-                ROOT.gROOT.GetListOfFiles().Remove(fIN);
-                fIN.Close()
-
-            # Memory management
-            configInfo.Delete()
-            ROOT.gROOT.GetListOfFiles().Remove(tf);
-            tf.Close()
-            for item in inputList:
-                if isinstance(item, ROOT.TObject):
-                    item.Delete()
-            inputList = None
-            if hSkimCounterSum != None:
-                hSkimCounterSum.Delete()
-            if _debugMemoryConsumption:
-                print "      MEMDBG: gDirectory", ROOT.gDirectory.GetList().GetSize()
-                print "      MEMDBG: list ", ROOT.gROOT.GetList().GetSize()
-                print "      MEMDBG: globals ", ROOT.gROOT.GetListOfGlobals().GetSize()
-                #for item in ROOT.gROOT.GetListOfGlobals():
-                    #print item.GetName()
-                print "      MEMDBG: files", ROOT.gROOT.GetListOfFiles().GetSize()
-                #for item in ROOT.gROOT.GetListOfFiles():
-                #    print "          %d items"%item.GetList().GetSize()
-                print "      MEMDBG: specials ", ROOT.gROOT.GetListOfSpecials().GetSize()
-                for item in ROOT.gROOT.GetListOfSpecials():
-                    print "          "+item.GetName()
-                
-                #gDirectory.GetList().Delete();
-                #gROOT.GetList().Delete();
-                #gROOT.GetListOfGlobals().Delete();
-                #TIter next(gROOT.GetList());
-                #while (TObject* o = dynamic_cast<TObject*>(next())) {
-                  #o.Delete();
-                #}
+                    tchain.SetCacheEntryRange(0, self._maxEvents[key])
+                    tchain.Process(tselector, "", self._maxEvents[key])
+        else:
+            tchain.Process(tselector)
+        if _debugMemoryConsumption:
+            print "    MEMDBG: TChain cache statistics:"
+            tchain.PrintCacheStats()
+        treeCache = self._getTreeCacheReport(tselector)
+
+        # Write configInfo (for shards this is done after merging)
+        cfgInfo = {"nanalyzers": nanalyzers, "usePUweights": usePUweights, "nAllEventsPUWeighted": nAllEventsPUWeighted,
+                   "useTopPtCorrection": useTopPtCorrection, "topPtSystematicVariation": None}
+        if hasattr(analyzer, "topPtSystematicVariation"):
+            cfgInfo["topPtSystematicVariation"] = getattr(analyzer, "topPtSystematicVariation")
+        if shard is None:
+            self._writeConfigInfo(dset, resFileName, cfgInfo)
+
+        # Memory management
+        for item in inputList:
+            if isinstance(item, ROOT.TObject):
+                item.Delete()
+        inputList = None
+        if hSkimCounterSum != None:
+            hSkimCounterSum.Delete()
+        if _debugMemoryConsumption:
+            print "      MEMDBG: gDirectory", ROOT.gDirectory.GetList().GetSize()
+            print "      MEMDBG: list ", ROOT.gROOT.GetList().GetSize()
+            print "      MEMDBG: globals ", ROOT.gROOT.GetListOfGlobals().GetSize()
+            #for item in ROOT.gROOT.GetListOfGlobals():
+                #print item.GetName()
+            print "      MEMDBG: files", ROOT.gROOT.GetListOfFiles().GetSize()
+            #for item in ROOT.gROOT.GetListOfFiles():
+            #    print "          %d items"%item.GetList().GetSize()
+            print "      MEMDBG: specials ", ROOT.gROOT.GetListOfSpecials().GetSize()
+            for item in ROOT.gROOT.GetListOfSpecials():
+                print "          "+item.GetName()
             
-            # Performance and information
-            timeStop = time.time()
-            clockStop = time.clock()
-            readCallsStop = ROOT.TFile.GetFileReadCalls()
-            readBytesStop = ROOT.TFile.GetFileBytesRead()
-
-            calls = ""
-            if _proof is not None:
-                tchain.SetProof(False)
-                queryResult = _proof.GetQueryResult()
-                cpuTime = queryResult.GetUsedCPU()
-                readMbytes = queryResult.GetBytes()/1024/1024
-            else:
-                cpuTime = clockStop-clockStart
-                readMbytes = float(readBytesStop-readBytesStart)/1024/1024
-                calls = " (%d calls)" % (readCallsStop-readCallsStart)
-            realTime = timeStop-timeStart
+            #gDirectory.GetList().Delete();
+            #gROOT.GetList().Delete();
+            #gROOT.GetListOfGlobals().Delete();
+            #TIter next(gROOT.GetList());
+            #while (TObject* o = dynamic_cast<TObject*>(next())) {
+              #o.Delete();
+            #}
+        
+        # Performance and information
+        timeStop = time.time()
+        clockStop = time.clock()
+        readCallsStop = ROOT.TFile.GetFileReadCalls()
+        readBytesStop = ROOT.TFile.GetFileBytesRead()
+
+        calls = ""
+        if _proof is not None:
+            tchain.SetProof(False)
+            queryResult = _proof.GetQueryResult()
+            cpuTime = queryResult.GetUsedCPU()
+            readMbytes = queryResult.GetBytes()/1024/1024
+        else:
+            cpuTime = clockStop-clockStart
+            readMbytes = float(readBytesStop-readBytesStart)/1024/1024
+            calls = " (%d calls)" % (readCallsStop-readCallsStart)
+        realTime = timeStop-timeStart
+        return {"readCalls": readCallsStop-readCallsStart, "cpuTime": cpuTime, "realTime": realTime, "readMbytes": readMbytes, "configInfo": cfgInfo,
+                "treeCache": treeCache}
+
+    def _getTreeCacheReport(self, tselector):
+        '''
+        Returns the TTreeCache size and branches reported by SelectorImpl, or None if
+        the cache policy was not used
+        '''
+        output = tselector.GetOutputList()
+        if output == None:
+            return None
+        size = output.FindObject("treeCacheSize")
+        branches = output.FindObject("treeCacheBranches")
+        if size == None or branches == None:
+            return None
+        return {"size": int(size.GetTitle()), "branches": branches.GetTitle().split(",")}
+
+    def _writeConfigInfo(self, dset, resFileName, cfgInfo):
+        '''
+        Writes the configInfo directory of the dataset output file: the dataVersion,
+        the code version and the configinfo histogram of the first input file,
+        extended with the isData, isPileupReweighted and isTopPtReweighted columns
+        '''
+        # Obtain Nall events for top pt corrections
+        NAllEventsTopPt = 0
+        if cfgInfo["useTopPtCorrection"]:
+            for inname in dset.getFileNames():
+                h = self._metadataIndex.get(inname).getHisto("configInfo/topPtWeightAllEvents")
+                if h != None:
+                    binNumber = 2 # nominal
+                    if cfgInfo["topPtSystematicVariation"] is not None:
+                        variation = cfgInfo["topPtSystematicVariation"]
+                        if variation == "minus":
+                            binNumber = 0
+                        # FIXME: The bin is to be added to the ttrees
+                        #elif variation == "plus":
+                            #binNumber = 3
+                            #if not h.GetXaxis().GetBinLabel().endsWith("Plus"):
+                                #raise Exception("This should not happen")
+                    if binNumber > 0:
+                        NAllEventsTopPt += h.GetBinContent(binNumber)
+                else:
+                    raise Exception("Warning: Could not obtain N(AllEvents) for top pt reweighting")
+                h.Delete()
+
+        # Write configInfo
+        cinfo = self._metadataIndex.get(dset.getFileNames()[0]).getHisto("configInfo/configinfo")
+        tf = ROOT.TFile.Open(resFileName, "UPDATE")
+        configInfo = tf.Get("configInfo")
+        if configInfo == None:
+            configInfo = tf.mkdir("configInfo")
+        configInfo.cd()
+        dv = ROOT.TNamed("dataVersion", str(dset.getDataVersion()))
+        dv.Write()
+        dv.Delete()
+        cv = ROOT.TNamed("codeVersionAnalysis", git.getCommitId())
+        cv.Write()
+        cv.Delete()
+        if not cinfo == None:
+            # Add more information to configInfo
+            n = cinfo.GetNbinsX()
+            cinfo.SetBins(n+3, 0, n+3)
+            cinfo.GetXaxis().SetBinLabel(n+1, "isData")
+            cinfo.GetXaxis().SetBinLabel(n+2, "isPileupReweighted")
+            cinfo.GetXaxis().SetBinLabel(n+3, "isTopPtReweighted")
+            # Add "isData" column
+            if not dset.getDataVersion().isMC():
+                cinfo.SetBinContent(n+1, cinfo.GetBinContent(1))
+            # Add "isPileupReweighted" column
+            if cfgInfo["usePUweights"]:
+                cinfo.SetBinContent(n+2, cfgInfo["nAllEventsPUWeighted"] / cfgInfo["nanalyzers"])
+            # Add "isTopPtReweighted" column
+            if cfgInfo["useTopPtCorrection"]:
+                cinfo.SetBinContent(n+3, NAllEventsTopPt)
+            # Write
+            cinfo.Write()
+            cinfo.Delete()
+
+        configInfo.Delete()
+        ROOT.gROOT.GetListOfFiles().Remove(tf);
+        tf.Close()
+        return
 
-            # Print usage stats in user-friendly formatting
-            self.PrintStats(readCallsStop, readCallsStart, cpuTime, realTime, readMbytes)
+    def _getNumberOfEntries(self, fileNames):
+        '''
+        Number of entries in the Events trees of the files, from the metadata index
+        '''
+        return sum([self._metadataIndex.getEntries(f) for f in fileNames])
 
-            # Time accumulation
-            realTimeTotal   += realTime
-            cpuTimeTotal    += cpuTime
-            readMbytesTotal += readMbytes
+    def _getMatchingKey(self, settings, datasetName):
+        '''
+        Returns the key of a per-dataset settings dictionary (e.g. maxEvents)
+        that applies to the given dataset: either "all" or the first regular
+        expression matching the dataset name. Returns "" if none applies.
+        '''
+        for k in settings.keys():
+            if k.lower() == "all":
+                return k
+            if re.search(k, datasetName):
+                return k
+        return ""
+
+    def _createShards(self, dset, outputDir, shards):
+        '''
+        Splits a dataset into shards that are processed by separate workers.
+        Datasets with at least as many files as requested shards are split into
+        file groups. Smaller datasets are split into entry ranges of the full
+        chain, with the skim counters only in the first shard (as done for the
+        PROOF workers).
 
-        # Total time stats
-        self.PrintStatsTotal(readMbytes, cpuTimeTotal, realTimeTotal, readMbytesTotal)
+        Returns a list of shard dictionaries, or [None] if the dataset is not split
+        '''
+        key = self._getMatchingKey(shards, dset.getName())
+        if key == "" or shards[key] < 2:
+            return [None]
+
+        # Datasets with a limited number of events are not split
+        maxKey = self._getMatchingKey(self._maxEvents, dset.getName())
+        if maxKey != "" and self._maxEvents[maxKey] != -1:
+            return [None]
+
+        nShards  = shards[key]
+        files    = dset.getFileNames()
+        shardDir = os.path.join(outputDir, dset.getName(), "shards")
+        ret = []
+        if len(files) >= nShards:
+            for i in range(nShards):
+                first = i*len(files)/nShards
+                last  = (i+1)*len(files)/nShards
+                ret.append({"files": files[first:last], "firstEntry": 0, "entries": -1, "skimCounters": True})
+        else:
+            nEntries = self._getNumberOfEntries(files)
+            for i in range(nShards):
+                first = i*nEntries/nShards
+                last  = (i+1)*nEntries/nShards
+                if last > first:
+                    ret.append({"files": files, "firstEntry": first, "entries": last-first, "skimCounters": len(ret) == 0})
+            if len(ret) < 2:
+                return [None]
+
+        os.makedirs(shardDir)
+        for i, shard in enumerate(ret):
+            shard["index"] = i
+            shard["fileName"] = os.path.join(shardDir, "histograms-%s-%d.root" % (dset.getName(), i))
+        return ret
+
+    def _mergeShards(self, dset, outputDir, shards, cfgInfo):
+        '''
+        Merges the shard outputs of a dataset into <outputDir>/<dataset>/res/histograms-<dataset>.root
+        and removes the shard files. The configInfo is written once for the merged file, so that the
+        configInfo/configinfo counters (e.g. control = number of merged ntuple files) are the same as
+        if the dataset had been processed in one go.
+        '''
+        resDir = os.path.join(outputDir, dset.getName(), "res")
+        resFileName = os.path.join(resDir, "histograms-%s.root"%dset.getName())
+        os.makedirs(resDir)
+
+        merger = ROOT.TFileMerger(False)
+        merger.SetPrintLevel(0)
+        for shard in shards:
+            merger.AddFile(shard["fileName"])
+        merger.OutputFile(resFileName, "RECREATE")
+        if not merger.Merge():
+            raise Exception("Merging the %d shards of dataset %s failed!" % (len(shards), dset.getName()))
+        merger.Reset()
+        self._writeConfigInfo(dset, resFileName, cfgInfo)
+        shutil.rmtree(os.path.dirname(shards[0]["fileName"]))
+        return
 
-        # Inform user of location of results
-        self.Print("Results are in %s" % (sh_Success + outputDir + sh_Normal), True)
-        return outputDir
-    
-    def PrintStatsTotal(self, readMbytes, cpuTimeTotal, realTimeTotal, readMbytesTotal):
+    def _runWorkers(self, outputDir, lumidata, workers, shards):
+        '''
+        Processes the datasets in a pool of local worker processes, one dataset (or one shard
+        of a dataset) per worker. Each worker runs its own SelectorImpl and writes its output
+        (stdout/stderr) to <outputDir>/<dataset>/processing[-<shard>].log. A worker that crashes
+        (exception or signal) is reported at the end, but does not affect the other workers.
+        The shards of a dataset are merged as soon as all of them have finished. If a shard
+        fails, the remaining shards of the dataset are cancelled and the dataset is not merged.
+
+        Returns a tuple of the total CPU time, the wall-clock time of the pool,
+        the total read size (twice, in the order expected by PrintStatsTotal) and
+        the list of (name, reason) of the failed datasets and shards
+        '''
+        self.Print("Processing datasets with %d parallel workers" % (workers), True)
+        # Create the jobs: one per dataset, or one per shard of a dataset
+        jobs     = []
+        nJobs    = {}
+        for ndset, dset in enumerate(self._datasets, 1):
+            dsetShards = self._createShards(dset, outputDir, shards)
+            if dsetShards[0] is not None:
+                self.Print("Splitting dataset %s into %d shards" % (sh_Note + dset.getName() + sh_Normal, len(dsetShards)), False)
+            nJobs[ndset] = len(dsetShards)
+            for shard in dsetShards:
+                jobs.append((ndset, dset, shard))
+
+        queue    = multiprocessing.Queue()
+        pending  = range(len(jobs))
+        running  = {}
+        finished = {}
+        failed   = []
+        cpuTimeTotal    = 0
+        readMbytesTotal = 0
+        timeStart = time.time()
+
+        while len(pending) > 0 or len(running) > 0:
+            # Keep the pool full
+            while len(pending) > 0 and len(running) < workers:
+                njob = pending.pop(0)
+                p = multiprocessing.Process(target=self._processDatasetInWorker, args=(queue, njob, jobs[njob], outputDir, lumidata))
+                p.start()
+                running[njob] = p
+
+            # Collect the stats of finished workers
+            try:
+                (njob, stats) = queue.get(True, 1.0)
+            except Queue.Empty:
+                pass
+            else:
+                ndset, dset, shard = jobs[njob]
+                finished.setdefault(ndset, []).append((shard, stats))
+                if len(finished[ndset]) == nJobs[ndset]:
+                    if not self._finishDataset(ndset, dset, outputDir, finished[ndset], failed):
+                        continue
+                    for shard, stats in finished[ndset]:
+                        if stats is None:
+                            continue
+                        cpuTimeTotal    += stats["cpuTime"]
+                        readMbytesTotal += stats["readMbytes"]
+
+            # Reap the workers that have exited
+            for njob in running.keys():
+                p = running[njob]
+                if p.is_alive():
+                    continue
+                p.join()
+                ndset, dset, shard = jobs[njob]
+                if shard in [s for s, stats in finished.get(ndset, [])]:
+                    del running[njob]
+                    continue
+                # Stats may still be in the queue for a worker that just exited cleanly
+                if p.exitcode == 0:
+                    continue
+                logName = self._getWorkerLogName(outputDir, dset, shard)
+                name = dset.getName()
+                if shard is not None:
+                    name += " shard %d/%d" % (shard["index"]+1, nJobs[ndset])
+                self.Print(sh_Error + "Dataset %s failed (exit code %s), see %s" % (name, p.exitcode, logName) + sh_Normal, True)
+                reason = "exit code %s" % p.exitcode
+                del running[njob]
+                # Cancel the remaining shards of a failed dataset
+                cancelled = len([n for n in pending if jobs[n][0] == ndset])
+                if cancelled > 0:
+                    reason += ", %d remaining shards cancelled" % cancelled
+                failed.append((name, reason))
+                pending = [n for n in pending if jobs[n][0] != ndset]
+                nJobs[ndset] = -1
+
+        realTimeTotal = time.time()-timeStart
+        return (cpuTimeTotal, realTimeTotal, readMbytesTotal, readMbytesTotal, failed)
+
+    def _finishDataset(self, ndset, dset, outputDir, results, failed):
+        '''
+        Called when all workers of a dataset have finished: merges the shards
+        (if any) and prints the usage stats summed over the shards
+
+        Returns False if merging the shards failed
         '''
-        Print usage stats (total) in user-friendly formatting
+        results = [(shard, stats) for shard, stats in results if stats is not None]
+        if len(results) == 0:
+            return True
+        stats = {}
+        for key in ["readCalls", "cpuTime", "readMbytes"]:
+            stats[key] = sum([s[key] for shard, s in results])
+        stats["realTime"] = max([s["realTime"] for shard, s in results])
+        stats["treeCache"] = results[0][1]["treeCache"]
+        if results[0][0] is not None:
+            timeStart = time.time()
+            try:
+                self._mergeShards(dset, outputDir, [shard for shard, s in results], results[0][1]["configInfo"])
+            except Exception, e:
+                self.Print(sh_Error + str(e) + sh_Normal, True)
+                failed.append((dset.getName(), "merging the shards failed"))
+                return False
+            stats["realTime"] += time.time()-timeStart
+        self.Print("Finished dataset (%d/%d) %s" % (ndset, len(self._datasets), sh_Note + dset.getName() + sh_Normal), True)
+        self.PrintStats(stats["readCalls"], 0, stats["cpuTime"], stats["realTime"], stats["readMbytes"], stats["treeCache"])
+        return True
+
+    def _getWorkerLogName(self, outputDir, dset, shard):
+        if shard is None:
+            return os.path.join(outputDir, dset.getName(), "processing.log")
+        return os.path.join(outputDir, dset.getName(), "processing-%d.log" % shard["index"])
+
+    def _processDatasetInWorker(self, queue, njob, job, outputDir, lumidata):
+        '''
+        Entry point of a worker process: redirects the output to a log file,
+        processes the dataset (or shard) and sends the usage stats back to the parent.
         '''
+        ndset, dset, shard = job
+        logName = self._getWorkerLogName(outputDir, dset, shard)
+        if not os.path.exists(os.path.dirname(logName)):
+            os.makedirs(os.path.dirname(logName))
+        log = open(logName, "w")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+        try:
+            stats = self._processDataset(ndset, dset, outputDir, lumidata, shard=shard)
+        except:
+            traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(1)
+        queue.put((njob, stats))
+        queue.close()
+        queue.join_thread()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+    def PrintStatsTotal(self, readMbytes, cpuTimeTotal, realTimeTotal, readMbytesTotal, failed=None):
+        '''
+        Print usage stats (total) in user-friendly formatting, and the
+        list of (name, reason) of the failed datasets and shards
+        '''
+        if failed is None:
+            failed = []
+        if len(failed) > 0:
+            msg  = "Failed datasets and shards (%d), not included in the total usage stats:\n\t" % (len(failed))
+            msg += "\n\t".join(["%s (%s)" % (n, r) for n, r in failed])
+            self.Print(sh_Error + msg + sh_Normal, True)
         if len(self._datasets) < 2:
             return
-        self.Print("Processed all %d datasets" % (len(self._datasets)), True)
+        if len(failed) > 0:
+            self.Print("Processed %d datasets (with failures)" % (len(self._datasets)), True)
+        else:
+            self.Print("Processed all %d datasets" % (len(self._datasets)), True)
         align = "{:<15} {:<1} {:<30}"
         total = {}
         total["CPU time"]     = "%.1f" % cpuTimeTotal  + " s (%.1f %% of real time)" % (cpuTimeTotal/realTimeTotal*100)
@@ -800,13 +1285,15 @@ class Process:
             self.Print(align.format(key, ":", total[key]), False)
         return
 
-    def PrintStats(self, readCallsStop, readCallsStart, cpuTime, realTime, readMbytes):
+    def PrintStats(self, readCallsStop, readCallsStart, cpuTime, realTime, readMbytes, treeCache=None):
         '''
         Print usage stats in user-friendly formatting
         '''
         align= "{:<23} {:<1} {:<60}"
         info = {}
         info["Read Calls"]   = "%s"   % (readCallsStop-readCallsStart)
+        if treeCache is not None:
+            info["Tree Cache"] = "%.1f MB (%d branches)" % (float(treeCache["size"])/1024/1024, len(treeCache["branches"]))
         info["CPU time"]     = "%.1f" % cpuTime  + " s"
         info["Read Percent"] = "%.1f" % (cpuTime/realTime*100) + " %"
         info["Read Size"]    = "%.1f" % (readMbytes) + " MB"
@@ -818,57 +1305,6 @@ class Process:
             self.Print(align.format(key, ":", info[key]), False)
         return
 
-    def _getDataPUhistos(self):
-        '''
-        Get data PU distributions from data
-        This is done every time for a dataset since memory management is simpler to handle
-        if all the histograms in memory are deleted after reading a dataset is finished
-
-        Returns PU histograms for data
-        '''
-        hPUs = {}
-        count= 0
-        for aname, analyzerIE in self._analyzers.iteritems():
-            count+=1
-            hPU = None            
-            direction="nominal"
-            analyzer = analyzerIE.getAnalyzer()
-
-            if hasattr(analyzer,"usePileupWeights"):
-                usePUweights = analyzer.__getattr__("usePileupWeights")
-                if not usePUweights:
-                    continue
-
-            if hasattr(analyzer, "PUWeightSystematicVariation"):
-                direction=getattr(analyzer, "PUWeightSystematicVariation")
-
-            # For-loop: All data datasets
-            for i, dset in enumerate(self.datasetsData, 1):
-                if analyzerIE.runForDataset_(dset.getName()):
-                    if hPU is None:
-                        hPU = dset.getPileUp(direction).Clone()
-                    else:
-                        hPU.Add(dset.getPileUp(direction))
-
-            # Determine PU histo name postfix 
-            if hPU != None:
-                if direction == "plus":
-                    direction_postfix="Up"
-                elif direction == "minus":
-                    direction_postfix = "Down"
-                else:
-                    direction_postfix = ""
-
-                # Set the histogram name
-                hPU.SetName("PileUpData"+direction_postfix)
-                hPU.SetDirectory(None)
-                hPUs[aname] = hPU
-                self.Verbose("Saving PU direction \"%s\" for aname \"%s\". Mean = %s" % (direction, aname, hPUs[aname].GetMean() ), True)
-                # self.Verbose("Determined PU spectrum from data to have mean %.1f" % (hPUs[aname].GetMean()), True)
-            else:
-                raise Exception("Cannot determine PU spectrum for data!")
-        return hPUs
-
     def _getDataPUhistos_ORIGINAL(self): # for backwards compatibility while in transition
         '''
         Get data PU distributions from data
@@ -919,7 +1355,7 @@ class Process:
                 raise Exception("Cannot determine PU spectrum for data!")
         return hPUs
  
-    def _parsePUweighting(self, dset, analyzer, aname, hDataPUs, inputList):
+    def _parsePUweighting(self, dset, analyzer, aname, inputList):
         '''
         Obtains PU histogram for MC
         Returns tuple of N(all events PU weighted) and status of enabling PU weights
@@ -930,52 +1366,38 @@ class Process:
             return (0.0, False)
         hPUMC = None
         nAllEventsPUWeighted = 0.0
-        if aname in hDataPUs.keys():
-#            if _debugPUreweighting:
-#                for k in range(hDataPUs[aname].GetNbinsX()):
-#                    print "DEBUG(PUreweighting,aname=%s): dataPU:%d:%f"%(aname,k+1, hDataPUs[aname].GetBinContent(k+1))
-            inputList.Add(hDataPUs[aname])
-        else:
-            n = 100
-            hFlat = ROOT.TH1F("dummyPU"+aname,"dummyPU"+aname,n,0,n)
-            hFlat.SetName("PileUpData")
-            for k in range(n):
-                hFlat.Fill(k+1, 1.0/n)
-            inputList.Add(hFlat)
-            hDataPUs[aname] = hFlat
+
+        # The data PU histogram is owned by the provider, the selector gets a copy (deleted after the dataset)
+        hDataPU = self._puProvider.getDataPU(aname)
+        hDataPUcopy = hDataPU.Clone()
+        hDataPUcopy.SetDirectory(None)
+        inputList.Add(hDataPUcopy)
         if dset.getPileUp("nominal") == None:
             raise Exception("Error: pileup spectrum is missing from dataset! Please switch to using newest multicrab!")
         hPUMC = dset.getPileUp("nominal").Clone()
         hPUMC.SetDirectory(None)
 
         # Sanity checks: Integral and Binning
-        if hDataPUs[aname].Integral() == 0.0:
-            raise Exception("hDataPUs[%s].Integral() = %s! Make sure that the histogram \"configInfo/pileup\" of dataset \"%s\" is not empty!" % (aname, hDataPUs[aname].Integral(), dset.getName()) )
+        if hDataPU.Integral() == 0.0:
+            raise Exception("hDataPUs[%s].Integral() = %s! Make sure that the histogram \"configInfo/pileup\" of dataset \"%s\" is not empty!" % (aname, hDataPU.Integral(), dset.getName()) )
         else:
-            Verbose("hDataPUs[%s].GetMean() =  %s" % (aname, hDataPUs[aname].GetMean() ), False)
-        if hPUMC.GetNbinsX() != hDataPUs[aname].GetNbinsX():
-            raise Exception("Pileup histogram dimension mismatch! data nPU has %d bins and MC nPU has %d bins, for dataset \"%s\"!" % (hDataPUs[aname].GetNbinsX(), hPUMC.GetNbinsX(), dset.getName()) )
+            Verbose("hDataPUs[%s].GetMean() =  %s" % (aname, hDataPU.GetMean() ), False)
+        if hPUMC.GetNbinsX() != hDataPU.GetNbinsX():
+            raise Exception("Pileup histogram dimension mismatch! data nPU has %d bins and MC nPU has %d bins, for dataset \"%s\"!" % (hDataPU.GetNbinsX(), hPUMC.GetNbinsX(), dset.getName()) )
         else:
             Verbose("hPUMC.GetMean() =  %s" % (hPUMC.GetMean() ), False)
 
         hPUMC.SetName("PileUpMC")
-#        if _debugPUreweighting:
-#            for k in range(hPUMC.GetNbinsX()):
-#                print "Debug(PUreweighting): MCPU:%d:%f"%(k+1, hPUMC.GetBinContent(k+1))
         inputList.Add(hPUMC)
 
         if analyzer.exists("usePileupWeights"):
             usePUweights = analyzer.__getattr__("usePileupWeights")           
             if _debugPUreweighting:
-                Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Integral(): %f"%(aname,hDataPUs[aname].Integral()), True)
-                Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Mean(): %f"%(aname,hDataPUs[aname].GetMean()), True)
+                Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Integral(): %f"%(aname,hDataPU.Integral()), True)
+                Print("Debug(PUreweighting,aname=%s): hDataPUs[aname].Mean(): %f"%(aname,hDataPU.GetMean()), True)
 
             # Apply PU-reweighting
-            factor = hPUMC.Integral() / hDataPUs[aname].Integral()
-            for k in range(0, hPUMC.GetNbinsX()+2):
-                if hPUMC.GetBinContent(k) > 0.0:
-                    w = hDataPUs[aname].GetBinContent(k) / hPUMC.GetBinContent(k) * factor
-                    nAllEventsPUWeighted += w * hPUMC.GetBinContent(k)
+            (nAllEventsPUWeighted, factor) = self._puProvider.getNAllEventsPUWeighted(aname, hPUMC)
             if _debugPUreweighting:
                 Print("Debug(PUreweighting, aname=%s): normalization factor: %f"%(aname,factor), True)
                 Print("Debug(PUreweighting, aname=%s): nAllEventsPUWeighted: %f"%(aname,nAllEventsPUWeighted), True)
@@ -991,15 +1413,14 @@ class Process:
 
         hSkimCounterSum = None
         for inname in datasetFilenameList:
-            fIN = ROOT.TFile.Open(inname)
-            hSkimCounters = fIN.Get("configInfo/SkimCounter")
+            hSkimCounters = self._metadataIndex.get(inname).getHisto("configInfo/SkimCounter")
+            if hSkimCounters == None:
+                continue
             if hSkimCounterSum == None:
-                hSkimCounterSum = hSkimCounters.Clone()
-                hSkimCounterSum.SetDirectory(None) # Store the histogram to memory TDirectory, not into fIN
+                hSkimCounterSum = hSkimCounters # not attached to any TDirectory
             else:
                 hSkimCounterSum.Add(hSkimCounters)
-            hSkimCounters.Delete()
-            fIN.Close()
+                hSkimCounters.Delete()
         if hSkimCounterSum == None:
             # Construct an empty histogram
             hSkimCounterSum = ROOT.TH1F("SkimCounter","SkimCounter",1,0,1)
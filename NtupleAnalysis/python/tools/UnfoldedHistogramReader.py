@@ -9,6 +9,8 @@
 #     . x-axis contains information for the factorisation bin (just one bin for event counts; n bins for a shape)
 #     . y-axis is the unfolded bin number (i.e. factorisation bin)
 #     . Unfolding of binning is done with formula: y = x1 + x2*Nx1 + x3*Nx1*Nx2 ... (Nx is the number of bins including under- and overflow for given dimension)
+#   - The bin contents and squared errors of a histogram are read once into numpy arrays of
+#     dimension [Nx1][Nx2]...[shape bin], cached by histogram identity; contractions are sums over these arrays
 #
 # Indexing starts always from zero; for accessing root items, one is added to the internal indexing
 #
@@ -16,10 +18,12 @@
 
 import os
 import sys
+import numpy
 import ROOT
 
 from HiggsAnalysis.NtupleAnalysis.tools.dataset import Count
 import HiggsAnalysis.NtupleAnalysis.tools.ShellStyles as ShellStyles
+import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
 from math import sqrt
 
 class UnfoldedHistogramReader:
@@ -32,6 +36,7 @@ class UnfoldedHistogramReader:
         self._factorisationFullBinLabels = []
         self._factorisationCaptions = []
         self._factorisationRanges = []
+        self._arrays = {} # id(histogram) -> (histogram, stamp, contents, squared errors)
 
     ## Returns the Nbins list (dimension is the number of factorisation axes) of the factorisation bins
     def getNbinsList(self):
@@ -81,53 +86,31 @@ class UnfoldedHistogramReader:
         # Check that binning dimension is correct
         if len(self._binCount) != len(factorisationBinIndexList):
             raise Exception("Error in UnfoldedHistogramReader::getEventCountForBin(): You asked for %d dimensions, but the histogram has %d dimensions (the dimension needs to be the same)!"%(len(factorisationBinIndexList), len(self._binCount)))
-        myResult = []
-        myMin = 0
-        myMax = h.GetNbinsX()
-        if h.GetNbinsX() != 1:
-            # Include under- and overflow bin
-            myMin -= 1
-            myMax += 1
-        myUnfoldedBin = self._convertBinIndexListToUnfoldedIndex(factorisationBinIndexList)+1
-        for i in range(myMin,myMax):
-            myValue = h.GetBinContent(i+1, myUnfoldedBin)
-            myUncertainty = h.GetBinError(i+1, myUnfoldedBin)
-            myResult.append(Count(myValue, myUncertainty))
-        return myResult
+        return self.getShapeByUnfoldedBin(self._convertBinIndexListToUnfoldedIndex(factorisationBinIndexList), h)
 
     ## Returns a list of Count objects for the unfolded factorisation bin
     # Note: under- and overflow bin included only, if more than one bins exist (assume one bin histogram to be a count histogram)
     def getShapeByUnfoldedBin(self, unfoldedBinIndex, h):
         self._initialize(h)
-        myResult = []
-        myMin = 0
-        myMax = h.GetNbinsX()
-        if h.GetNbinsX() != 1:
-            # Include under- and overflow bin
-            myMin -= 1
-            myMax += 1
-        for i in range(myMin,myMax):
-            myValue = h.GetBinContent(i+1, unfoldedBinIndex+1)
-            myUncertainty = h.GetBinError(i+1, unfoldedBinIndex+1)
-            myResult.append(Count(myValue, myUncertainty))
-        return myResult
+        (myContents, myErrors2) = self._getArrays(h)
+        myShapeBins = self._getShapeBins(h)
+        return self._toCounts(myContents[unfoldedBinIndex+1, myShapeBins], myErrors2[unfoldedBinIndex+1, myShapeBins])
 
     ## Returns a list of the Count objects for a factorisation bin by contracting the other factorisation dimensions (i.e. reduce the factorisation dimensions to just the one specified)
     # Note: under- and overflow bin included only, if more than one bins exist (assume one bin histogram to be a count histogram)
     def getContractedShapeForBin(self, factorisationAxisToKeep, factorisationBin, h):
         self._initialize(h)
-        myResult = []
-        myMin = 0
-        myMax = h.GetNbinsX()
-        if h.GetNbinsX() != 1:
-            # Include under- and overflow bin
-            myMin -= 1
-            myMax += 1
-        for i in range(myMin,myMax):
-            myValue = self._contractionRecursionForBin([], factorisationAxisToKeep, factorisationBin, h, i)
-            myUncertainty = sqrt(self._contractionRecursionUncertaintyForBin([], factorisationAxisToKeep, factorisationBin, h, i))
-            myResult.append(Count(myValue, myUncertainty))
-        return myResult
+        (myContents, myErrors2) = self._getArrays(h)
+        myShapeBins = self._getShapeBins(h)
+        myContents = self._getCellArray(myContents)[..., myShapeBins]
+        myErrors2 = self._getCellArray(myErrors2)[..., myShapeBins]
+        if factorisationAxisToKeep >= 0 and factorisationAxisToKeep < len(self._binCount):
+            # Keep only the chosen bin of the desired axis
+            myContents = numpy.take(myContents, factorisationBin, axis=factorisationAxisToKeep)
+            myErrors2 = numpy.take(myErrors2, factorisationBin, axis=factorisationAxisToKeep)
+        # Sum over all other factorisation axes (uncertainties in quadrature)
+        myNShapeBins = myContents.shape[-1]
+        return self._toCounts(myContents.reshape(-1, myNShapeBins).sum(axis=0), myErrors2.reshape(-1, myNShapeBins).sum(axis=0))
 
     # Prints info about factorisation axes and ranges
     def printFactorisationDefinitions(self):
@@ -135,70 +118,43 @@ class UnfoldedHistogramReader:
         for i in range(0,len(self._binLabels)):
             print "  variable: %s, binning={%s}"%(self._binLabels[i], '; '.join(map(str, self._factorisationRanges[i])))
 
-    ## Do the summing by recursion for a given shape bin at a time
-    def _contractionRecursionForBin(self, binIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin):
-        #print "recursion",binIndexList
-        if len(binIndexList) == len(self._binCount):
-            # On final axis, return value
-            if len(binIndexList) != factorisationAxisToKeep:
-                #print "value=",h.GetBinContent(shapeBin, self._convertBinIndexListToUnfoldedIndex(binIndexList))
-                return h.GetBinContent(shapeBin+1, self._convertBinIndexListToUnfoldedIndex(binIndexList)+1)
-            else:
-                if binIndexList[len(binIndexList)] == factorisationBin:
-                    #print "value=",h.GetBinContent(shapeBin, self._convertBinIndexListToUnfoldedIndex(binIndexList))
-                    return h.GetBinContent(shapeBin+1, self._convertBinIndexListToUnfoldedIndex(binIndexList)+1)
-                else:
-                    #print "value=0"
-                    return 0.0
+    ## Returns the bin contents and the squared bin errors of the histogram as numpy arrays of dimension [y bin][x bin]
+    # (including under- and overflow bins). The arrays are read once per histogram object.
+    def _getArrays(self, h):
+        myStamp = (h.GetEntries(), h.GetSumOfWeights())
+        myCached = self._arrays.get(id(h), None)
+        if myCached is not None and myCached[0] is h and myCached[1] == myStamp:
+            return myCached[2:]
+        nx = h.GetNbinsX()+2
+        ny = h.GetNbinsY()+2
+        myContents = aux.tarrayToNumpy(h, nx*ny).reshape(ny, nx)
+        if h.GetSumw2N() > 0:
+            myErrors2 = aux.tarrayToNumpy(h.GetSumw2(), nx*ny).reshape(ny, nx)
         else:
-            # Not last axis, i.e. need to investigate next dimension
-            mySum = 0.0
-            if len(binIndexList) != factorisationAxisToKeep:
-                #print "not on axis"
-                # Not on desired axis, loop over all cells
-                for i in range(0,self._binCount[len(binIndexList)]):
-                    myBinIndexList = []
-                    myBinIndexList.extend(binIndexList)
-                    myBinIndexList.append(i)
-                    mySum += self._contractionRecursionForBin(myBinIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin)
-            else:
-                #print "axis",factorisationAxisToKeep
-                # On desired axis, take only the chosen value
-                myBinIndexList = []
-                myBinIndexList.extend(binIndexList)
-                myBinIndexList.append(factorisationBin)
-                mySum += self._contractionRecursionForBin(myBinIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin)
-            return mySum
+            myErrors2 = numpy.abs(myContents)
+        self._arrays[id(h)] = (h, myStamp, myContents, myErrors2)
+        return (myContents, myErrors2)
 
-    ## Helper method to do the actual recursion
-    def _contractionRecursionUncertaintyForBin(self, binIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin):
-        #print "recursion",binIndexList
-        if len(binIndexList) == len(self._binCount):
-            # On final axis, return value
-            if len(binIndexList) != factorisationAxisToKeep:
-                return h.GetBinError(shapeBin+1, self._convertBinIndexListToUnfoldedIndex(binIndexList)+1)**2
-            else:
-                if binIndexList[len(binIndexList+1)] == factorisationBin:
-                    return h.GetBinError(shapeBin, self._convertBinIndexListToUnfoldedIndex(binIndexList)+1)**2
-                else:
-                    return 0.0
-        else:
-            # Not last axis, i.e. need to investigate next dimension
-            mySum = 0.0
-            if len(binIndexList) != factorisationAxisToKeep:
-                # Not on desired axis, loop over all cells
-                for i in range(0,self._binCount[len(binIndexList)]):
-                    myBinIndexList = []
-                    myBinIndexList.extend(binIndexList)
-                    myBinIndexList.append(i)
-                    mySum += self._contractionRecursionUncertaintyForBin(myBinIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin)
-            else:
-                # On desired axis, take only the chosen value
-                myBinIndexList = []
-                myBinIndexList.extend(binIndexList)
-                myBinIndexList.append(factorisationBin)
-                mySum += self._contractionRecursionUncertaintyForBin(myBinIndexList, factorisationAxisToKeep, factorisationBin, h, shapeBin)
-            return mySum
+    ## Returns a view of a [y bin][x bin] array as [Nx1][Nx2]...[x bin], i.e. with one dimension per factorisation axis
+    def _getCellArray(self, a):
+        myCells = 1
+        for n in self._binCount:
+            myCells *= n
+        # y = x1 + x2*Nx1 + ..., i.e. the first factorisation axis runs fastest
+        myCellArray = a[1:myCells+1].reshape(list(reversed(self._binCount)) + [a.shape[1]])
+        myDims = len(self._binCount)
+        return myCellArray.transpose(range(myDims-1, -1, -1) + [myDims])
+
+    ## Returns the slice of x bins forming the shape
+    # Note: under- and overflow bin included only, if more than one bins exist (assume one bin histogram to be a count histogram)
+    def _getShapeBins(self, h):
+        if h.GetNbinsX() != 1:
+            return slice(0, h.GetNbinsX()+2)
+        return slice(1, 2)
+
+    ## Converts arrays of values and squared uncertainties to a list of Count objects
+    def _toCounts(self, values, errors2):
+        return [Count(float(v), sqrt(float(e2))) for v, e2 in zip(values, errors2)]
 
     ## Decompose factorisation bin labels and nbins information from histogram title
     def _initialize(self, h):
@@ -348,6 +348,23 @@ def listDirectoryContent(tdirectory, predicate=None):
         key = diriter.Next()
     return ret
 
+## Cache of TClass::InheritsFrom() results, (class name, base class name) -> bool
+_keyClassInherits = {}
+
+def keyInheritsFrom(baseClassName):
+    '''
+    Returns a predicate for listDirectoryContent() that is true for the keys
+    of objects inheriting from baseClassName. Only the class name stored in the
+    TKey is used, the objects are not read from the file.
+    '''
+    def predicate(key):
+        cacheKey = (key.GetClassName(), baseClassName)
+        if cacheKey not in _keyClassInherits:
+            cls = ROOT.TClass.GetClass(cacheKey[0])
+            _keyClassInherits[cacheKey] = bool(cls) and bool(cls.InheritsFrom(baseClassName))
+        return _keyClassInherits[cacheKey]
+    return predicate
+
 def th1Xmin(th1):
     if th1 is None:
         return None
@@ -371,6 +388,27 @@ def th2Ymax(th2):
 def th1Integral(th1):
     return th1.Integral(0, th1.GetNbinsX())
 
+## numpy types of the ROOT array classes (histograms inherit from one of them)
+_tarrayTypes = [("TArrayD", "float64"), ("TArrayF", "float32"), ("TArrayI", "int32"), ("TArrayS", "int16"), ("TArrayC", "int8")]
+
+## Copy the content of a ROOT array to a numpy float64 array
+#
+# \param tarray  TArray (or TH1/TH2/TH3 for the bin contents, TArrayD for the Sumw2 array)
+# \param n       Number of elements (default: all cells of a histogram including under/overflow bins)
+#
+# For histograms the array is indexed with the global bin number,
+# i.e. index 0 is the underflow bin
+def tarrayToNumpy(tarray, n=None):
+    import numpy
+    if n is None:
+        n = tarray.GetNcells() if hasattr(tarray, "GetNcells") else tarray.GetSize()
+    for className, dtype in _tarrayTypes:
+        if isinstance(tarray, getattr(ROOT, className)):
+            buf = tarray.GetArray()
+            buf.SetSize(n)
+            return numpy.frombuffer(buf, dtype=dtype, count=n).astype(numpy.float64)
+    raise Exception("Unsupported array type %s" % tarray.ClassName())
+
 ## Copy (some) style attributes from one ROOT object to another
 #
 # \param src  Source object (copy attributes from)
@@ -681,5 +719,19 @@ if __name__ == "__main__":
             tasks = ["Foo", "Bar", "Foobar"]
             self.assertRaises(Exception, includeExcludeTasks, tasks, excludeTasks="Foo", includeOnlyTasks="Bar")
 
+    class TestKeyInheritsFrom(unittest.TestCase):
+        def testClassName(self):
+            class Key:
+                def __init__(self, className):
+                    self._className = className
+                def GetClassName(self):
+                    return self._className
+            isTH1 = keyInheritsFrom("TH1")
+            self.assertTrue(isTH1(Key("TH1F")))
+            self.assertTrue(isTH1(Key("TH2D")))
+            self.assertFalse(isTH1(Key("TNamed")))
+            self.assertFalse(isTH1(Key("TDirectoryFile")))
+            self.assertFalse(isTH1(Key("NoSuchClass")))
+
     unittest.main()
 
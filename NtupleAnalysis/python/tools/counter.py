@@ -2171,10 +2171,10 @@ class EventCounter:
     # \param mainCounterOnly     If True, read only the main counter (default: False)
     # \param kwargs              Keyword arguments, passed to Dataset.getDatasetRootHisto() when reading the counter histograms
     #
-    # Creates counter.Counter for the main counter and each subcounter
+    # Creates counter.Counter for the main counter. The subcounters are
+    # found from the TKey class names (without reading the histograms)
+    # when first needed, and each counter.Counter is created on first access.
     def __init__(self, datasets, countNameFunction=None, counters=None, mainCounterOnly=False, **kwargs):
-        counterNames = {}
-
         allDatasets = []
         if hasattr(datasets, "getAllDatasets"):
             allDatasets = datasets.getAllDatasets()
@@ -2195,30 +2195,55 @@ class EventCounter:
                 else:
                     if counterDir != dataset.getCounterDirectory():
                         raise Exception("Sanity check failed, datasets have different counter directories!")
-        # Pick all possible names of counters
-        for dataset in allDatasets:
-            for name in dataset.getDirectoryContent(counterDir, lambda obj: isinstance(obj, ROOT.TH1)):
-                counterNames[name] = 1
-
-        try:
-            del counterNames["counter"]
-        except KeyError:
-            raise Exception("Error: no 'counter' histogram in the '%s' directories" % counterDir)
 
-        def getDatasetRootHistos(path):
-            return [d.getDatasetRootHisto(path, **kwargs) for d in allDatasets]
+        self._datasets = allDatasets
+        self._counterDir = counterDir
+        self._countNameFunction = countNameFunction
+        self._kwargs = kwargs
+        self._mainCounterOnly = mainCounterOnly
+        self._subCounterNames = None
+        self._operations = []
 
-        self.mainCounter = Counter(getDatasetRootHistos(counterDir+"/counter"), countNameFunction)
+        self.mainCounter = Counter(self._getDatasetRootHistos("counter"), countNameFunction)
         self.subCounters = {}
-        if not mainCounterOnly:
-            for subname in counterNames.keys():
-                try:
-                    self.subCounters[subname] = Counter(getDatasetRootHistos(counterDir+"/"+subname), countNameFunction)
-                except:
-                    pass
 
         self.normalization = "None"
 
+    def _getDatasetRootHistos(self, name):
+        return [d.getDatasetRootHisto(self._counterDir+"/"+name, **self._kwargs) for d in self._datasets]
+
+    ## Get the names of the subcounter histograms present in all datasets
+    #
+    # The class names stored in the TKeys are used if the datasets
+    # support it, otherwise each object is read to check its type.
+    def _findSubCounterNames(self):
+        if self._subCounterNames is not None:
+            return self._subCounterNames
+        counterNames = set()
+        if not self._mainCounterOnly:
+            for i, dataset in enumerate(self._datasets):
+                if hasattr(dataset, "getDirectoryContentByClass"):
+                    names = dataset.getDirectoryContentByClass(self._counterDir, "TH1")
+                else:
+                    names = dataset.getDirectoryContent(self._counterDir, lambda obj: isinstance(obj, ROOT.TH1))
+                if i == 0:
+                    counterNames = set(names)
+                else:
+                    counterNames &= set(names)
+            counterNames.discard("counter")
+        self._subCounterNames = sorted(counterNames)
+        return self._subCounterNames
+
+    ## Create a subcounter, and apply the operations done so far to it
+    def _createSubCounter(self, name):
+        if name not in self._findSubCounterNames():
+            raise KeyError(name)
+        counter = Counter(self._getDatasetRootHistos(name), self._countNameFunction)
+        for func in self._operations:
+            func(counter)
+        self.subCounters[name] = counter
+        return counter
+
     ## Remove columns
     #
     # \param datasetNames   Names of datasets to remove
@@ -2229,10 +2254,13 @@ class EventCounter:
         self.mainCounter.removeRows(counterName)
 
     ## Loop through all counters calling the given function
+    #
+    # The function is also recorded, and applied to the subcounters created later
     def _forEachCounter(self, func):
         func(self.mainCounter)
         for c in self.subCounters.itervalues():
             func(c)
+        self._operations.append(func)
 
     ## Set normalization scheme to unit area
     def normalizeToOne(self):
@@ -2281,19 +2309,21 @@ class EventCounter:
 
     ## Get names of subcounters
     def getSubCounterNames(self):
-        return self.subCounters.keys()
+        return self._findSubCounterNames()[:]
 
     ## Get the counter.Counter of a subcounter
     #
     # \param name  Name of subcounter
     def getSubCounter(self, name):
-        return self.subCounters[name]
+        if name in self.subCounters:
+            return self.subCounters[name]
+        return self._createSubCounter(name)
 
     ## Get the counter.CounterTable from a subcounter
     #
     # \param name  Name of subcounter
     def getSubCounterTable(self, name):
-        return self.subCounters[name].getTable()
+        return self.getSubCounter(name).getTable()
 
     ## Get current normalization scheme string
     def getNormalizationString(self):
@@ -2302,7 +2332,63 @@ class EventCounter:
     ## \var mainCounter
     # counter.Counter object for the main counter
     ## \var subCounters
-    # Dictionary of counter.Counter objects for the subcounters.
+    # Dictionary of counter.Counter objects for the subcounters created so far.
     # Subcounter names serve as the keys.
     ## \var normalization
     # Name of current normalization scheme
+
+if __name__ == "__main__":
+    import unittest
+
+    class FakeDatasetRootHisto:
+        def __init__(self, dataset, path):
+            self._dataset = dataset
+            self.path = path
+
+        def getDataset(self):
+            return self._dataset
+
+        def getBinLabels(self):
+            return ["all", "passed"]
+
+    class FakeDataset:
+        def __init__(self, name, content):
+            self._name = name
+            self._content = content
+            self.readPaths = []
+
+        def getName(self):
+            return self._name
+
+        def getCounterDirectory(self):
+            return "analysis/counters"
+
+        def getDirectoryContentByClass(self, directory, className):
+            return self._content
+
+        def getDatasetRootHisto(self, path, **kwargs):
+            self.readPaths.append(path)
+            return FakeDatasetRootHisto(self, path)
+
+    class TestEventCounter(unittest.TestCase):
+        def setUp(self):
+            self.datasets = [FakeDataset("Data", ["counter", "tau", "jet"]),
+                             FakeDataset("TT", ["counter", "jet", "tau", "mu"])]
+
+        def testSubCounterNames(self):
+            ec = EventCounter(self.datasets)
+            self.assertEqual(self.datasets[0].readPaths, ["analysis/counters/counter"])
+            self.assertEqual(ec.getSubCounterNames(), ["jet", "tau"])
+            self.assertEqual(EventCounter(self.datasets, mainCounterOnly=True).getSubCounterNames(), [])
+
+        def testSubCounter(self):
+            ec = EventCounter(self.datasets)
+            ec.removeColumns(["Data"])
+            jet = ec.getSubCounter("jet")
+            self.assertEqual(jet.getColumnNames(), ["TT"])
+            self.assertEqual(jet.counters[0].datasetRootHisto.path, "analysis/counters/jet")
+            self.assertTrue(ec.getSubCounter("jet") is jet)
+            self.assertEqual(self.datasets[1].readPaths, ["analysis/counters/counter", "analysis/counters/jet"])
+            self.assertRaises(KeyError, ec.getSubCounter, "mu")
+
+    unittest.main()
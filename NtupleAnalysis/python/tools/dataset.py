@@ -18,6 +18,7 @@ import StringIO
 import hashlib
 import array
 import socket
+import resource
 from collections import OrderedDict
 
 import ROOT
@@ -26,6 +27,8 @@ import HiggsAnalysis.NtupleAnalysis.tools.histogramsExtras as histogramsExtras
 import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
 import HiggsAnalysis.NtupleAnalysis.tools.pileupReweightedAllEvents as pileupReweightedAllEvents
 import HiggsAnalysis.NtupleAnalysis.tools.crosssection as crosssection
+import HiggsAnalysis.NtupleAnalysis.tools.fileMetadata as fileMetadata
+import HiggsAnalysis.NtupleAnalysis.tools.histogramCache as histogramCache
 
 from sys import platform as _platform
 
@@ -401,6 +404,8 @@ def addOptions(parser, analysisName=None, searchMode=None, dataEra=None, optimiz
                       help="List available analysis name information, and quit.")
     parser.add_option("--counterDir", "-c", dest="counterDir", type="string", default=None,
                       help="TDirectory name containing the counters, relative to the analysis directory (default: analysisDirectory+'/counters')")
+    parser.add_option("--histogramCache", dest="histogramCache", action="store_true", default=False,
+                      help="Cache the histograms read from the ROOT files to %s in the multicrab directory, and read them from there in later runs" % histogramCache.cacheFileName)
     return
 
 
@@ -678,6 +683,42 @@ def _normalizeToFactor(h, f):
     h.Scale(f)
     return h
 
+## Add a histogram to a sum histogram
+#
+# \param hsum        RootHistoWithUncertainties object of the sum, modified in place
+# \param histo       RootHistoWithUncertainties object to add
+# \param sumName     Name of the dataset of \a hsum (for error message)
+# \param histoName   Name of the dataset of \a histo (for error message)
+#
+# Histograms with different number of bins can be added only if they
+# have bin labels (i.e. counters), in which case the bin contents are
+# matched by the labels (ignoring the uncertainties).
+def _addToSumHistogram(hsum, histo, sumName, histoName):
+    if histo.GetNbinsX() == hsum.GetNbinsX():
+        hsum.Add(histo)
+        return
+
+    nSuccess = 0
+    if len(hsum.getRootHisto().GetXaxis().GetBinLabel(1)) > 0:
+        # Try to recover for histograms with bin labels, i.e. counters
+        for i in range(1,hsum.getRootHisto().GetNbinsX()+1):
+            for j in range(1,histo.getRootHisto().GetNbinsX()+1):
+                if len(hsum.getRootHisto().GetXaxis().GetBinLabel(i)) > 0:
+                    if hsum.getRootHisto().GetXaxis().GetBinLabel(i) == histo.getRootHisto().GetXaxis().GetBinLabel(j):
+                        nSuccess += 1
+                        hsum.getRootHisto().SetBinContent(i, hsum.getRootHisto().GetBinContent(i) + histo.getRootHisto().GetBinContent(j));
+                        # Ignore uncertainties
+    if nSuccess == 0:
+        raise Exception("Histogram '%s' from datasets '%s' and '%s' have different binnings: %d vs. %d" % (hsum.GetName(), sumName, histoName, hsum.GetNbinsX(), histo.GetNbinsX()))
+
+## Peak resident memory of the process in MB
+def getPeakMemoryUsage():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if _platform == "darwin":
+        # bytes on OS X, kilobytes on Linux
+        return peak/1024.0**2
+    return peak/1024.0
+
 
 ## Helper function for merging/stacking a set of datasets.
 # 
@@ -845,7 +886,10 @@ class TreeDraw:
             raise Exception("No TTree '%s' in file %s" % (treeName, dataset.getRootFile().GetName()))
 
         if self.varexp == "":
-            nentries = tree.GetEntries(selection)
+            if selection == "":
+                nentries = dataset.getNumberOfEntries(self.tree)
+            else:
+                nentries = tree.GetEntries(selection)
             h = ROOT.TH1F("nentries", "Number of entries by selection %s"%selection, 1, 0, 1)
             h.SetDirectory(0)
             if len(self.weight) > 0:
@@ -1032,6 +1076,9 @@ def _treeDrawToNumEntriesSingle(treeDraw):
 #
 # Seems to be used only from DatasetQCDData class, which was never
 # finished.
+#
+# Without selection and weight the returned TreeDraw takes the number
+# of entries from the entry-count index (Dataset.getNumberOfEntries())
 def treeDrawToNumEntries(treeDraw):
     if isinstance(treeDraw, TreeDrawCompound):
         td = TreeDrawCompound(_treeDrawToNumEntriesSingle(treeDraw.default))
@@ -1280,9 +1327,44 @@ class SystematicsHelper:
 
         
 
+## Get the squared bin errors of a histogram as a numpy array (indexed with the global bin number)
+def _th1Errors2ToArray(h):
+    import numpy
+    if h.GetBinErrorOption() != ROOT.TH1.kNormal:
+        return numpy.array([h.GetBinError(i)**2 for i in xrange(h.GetNcells())])
+    if h.GetSumw2N() > 0:
+        return aux.tarrayToNumpy(h.GetSumw2(), h.GetNcells())
+    # Same as TH1::GetBinError() without Sumw2
+    return numpy.abs(aux.tarrayToNumpy(h))
+
+## Set the bin contents of a histogram from an array (indexed with the global bin number)
+def _setTH1Content(h, values):
+    h.SetContent(array.array("d", values.tolist()))
+
+## Sum the shape variation uncertainties to asymmetric uncertainties
+#
+# \param plus   numpy array (nVariations x nBins) of the (plus variation - nominal) differences
+# \param minus  numpy array (nVariations x nBins) of the (minus variation - nominal) differences
+#
+# \return pair of numpy arrays (nBins) of the squared upper and lower uncertainties
+#
+# Vectorised version of aux.getProperAdditivesForVariationUncertainties(),
+# summed over the variations: if both variations go to the same
+# direction, only the larger one is taken in that direction.
+def _sumVariationUncertainties2(plus, minus):
+    import numpy
+    high = numpy.maximum(numpy.maximum(plus, minus), 0.0)
+    low = numpy.minimum(numpy.minimum(plus, minus), 0.0)
+    return ((high**2).sum(axis=0), (low**2).sum(axis=0))
+
 ## Class to encapsulate a ROOT histogram with a bunch of uncertainties
 #
 # Looks almost as TH1, except holds bunch of uncertainties; the histograms contained are clones and therefore owned by the class
+#
+# The uncertainty computations (getSystematicUncertaintyGraph(),
+# treatNegativeBins(), relative uncertainties) are done on numpy
+# arrays of the nominal histogram and of the variations, see
+# getUncertaintyArrays().
 class RootHistoWithUncertainties:
     def __init__(self, rootHisto):
         self._rootHisto = None
@@ -1351,12 +1433,10 @@ class RootHistoWithUncertainties:
             raise Exception("getRate(): The under/overflow bins might not be not empty! Did you forget to call makeFlowBinsVisible() before getRate()?")
         if len(self._treatShapesAsStat) > 0:
             print "WARNING: some shapes are treated as statistical uncertainty, but they have not been implemented yet to getRateStatUncertainty()!"
-        mySum = 0.0
         if isinstance(self._rootHisto, ROOT.TH2):
             raise Exception("getRateStatUncertainty() supported currently only for TH1!")
-        for i in range(1, self._rootHisto.GetNbinsX()+1):
-            mySum += self._rootHisto.GetBinError(i)**2
-        return math.sqrt(mySum)
+        errors2 = _th1Errors2ToArray(self._rootHisto)
+        return math.sqrt(errors2[1:self._rootHisto.GetNbinsX()+1].sum())
 
     ## Get the syst. uncertainty of the root histo object
     def getRateSystUncertainty(self):
@@ -1386,16 +1466,19 @@ class RootHistoWithUncertainties:
         histogramsExtras.makeFlowBinsVisible(self._rootHisto)
 
     ## Sets negative bins to zero events
+    #
+    # Only the bins that change are written to the histograms
     def treatNegativeBins(self, minimumStatUncertainty):
+        import numpy
         def treatBins(h):
-            for i in range(h.GetNbinsX()):
-                if h.GetBinContent(i+1) < 0.0:
-                    h.SetBinContent(i+1, 0.0)
+            values = aux.tarrayToNumpy(h)[1:h.GetNbinsX()+1]
+            for i in numpy.flatnonzero(values < 0.0):
+                h.SetBinContent(int(i)+1, 0.0)
         # Treat negative bins in rate histo
         treatBins(self._rootHisto)
-        for i in range(self._rootHisto.GetNbinsX()):
-            if self._rootHisto.GetBinError(i+1) < minimumStatUncertainty:
-                self._rootHisto.SetBinError(i+1, minimumStatUncertainty)
+        errors2 = _th1Errors2ToArray(self._rootHisto)[1:self._rootHisto.GetNbinsX()+1]
+        for i in numpy.flatnonzero(errors2 < minimumStatUncertainty**2):
+            self._rootHisto.SetBinError(int(i)+1, minimumStatUncertainty)
         # Treat negative bins in variations
         for key, (hPlus, hMinus) in self._shapeUncertainties.iteritems():
             treatBins(hPlus)
@@ -1494,10 +1577,13 @@ class RootHistoWithUncertainties:
             hminus = aux.Clone(th1Plus)
             hminus.Scale(-1)
 
-        for bin in xrange(1, self._rootHisto.GetNbinsX()+1):
-            myRate = self._rootHisto.GetBinContent(bin)
-            hplus.SetBinContent(bin, myRate * hplus.GetBinContent(bin))
-            hminus.SetBinContent(bin, myRate * hminus.GetBinContent(bin))
+        # Scale the relative uncertainties of the visible bins by the rate
+        nbins = self._rootHisto.GetNbinsX()
+        myRate = aux.tarrayToNumpy(self._rootHisto)[1:nbins+1]
+        for h in [hplus, hminus]:
+            values = aux.tarrayToNumpy(h)
+            values[1:nbins+1] *= myRate
+            _setTH1Content(h, values)
 
         self._shapeUncertainties[name] = (hplus, hminus)
 
@@ -1513,16 +1599,21 @@ class RootHistoWithUncertainties:
         if name in self._shapeUncertainties.keys():
             raise Exception("addShapeUncertaintyRelative(): Uncertainty '%s' already exists (did you add it twice?)!"%name)
 
+        import numpy
         hplus = aux.Clone(self._rootHisto)
         hplus.Reset()
         hminus = aux.Clone(hplus)
-        for bin in xrange(1, self._rootHisto.GetNbinsX()+1):
-            myRate = self._rootHisto.GetBinContent(bin)
-            hplus.SetBinContent(bin, myRate * uncertaintyPlus)
-            if uncertaintyMinus == None:
-                hminus.SetBinContent(bin, -myRate * uncertaintyPlus)
-            else:
-                hminus.SetBinContent(bin, -abs(myRate * uncertaintyMinus))
+        nbins = self._rootHisto.GetNbinsX()
+        myRate = aux.tarrayToNumpy(self._rootHisto)
+        plusValues = numpy.zeros_like(myRate)
+        minusValues = numpy.zeros_like(myRate)
+        plusValues[1:nbins+1] = myRate[1:nbins+1] * uncertaintyPlus
+        if uncertaintyMinus == None:
+            minusValues[1:nbins+1] = -myRate[1:nbins+1] * uncertaintyPlus
+        else:
+            minusValues[1:nbins+1] = -numpy.abs(myRate[1:nbins+1] * uncertaintyMinus)
+        _setTH1Content(hplus, plusValues)
+        _setTH1Content(hminus, minusValues)
 
         self._shapeUncertainties[name] = (hplus, hminus)
 
@@ -1530,6 +1621,32 @@ class RootHistoWithUncertainties:
     def getShapeUncertainties(self):
         return self._shapeUncertainties
 
+    ## Get the nominal histogram and the shape variation uncertainties as numpy arrays
+    #
+    # \param names  List of the shape uncertainty names (default: all, in the order of getShapeUncertaintyNames())
+    #
+    # \return triple of numpy arrays: nominal bin contents (nBins),
+    # and the (variation - nominal) differences of the plus and minus
+    # variations (nVariations x nBins); the arrays are indexed with the
+    # global bin number, i.e. including the under/overflow bins
+    def getUncertaintyArrays(self, names=None):
+        import numpy
+        if names is None:
+            names = self._shapeUncertainties.keys()
+        if isinstance(self._rootHisto, ROOT.TGraph):
+            # For graphs the point index is used as the bin number of the shape histograms
+            nominal = numpy.array([self._rootHisto.GetY()[i] for i in xrange(self._rootHisto.GetN())])
+        else:
+            nominal = aux.tarrayToNumpy(self._rootHisto)
+        n = len(nominal)
+        plus = numpy.zeros((len(names), n))
+        minus = numpy.zeros((len(names), n))
+        for i, name in enumerate(names):
+            (hPlus, hMinus) = self._shapeUncertainties[name]
+            plus[i] = aux.tarrayToNumpy(hPlus)[:n]
+            minus[i] = aux.tarrayToNumpy(hMinus)[:n]
+        return (nominal, plus, minus)
+
     def getShapeUncertaintyNames(self):
         return self._shapeUncertainties.keys()
 
@@ -1569,48 +1686,7 @@ class RootHistoWithUncertainties:
     # direction (i.e. asymmetrically). Again, a rather crude
     # approximation.
     def getSystematicUncertaintyGraph(self, addStatistical=False, addSystematic=True):
-        xvalues = []
-        xerrhigh = []
-        xerrlow = []
-        yvalues = []
-        yerrhigh = []
-        yerrlow = []
-
-        class WrapTH1:
-            def __init__(self, th1):
-                self._th1 = th1
-            def begin(self):
-                return 1
-            def end(self):
-                return self._th1.GetNbinsX()+1
-            def xvalues(self, i):
-                xval = self._th1.GetBinCenter(i)
-                xlow = xval-self._th1.GetXaxis().GetBinLowEdge(i)
-                xhigh = self._th1.GetXaxis().GetBinUpEdge(i)-xval
-                return (xval, xlow, xhigh)
-            def y(self, i):
-                return self._th1.GetBinContent(i)
-            def statErrors(self, i):
-                stat = self._th1.GetBinError(i)
-                return (stat, stat)
-        class WrapTGraph:
-            def __init__(self, gr):
-                self._gr = gr
-            def begin(self):
-                return 0
-            def end(self):
-                return self._gr.GetN()
-            def xvalues(self, i):
-                return (self._gr.GetX()[i], self._gr.GetErrorXlow(i), self._gr.GetErrorXhigh(i))
-            def y(self, i):
-                return self._gr.GetY()[i]
-            def statErrors(self, i):
-                return (self._gr.GetErrorYlow(i), self._gr.GetErrorYhigh(i))
-
-        if isinstance(self._rootHisto, ROOT.TGraph):
-            wrapper = WrapTGraph(self._rootHisto)
-        else:
-            wrapper = WrapTH1(self._rootHisto)
+        import numpy
 
         # Set shapes to stat, syst, or stat+syst according to what was
         # requested
@@ -1618,48 +1694,56 @@ class RootHistoWithUncertainties:
         if addStatistical and len(self._treatShapesAsStat) > 0:
             if addSystematic:
                 # stat+syst, so we can just add all shape uncertainties
-                shapes = self._shapeUncertainties.values()
+                shapes = self._shapeUncertainties.keys()
             else:
                 # only stat, so get only them
-                for name in self._treatShapesAsStat:
-                    shapes.append(self._shapeUncertainties[name])
+                shapes = list(self._treatShapesAsStat)
         elif addSystematic:
             # in this case all shapes are syst
-            shapes = self._shapeUncertainties.values()
-
-        #shapes.sort()
-        #print addStatistical, addSystematic, "\n  ".join([x[0].GetName() for x in shapes])
-
-        for i in xrange(wrapper.begin(), wrapper.end()):
-            (xval, xlow, xhigh) = wrapper.xvalues(i)
-
-            yval = wrapper.y(i)
-            yhighSquareSum = 0.0
-            ylowSquareSum = 0.0
-
-            if addStatistical:
-                (statLow, statHigh) = wrapper.statErrors(i)
-                yhighSquareSum += statHigh**2
-                ylowSquareSum += statLow**2
-
-            if len(shapes) > 0:
-                for shapePlus, shapeMinus in shapes:
-                    diffPlus = shapePlus.GetBinContent(i) # Note that this could have + or - sign
-                    diffMinus = shapeMinus.GetBinContent(i) # Note that this could have + or - sign
-                    (addPlus, addMinus) = aux.getProperAdditivesForVariationUncertainties(diffPlus, diffMinus)
-                    yhighSquareSum += addPlus
-                    ylowSquareSum += addMinus
-
-            xvalues.append(xval)
-            xerrhigh.append(xhigh)
-            xerrlow.append(xlow)
-            yvalues.append(yval)
-            yerrhigh.append(math.sqrt(yhighSquareSum))
-            yerrlow.append(math.sqrt(ylowSquareSum))
-
-        return ROOT.TGraphAsymmErrors(len(xvalues), array.array("d", xvalues), array.array("d", yvalues),
-                                      array.array("d", xerrlow), array.array("d", xerrhigh),
-                                      array.array("d", yerrlow), array.array("d", yerrhigh))
+            shapes = self._shapeUncertainties.keys()
+
+        if isinstance(self._rootHisto, ROOT.TGraph):
+            gr = self._rootHisto
+            n = gr.GetN()
+            bins = slice(0, n)
+            xvalues = numpy.array([gr.GetX()[i] for i in xrange(n)])
+            yvalues = numpy.array([gr.GetY()[i] for i in xrange(n)])
+            xerrlow = numpy.array([gr.GetErrorXlow(i) for i in xrange(n)])
+            xerrhigh = numpy.array([gr.GetErrorXhigh(i) for i in xrange(n)])
+            statLow2 = numpy.array([gr.GetErrorYlow(i)**2 for i in xrange(n)])
+            statHigh2 = numpy.array([gr.GetErrorYhigh(i)**2 for i in xrange(n)])
+        else:
+            th1 = self._rootHisto
+            n = th1.GetNbinsX()
+            bins = slice(1, n+1)
+            axis = th1.GetXaxis()
+            if axis.IsVariableBinSize():
+                edges = aux.tarrayToNumpy(axis.GetXbins(), n+1)
+            else:
+                edges = numpy.linspace(axis.GetXmin(), axis.GetXmax(), n+1)
+            xvalues = 0.5*(edges[:-1]+edges[1:])
+            xerrlow = xvalues-edges[:-1]
+            xerrhigh = edges[1:]-xvalues
+            yvalues = aux.tarrayToNumpy(th1)[bins]
+            statLow2 = statHigh2 = _th1Errors2ToArray(th1)[bins]
+
+        yhighSquareSum = numpy.zeros(n)
+        ylowSquareSum = numpy.zeros(n)
+        if addStatistical:
+            yhighSquareSum += statHigh2
+            ylowSquareSum += statLow2
+
+        if len(shapes) > 0:
+            (nominal, plus, minus) = self.getUncertaintyArrays(shapes)
+            (addPlus, addMinus) = _sumVariationUncertainties2(plus[:, bins], minus[:, bins])
+            yhighSquareSum += addPlus
+            ylowSquareSum += addMinus
+
+        def toArray(a):
+            return array.array("d", a.tolist())
+        return ROOT.TGraphAsymmErrors(n, toArray(xvalues), toArray(yvalues),
+                                      toArray(xerrlow), toArray(xerrhigh),
+                                      toArray(numpy.sqrt(ylowSquareSum)), toArray(numpy.sqrt(yhighSquareSum)))
 
     ## Print associated systematic uncertainties
     def printUncertainties(self):
@@ -2157,21 +2241,7 @@ class DatasetRootHistoCompoundBase(DatasetRootHistoBase):
 
         for h in self.histoWrappers[i+1:]:
             histo = h.getHistogramWithUncertainties()
-            if histo.GetNbinsX() != hsum.GetNbinsX():
-                hh = nSuccess = 0
-                if len(hsum.getRootHisto().GetXaxis().GetBinLabel(1)) > 0:
-                    # Try to recover for histograms with bin labels, i.e. counters
-                    for i in range(1,hsum.getRootHisto().GetNbinsX()+1):
-                        for j in range(1,histo.getRootHisto().GetNbinsX()+1):
-                            if len(hsum.getRootHisto().GetXaxis().GetBinLabel(i)) > 0:
-                                if hsum.getRootHisto().GetXaxis().GetBinLabel(i) == histo.getRootHisto().GetXaxis().GetBinLabel(j):
-                                    nSuccess += 1
-                                    hsum.getRootHisto().SetBinContent(i, hsum.getRootHisto().GetBinContent(i) + histo.getRootHisto().GetBinContent(j));
-                                    # Ignore uncertainties
-                if nSuccess == 0:
-                    raise Exception("Histogram '%s' from datasets '%s' and '%s' have different binnings: %d vs. %d" % (hsum.GetName(), self.histoWrappers[i].getDataset().getName(), h.getDataset().getName(), hsum.GetNbinsX(), histo.GetNbinsX()))
-            else:
-                hsum.Add(histo)
+            _addToSumHistogram(hsum, histo, self.histoWrappers[i].getDataset().getName(), h.getDataset().getName())
             histo.Delete()
         return hsum
 
@@ -2415,6 +2485,44 @@ class DatasetRootHistoMergedMC(DatasetRootHistoCompoundBase):
     # String representing the current normalization scheme
 
 
+## Wrapper for the sum of merged TH1 histograms from MC, accumulated without keeping the constituents.
+#
+# Created by DatasetMerged.getDatasetRootHisto() in the streaming mode
+# (see DatasetMerged.setStreamHistograms()). The histogram of each
+# merged dataset is normalized by cross section right after reading,
+# and added (with its shape variation uncertainties) to the running
+# total, after which it is deleted. Only the total is kept, so the
+# cross sections and the numbers of all events of the merged datasets
+# must be final when the histogram is read, and forEach() and
+# modifyRootHisto() act on the total.
+#
+# See also the documentation of DatasetRootHistoMergedMC class.
+class DatasetRootHistoMergedMCSum(DatasetRootHisto):
+    ## Constructor.
+    #
+    # \param histo          RootHistoWithUncertainties object of the sum of the cross section normalized histograms
+    # \param mergedDataset  The corresponding dataset.DatasetMerged object
+    def __init__(self, histo, mergedDataset):
+        DatasetRootHisto.__init__(self, histo, mergedDataset)
+
+    ## Return normalized clone of the summed histogram
+    def _normalizedHistogram(self):
+        if self.normalization == "none":
+            raise Exception("Merged MC histograms must be normalized to something!")
+        if self.histo is None:
+            return None
+
+        h = self.histo.Clone()
+        h.SetName(h.GetName()+"_cloned")
+        if self.normalization == "toOne":
+            return _normalizeToOne(h)
+        elif self.normalization == "byCrossSection":
+            return h
+        elif self.normalization == "toLuminosity":
+            return _normalizeToFactor(h, self.luminosity)
+        else:
+            raise Exception("Internal error, got normalization %s" % self.normalization)
+
 ## Wrapper for a added TH1 histograms from MC and the corresponding Datasets.
 #
 # Here "Adding" is like merging, but for datasets which have the same
@@ -2605,6 +2713,7 @@ class Dataset:
     #                                      available on the ROOT file (without the "Plus"/"Minus" postfix)
     # \param enableSystematicVariationForData Add \a systematicVariation to directory name also for data (needed for embedding)
     # \param setCrossSectionAutomatically Try to set cross section automatically if the dataset is MC (default True)
+    # \param histogramCache    histogramCache.HistogramCache for the histograms read with getRootHisto() (optional)
     #
     # 
     # Opens the ROOT file, reads 'configInfo/configInfo' histogram
@@ -2628,10 +2737,11 @@ class Dataset:
     # therefore the 
     def __init__(self, name, tfiles, analysisName,
                  searchMode=None, dataEra=None, optimizationMode=None, systematicVariation=None,
-                 weightedCounters=True, counterDir="counters", useAnalysisNameOnly=False, availableSystematicVariationSources=[], enableSystematicVariationForData=False, setCrossSectionAutomatically=True):
+                 weightedCounters=True, counterDir="counters", useAnalysisNameOnly=False, availableSystematicVariationSources=[], enableSystematicVariationForData=False, setCrossSectionAutomatically=True, histogramCache=None):
         self.rawName = name
         self.name = name
         self.files = tfiles
+        self._histogramCache = histogramCache
         if len(self.files) == 0:
             raise Exception("Expecting at least one TFile, jot 0")
 
@@ -2701,6 +2811,7 @@ class Dataset:
         self._availableSystematicVariationSources = availableSystematicVariationSources
         self._enableSystematicVariationForData = enableSystematicVariationForData
         self._setCrossSectionAutomatically = setCrossSectionAutomatically
+        self._directoryIndex = {}
 
         self._analysisDirectoryName = self._analysisName
         if not self._useAnalysisNameOnly:
@@ -2797,7 +2908,7 @@ class Dataset:
     # while also keeping the original ttbar with the original SM cross
     # section.
     def deepCopy(self):
-        d = Dataset(self.rawName, self.files, self._analysisName, self._searchMode, self._dataEra, self._optimizationMode, self._systematicVariation, self._weightedCounters, self._unweightedCounterDir, self._useAnalysisNameOnly, self._availableSystematicVariationSources, self._enableSystematicVariationForData, self._setCrossSectionAutomatically)
+        d = Dataset(self.rawName, self.files, self._analysisName, self._searchMode, self._dataEra, self._optimizationMode, self._systematicVariation, self._weightedCounters, self._unweightedCounterDir, self._useAnalysisNameOnly, self._availableSystematicVariationSources, self._enableSystematicVariationForData, self._setCrossSectionAutomatically, self._histogramCache)
         d.info.update(self.info)
         d.nAllEvents = self.nAllEvents
         d.name = self.name
@@ -2877,6 +2988,10 @@ class Dataset:
     # draw() method), the draw() method is called by giving the
     # Dataset object as parameters. The draw() method is expected to
     # return a TH1 which is then returned.
+    #
+    # If the Dataset has a histogramCache.HistogramCache, the (summed)
+    # histogram is taken from it if the files have not changed since
+    # the histogram was stored, and stored to it otherwise.
     def getRootHisto(self, name, **kwargs):
         if hasattr(name, "draw"):
             if len(kwargs) > 0:
@@ -2884,6 +2999,12 @@ class Dataset:
             h = name.draw(self)
             realName = None
         else:
+            fileNames = [f.GetName() for f in self.files]
+            if self._histogramCache is not None:
+                realName = self._translateName(name, **kwargs)
+                h = self._histogramCache.get(fileNames, realName)
+                if h is not None:
+                    return (h, realName)
             (histos, realName) = self.getRootObjects(name, **kwargs)
             if len(histos) == 1:
                 h = histos[0]
@@ -2892,6 +3013,8 @@ class Dataset:
                 h = aux.Clone(h, h.GetName()+"_cloned")
                 for h2 in histos[1:]:
                     h.Add(h2)
+            if self._histogramCache is not None:
+                self._histogramCache.put(fileNames, realName, h)
     
         return (h, realName)
 
@@ -2912,6 +3035,23 @@ class Dataset:
             chain.Add(f.GetName())
         return (chain, realName)
 
+    ## Get the number of entries of a TTree
+    #
+    # \param treeName  Path of the ROOT TTree relative to the analysis
+    #                  root directory
+    # \param kwargs    Keyword arguments, forwarded to _translateName()
+    #
+    # The per-file entry counts are taken from the file metadata index
+    # of the multicrab directory (fileMetadata.indexFileName). Counts
+    # missing from the index are read once from the files and added to
+    # it, so TChain.GetEntries() is not needed.
+    def getNumberOfEntries(self, treeName, **kwargs):
+        realName = self._translateName(treeName, **kwargs)
+        index = fileMetadata.getMetadataIndex(os.path.join(self.getBaseDirectory(), fileMetadata.indexFileName))
+        nentries = sum([index.getEntries(f.GetName(), realName) for f in self.files])
+        index.save()
+        return nentries
+
     ## Get arbitrary ROOT object from the file
     #
     # \param name    Path of the ROOT object relative to the analysis
@@ -3268,6 +3408,30 @@ class Dataset:
 
         return aux.listDirectoryContent(dirs[0], wrapped)
 
+    def getDirectoryContentByClass(self, directory, className):
+        '''
+        Get the names of the objects of a given class (or of its subclasses) in a directory of the ROOT file.
+
+        \param directory   Path of the directory in the ROOT file
+
+        \param className   Name of the (base) class, e.g. "TH1"
+
+        \return List of names in the directory.
+
+        Unlike getDirectoryContent() with a predicate, the objects are not
+        read: the class name stored in the TKey is used. The listing is
+        cached. If the dataset consists of multiple files, the listing of
+        the first file is given.
+        '''
+        key = (directory, className)
+        if key not in self._directoryIndex:
+            (dirs, realDir) = self.getRootObjects(directory)
+            self._directoryIndex[key] = aux.listDirectoryContent(dirs[0], aux.keyInheritsFrom(className))
+        content = self._directoryIndex[key]
+        if content is None:
+            return None
+        return content[:]
+
     def _setBaseDirectory(self,base):
         self.basedir = base
         
@@ -3325,6 +3489,7 @@ class DatasetMerged:
         self.name = name
         #self.stacked = stacked
         self.datasets = datasets
+        self._streamHistograms = False
         if len(datasets) == 0:
             raise Exception("Can't create a DatasetMerged from 0 datasets")
 
@@ -3365,8 +3530,44 @@ class DatasetMerged:
     def deepCopy(self):
         dm = DatasetMerged(self.name, [d.deepCopy() for d in self.datasets])
         dm.info.update(self.info)
+        dm.setStreamHistograms(self._streamHistograms)
         return dm
 
+    ## Set the streaming mode of getDatasetRootHisto()
+    #
+    # \param stream  If True, the histograms of the merged MC datasets
+    #                are summed as they are read, and only the sum is
+    #                kept (see DatasetRootHistoMergedMCSum). This
+    #                bounds the memory needed for merging many datasets
+    #                with many shape variations (e.g. 2D histograms).
+    def setStreamHistograms(self, stream=True):
+        self._streamHistograms = stream
+
+    ## Read and sum the histograms of the merged datasets one at a time
+    #
+    # \param name       Path of the histogram in the ROOT file
+    # \param normalize  Normalize each histogram by cross section before adding
+    # \param kwargs     Keyword arguments, forwarded to getDatasetRootHisto() of the contained Dataset objects
+    #
+    # \return RootHistoWithUncertainties object of the sum
+    def _getStreamedHistogram(self, name, normalize, **kwargs):
+        hsum = None
+        for d in self.datasets:
+            drh = d.getDatasetRootHisto(name, **kwargs)
+            if normalize:
+                drh.normalizeByCrossSection()
+            histo = drh.getHistogramWithUncertainties() # we get a clone
+            del drh
+            if histo is None:
+                continue
+            if hsum is None:
+                hsum = histo
+                continue
+            _addToSumHistogram(hsum, histo, self.datasets[0].getName(), d.getName())
+            histo.Delete()
+        Verbose("Summed histogram %s of %d datasets to %s, peak memory %.0f MB" % (name, len(self.datasets), self.name, getPeakMemoryUsage()))
+        return hsum
+
     def setDirectoryPostfix(self, postfix):
         for d in self.datasets:
             d.setDirectoryPostfix(postfix)
@@ -3458,6 +3659,8 @@ class DatasetMerged:
     #
     # DatasetRootHistoMergedData works also for pseudo
     def getDatasetRootHisto(self, name, **kwargs):
+        if self._streamHistograms and self.isMC():
+            return DatasetRootHistoMergedMCSum(self._getStreamedHistogram(name, True, **kwargs), self)
         wrappers = [d.getDatasetRootHisto(name, **kwargs) for d in self.datasets]
         if self.isMC():
             return DatasetRootHistoMergedMC(wrappers, self)
@@ -3507,6 +3710,13 @@ class DatasetMerged:
                 raise Exception("Error: merged datasets have different contents in directory '%s'" % directory)
         return content
 
+    def getDirectoryContentByClass(self, directory, className):
+        content = self.datasets[0].getDirectoryContentByClass(directory, className)
+        for d in self.datasets[1:]:
+            if content != d.getDirectoryContentByClass(directory, className):
+                raise Exception("Error: merged datasets have different contents in directory '%s'" % directory)
+        return content
+
     def formatDatasetTree(self, indent):
         ret = '%sDatasetMerged("%s", [\n' % (indent, self.getName())
         for dataset in self.datasets:
@@ -3535,6 +3745,7 @@ class DatasetAddedMC(DatasetMerged):
         self.name = name
         #self.stacked = stacked
         self.datasets = datasets
+        self._streamHistograms = False
         if len(datasets) == 0:
             raise Exception("Can't create a DatasetAddedMC from 0 datasets")
 
@@ -3563,6 +3774,7 @@ class DatasetAddedMC(DatasetMerged):
     def deepCopy(self):
         dm = DatasetAddedMC(self.name, [d.deepCopy() for d in self.datasets])
         dm.info.update(self.info)
+        dm.setStreamHistograms(self._streamHistograms)
         return dm
 
     ## Set cross section of MC dataset (in pb).
@@ -3583,7 +3795,13 @@ class DatasetAddedMC(DatasetMerged):
     # \param kwargs Keyword arguments, forwarder to get
     #               getDatasetRootHisto() of the contained
     #               Dataset objects
+    #
+    # In the streaming mode (see DatasetMerged.setStreamHistograms())
+    # the histograms are summed as they are read, and the sum is
+    # wrapped to a DatasetRootHisto of this DatasetAddedMC.
     def getDatasetRootHisto(self, name, **kwargs):
+        if self._streamHistograms:
+            return DatasetRootHisto(self._getStreamedHistogram(name, False, **kwargs), self)
         wrappers = [d.getDatasetRootHisto(name, **kwargs) for d in self.datasets]
         return DatasetRootHistoAddedMC(wrappers, self)
 
@@ -3654,6 +3872,7 @@ class DatasetManager:
 
         self.datasets   = []
         self.datasetMap = {}
+        self._streamMergedHistograms = False
         self._setBaseDirectory(base)
         return
 
@@ -3951,6 +4170,22 @@ class DatasetManager:
         return
 
 
+    def setStreamMergedHistograms(self, stream=True):
+        '''
+        Set the streaming mode of the merged datasets (existing and created later by merge()).
+
+        \param stream  If True, the histograms of merged MC datasets are normalized
+        and summed as they are read, and the histograms of the individual datasets
+        are deleted right after (see DatasetMerged.setStreamHistograms()). The peak
+        memory usage is printed in the verbose mode (see getPeakMemoryUsage()).
+        '''
+        self._streamMergedHistograms = stream
+        for d in self.datasets:
+            if hasattr(d, "setStreamHistograms"):
+                d.setStreamHistograms(stream)
+        return
+
+
     def merge(self, newName, nameList, keepSources=False, addition=False, silent=True, allowMissingDatasets=False):
         '''
         Merge dataset.Dataset objects.
@@ -3997,6 +4232,7 @@ class DatasetManager:
             newDataset = DatasetAddedMC(newName, selected)
         else:
             newDataset = DatasetMerged(newName, selected)
+        newDataset.setStreamHistograms(self._streamMergedHistograms)
 
         self.datasets.insert(firstIndex, newDataset)
         self._populateMap()
@@ -4337,8 +4573,12 @@ class DatasetPrecursor:
     Precursor dataset, helper class for DatasetManagerCreator
     
     This holds the name, ROOT file, and data/MC status of a dataset.
+
+    If a fileMetadata.MetadataIndex is given, the data version, pileup and
+    N(all events) are taken from it, and the ROOT files are opened only
+    when getFiles() is called.
     '''
-    def __init__(self, name, filenames):
+    def __init__(self, name, filenames, metadataIndex=None):
         Verbose("__init__", True)
         self._name = name
         if isinstance(filenames, basestring):
@@ -4353,6 +4593,11 @@ class DatasetPrecursor:
         self._pileup_down = None
         self._nAllEvents = 0.0
 
+        if metadataIndex is not None:
+            self._readMetadata(metadataIndex)
+            self._setStatus()
+            return
+
         Verbose("Opening ROOT files", False)
         for name in self._filenames:
 
@@ -4426,7 +4671,61 @@ class DatasetPrecursor:
                         self._nAllEvents += counters.GetBinContent(1)
                 if self._nAllEvents == 0.0:
                     print "Warning (DatasetPrecursor): N(allEvents) = 0 !!!"
+        self._setStatus()
+
+    def _readMetadata(self, metadataIndex):
+        '''
+        Same as the file loop of the constructor, but from the metadata index
+        '''
+        for name in self._filenames:
+            md = metadataIndex.get(name)
+            dv = md.getDataVersion()
+            if dv is None:
+                print "Unable to find 'configInfo/dataVersion' from ROOT file '%s', I have no idea if this file is data, MC, or pseudo" % name
+                continue
+            if self._dataVersion is None:
+                self._dataVersion = dv
+            elif self._dataVersion != dv:
+                raise Exception("Mismatch in dataVersion when creating multi-file DatasetPrecursor, got %s from file %s, and %s from %s" % (self._dataVersion, self._filenames[0], dv, name))
+            if not md.hasEvents():
+                continue
+
+            # Pileup histograms
+            pileup = md.getHisto("configInfo/pileup")
+            if pileup == None:
+                Print("Unable to find 'configInfo/pileup' from ROOT file '%s'" % name, True)
+                sys.exit()
+            if (pileup.Integral() == 0):
+                raise Exception("Empty pileup histogram \"configInfo/pileup\" in ROOT file \"%s\". Entries = \"%s\"." % (name, pileup.GetEntries()) )
+            self._pileup = self._addHisto(self._pileup, pileup)
+            if ("data" in self._dataVersion):
+                for attr, puName in [("_pileup_up", "configInfo/pileup_up"), ("_pileup_down", "configInfo/pileup_down")]:
+                    h = md.getHisto(puName)
+                    if h == None:
+                        print "Unable to find '%s' from ROOT file '%s'" % (puName, name)
+                        continue
+                    setattr(self, attr, self._addHisto(getattr(self, attr), h))
 
+            # Obtain nAllEvents
+            counters = md.getHisto("configInfo/SkimCounter")
+            if counters != None:
+                if counters.GetNbinsX() > 0:
+                    if not "All" in counters.GetXaxis().GetBinLabel(1):
+                        raise Exception("Error: The first bin of the counters histogram should be the all events bin!")
+                    self._nAllEvents += counters.GetBinContent(1)
+                counters.Delete()
+            if self._nAllEvents == 0.0:
+                print "Warning (DatasetPrecursor): N(allEvents) = 0 !!!"
+        return
+
+    def _addHisto(self, hSum, h):
+        if hSum is None:
+            return h
+        hSum.Add(h)
+        h.Delete()
+        return hSum
+
+    def _setStatus(self):
         if self._dataVersion is None:
             self._isData = False
             self._isPseudo = False
@@ -4440,6 +4739,15 @@ class DatasetPrecursor:
         return self._name
 
     def getFiles(self):
+        '''
+        Returns the opened ROOT files (opened here if the metadata was read from an index)
+        '''
+        if len(self._rootFiles) == 0:
+            for name in self._filenames:
+                rf = ROOT.TFile.Open(name)
+                if rf == None:
+                    raise Exception("Unable to open ROOT file '%s' for dataset '%s'" % (name, self._name))
+                self._rootFiles.append(rf)
         return self._rootFiles
 
     def getFileNames(self):
@@ -4501,13 +4809,17 @@ class DatasetManagerCreator:
         
         <b>Keyword arguments</b>
         \li \a baseDirectory    Base directory of the datasets (delivered later to DatasetManager._setBaseDirectory())
+        \li \a metadataIndex    fileMetadata.MetadataIndex for reading the dataset metadata without opening the ROOT files (optional)
+        \li \a histogramCache   histogramCache.HistogramCache given to the created Datasets, or True for the
+                                histogramCache.cacheFileName of the base directory (optional, also enabled with \a opts.histogramCache)
     
         Creates DatasetPrecursor objects for each ROOT file, reads the
         contents of first MC file to get list of available analyses.
         '''
         self._label = None
-        self._precursors = [DatasetPrecursor(name, filenames) for name, filenames in rootFileList]
+        self._precursors = [DatasetPrecursor(name, filenames, kwargs.get("metadataIndex", None)) for name, filenames in rootFileList]
         self._baseDirectory = kwargs.get("baseDirectory", "")
+        self._histogramCache = self._getHistogramCache(kwargs.get("histogramCache", None), kwargs.get("opts", None))
         
         mcRead = False
         for d in self._precursors:
@@ -4617,12 +4929,28 @@ class DatasetManagerCreator:
         self._systematicVariationSources = systTmp.keys()
         self._systematicVariationSources.sort()
 
+    def _getHistogramCache(self, cache, opts):
+        if cache is None and getattr(opts, "histogramCache", False):
+            cache = True
+        if cache is True:
+            return histogramCache.getHistogramCache(os.path.join(self._baseDirectory, histogramCache.cacheFileName))
+        return cache
+
     def getBaseDirectory(self):
         return self._baseDirectory
 
+    def getHistogramCache(self):
+        return self._histogramCache
+
     def getLumiFile(self):
         return os.path.join(self._baseDirectory, "lumi.json")
 
+    def getFileNames(self):
+        '''
+        Returns the names of the ROOT files of all datasets
+        '''
+        return [name for precursor in self._precursors for name in precursor.getFileNames()]
+
     ## Create DatasetManager
     #
     # \param kwargs   Keyword arguments (see below)
@@ -4634,6 +4962,7 @@ class DatasetManagerCreator:
     # \li \a optimizationMode  String for optimization mode (optional)
     # \li \a systematicVariation String for systematic variation (optional)
     # \li \a opts              Optional OptionParser object. Should have options added with addOptions().
+    # \li \a histogramCache    histogramCache.HistogramCache for the histograms of the datasets (optional, default is the one given to the constructor)
     #
     # The values of \a analysisName, \a searchMode, \a dataEra, and \a
     # optimizationMode are overridden from \a opts, if they are set
@@ -4664,6 +4993,10 @@ class DatasetManagerCreator:
                     _args[arg] = o
             del _args["opts"]
 
+        _args["histogramCache"] = self._getHistogramCache(_args.get("histogramCache", None), None)
+        if _args["histogramCache"] is None:
+            _args["histogramCache"] = self._histogramCache
+
         if not "analysisName" in _args:
             raise Exception("You did not specify AnalysisName, and it was not automatically detected from ROOT file")
 
@@ -4867,10 +5200,13 @@ class NtupleCache:
     # \param maxEvents      Maximum number of events to process (-1 for all events)
     # \param printStatus    Print processing status information
     # \param macros         Additional macro files to compile and load
+    # \param treeCacheSize  Size of the TTreeCache in bytes (the branches are learned from the first entries)
+    # \param treeCachePrefetch  Fill the TTreeCache asynchronously (useful for remote files)
     #
     # I would like to make \a process redundant, but so far I haven't
     # figured out a bullet-proof method for that.
-    def __init__(self, treeName, selector, selectorArgs=[], process=True, cacheFileName="histogramCache.root", maxEvents=-1, printStatus=True, macros=[]):
+    def __init__(self, treeName, selector, selectorArgs=[], process=True, cacheFileName="histogramCache.root", maxEvents=-1, printStatus=True, macros=[],
+                 treeCacheSize=10*1024*1024, treeCachePrefetch=False):
         self.treeName = treeName
         self.cacheFileName = cacheFileName
         self.selectorName = selector
@@ -4878,6 +5214,8 @@ class NtupleCache:
         self.doProcess = process
         self.maxEvents = maxEvents
         self.printStatus = printStatus
+        self.treeCacheSize = treeCacheSize
+        self.treeCachePrefetch = treeCachePrefetch
 
         self.additionalSelectors = {}
         self.datasetSelectorArgs = {}
@@ -4972,7 +5310,7 @@ class NtupleCache:
         selectorArgs = getSelectorArgs(None, self.selectorArgs)
         (tree, realTreeName) = dataset.createRootChain(self.treeName)
 
-        N = tree.GetEntries()
+        N = dataset.getNumberOfEntries(self.treeName)
         useMaxEvents = False
         if self.maxEvents >= 0 and N > self.maxEvents:
             useMaxEvents = True
@@ -5005,9 +5343,11 @@ class NtupleCache:
         print "Processing dataset", datasetName
         
         # Setup cache
-        useCache = True
+        useCache = self.treeCacheSize > 0
         if useCache:
-            tree.SetCacheSize(1024*1024) # 10 MB
+            if self.treeCachePrefetch:
+                ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1)
+            tree.SetCacheSize(self.treeCacheSize)
             tree.SetCacheLearnEntries(100);
 
         readBytesStart = ROOT.TFile.GetFileBytesRead()
@@ -0,0 +1,367 @@
+## \package fileMetadata
+# Single-pass harvesting of the configInfo metadata of ntuple files
+#
+# The analysis driver (main.Process) needs several small objects from
+# every input file before the event loop: the data version, the pileup
+# spectra, the skim counters, the top-pt N(all events) and the
+# configinfo histogram. Each file is opened only once to collect all of
+# them, and the result can be kept in a JSON index next to the
+# multicrab directory, so that later runs do not open the files at all.
+#
+# The index also records the number of entries of the TTrees of each
+# file (the Events tree at harvest time, others on first request), which
+# replaces the TChain.GetEntries() calls that would otherwise open every
+# file of a chain.
+
+import os
+import json
+import array
+
+import ROOT
+
+## Name of the index file (in the multicrab directory)
+indexFileName = "fileMetadata.json"
+
+## Version of the index file format
+_indexVersion = 2
+
+## Histograms read from each file
+_histogramPaths = [
+    "configInfo/SkimCounter",
+    "configInfo/topPtWeightAllEvents",
+    "configInfo/configinfo",
+    "configInfo/pileup",
+    "configInfo/pileup_up",
+    "configInfo/pileup_down",
+]
+
+def _histoToDict(h):
+    '''
+    Converts a 1D histogram to a JSON-serializable dictionary
+    '''
+    n = h.GetNbinsX()
+    axis = h.GetXaxis()
+    d = {
+        "class": h.ClassName(),
+        "name": h.GetName(),
+        "title": h.GetTitle(),
+        "nbins": n,
+        "xmin": axis.GetXmin(),
+        "xmax": axis.GetXmax(),
+        "entries": h.GetEntries(),
+        "contents": [h.GetBinContent(i) for i in xrange(n+2)],
+    }
+    if axis.IsVariableBinSize():
+        d["edges"] = [axis.GetBinLowEdge(i) for i in xrange(1, n+2)]
+    if h.GetSumw2N() > 0:
+        d["sumw2"] = [h.GetSumw2().At(i) for i in xrange(n+2)]
+    if axis.GetLabels():
+        d["labels"] = [axis.GetBinLabel(i) for i in xrange(1, n+1)]
+    return d
+
+def _dictToHisto(d):
+    '''
+    Constructs a 1D histogram (not attached to any directory) from a dictionary of _histoToDict()
+    '''
+    addDirectory = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory(False)
+    cls = getattr(ROOT, str(d["class"]))
+    if "edges" in d:
+        h = cls(str(d["name"]), str(d["title"]), d["nbins"], array.array("d", d["edges"]))
+    else:
+        h = cls(str(d["name"]), str(d["title"]), d["nbins"], d["xmin"], d["xmax"])
+    ROOT.TH1.AddDirectory(addDirectory)
+
+    if "labels" in d:
+        for i, label in enumerate(d["labels"], 1):
+            h.GetXaxis().SetBinLabel(i, str(label))
+    if "sumw2" in d:
+        h.Sumw2()
+    for i, value in enumerate(d["contents"]):
+        h.SetBinContent(i, value)
+    if "sumw2" in d:
+        sumw2 = h.GetSumw2()
+        for i, value in enumerate(d["sumw2"]):
+            sumw2.SetAt(value, i)
+    h.SetEntries(d["entries"])
+    return h
+
+## Index objects shared within the process, see getMetadataIndex()
+_indices = {}
+
+def _fileKey(fileName):
+    '''
+    Index key of a file: absolute path for local files, unchanged for remote files
+    '''
+    if "://" in fileName or fileName.startswith("root:"):
+        return fileName
+    return os.path.abspath(fileName)
+
+def _readEntries(rf, treeName):
+    '''
+    Number of entries of a TTree in an open file. Raises an exception
+    if the tree does not exist (e.g. corrupt or mis-named input file)
+    '''
+    tree = rf.Get(treeName)
+    if tree == None:
+        raise Exception("Unable to find TTree '%s' in ROOT file '%s'" % (treeName, rf.GetName()))
+    return int(tree.GetEntries())
+
+def getMetadataIndex(indexFile):
+    '''
+    Returns the MetadataIndex of an index file, shared by all callers within the process
+    '''
+    indexFile = os.path.abspath(indexFile)
+    if indexFile not in _indices:
+        _indices[indexFile] = MetadataIndex(indexFile)
+    return _indices[indexFile]
+
+def _fileStamp(fileName):
+    '''
+    Returns (size, mtime) of a local file, or None for remote files
+    (e.g. root://), which are assumed not to change after merging
+    '''
+    if not os.path.exists(fileName):
+        return None
+    st = os.stat(fileName)
+    return [st.st_size, int(st.st_mtime)]
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class FileMetadata:
+    '''
+    The configInfo metadata of one ROOT file
+    '''
+    def __init__(self, data):
+        self._data = data
+
+    @staticmethod
+    def harvest(fileName):
+        '''
+        Opens the file once and reads all metadata objects from it
+        '''
+        rf = ROOT.TFile.Open(fileName)
+        # Below is important to use '==' instead of 'is' to check for null file
+        if rf == None:
+            raise Exception("Unable to open ROOT file '%s'" % fileName)
+        data = {"stamp": _fileStamp(fileName), "dataVersion": None, "hasEvents": False, "histograms": {}, "entries": {}}
+        dv = rf.Get("configInfo/dataVersion")
+        if dv != None:
+            data["dataVersion"] = dv.GetTitle()
+        data["hasEvents"] = rf.Get("Events") != None
+        if data["hasEvents"]:
+            data["entries"]["Events"] = _readEntries(rf, "Events")
+        for path in _histogramPaths:
+            h = rf.Get(path)
+            if h != None:
+                data["histograms"][path] = _histoToDict(h)
+        rf.Close()
+        return FileMetadata(data)
+
+    def getDataVersion(self):
+        if self._data["dataVersion"] is None:
+            return None
+        return str(self._data["dataVersion"])
+
+    def hasEvents(self):
+        return self._data["hasEvents"]
+
+    def hasHisto(self, path):
+        return path in self._data["histograms"]
+
+    def getHisto(self, path):
+        '''
+        Returns a new histogram (owned by the caller), or None if the object does not exist in the file
+        '''
+        if not self.hasHisto(path):
+            return None
+        return _dictToHisto(self._data["histograms"][path])
+
+    def getEntries(self, treeName):
+        '''
+        Returns the number of entries of a TTree, or None if it has not been recorded
+        '''
+        return self._data["entries"].get(treeName, None)
+
+    def setEntries(self, treeName, entries):
+        self._data["entries"][treeName] = entries
+
+    def getStamp(self):
+        return self._data["stamp"]
+
+    def serialize(self):
+        return self._data
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class MetadataIndex:
+    '''
+    Index of FileMetadata objects, optionally persisted to a JSON file
+
+    Files missing from the index, or local files whose size or modification
+    time changed, are harvested on first access. The updated index is written
+    with save(); if the index file cannot be written the index stays in memory.
+    '''
+    def __init__(self, indexFile=None):
+        self._indexFile = None
+        self._files = {}
+        self._modified = False
+        if indexFile is not None:
+            self.load(indexFile)
+
+    def load(self, indexFile):
+        '''
+        Adds the entries of an index file. The first loaded file is the one
+        written by save() (it does not need to exist yet).
+        '''
+        if self._indexFile is None:
+            self._indexFile = indexFile
+            self._modified = len(self._files) > 0
+        if not os.path.exists(indexFile):
+            return
+        f = open(indexFile)
+        try:
+            data = json.load(f)
+        except ValueError:
+            print "Ignoring corrupt file metadata index %s" % indexFile
+            data = {}
+        f.close()
+        if data.get("version", None) != _indexVersion:
+            return
+        for fileName, fileData in data["files"].iteritems():
+            if fileName not in self._files:
+                self._files[str(fileName)] = FileMetadata(fileData)
+        return
+
+    def get(self, fileName):
+        key = _fileKey(fileName)
+        md = self._files.get(key, None)
+        if md is not None:
+            stamp = _fileStamp(fileName)
+            if stamp is None or stamp == md.getStamp():
+                return md
+        md = FileMetadata.harvest(fileName)
+        self._files[key] = md
+        self._modified = True
+        return md
+
+    def getEntries(self, fileName, treeName="Events"):
+        '''
+        Number of entries of a TTree in a file. Trees not seen before are
+        read from the file once and recorded in the index.
+        '''
+        md = self.get(fileName)
+        entries = md.getEntries(treeName)
+        if entries is None:
+            rf = ROOT.TFile.Open(fileName)
+            if rf == None:
+                raise Exception("Unable to open ROOT file '%s'" % fileName)
+            try:
+                entries = _readEntries(rf, treeName)
+            finally:
+                rf.Close()
+            md.setEntries(treeName, entries)
+            self._modified = True
+        return entries
+
+    def save(self):
+        if self._indexFile is None or not self._modified:
+            return
+        data = {"version": _indexVersion, "files": dict([(k, v.serialize()) for k, v in self._files.iteritems()])}
+        tmpName = self._indexFile+".tmp%d" % os.getpid()
+        try:
+            f = open(tmpName, "w")
+            json.dump(data, f)
+            f.close()
+            os.rename(tmpName, self._indexFile)
+        except (IOError, OSError), e:
+            print "Unable to write file metadata index %s: %s" % (self._indexFile, str(e))
+            return
+        self._modified = False
+        return
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+    import shutil
+
+    class TestHistoConversion(unittest.TestCase):
+        def testRoundTrip(self):
+            h = ROOT.TH1F("SkimCounter", "SkimCounter", 3, 0, 3)
+            h.SetDirectory(None)
+            h.Sumw2()
+            for i, label in enumerate(["All events", "Passed", "Trigger"], 1):
+                h.GetXaxis().SetBinLabel(i, label)
+                h.Fill(label, i*2.0)
+            h2 = _dictToHisto(json.loads(json.dumps(_histoToDict(h))))
+            self.assertEqual(h2.ClassName(), "TH1F")
+            self.assertEqual(h2.GetName(), "SkimCounter")
+            self.assertEqual(h2.GetNbinsX(), 3)
+            self.assertEqual(h2.GetEntries(), h.GetEntries())
+            for i in xrange(5):
+                self.assertEqual(h2.GetBinContent(i), h.GetBinContent(i))
+                self.assertAlmostEqual(h2.GetBinError(i), h.GetBinError(i))
+            self.assertEqual(h2.GetXaxis().GetBinLabel(1), "All events")
+
+        def testVariableBins(self):
+            h = ROOT.TH1D("pileup", "pileup", 3, array.array("d", [0, 1, 5, 10]))
+            h.SetDirectory(None)
+            h.Fill(3)
+            h2 = _dictToHisto(_histoToDict(h))
+            self.assertEqual(h2.GetXaxis().GetBinLowEdge(3), 5)
+            self.assertEqual(h2.GetBinContent(2), 1)
+
+    class TestMetadataIndex(unittest.TestCase):
+        def setUp(self):
+            self._dir = tempfile.mkdtemp()
+            self._rootFile = os.path.join(self._dir, "histograms-Foo.root")
+            f = ROOT.TFile.Open(self._rootFile, "RECREATE")
+            d = f.mkdir("configInfo")
+            d.cd()
+            ROOT.TNamed("dataVersion", "80Xmc").Write()
+            h = ROOT.TH1F("pileup", "pileup", 10, 0, 10)
+            h.Fill(4)
+            h.Write()
+            f.Close()
+
+        def tearDown(self):
+            shutil.rmtree(self._dir)
+
+        def testPersist(self):
+            indexFile = os.path.join(self._dir, indexFileName)
+            index = MetadataIndex(indexFile)
+            md = index.get(self._rootFile)
+            self.assertEqual(md.getDataVersion(), "80Xmc")
+            self.assertFalse(md.hasEvents())
+            self.assertEqual(md.getHisto("configInfo/pileup").GetBinContent(5), 1)
+            self.assertEqual(md.getHisto("configInfo/SkimCounter"), None)
+            index.save()
+            self.assertTrue(os.path.exists(indexFile))
+
+            index2 = MetadataIndex(indexFile)
+            self.assertEqual(index2.get(self._rootFile).getStamp(), md.getStamp())
+            self.assertFalse(index2._modified)
+
+        def testEntries(self):
+            f = ROOT.TFile.Open(self._rootFile, "UPDATE")
+            tree = ROOT.TTree("Events", "Events")
+            x = array.array("i", [0])
+            tree.Branch("x", x, "x/I")
+            for i in xrange(7):
+                tree.Fill()
+            tree.Write()
+            f.Close()
+
+            indexFile = os.path.join(self._dir, indexFileName)
+            index = MetadataIndex(indexFile)
+            self.assertEqual(index.getEntries(self._rootFile), 7)
+            self.assertRaises(Exception, index.getEntries, self._rootFile, "configInfo/Missing")
+            index.save()
+            index2 = MetadataIndex(indexFile)
+            self.assertEqual(index2.get(os.path.relpath(self._rootFile)).getEntries("Events"), 7)
+            self.assertEqual(index2.get(self._rootFile).getEntries("configInfo/Missing"), None)
+            self.assertFalse(index2._modified)
+
+    unittest.main()
@@ -3,8 +3,32 @@
 import ROOT
 ROOT.gROOT.SetBatch(True)
 import math
+import re
 import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
 
+## Formats a number as a constant of a TFormula expression (repr keeps the full double precision)
+def formulaConstant(value):
+    return "(%r)"%float(value)
+
+## Replaces the parameters [i] of a TFormula expression by the given values
+def substituteFormulaParameters(formula, parameters):
+    return re.sub(r"\[(\d+)\]", lambda m: formulaConstant(parameters[int(m.group(1))]), formula)
+
+## Creates a TF1 from a TFormula expression, which is compiled instead of calling back to python for every point
+# If the expression is None or it does not give a valid function of nParams parameters,
+# the TF1 is created from the python callable
+#
+# \param name      name of the TF1
+# \param formula   TFormula expression of the function (or None)
+# \param function  python callable f(x, par) giving the same values
+def createTF1(name, formula, function, xmin, xmax, nParams):
+    if formula != None:
+        f = ROOT.TF1(name, formula, xmin, xmax)
+        if f.IsValid() and f.GetNpar() == nParams:
+            return f
+        print "Warning: could not compile fit function '%s' from formula '%s', using the python function instead"%(name, formula)
+    return ROOT.TF1(name, function, xmin, xmax, nParams)
+
 class FitParameterOrthogonalizer:
     ## Default constructor
     # The strategy is to first diagonalize the error matrix of the fit parameters
@@ -174,5 +198,21 @@ if __name__ == "__main__":
             self.assertLess(abs(fpo.getTotalFitParameterUncertaintyUp()-3.16), 0.01)
             self.assertLess(abs(fpo.getTotalFitParameterUncertaintyDown()-3.17), 0.01)
 
+    class TestCreateTF1(unittest.TestCase):
+        def testFormula(self):
+            class MyFit:
+                def __call__(self, x, par):
+                    return par[0]*ROOT.TMath.Gaus(x[0],par[1],par[2],1)
+            f = createTF1("fformula", "[0]*TMath::Gaus(x,[1],[2],1)", MyFit(), 0, 10, 3)
+            g = createTF1("fpython", None, MyFit(), 0, 10, 3)
+            self.assertEqual(f.GetNpar(), 3)
+            for func in [f, g]:
+                func.SetParameters(2.0, 4.0, 1.5)
+            for x in [0.0, 2.5, 4.0, 9.9]:
+                self.assertEqual(f.Eval(x), g.Eval(x))
+
+        def testSubstitution(self):
+            self.assertEqual(substituteFormulaParameters("[0]*x+[1]", [2, -0.5]), "(2.0)*x+(-0.5)")
+
     unittest.main()
     
\ No newline at end of file
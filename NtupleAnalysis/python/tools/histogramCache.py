@@ -0,0 +1,237 @@
+## \package histogramCache
+# Persistent cache of the histograms read by dataset.Dataset.getRootHisto()
+#
+# Plotting scripts read the same histograms from the same ROOT files
+# every time they are run. With the cache, the histogram of a dataset
+# (already summed over the files of the dataset) is stored in a single
+# ROOT file next to the multicrab directory, and later runs take it
+# from there instead of traversing the directories of every input
+# file.
+#
+# An entry is keyed by the paths, sizes and modification times of the
+# input files together with the path of the histogram, so entries of
+# files that have been changed (e.g. re-merged) are never used, and
+# they are dropped when the cache is written.
+
+import os
+import json
+import atexit
+import hashlib
+
+import ROOT
+import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
+
+## Name of the cache file (in the multicrab directory)
+cacheFileName = "histogramCache.root"
+
+## Version of the cache file format
+_cacheVersion = 1
+
+## Name of the TNamed holding the JSON index of the cache file
+_indexName = "histogramCacheIndex"
+
+## Cache objects shared within the process, see getHistogramCache()
+_caches = {}
+
+def _fileStamp(fileName):
+    '''
+    Returns [absolute path, size, mtime] of a local file, or None for
+    remote files (e.g. root://), whose histograms are not cached
+    '''
+    if "://" in fileName or fileName.startswith("root:") or not os.path.exists(fileName):
+        return None
+    st = os.stat(fileName)
+    return [os.path.abspath(fileName), st.st_size, int(st.st_mtime)]
+
+def _entryKey(stamps, name):
+    '''
+    Name of the cache entry of a histogram read from files with the given stamps
+    '''
+    return "h"+hashlib.sha1(json.dumps([stamps, name])).hexdigest()
+
+def getHistogramCache(cacheFile):
+    '''
+    Returns the HistogramCache of a cache file, shared by all callers within the process
+    '''
+    cacheFile = os.path.abspath(cacheFile)
+    if cacheFile not in _caches:
+        _caches[cacheFile] = HistogramCache(cacheFile)
+    return _caches[cacheFile]
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class HistogramCache:
+    '''
+    Histograms keyed by (input files, histogram path), persisted to a ROOT file
+
+    The cache file is opened on the first lookup. New entries are kept in
+    memory and written with save(), which is also called at exit. If the
+    cache file cannot be written the cache stays in memory.
+    '''
+    def __init__(self, cacheFile):
+        self._cacheFile = cacheFile
+        self._file = None
+        self._index = None
+        self._new = {}
+        atexit.register(self.save)
+
+    def _load(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if not os.path.exists(self._cacheFile):
+            return
+        f = ROOT.TFile.Open(self._cacheFile)
+        # Below is important to use '==' instead of 'is' to check for null file
+        if f == None or f.IsZombie():
+            print "Ignoring corrupt histogram cache %s" % self._cacheFile
+            return
+        index = f.Get(_indexName)
+        data = {}
+        if index != None:
+            try:
+                data = json.loads(index.GetTitle())
+            except ValueError:
+                print "Ignoring corrupt histogram cache %s" % self._cacheFile
+        if data.get("version", None) != _cacheVersion:
+            f.Close()
+            return
+        self._file = f
+        self._index = dict([(str(k), v) for k, v in data["entries"].iteritems()])
+
+    def _stamps(self, fileNames):
+        stamps = [_fileStamp(f) for f in fileNames]
+        if None in stamps:
+            return None
+        return stamps
+
+    def get(self, fileNames, name):
+        '''
+        Returns a new histogram (owned by the caller), or None if the
+        histogram of these files is not in the cache
+        '''
+        stamps = self._stamps(fileNames)
+        if stamps is None:
+            return None
+        key = _entryKey(stamps, name)
+        if key in self._new:
+            return aux.Clone(self._new[key][1])
+        self._load()
+        if key not in self._index:
+            return None
+        return aux.Get(self._file, key)
+
+    def put(self, fileNames, name, histo):
+        '''
+        Adds a histogram (a copy of it is stored) read from the files
+        '''
+        stamps = self._stamps(fileNames)
+        if stamps is None or not isinstance(histo, ROOT.TH1):
+            return
+        self._new[_entryKey(stamps, name)] = ({"files": stamps, "name": name}, aux.Clone(histo))
+
+    def save(self):
+        '''
+        Writes the cache file with the new entries, dropping the entries of files that have changed
+        '''
+        if len(self._new) == 0:
+            return
+        self._load()
+
+        current = {}
+        def isCurrent(entry):
+            for stamp in entry["files"]:
+                path = stamp[0]
+                if path not in current:
+                    current[path] = _fileStamp(path)
+                if current[path] != stamp:
+                    return False
+            return True
+
+        tmpName = self._cacheFile+".tmp%d.root" % os.getpid()
+        f = ROOT.TFile.Open(tmpName, "RECREATE")
+        if f == None or f.IsZombie():
+            print "Unable to write histogram cache %s" % self._cacheFile
+            return
+        f.cd()
+        entries = {}
+        for key, entry in self._index.iteritems():
+            if key in self._new or not isCurrent(entry):
+                continue
+            h = self._file.Get(key)
+            if h == None:
+                continue
+            h.Write(key)
+            entries[key] = entry
+        for key, (entry, h) in self._new.iteritems():
+            h.Write(key)
+            entries[key] = entry
+        ROOT.TNamed(_indexName, json.dumps({"version": _cacheVersion, "entries": entries})).Write()
+        f.Close()
+
+        if self._file is not None:
+            self._file.Close()
+            self._file = None
+        try:
+            os.rename(tmpName, self._cacheFile)
+        except OSError, e:
+            print "Unable to write histogram cache %s: %s" % (self._cacheFile, str(e))
+            os.remove(tmpName)
+            return
+        self._index = None
+        self._new = {}
+        return
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+    import shutil
+
+    class TestHistogramCache(unittest.TestCase):
+        def setUp(self):
+            self._dir = tempfile.mkdtemp()
+            self._rootFile = os.path.join(self._dir, "histograms-Foo.root")
+            f = ROOT.TFile.Open(self._rootFile, "RECREATE")
+            f.Close()
+
+        def tearDown(self):
+            shutil.rmtree(self._dir)
+
+        def _histo(self):
+            h = ROOT.TH1F("met", "met", 10, 0, 100)
+            h.SetDirectory(None)
+            h.Fill(42, 2.0)
+            return h
+
+        def testPersist(self):
+            cacheFile = os.path.join(self._dir, cacheFileName)
+            cache = HistogramCache(cacheFile)
+            self.assertEqual(cache.get([self._rootFile], "analysis/met"), None)
+            cache.put([self._rootFile], "analysis/met", self._histo())
+            self.assertEqual(cache.get([self._rootFile], "analysis/met").GetBinContent(5), 2.0)
+            cache.save()
+            self.assertTrue(os.path.exists(cacheFile))
+
+            cache2 = HistogramCache(cacheFile)
+            h = cache2.get([os.path.relpath(self._rootFile)], "analysis/met")
+            self.assertEqual(h.GetName(), "met")
+            self.assertEqual(h.GetBinContent(5), 2.0)
+            self.assertEqual(cache2.get([self._rootFile], "analysis/pt"), None)
+
+        def testChangedFile(self):
+            cacheFile = os.path.join(self._dir, cacheFileName)
+            cache = HistogramCache(cacheFile)
+            cache.put([self._rootFile], "analysis/met", self._histo())
+            cache.put([self._rootFile], "analysis/pt", self._histo())
+            cache.save()
+
+            os.utime(self._rootFile, (0, 0))
+            cache2 = HistogramCache(cacheFile)
+            self.assertEqual(cache2.get([self._rootFile], "analysis/met"), None)
+            cache2.put([self._rootFile], "analysis/pt", self._histo())
+            cache2.save()
+            cache2._load()
+            self.assertEqual(len(cache2._index), 1)
+
+    unittest.main()
@@ -42,6 +42,10 @@ import sys
 import array
 import math
 import copy
+import time
+import subprocess
+import multiprocessing
+import distutils.spawn
 
 import ROOT
 
@@ -1742,6 +1746,190 @@ def partiallyBlind(plot, maxShownValue=None, minShownValue=None, invert=False, m
     plot.appendPlotObject(tb)
 
 
+## Batch renderer collecting the plots saved with PlotBase.save()/saveAs(), see beginBatchRendering()
+_batchRenderer = None
+
+## Jobs of the batch renderer, module-level to be inherited by the forked worker processes
+_batchJobs = []
+
+## Path of the Ghostscript executable (False if not looked up yet)
+_ghostscript = False
+
+## Rasterise a PDF file with Ghostscript to the pixel size of the canvas
+#
+# \param pdfName   Path of the PDF file
+# \param pngName   Path of the PNG file to write
+# \param canvas    TCanvas the PDF file was written from
+#
+# \return True if the PNG file was written
+def _pdfToPng(pdfName, pngName, canvas):
+    global _ghostscript
+    if _ghostscript is False:
+        _ghostscript = distutils.spawn.find_executable("gs")
+    if _ghostscript is None:
+        return False
+    ret = subprocess.call([_ghostscript, "-q", "-dSAFER", "-dBATCH", "-dNOPAUSE", "-sDEVICE=png16m",
+                           "-dTextAlphaBits=4", "-dGraphicsAlphaBits=4", "-dPDFFitPage",
+                           "-g%dx%d" % (canvas.GetWw(), canvas.GetWh()), "-sOutputFile=%s" % pngName, pdfName])
+    return ret == 0
+
+## Formats which can be derived from the master format file (master format -> {format: function})
+_derivedFormats = {
+    ".pdf": {".png": _pdfToPng},
+}
+
+## Save a canvas to file(s)
+#
+# \param canvas        TCanvas to save
+# \param saveName      File name without the suffix
+# \param formats       List of suffixes of the formats
+# \param masterFormat  If in \a formats, this format is written first,
+#                      and the formats of _derivedFormats are converted
+#                      from it (falling back to TCanvas.SaveAs())
+#
+# \return List of (format, time in seconds) pairs
+def _saveCanvas(canvas, saveName, formats, masterFormat=None):
+    formats = list(formats)
+    derived = {}
+    if masterFormat in formats:
+        formats.remove(masterFormat)
+        formats.insert(0, masterFormat)
+        derived = _derivedFormats.get(masterFormat, {})
+
+    backup = ROOT.gErrorIgnoreLevel
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning
+
+    timings = []
+    for f in formats:
+        start = time.time()
+        if not (f in derived and derived[f](saveName+masterFormat, saveName+f, canvas)):
+            canvas.SaveAs(saveName+f)
+        timings.append((f, time.time()-start))
+
+    ROOT.gErrorIgnoreLevel = backup
+    return timings
+
+## Worker function of BatchRenderer
+#
+# \param index   Index of the job in _batchJobs
+def _renderBatchJob(index):
+    (canvas, canvasName, saveName, formats, style, masterFormat) = _batchJobs[index]
+    style.cd()
+    canvas.SetName(canvasName)
+    return (saveName, _saveCanvas(canvas, saveName, formats, masterFormat))
+
+## Renderer for saving many plots in parallel
+#
+# When active (see beginBatchRendering()), PlotBase.save() and
+# PlotBase.saveAs() take a snapshot of the canvas (and of gStyle)
+# instead of writing the files. The snapshots are written by
+# render() in a pool of worker processes, so a script saving
+# hundreds of plots uses all cores for the PDF/PNG output. The
+# master format (PDF by default) is written first, and the PNG is
+# rasterised from it with Ghostscript if it is available.
+#
+# The worker processes are forked, so this works only on platforms
+# where multiprocessing uses fork (i.e. not on Windows).
+class BatchRenderer:
+    ## Constructor
+    #
+    # \param nProcesses    Number of worker processes (None for the number of CPUs, 1 for saving immediately)
+    # \param masterFormat  Format written first, from which the other formats are derived if possible (None to disable)
+    def __init__(self, nProcesses=None, masterFormat=".pdf"):
+        if nProcesses is None:
+            nProcesses = multiprocessing.cpu_count()
+        self._nProcesses = nProcesses
+        self._masterFormat = masterFormat
+        self._jobs = []
+        self._queued = {} # save name -> index in self._jobs
+        self._timings = []
+
+    ## Add a canvas to be saved
+    #
+    # \param canvas    TCanvas to save
+    # \param saveName  File name without the suffix
+    # \param formats   List of suffixes of the formats
+    #
+    # With one process the canvas is saved immediately, otherwise a
+    # clone of it is stored so that the plot can be modified or deleted
+    # afterwards. A canvas whose saveName is already queued is not
+    # queued again (two workers would write the same files), only its
+    # missing formats are added to the queued job.
+    def add(self, canvas, saveName, formats):
+        if self._nProcesses <= 1:
+            self._timings.append((saveName, _saveCanvas(canvas, saveName, formats, self._masterFormat)))
+            return
+        if saveName in self._queued:
+            queuedFormats = self._jobs[self._queued[saveName]][3]
+            queuedFormats.extend([f for f in formats if f not in queuedFormats])
+            return
+        snapshot = canvas.DrawClone()
+        ROOT.SetOwnership(snapshot, True)
+        style = ROOT.gStyle.Clone()
+        ROOT.SetOwnership(style, True)
+        canvas.cd()
+        self._queued[saveName] = len(self._jobs)
+        self._jobs.append((snapshot, canvas.GetName(), saveName, list(formats), style, self._masterFormat))
+
+    ## Save the collected canvases in the worker processes
+    #
+    # \return List of (save name, [(format, time in seconds)]) pairs of all canvases saved so far
+    def render(self):
+        global _batchJobs
+        if len(self._jobs) == 0:
+            return self._timings
+        _batchJobs = self._jobs
+        pool = multiprocessing.Pool(min(self._nProcesses, len(self._jobs)))
+        try:
+            for result in pool.imap_unordered(_renderBatchJob, xrange(len(self._jobs))):
+                self._timings.append(result)
+        finally:
+            pool.close()
+            pool.join()
+            _batchJobs = []
+        self._jobs = []
+        self._queued = {}
+        return self._timings
+
+    ## Print the time spent in saving each canvas, slowest first
+    def printReport(self):
+        timings = sorted(self._timings, key=lambda t: -sum([s for f, s in t[1]]))
+        total = 0.0
+        for saveName, times in timings:
+            t = sum([s for f, s in times])
+            total += t
+            print "%8.2f s %s (%s)" % (t, saveName, ", ".join(["%s %.2f s" % (f, s) for f, s in times]))
+        print "Saved %d plots in %.2f s of worker time with %d processes" % (len(timings), total, self._nProcesses)
+
+## Start collecting the saved plots for parallel rendering
+#
+# \param kwargs  Keyword arguments, forwarded to BatchRenderer.__init__()
+#
+# Until endBatchRendering() is called, PlotBase.save() and
+# PlotBase.saveAs() (and therefore plots.drawPlot()) only add the plot
+# to the BatchRenderer.
+def beginBatchRendering(**kwargs):
+    global _batchRenderer
+    if _batchRenderer is not None:
+        raise Exception("beginBatchRendering() called twice without endBatchRendering()")
+    _batchRenderer = BatchRenderer(**kwargs)
+
+## Save the plots collected since beginBatchRendering()
+#
+# \param report   Print the time spent in saving each plot
+#
+# \return List of (save name, [(format, time in seconds)]) pairs
+def endBatchRendering(report=True):
+    global _batchRenderer
+    if _batchRenderer is None:
+        raise Exception("endBatchRendering() called without beginBatchRendering()")
+    renderer = _batchRenderer
+    _batchRenderer = None
+    timings = renderer.render()
+    if report:
+        renderer.printReport()
+    return timings
+
 ## Base class for plots
 #
 # This class can also be used as for plots which don't need the
@@ -2064,17 +2252,11 @@ class PlotBase:
     # \param formats   Save to these formats (if not given, the values
     #                  given in the constructor and in
     #                  appendSaveFormat() are used
+    #
+    # Between beginBatchRendering() and endBatchRendering() the plot
+    # is only added to the batch renderer.
     def save(self, formats=None):
-        if formats == None:
-            formats = self.saveFormats
-
-        backup = ROOT.gErrorIgnoreLevel
-        ROOT.gErrorIgnoreLevel = ROOT.kWarning
-
-        for f in formats:
-            self.cf.canvas.SaveAs(self.cf.canvas.GetName()+f)
-
-        ROOT.gErrorIgnoreLevel = backup
+        self.saveAs(self.cf.canvas.GetName(), formats)
         
     ## Save the plot to file(s)
     #
@@ -2086,13 +2268,11 @@ class PlotBase:
         if formats == None:
             formats = self.saveFormats
 
-        backup = ROOT.gErrorIgnoreLevel
-        ROOT.gErrorIgnoreLevel = ROOT.kWarning
-
-        for f in formats:
-            self.cf.canvas.SaveAs(saveName+f)
+        if _batchRenderer is not None:
+            _batchRenderer.add(self.cf.canvas, saveName, formats)
+            return
 
-        ROOT.gErrorIgnoreLevel = backup
+        _saveCanvas(self.cf.canvas, saveName, formats)
 
     ## \var histoMgr
     # histograms.HistoManager object for histogram management
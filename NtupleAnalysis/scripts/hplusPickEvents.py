@@ -1,37 +1,101 @@
 #!/usr/bin/env python
 
+# Script for copying a list of events (run:lumi:event) from the Events
+# tree of ntuple files to new files (<rootfile>_PickEvents.root).
+#
+# The entries of the picked events are looked up from the run, lumi and
+# event branches, which are read in one pass with their own types
+# (event is 64-bit). Only the matching entries are then copied, so the
+# full events are read once whatever the length of the pick list.
+# Several input files can be processed in parallel.
+
 import sys
 import os
 import re
+import multiprocessing
+from optparse import OptionParser
 
 import ROOT
 
+## Compiled event lookup, fills a TEntryList with the entries whose
+# (run, lumi, event) is in the pick list
+_lookupCode = """
+#include <set>
+#include <tuple>
+#include <vector>
+#include "TTree.h"
+#include "TBranch.h"
+#include "TEntryList.h"
+
+void hplusPickEventsLookup(TTree *tree, TEntryList *elist, const std::vector<UInt_t>& pickRuns,
+                           const std::vector<UInt_t>& pickLumis, const std::vector<ULong64_t>& pickEvents) {
+  std::set<std::tuple<UInt_t, UInt_t, ULong64_t> > picks;
+  for (size_t i = 0; i < pickRuns.size(); ++i)
+    picks.insert(std::make_tuple(pickRuns[i], pickLumis[i], pickEvents[i]));
+  UInt_t run = 0, lumi = 0;
+  ULong64_t event = 0;
+  TBranch *bRun = tree->GetBranch("run");
+  TBranch *bLumi = tree->GetBranch("lumi");
+  TBranch *bEvent = tree->GetBranch("event");
+  bRun->SetAddress(&run);
+  bLumi->SetAddress(&lumi);
+  bEvent->SetAddress(&event);
+  Long64_t nEntries = tree->GetEntries();
+  for (Long64_t i = 0; i < nEntries; ++i) {
+    bRun->GetEntry(i);
+    bLumi->GetEntry(i);
+    bEvent->GetEntry(i);
+    if (picks.count(std::make_tuple(run, lumi, event)))
+      elist->Enter(i);
+  }
+  tree->ResetBranchAddresses();
+}
+"""
+_lookupDeclared = False
+
 def usage():
     print
-    print "### Usage:   ",os.path.basename(sys.argv[0])," <rootfile> <pickEvents.txt>"
+    print "### Usage:   ",os.path.basename(sys.argv[0])," [-j N] <rootfile1> [<rootfile2> ...] <pickEvents.txt>"
     print
     sys.exit()
 
-def main():
-
-    if len(sys.argv) < 3:
-        usage()
-
-    root_re = re.compile("(?P<filename>[^/]*\.root)")
-    pick_re = re.compile("(?P<filename>pick\S*\.txt)")
-
-    rootFile = ""
-    pickFile = ""
-    for argv in sys.argv:
-        match = root_re.search(argv)
-        if match:
-            rootFile = argv
-        match = pick_re.search(argv)
+def readPickList(pickFile):
+    '''
+    Returns the set of (run, lumi, event) tuples of a pick list file
+    '''
+    rle_re = re.compile("(?P<run>\d+):(?P<lumi>\d+):(?P<event>\d+)")
+    picks = set()
+    fPick = open(pickFile)
+    for line in fPick:
+        match = rle_re.search(line)
         if match:
-            pickFile = argv
-
-    #print rootFile,pickFile
-
+            picks.add((int(match.group("run")), int(match.group("lumi")), int(match.group("event"))))
+    fPick.close()
+    return picks
+
+def findEntries(tree, picks):
+    '''
+    Returns the sorted tree entry numbers of the events in picks
+    '''
+    global _lookupDeclared
+    if not _lookupDeclared:
+        ROOT.gInterpreter.Declare(_lookupCode)
+        _lookupDeclared = True
+    pickRuns = ROOT.std.vector("UInt_t")()
+    pickLumis = ROOT.std.vector("UInt_t")()
+    pickEvents = ROOT.std.vector("ULong64_t")()
+    for (run, lumi, event) in picks:
+        pickRuns.push_back(run)
+        pickLumis.push_back(lumi)
+        pickEvents.push_back(event)
+    elist = ROOT.TEntryList("pickedEvents", "pickedEvents", tree)
+    ROOT.hplusPickEventsLookup(tree, elist, pickRuns, pickLumis, pickEvents)
+    return [elist.GetEntry(i) for i in xrange(elist.GetN())]
+
+def pickEvents(rootFile, picks):
+    '''
+    Copies the picked events of a file to <rootfile>_PickEvents.root, returns the number of copied events
+    '''
     newFile = os.path.basename(rootFile.replace(".root","_PickEvents.root"))
 
     fIN = ROOT.TFile.Open(rootFile)
@@ -58,8 +122,6 @@ def main():
     tcommit = ROOT.TNamed("","")
     tcommit.Write(commit)
 
-    dv_re = re.compile("")
-    dataversion = None
     configInfoDir = fOUT.mkdir("configInfo")
     if fIN.cd("configInfo"):
         subdir = ROOT.gDirectory
@@ -76,39 +138,21 @@ def main():
     tree = fIN.Get("Events")
     fOUT.cd()
     pickTree = tree.CloneTree(0)
-    rle_re = re.compile("(?P<run>\d+):(?P<lumi>\d+):(?P<event>\d+)")
-    fPick = open(pickFile)
-    fSelection = ""
-    for i,line in enumerate(fPick):
-        match = rle_re.search(line)
-        if match:
-            run = match.group("run")
-            lumi = match.group("lumi")
-            event = match.group("event")
-            selection = "(run == %s && lumi == %s && event == %s)"%(run,lumi,event)
-            if len(fSelection) == 0:
-                fSelection += selection
-            else:
-                fSelection += "||"+selection 
-            if i > 0 and i%50 == 0:
-                sys.stdout.write("Processing %ith event          "%i)
-                sys.stdout.flush()
-                restart_line()
-                fIN.cd()
-                tmptree = tree.CopyTree(fSelection)
-                treelist = ROOT.TList()
-                treelist.Add(tmptree)
-                fOUT.cd()
-                pickTree.Merge(treelist)
-                fSelection = ""
-    fIN.cd()
-    tmptree = tree.CopyTree(fSelection)
-    treelist = ROOT.TList()
-    treelist.Add(tmptree)
-    fOUT.cd()
+
+    # Find the entries of the picked events (reads only the id branches)
+    entries = findEntries(tree, picks)
+
+    # Copy the entries in one pass
+    for i, entry in enumerate(entries):
+        if i % 50 == 0:
+            sys.stdout.write("Processing %ith event          "%i)
+            sys.stdout.flush()
+            restart_line()
+        tree.GetEntry(entry)
+        pickTree.Fill()
     print "Processed all events         "
-    pickTree.Merge(treelist)
 
+    fOUT.cd()
     pickTree.Write()
 
     fgen = ROOT.TNamed("","")
@@ -123,13 +167,57 @@ def main():
     fpick.Write(pick)
 
     fOUT.ls()
-    print "Picked Events, entries",pickTree.GetEntries()
+    nPicked = pickTree.GetEntries()
+    print "Picked Events, entries",nPicked
     fOUT.Close()
     fIN.Close()
+    return nPicked
+
+def _pickEventsForPool(args):
+    return pickEvents(*args)
+
+def main(opts, rootFiles, pickFile):
+    picks = readPickList(pickFile)
+    print "Picking %d events from %d files" % (len(picks), len(rootFiles))
+
+    nProcesses = opts.nProcesses
+    if nProcesses == 0:
+        nProcesses = multiprocessing.cpu_count()
+    nProcesses = min(nProcesses, len(rootFiles))
+    if nProcesses > 1:
+        pool = multiprocessing.Pool(nProcesses)
+        nPicked = pool.map(_pickEventsForPool, [(f, picks) for f in rootFiles])
+        pool.close()
+        pool.join()
+    else:
+        nPicked = [pickEvents(f, picks) for f in rootFiles]
+
+    for rootFile, n in zip(rootFiles, nPicked):
+        print "%s: %d events" % (rootFile, n)
+    print "Copied %d events for a pick list of %d events" % (sum(nPicked), len(picks))
 
 def restart_line():
     sys.stdout.write('\r')
     sys.stdout.flush()
 
 if __name__ == "__main__":
-    main()
+    NPROCESSES = 1 # 0 for all cores
+
+    parser = OptionParser(usage="Usage: %prog [options] <rootfile1> [<rootfile2> ...] <pickEvents.txt>")
+    parser.add_option("-j", "--nProcesses", dest="nProcesses", type=int, default=NPROCESSES,
+                      help="Number of input files processed in parallel (0 for all cores) [default: %s]" % (NPROCESSES) )
+    (opts, args) = parser.parse_args()
+
+    root_re = re.compile("(?P<filename>[^/]*\.root)")
+    rootFiles = []
+    pickFile = None
+    for arg in args:
+        if root_re.search(arg):
+            rootFiles.append(arg)
+        else:
+            pickFile = arg
+
+    if len(rootFiles) == 0 or pickFile is None:
+        usage()
+
+    main(opts, rootFiles, pickFile)
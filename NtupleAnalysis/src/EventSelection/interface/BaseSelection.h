@@ -8,8 +8,12 @@ class HistoWrapper;
 class EventID;
 class CommonPlots;
 class EventWeight;
+class ParameterSet;
+
+#include "Framework/interface/SharedSelections.h"
 
 #include <string>
+#include <memory>
 
 class BaseSelection {
   public:
@@ -48,6 +52,16 @@ class BaseSelection {
     HistoWrapper* fLocalDummyHistoWrapper; // Used only for constructor without histogramming (owner)
   
   protected:
+    /// Shares the evaluation of the stage with the other analyzers having an identical stage (see SharedSelections)
+    void enableSharing(const std::string& stageName, const ParameterSet& config);
+    /// Returns evaluate(), or the result of the stage evaluated by another analyzer in this event
+    template <typename T, typename F>
+    T sharedAnalyze(F&& evaluate) {
+      if (!fSharedSelectionsClient)
+        return evaluate();
+      return fSharedSelectionsClient->analyze<T>(std::forward<F>(evaluate));
+    }
+
     EventCounter& fEventCounter;
     HistoWrapper& fHistoWrapper;
     CommonPlots* fCommonPlots;
@@ -57,6 +71,7 @@ class BaseSelection {
     unsigned long long fEventNumber;
     unsigned int fLumiNumber;
     unsigned int fRunNumber;
+    std::shared_ptr<SharedSelections::Client> fSharedSelectionsClient;
   };
 
 #endif
@@ -14,6 +14,9 @@
 
 #include <string>
 #include <vector>
+#include <array>
+#include <map>
+#include <cstring>
 
 #include <TDirectory.h>
 #include <TChain.h>
@@ -28,6 +31,7 @@
 #include <TMVA/Tools.h>
 #include <TMVA/TMVAGui.h>
 #include <TMVA/Reader.h>
+#include <TMVA/MethodBase.h>
 
 // Forward declarations
 class ParameterSet;
@@ -37,6 +41,7 @@ class EventCounter;
 class HistoWrapper;
 class WrappedTH1;
 class WrappedTH2;
+class EventID;
 
 
 struct TrijetSelection{
@@ -318,6 +323,21 @@ public:
   Data analyze(const Event& event, const JetSelection::Data& jetData, const BJetSelection::Data& bjetData);
 
   TMVA::Reader *reader;
+
+  /// BDT input variables of a top candidate (in the order of the reader variables)
+  typedef std::array<Float_t, 19> BDTInputs;
+  /// Orders the inputs by their bit patterns (well defined also for NaN values)
+  struct BDTInputsLess {
+    bool operator()(const BDTInputs& a, const BDTInputs& b) const { return std::memcmp(a.data(), b.data(), sizeof(BDTInputs)) < 0; }
+  };
+  /// BDT scores of the candidates of the current event, shared by the instances using the same weight file
+  struct BDTScoreMemo {
+    BDTScoreMemo() : fEvent(0), fLumi(0), fRun(0) { }
+    unsigned long long fEvent;
+    unsigned int fLumi;
+    unsigned int fRun;
+    std::map<BDTInputs, float, BDTInputsLess> fScores;
+  };
   
   Float_t TrijetPtDR;
   Float_t TrijetDijetPtDR;
@@ -346,6 +366,10 @@ private:
   void initialize(const ParameterSet& config);
   /// The actual selection
   Data privateAnalyze(const Event& event, const std::vector<Jet> selectedJets, const std::vector<Jet> selectedBjets);
+  /// BDT input variables of a trijet
+  BDTInputs getBDTInputs(const Jet& bjet, const Jet& jet1, const Jet& jet2, const math::XYZTLorentzVector& top_p4, const math::XYZTLorentzVector& w_p4) const;
+  /// BDT scores of all top candidates of an event (taken from the memo when already evaluated in this event)
+  std::vector<float> evaluateMVA(const EventID& eventID, const std::vector<BDTInputs>& inputs);
   /// Returns true if the two jets are the same
   bool areSameJets(const Jet& jet1, const Jet& jet2);
   /// Return true if a selected jet matches a selected bjet
@@ -367,6 +391,10 @@ private:
 		    const std::vector<Jet>& MCtrue_LdgJet,  const std::vector<Jet>& MCtrue_SubldgJet, const std::vector<Jet>& MCtrue_Bjet);
 
  
+  // BDT method of the reader and the score memo of its weight file
+  TMVA::MethodBase* fBDTMethod;
+  BDTScoreMemo* fBDTScoreMemo;
+
   // Input parameters
   const DirectionalCut<double> cfg_AnyTopMVACut;
   const DirectionalCut<double> cfg_TopMVACut;
@@ -7,6 +7,7 @@
 #include "Framework/interface/type.h"
 #include "Framework/interface/Exception.h"
 #include "Framework/interface/EventWeight.h"
+#include "Framework/interface/ParameterSet.h"
 #include "TDirectory.h"
 
 BaseSelection::BaseSelection(EventCounter& eventCounter, HistoWrapper& histoWrapper, CommonPlots* commonPlots, const std::string& postfix)
@@ -71,6 +72,12 @@ void BaseSelection::bookHistograms(TDirectory* dir) {
   
 }
 
+void BaseSelection::enableSharing(const std::string& stageName, const ParameterSet& config) {
+  // Histograms are booked with the postfix, and the stage fills the common plots only if they are enabled
+  std::string key = stageName + "|" + sPostfix + "|" + (fCommonPlotsIsEnabled() ? "1" : "0") + "|" + config.serialize();
+  fSharedSelectionsClient = std::make_shared<SharedSelections::Client>(stageName, key);
+}
+
 void BaseSelection::disableHistogramsAndCounters() {
   fHistoWrapper.enable(false);
   fEventCounter.enable(false);  
@@ -33,6 +33,7 @@ ElectronSelection::ElectronSelection(const ParameterSet& config, EventCounter& e
   cSubPassedIsolation(fEventCounter.addSubCounter("e selection ("+postfix+")", "Passed isolation"))
 {
   initialize(config, postfix);
+  enableSharing("ElectronSelection", config);
 }
 
 ElectronSelection::ElectronSelection(const ParameterSet& config, const std::string& postfix)
@@ -55,6 +56,7 @@ ElectronSelection::ElectronSelection(const ParameterSet& config, const std::stri
   cSubPassedIsolation(fEventCounter.addSubCounter("e selection ("+postfix+")", "Passed isolation"))
 {
   initialize(config, postfix);
+  enableSharing("ElectronSelection", config);
   bookHistograms(new TDirectory());
 }
 
@@ -167,14 +169,14 @@ ElectronSelection::Data ElectronSelection::silentAnalyze(const Event& event) {
   ensureSilentAnalyzeAllowed(event.eventID());
   // Disable histogram filling and counter
   disableHistogramsAndCounters();
-  Data myData = privateAnalyze(event);
+  Data myData = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   enableHistogramsAndCounters();
   return myData;
 }
 
 ElectronSelection::Data ElectronSelection::analyze(const Event& event) {
   ensureAnalyzeAllowed(event.eventID());
-  ElectronSelection::Data data = privateAnalyze(event);
+  ElectronSelection::Data data = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   // Send data to CommonPlots
   if (fCommonPlotsIsEnabled())
     fCommonPlots->fillControlPlotsAtElectronSelection(event, data);
@@ -20,6 +20,7 @@ METFilterSelection::METFilterSelection(const ParameterSet& config, EventCounter&
   cPassedMETFilterSelection(fEventCounter.addCounter("passed METFilter selection ("+postfix+")"))
 {
   initialize(config);
+  enableSharing("METFilterSelection", config);
 }
 
 METFilterSelection::METFilterSelection(const ParameterSet& config)
@@ -29,6 +30,7 @@ METFilterSelection::METFilterSelection(const ParameterSet& config)
   cPassedMETFilterSelection(fEventCounter.addCounter("passed METFilter selection"))
 {
   initialize(config);
+  enableSharing("METFilterSelection", config);
   bookHistograms(new TDirectory());
 }
 
@@ -60,14 +62,14 @@ METFilterSelection::Data METFilterSelection::silentAnalyze(const Event& event) {
   ensureSilentAnalyzeAllowed(event.eventID());
   // Disable histogram filling and counter
   disableHistogramsAndCounters();
-  Data myData = privateAnalyze(event);
+  Data myData = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   enableHistogramsAndCounters();
   return myData;
 }
 
 METFilterSelection::Data METFilterSelection::analyze(const Event& event) {
   ensureAnalyzeAllowed(event.eventID());
-  METFilterSelection::Data data = privateAnalyze(event);
+  METFilterSelection::Data data = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   // Return data
   return data;
 }
@@ -32,6 +32,7 @@ MuonSelection::MuonSelection(const ParameterSet& config, EventCounter& eventCoun
   cSubPassedIsolation(fEventCounter.addSubCounter("mu selection ("+postfix+")", "Passed isolation"))
 {
   initialize(config, postfix);
+  enableSharing("MuonSelection", config);
 }
 
 MuonSelection::MuonSelection(const ParameterSet& config, const std::string& postfix)
@@ -52,6 +53,7 @@ MuonSelection::MuonSelection(const ParameterSet& config, const std::string& post
   cSubPassedIsolation(fEventCounter.addSubCounter("mu selection ("+postfix+")", "Passed isolation"))
 {
   initialize(config, postfix);
+  enableSharing("MuonSelection", config);
   bookHistograms(new TDirectory());
 }
 
@@ -155,14 +157,14 @@ MuonSelection::Data MuonSelection::silentAnalyze(const Event& event) {
   ensureSilentAnalyzeAllowed(event.eventID());
   // Disable histogram filling and counter
   disableHistogramsAndCounters();
-  Data myData = privateAnalyze(event);
+  Data myData = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   enableHistogramsAndCounters();
   return myData;
 }
 
 MuonSelection::Data MuonSelection::analyze(const Event& event) {
   ensureAnalyzeAllowed(event.eventID());
-  MuonSelection::Data data = privateAnalyze(event);
+  MuonSelection::Data data = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   // Send data to CommonPlots
   if (fCommonPlotsIsEnabled())
     fCommonPlots->fillControlPlotsAtMuonSelection(event, data);
@@ -106,6 +106,7 @@ TauSelection::TauSelection(const ParameterSet& config, EventCounter& eventCounte
   }
   
   initialize(config, postfix);
+  enableSharing("TauSelection", config);
 } 
 
 TauSelection::TauSelection(const ParameterSet& config, const std::string& postfix)
@@ -167,6 +168,7 @@ TauSelection::TauSelection(const ParameterSet& config, const std::string& postfi
   }
   
   initialize(config, postfix);
+  enableSharing("TauSelection", config);
   bookHistograms(new TDirectory());
 }
 
@@ -224,14 +226,14 @@ TauSelection::Data TauSelection::silentAnalyze(const Event& event) {
   ensureSilentAnalyzeAllowed(event.eventID());
   // Disable histogram filling and counter
   disableHistogramsAndCounters();
-  Data myData = privateAnalyze(event);
+  Data myData = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   enableHistogramsAndCounters();
   return myData;
 }
 
 TauSelection::Data TauSelection::analyze(const Event& event) {
   ensureAnalyzeAllowed(event.eventID());
-  TauSelection::Data data = privateAnalyze(event);
+  TauSelection::Data data = sharedAnalyze<Data>([&]() { return privateAnalyze(event); });
   // Send data to CommonPlots
   if (fCommonPlots != nullptr)
     fCommonPlots->fillControlPlotsAtTauSelection(event, data);
@@ -10,6 +10,12 @@
 #include "Tools/interface/MCTools.h"
 
 #include "Math/VectorUtil.h"
+#include "TMath.h"
+
+namespace {
+  /// BDT score memos by weight file, shared by all TopSelectionBDT instances (e.g. those of the systematic variations)
+  std::map<std::string, TopSelectionBDT::BDTScoreMemo> gBDTScoreMemos;
+}
 
 TopSelectionBDT::Data::Data()
 :
@@ -62,6 +68,8 @@ TopSelectionBDT::Data::~Data() { }
 
 TopSelectionBDT::TopSelectionBDT(const ParameterSet& config, EventCounter& eventCounter, HistoWrapper& histoWrapper, CommonPlots* commonPlots, const std::string& postfix)
   : BaseSelection(eventCounter, histoWrapper, commonPlots, postfix),
+    fBDTMethod(nullptr),
+    fBDTScoreMemo(nullptr),
     // Input parameters
     cfg_AnyTopMVACut(config , "AnyTopMVACut"),
     cfg_TopMVACut(config    , "TopMVACut"),
@@ -90,6 +98,8 @@ TopSelectionBDT::TopSelectionBDT(const ParameterSet& config, EventCounter& event
 
 TopSelectionBDT::TopSelectionBDT(const ParameterSet& config)
 : BaseSelection(),
+  fBDTMethod(nullptr),
+  fBDTScoreMemo(nullptr),
   // Input parameters
   cfg_AnyTopMVACut(config , "AnyTopMVACut"), 
   cfg_TopMVACut(config    , "TopMVACut"),
@@ -245,6 +255,13 @@ void TopSelectionBDT::initialize(const ParameterSet& config) {
   // std::cout << "Opening BDT weight file " << fullPath << std::endl;
   reader->BookMVA("BTDG method", fullPath);
 
+  // Keep the booked method to skip the lookup by name in the evaluation
+  fBDTMethod = dynamic_cast<TMVA::MethodBase*>(reader->FindMVA("BTDG method"));
+  if (fBDTMethod == nullptr) {
+    throw hplus::Exception("config") << "Failed to book the BDT method from weight file " << fullPath;
+  }
+  fBDTScoreMemo = &gBDTScoreMemos[fullPath];
+
   return;
 }
 
@@ -407,6 +424,94 @@ TopSelectionBDT::Data TopSelectionBDT::analyze(const Event& event, const JetSele
   return data;
 }
 
+TopSelectionBDT::BDTInputs TopSelectionBDT::getBDTInputs(const Jet& bjet, const Jet& jet1, const Jet& jet2, const math::XYZTLorentzVector& top_p4, const math::XYZTLorentzVector& w_p4) const {
+
+  // Calculate variables
+  double dr_sd = ROOT::Math::VectorUtil::DeltaR( jet1.p4(), jet2.p4());
+  double softDrop_n2 = min(jet2.pt(), jet1.pt()) / ( (jet2.pt() + jet1.pt()) * dr_sd * dr_sd);
+
+  // Calculate our BDT discriminating variables for MVA use (in the order of the reader variables)
+  BDTInputs inputs = {{
+      (Float_t) (top_p4.Pt() * ROOT::Math::VectorUtil::DeltaR( w_p4  , bjet.p4() )), // TrijetPtDR
+      (Float_t) (w_p4.Pt() * ROOT::Math::VectorUtil::DeltaR( jet1.p4() , jet2.p4() )), // TrijetDijetPtDR
+      (Float_t) bjet.p4().M(),                  // TrijetBjetMass
+      (Float_t) jet1.bjetDiscriminator(),       // TrijetLdgJetBDisc
+      (Float_t) jet2.bjetDiscriminator(),       // TrijetSubldgJetBDisc
+      (Float_t) (bjet.p4() + jet1.p4()).M(),    // TrijetBJetLdgJetMass
+      (Float_t) (bjet.p4() + jet2.p4()).M(),    // TrijetBJetSubldgJetMass
+      (Float_t) top_p4.M(),                     // TrijetMass
+      (Float_t) w_p4.M(),                       // TrijetDijetMass
+      (Float_t) bjet.bjetDiscriminator(),       // TrijetBJetBDisc
+      (Float_t) softDrop_n2,                    // TrijetSoftDrop_n2
+      (Float_t) jet1.pfCombinedCvsLJetTags(),   // TrijetLdgJetCvsL
+      (Float_t) jet2.pfCombinedCvsLJetTags(),   // TrijetSubldgJetCvsL
+      (Float_t) jet1.QGTaggerAK4PFCHSptD(),     // TrijetLdgJetPtD
+      (Float_t) jet2.QGTaggerAK4PFCHSptD(),     // TrijetSubldgJetPtD
+      (Float_t) jet1.QGTaggerAK4PFCHSaxis2(),   // TrijetLdgJetAxis2
+      (Float_t) jet2.QGTaggerAK4PFCHSaxis2(),   // TrijetSubldgJetAxis2
+      (Float_t) jet1.QGTaggerAK4PFCHSmult(),    // TrijetLdgJetMult
+      (Float_t) jet2.QGTaggerAK4PFCHSmult()     // TrijetSubldgJetMult
+    }};
+  return inputs;
+}
+
+std::vector<float> TopSelectionBDT::evaluateMVA(const EventID& eventID, const std::vector<BDTInputs>& inputs) {
+
+  // The memo holds the scores of one event only
+  BDTScoreMemo& memo = *fBDTScoreMemo;
+  if (memo.fEvent != eventID.event() || memo.fLumi != eventID.lumi() || memo.fRun != eventID.run())
+    {
+      memo.fScores.clear();
+      memo.fEvent = eventID.event();
+      memo.fLumi  = eventID.lumi();
+      memo.fRun   = eventID.run();
+    }
+
+  // The score depends only on the inputs: candidates of jets unchanged by a systematic variation are evaluated once per event
+  std::vector<float> output;
+  output.reserve(inputs.size());
+  for (const BDTInputs& in: inputs)
+    {
+      auto found = memo.fScores.find(in);
+      if (found != memo.fScores.end())
+	{
+	  output.push_back(found->second);
+	  continue;
+	}
+
+      // Set the reader variables
+      TrijetPtDR              = in[0];
+      TrijetDijetPtDR         = in[1];
+      TrijetBjetMass          = in[2];
+      TrijetLdgJetBDisc       = in[3];
+      TrijetSubldgJetBDisc    = in[4];
+      TrijetBJetLdgJetMass    = in[5];
+      TrijetBJetSubldgJetMass = in[6];
+      TrijetMass              = in[7];
+      TrijetDijetMass         = in[8];
+      TrijetBJetBDisc         = in[9];
+      TrijetSoftDrop_n2       = in[10];
+      TrijetLdgJetCvsL        = in[11];
+      TrijetSubldgJetCvsL     = in[12];
+      TrijetLdgJetPtD         = in[13];
+      TrijetSubldgJetPtD      = in[14];
+      TrijetLdgJetAxis2       = in[15];
+      TrijetSubldgJetAxis2    = in[16];
+      TrijetLdgJetMult        = in[17];
+      TrijetSubldgJetMult     = in[18];
+
+      // EvaluateMVA("BTDG method") returns -999 for NaN inputs, the MethodBase* overload does not check them
+      bool hasNaN = false;
+      for (Float_t value: in) {
+        if (TMath::IsNaN(value)) hasNaN = true;
+      }
+      float MVAoutput = hasNaN ? -999 : reader->EvaluateMVA(fBDTMethod);
+      memo.fScores[in] = MVAoutput;
+      output.push_back(MVAoutput);
+    }
+  return output;
+}
+
 TopSelectionBDT::Data TopSelectionBDT::privateAnalyze(const Event& event, const std::vector<Jet> selectedJets, const std::vector<Jet> selectedBjets) {
   Data output;
   cSubAll.increment();
@@ -432,6 +537,17 @@ TopSelectionBDT::Data TopSelectionBDT::privateAnalyze(const Event& event, const
   TrijetSelection fNotSelectedTops;
   TrijetSelection fAllCleanedTops;
 
+  // Top candidates passing the mass and b-tag cuts and their BDT inputs
+  struct TrijetCandidate {
+    const Jet* bjet;
+    const Jet* jet1;
+    const Jet* jet2;
+    math::XYZTLorentzVector top_p4;
+    math::XYZTLorentzVector w_p4;
+  };
+  std::vector<TrijetCandidate> candidates;
+  std::vector<BDTInputs> candidateInputs;
+
   // For-loop: All b-jets
   // mafor (auto& bjet: jets) // OldTop (Between ~March-June 2018)
   for (auto& bjet: bjets) // NewTop (Testing since 01/06/2018)
@@ -478,79 +594,68 @@ TopSelectionBDT::Data TopSelectionBDT::privateAnalyze(const Event& event, const
 	      if (!cfg_CSV_bDiscCut.passedCut(bjet.bjetDiscriminator())) continue;
 	      cTopsPassBDiscCut.increment();
 
-	      // Calculate variables
-	      double dr_sd = ROOT::Math::VectorUtil::DeltaR( jet1.p4(), jet2.p4());
-	      double softDrop_n2 = min(jet2.pt(), jet1.pt()) / ( (jet2.pt() + jet1.pt()) * dr_sd * dr_sd);
-
-	      // Calculate our BDT discriminating variables for MVA use
-	      TrijetPtDR              = top_p4.Pt() * ROOT::Math::VectorUtil::DeltaR( w_p4  , bjet.p4() );
-	      TrijetDijetPtDR         = w_p4.Pt() * ROOT::Math::VectorUtil::DeltaR( jet1.p4() , jet2.p4() );
-	      TrijetBjetMass          = bjet.p4().M();
-	      TrijetLdgJetBDisc       = jet1.bjetDiscriminator();
-	      TrijetSubldgJetBDisc    = jet2.bjetDiscriminator();
-	      TrijetBJetLdgJetMass    = (bjet.p4() + jet1.p4()).M();
-	      TrijetBJetSubldgJetMass = (bjet.p4() + jet2.p4()).M();
-	      TrijetMass              = top_p4.M();
-	      TrijetDijetMass         = w_p4.M();
-	      TrijetBJetBDisc         = bjet.bjetDiscriminator();
-	      TrijetSoftDrop_n2       = softDrop_n2;
-	      TrijetLdgJetCvsL        = jet1.pfCombinedCvsLJetTags();
-	      TrijetSubldgJetCvsL     = jet2.pfCombinedCvsLJetTags();
-	      TrijetLdgJetPtD         = jet1.QGTaggerAK4PFCHSptD();
-	      TrijetSubldgJetPtD      = jet2.QGTaggerAK4PFCHSptD();
-	      TrijetLdgJetAxis2       = jet1.QGTaggerAK4PFCHSaxis2();
-	      TrijetSubldgJetAxis2    = jet2.QGTaggerAK4PFCHSaxis2();
-	      TrijetLdgJetMult        = jet1.QGTaggerAK4PFCHSmult();
-	      TrijetSubldgJetMult     = jet2.QGTaggerAK4PFCHSmult();
-
-	      // Evaluate the MVA discriminator value
-	      float MVAoutput = reader->EvaluateMVA("BTDG method");
-	      // std::cout << "MVA = " << MVAoutput << ", Pt = " << top_p4.pt() << ", M = " << TrijetMass << std::endl;
-
-	      // Fill top candidate BDT values
-	      hTopBDT_AllCandidates -> Fill(MVAoutput);
-	      hTopMass_AllCandidates-> Fill(top_p4.M());
-	      hTopPt_AllCandidates  -> Fill(top_p4.pt());
-
-	      // Save top candidates
-	      fAllTops.MVA.push_back(MVAoutput);
-	      fAllTops.TrijetP4.push_back(top_p4);
-	      fAllTops.DijetP4.push_back(w_p4);
-	      fAllTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
-	      fAllTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
-	      fAllTops.BJet.push_back(bjet);
-	      fAllTops.isGenuine.push_back(false);
-	      fAllTops.isTagged.push_back(cfg_TopMVACut.passedCut(MVAoutput));
-
-	      // Get top candidates above MVA cut
-	      if (cfg_TopMVACut.passedCut(MVAoutput))
-		{
-		  cTopsPassBDTCut.increment();
-		  fSelectedTops.MVA.push_back(MVAoutput);
-		  fSelectedTops.TrijetP4.push_back(top_p4);
-		  fSelectedTops.DijetP4.push_back(w_p4);
-		  fSelectedTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
-		  fSelectedTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
-		  fSelectedTops.BJet.push_back(bjet);
-		  fSelectedTops.isGenuine.push_back(false);
-		  fSelectedTops.isTagged.push_back(true);  // fixme: which MVA cut? ldg, or subldg, or?
-		}
-	      else
-		{
-		  // Get top candidates failing MVA cut
-		  fNotSelectedTops.MVA.push_back(MVAoutput);
-		  fNotSelectedTops.TrijetP4.push_back(top_p4);
-		  fNotSelectedTops.DijetP4.push_back(w_p4);
-		  fNotSelectedTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
-		  fNotSelectedTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
-		  fNotSelectedTops.BJet.push_back(bjet);
-		  fNotSelectedTops.isGenuine.push_back(false); // fixme
-		  fNotSelectedTops.isTagged.push_back(false); // fixme: which MVA cut? ldg, or subldg, or?
-		}
-		
+	      // Save the candidate, the BDT is evaluated for all candidates at once below
+	      candidates.push_back(TrijetCandidate{&bjet, &jet1, &jet2, top_p4, w_p4});
+	      candidateInputs.push_back(getBDTInputs(bjet, jet1, jet2, top_p4, w_p4));
 	    }// For-loop: All jets
 	}// For-loop: All jets
     }// For-loop: All b-jets
+
+  // Evaluate the MVA discriminator values of all candidates
+  std::vector<float> MVAoutputs = evaluateMVA(event.eventID(), candidateInputs);
+
+  // For-loop: All top candidates
+  for (size_t i = 0; i < candidates.size(); i++)
+    {
+      const Jet& bjet = *candidates.at(i).bjet;
+      const Jet& jet1 = *candidates.at(i).jet1;
+      const Jet& jet2 = *candidates.at(i).jet2;
+      const math::XYZTLorentzVector& top_p4 = candidates.at(i).top_p4;
+      const math::XYZTLorentzVector& w_p4   = candidates.at(i).w_p4;
+      float MVAoutput = MVAoutputs.at(i);
+      // std::cout << "MVA = " << MVAoutput << ", Pt = " << top_p4.pt() << ", M = " << top_p4.M() << std::endl;
+
+      // Fill top candidate BDT values
+      hTopBDT_AllCandidates -> Fill(MVAoutput);
+      hTopMass_AllCandidates-> Fill(top_p4.M());
+      hTopPt_AllCandidates  -> Fill(top_p4.pt());
+
+      // Save top candidates
+      fAllTops.MVA.push_back(MVAoutput);
+      fAllTops.TrijetP4.push_back(top_p4);
+      fAllTops.DijetP4.push_back(w_p4);
+      fAllTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
+      fAllTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
+      fAllTops.BJet.push_back(bjet);
+      fAllTops.isGenuine.push_back(false);
+      fAllTops.isTagged.push_back(cfg_TopMVACut.passedCut(MVAoutput));
+
+      // Get top candidates above MVA cut
+      if (cfg_TopMVACut.passedCut(MVAoutput))
+	{
+	  cTopsPassBDTCut.increment();
+	  fSelectedTops.MVA.push_back(MVAoutput);
+	  fSelectedTops.TrijetP4.push_back(top_p4);
+	  fSelectedTops.DijetP4.push_back(w_p4);
+	  fSelectedTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
+	  fSelectedTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
+	  fSelectedTops.BJet.push_back(bjet);
+	  fSelectedTops.isGenuine.push_back(false);
+	  fSelectedTops.isTagged.push_back(true);  // fixme: which MVA cut? ldg, or subldg, or?
+	}
+      else
+	{
+	  // Get top candidates failing MVA cut
+	  fNotSelectedTops.MVA.push_back(MVAoutput);
+	  fNotSelectedTops.TrijetP4.push_back(top_p4);
+	  fNotSelectedTops.DijetP4.push_back(w_p4);
+	  fNotSelectedTops.Jet1.push_back(getLeadingSubleadingJet(jet1, jet2, "leading"));
+	  fNotSelectedTops.Jet2.push_back(getLeadingSubleadingJet(jet1, jet2, "subleading"));
+	  fNotSelectedTops.BJet.push_back(bjet);
+	  fNotSelectedTops.isGenuine.push_back(false); // fixme
+	  fNotSelectedTops.isTagged.push_back(false); // fixme: which MVA cut? ldg, or subldg, or?
+	}
+    }// For-loop: All top candidates
   hTopMultiplicity_AllCandidates->Fill(fAllTops.MVA.size());
 
   //================================================================================================  
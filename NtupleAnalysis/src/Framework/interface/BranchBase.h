@@ -24,6 +24,10 @@ public:
 
   const std::string& getName() const { return name; }
 
+  // Compressed size of the branch (including sub-branches) in the current TTree, 0 if not valid
+  Long64_t getZipBytes() const;
+  Long64_t getEntries() const;
+
   virtual std::string getTypeName() const = 0;
 
   // public only to allow testability
@@ -44,6 +44,11 @@ public:
     }
   }
 
+  // Names of the booked branches that exist in the TTree (i.e. the ones actually read)
+  std::vector<std::string> getEnabledBranchNames() const;
+  // Average compressed bytes per entry of the enabled branches in the current TTree
+  double getEnabledBytesPerEntry() const;
+
 private:
   void throwTypeMismatch(const std::string& name, const std::string& oldType, const std::string& newType) const;
   TTree *fTree; // not the owner
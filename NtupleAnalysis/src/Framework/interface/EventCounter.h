@@ -2,6 +2,8 @@
 #ifndef Framework_EventCounter_h
 #define Framework_EventCounter_h
 
+#include "Framework/interface/SharedSelections.h"
+
 #include <string>
 #include <vector>
 
@@ -106,6 +108,7 @@ private:
 
 inline
 void Count::increment() {
+  SharedSelections::record(SharedSelections::Operation::kCount, this, false);
   if (fEventCounter->isEnabled())
     fEventCounter->incrementCount(fCounterIndex, fCountIndex);
 }
@@ -6,6 +6,7 @@
 #include "Framework/interface/EventWeight.h"
 #include "Framework/interface/Exception.h"
 #include "Framework/interface/HistoWrapperTraits.h"
+#include "Framework/interface/SharedSelections.h"
 
 #include "TDirectory.h"
 #include "TH1.h"
@@ -169,12 +170,12 @@ public:
   ~WrappedTH1();
 
   /// Fills histogram (if it exists) with event weight
-  template<typename Arg1> void Fill(const Arg1& a1) { if (isActive()) h->Fill(a1, getWeight()); }
+  template<typename Arg1> void Fill(const Arg1& a1) { SharedSelections::record(SharedSelections::Operation::kTH1, this, false, a1); if (isActive()) h->Fill(a1, getWeight()); }
   /// Fills histogram (if it exists) with custom event weight
-  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, const Arg2& a2) { if (isActive()) h->Fill(a1, a2); }
+  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, const Arg2& a2) { SharedSelections::record(SharedSelections::Operation::kTH1Weighted, this, false, a1, a2); if (isActive()) h->Fill(a1, a2); }
 
-  template<typename Arg1, typename Arg2> void SetBinContent(const Arg1& a1, const Arg2& a2) { if(isActive()) h->SetBinContent(a1, a2); }
-  template<typename Arg1, typename Arg2> void SetBinError(const Arg1& a1, const Arg2& a2) { if(isActive()) h->SetBinError(a1, a2); }
+  template<typename Arg1, typename Arg2> void SetBinContent(const Arg1& a1, const Arg2& a2) { SharedSelections::invalidate(); if(isActive()) h->SetBinContent(a1, a2); }
+  template<typename Arg1, typename Arg2> void SetBinError(const Arg1& a1, const Arg2& a2) { SharedSelections::invalidate(); if(isActive()) h->SetBinError(a1, a2); }
 };
 
 /// Wrapper class for TH2 object
@@ -185,9 +186,9 @@ public:
   ~WrappedTH2();
 
   /// Fills histogram (if it exists) with event weight
-  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, const Arg2& a2) { if (isActive()) h->Fill(a1, a2, getWeight()); }
+  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, const Arg2& a2) { SharedSelections::record(SharedSelections::Operation::kTH2, this, false, a1, a2); if (isActive()) h->Fill(a1, a2, getWeight()); }
   /// Fills histogram (if it exists) with custom event weight
-  template<typename Arg1, typename Arg2, typename Arg3> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3) { if (isActive()) h->Fill(a1, a2, a3); }
+  template<typename Arg1, typename Arg2, typename Arg3> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3) { SharedSelections::record(SharedSelections::Operation::kTH2Weighted, this, false, a1, a2, a3); if (isActive()) h->Fill(a1, a2, a3); }
 };
 
 /// Wrapper class for TH3 object
@@ -198,9 +199,9 @@ public:
   ~WrappedTH3();
 
   /// Fills histogram (if it exists) with event weight
-  template<typename Arg1, typename Arg2, typename Arg3> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3) { if (isActive()) h->Fill(a1, a2, a3, getWeight()); }
+  template<typename Arg1, typename Arg2, typename Arg3> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3) { SharedSelections::record(SharedSelections::Operation::kTH3, this, false, a1, a2, a3); if (isActive()) h->Fill(a1, a2, a3, getWeight()); }
   /// Fills histogram (if it exists) with custom event weight
-  template<typename Arg1, typename Arg2, typename Arg3, typename Arg4> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3, const Arg4& a4) { if (isActive()) h->Fill(a1, a2, a3, a4); }
+  template<typename Arg1, typename Arg2, typename Arg3, typename Arg4> void Fill(const Arg1& a1, const Arg2& a2, const Arg3& a3, const Arg4& a4) { SharedSelections::record(SharedSelections::Operation::kTH3Weighted, this, false, a1, a2, a3, a4); if (isActive()) h->Fill(a1, a2, a3, a4); }
 };
 
 /// Wrapper class for factorisation histograms (binning unfolded on y-axis and value(s) on x-axis)
@@ -211,9 +212,9 @@ public:
   ~WrappedUnfoldedFactorisationHisto();
 
   /// Fills histogram (if it exists) with event weight
-  template<typename Arg1> void Fill(const Arg1& a1, int factorisationBin) { if (isActive()) h->Fill(a1, factorisationBin, getWeight()); }
+  template<typename Arg1> void Fill(const Arg1& a1, int factorisationBin) { SharedSelections::record(SharedSelections::Operation::kUnfolded, this, false, a1, factorisationBin); if (isActive()) h->Fill(a1, factorisationBin, getWeight()); }
   /// Fills histogram (if it exists) with custom event weight
-  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, int factorisationBin, const Arg2& a2) { if (isActive()) h->Fill(a1, factorisationBin, a2); }
+  template<typename Arg1, typename Arg2> void Fill(const Arg1& a1, int factorisationBin, const Arg2& a2) { SharedSelections::record(SharedSelections::Operation::kUnfoldedWeighted, this, false, a1, factorisationBin, a2); if (isActive()) h->Fill(a1, factorisationBin, a2); }
 };
 
 template<class T>
@@ -299,9 +300,9 @@ public:
   ~WrappedTH1Triplet() { }
   
   /// Fills histogram (if it exists) with value
-  template<typename Arg1> void Fill(bool status, const Arg1& a1) { this->_Fill(status, a1, getWeight()); }
+  template<typename Arg1> void Fill(bool status, const Arg1& a1) { SharedSelections::record(SharedSelections::Operation::kTH1Triplet, this, status, a1); this->_Fill(status, a1, getWeight()); }
   /// Fills histogram (if it exists) with value and weight
-  template<typename Arg1, typename Arg2> void Fill(bool status, const Arg1& a1, const Arg2& a2) { this->_Fill(status, a1, a2); }
+  template<typename Arg1, typename Arg2> void Fill(bool status, const Arg1& a1, const Arg2& a2) { SharedSelections::record(SharedSelections::Operation::kTH1TripletWeighted, this, status, a1, a2); this->_Fill(status, a1, a2); }
 };
 
 /// Wrapper class for TH2 triplet object
@@ -312,9 +313,9 @@ public:
   ~WrappedTH2Triplet() { }
   
   /// Fills histogram (if it exists) with value
-  template<typename Arg1, typename Arg2> void Fill(bool status, const Arg1& a1, const Arg2& a2) { this->_Fill(status, a1, a2, getWeight()); }
+  template<typename Arg1, typename Arg2> void Fill(bool status, const Arg1& a1, const Arg2& a2) { SharedSelections::record(SharedSelections::Operation::kTH2Triplet, this, status, a1, a2); this->_Fill(status, a1, a2, getWeight()); }
   /// Fills histogram (if it exists) with value and weight
-  template<typename Arg1, typename Arg2, typename Arg3> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3) { this->_Fill(status, a1, a2, a3); }
+  template<typename Arg1, typename Arg2, typename Arg3> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3) { SharedSelections::record(SharedSelections::Operation::kTH2TripletWeighted, this, status, a1, a2, a3); this->_Fill(status, a1, a2, a3); }
 };
 
 /// Wrapper class for TH2 triplet object
@@ -325,9 +326,9 @@ public:
   ~WrappedTH3Triplet() { }
   
   /// Fills histogram (if it exists) with value
-  template<typename Arg1, typename Arg2, typename Arg3> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3) { this->_Fill(status, a1, a2, a3, getWeight()); }
+  template<typename Arg1, typename Arg2, typename Arg3> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3) { SharedSelections::record(SharedSelections::Operation::kTH3Triplet, this, status, a1, a2, a3); this->_Fill(status, a1, a2, a3, getWeight()); }
   /// Fills histogram (if it exists) with value and weight
-  template<typename Arg1, typename Arg2, typename Arg3, typename Arg4> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3, const Arg4& a4) { this->_Fill(status, a1, a2, a3, a4); }
+  template<typename Arg1, typename Arg2, typename Arg3, typename Arg4> void Fill(bool status, const Arg1& a1, const Arg2& a2, const Arg3& a3, const Arg4& a4) { SharedSelections::record(SharedSelections::Operation::kTH3TripletWeighted, this, status, a1, a2, a3, a4); this->_Fill(status, a1, a2, a3, a4); }
 };
 
 //////////////////////////////////////// Implementations of inline/template functions
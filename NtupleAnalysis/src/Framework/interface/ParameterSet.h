@@ -82,6 +82,8 @@ public:
   
   bool isMC() const;
   bool exists(const std::string&) const;
+  /// Compact JSON of the contents, e.g. for comparing the configurations of two modules
+  std::string serialize() const;
   
 private:
   template <typename T, typename PChild>
@@ -70,6 +70,7 @@ private:
 
   void printStatus();
   void resetStatus();
+  void setupTreeCache(TTree *tree);
 
   Long64_t                  fEntries;      //! Number of entries in the tree
   Long64_t                  fProcessed;    //! Number of processed entries
@@ -91,6 +92,11 @@ private:
   int fPrintAdaptCount;
   bool fPrintStatus;
 
+  // TTreeCache restricted to the branches enabled in BranchManager
+  Long64_t fTreeCacheMaxSize; // 0 to leave the cache as set up by the caller
+  Long64_t fTreeCacheSize;
+  std::vector<std::string> fTreeCacheBranches;
+
   // Input parameters
   TString fOptionString;
   bool bIsMC;
@@ -0,0 +1,190 @@
+// -*- c++ -*-
+#ifndef Framework_SharedSelections_h
+#define Framework_SharedSelections_h
+
+#include <string>
+#include <vector>
+#include <map>
+#include <unordered_map>
+#include <memory>
+#include <iostream>
+#include <type_traits>
+#include <initializer_list>
+
+class WrappedTH1;
+class WrappedTH2;
+class WrappedTH3;
+class WrappedUnfoldedFactorisationHisto;
+class WrappedTH1Triplet;
+class WrappedTH2Triplet;
+class WrappedTH3Triplet;
+class Count;
+
+/// Selection stages evaluated once per event for all analyzers of the job
+///
+/// The analyzers built for the variations of an analysis (search modes,
+/// optimisation, systematics) mostly run the same selection stages with
+/// the same configuration. A stage registered here (see
+/// BaseSelection::enableSharing()) is evaluated by the first analyzer in
+/// each event, and its histogram fills and counter increments are
+/// recorded. The other analyzers with an identical stage (same stage
+/// name, postfix and configuration) take a copy of the result and replay
+/// the recorded fills to their own histograms and counters, so their
+/// output is the same as if they had evaluated the stage themselves
+/// (fills with the event weight use the weight of the replaying analyzer).
+///
+/// The histograms and counters of two analyzers are matched by comparing
+/// the recordings of the stage: an analyzer evaluates the stage itself
+/// (and learns the matching) until all objects of the recording are
+/// known. If the recordings differ, the stage is never shared between
+/// the two analyzers.
+class SharedSelections {
+public:
+  /// Recorded histogram fill or counter increment
+  struct Operation {
+    enum Kind {
+      kTH1, kTH1Weighted, kTH2, kTH2Weighted, kTH3, kTH3Weighted,
+      kUnfolded, kUnfoldedWeighted,
+      kTH1Triplet, kTH1TripletWeighted, kTH2Triplet, kTH2TripletWeighted, kTH3Triplet, kTH3TripletWeighted,
+      kCount
+    };
+    Kind kind;
+    void *object;
+    bool status;
+    double values[4];
+  };
+
+  /// Operations recorded while a stage was evaluated
+  struct Recording {
+    Recording(): valid(true) { }
+    std::vector<Operation> operations;
+    bool valid; // false if something that can not be replayed was done
+  };
+
+  /// Per-stage statistics of the timing report
+  struct StageStatistics {
+    StageStatistics(): evaluations(0), reuses(0), evaluationTime(0), replayTime(0) { }
+    long evaluations;
+    long reuses;
+    double evaluationTime; // s
+    double replayTime; // s
+  };
+
+  /// Sharing state of the stage of one analyzer
+  class Client {
+  public:
+    Client(const std::string& stageName, const std::string& key): fStageName(stageName), fKey(key), bDisabled(false) { }
+
+    /// Evaluates the stage (with evaluate()) or takes the result evaluated by another analyzer in this event
+    template <typename T, typename F>
+    T analyze(F&& evaluate);
+
+  private:
+    bool replay(const Recording& recording);
+    bool learn(const Recording& source, const Recording& own);
+
+    const std::string fStageName;
+    const std::string fKey;
+    // Objects of the other analyzers mapped to the own ones
+    std::unordered_map<const void*, void*> fObjects;
+    bool bDisabled;
+  };
+
+  static void setEnabled(bool enabled) { bEnabled = enabled; }
+  static bool isEnabled() { return bEnabled; }
+
+  /// Drops the stage results of the previous event
+  static void beginEvent();
+  /// Drops all results and statistics
+  static void clear();
+  /// Prints the evaluations, reuses and time spent per stage
+  static void printReport(std::ostream& out);
+
+  /// Recording hooks called from the histogram wrappers and counters
+  template <typename ...Args>
+  static void record(Operation::Kind kind, const void *object, bool status, const Args&... args) {
+    if (fRecording != nullptr)
+      append(kind, object, status, {toValue(args)...});
+  }
+  static void invalidate() {
+    if (fRecording != nullptr)
+      fRecording->valid = false;
+  }
+
+private:
+  /// Stage result of the current event
+  struct Result {
+    std::shared_ptr<void> data;
+    Recording recording;
+  };
+
+  template <typename T>
+  static typename std::enable_if<std::is_arithmetic<T>::value || std::is_enum<T>::value, double>::type toValue(const T& value) { return static_cast<double>(value); }
+  template <typename T>
+  static typename std::enable_if<!(std::is_arithmetic<T>::value || std::is_enum<T>::value), double>::type toValue(const T&) {
+    invalidate();
+    return 0.0;
+  }
+  static void append(Operation::Kind kind, const void *object, bool status, std::initializer_list<double> values);
+
+  static double now();
+
+  static bool bEnabled;
+  static Recording *fRecording;
+  static std::unordered_map<std::string, Result> fResults;
+  static std::map<std::string, StageStatistics> fStatistics;
+};
+
+template <typename T, typename F>
+T SharedSelections::Client::analyze(F&& evaluate) {
+  if (!bEnabled || bDisabled)
+    return evaluate();
+
+  StageStatistics& stats = fStatistics[fStageName];
+  auto found = fResults.find(fKey);
+  if (found != fResults.end() && found->second.recording.valid) {
+    // Evaluated already by another analyzer
+    double start = now();
+    if (replay(found->second.recording)) {
+      stats.reuses++;
+      stats.replayTime += now() - start;
+      return *static_cast<const T*>(found->second.data.get());
+    }
+  }
+
+  // Evaluate while recording the fills
+  double start = now();
+  Recording *outer = fRecording;
+  Recording own;
+  fRecording = &own;
+  T result;
+  try {
+    result = evaluate();
+  } catch (...) {
+    fRecording = outer;
+    throw;
+  }
+  fRecording = outer;
+  if (outer != nullptr) {
+    // Fills of a stage evaluated within another stage belong to both
+    outer->operations.insert(outer->operations.end(), own.operations.begin(), own.operations.end());
+    outer->valid = outer->valid && own.valid;
+  }
+  stats.evaluations++;
+  stats.evaluationTime += now() - start;
+
+  // Stages evaluated within evaluate() may have invalidated the iterator
+  found = fResults.find(fKey);
+  if (found != fResults.end()) {
+    // Learn the matching of the histograms and counters from the two recordings
+    if (found->second.recording.valid && own.valid && !learn(found->second.recording, own))
+      bDisabled = true;
+  } else {
+    Result& r = fResults[fKey];
+    r.data = std::make_shared<T>(result);
+    r.recording = std::move(own);
+  }
+  return result;
+}
+
+#endif
@@ -1,10 +1,24 @@
 #include "Framework/interface/BranchBase.h"
 
+#include "TBranch.h"
+
 #include <stdexcept>
 #include <iostream>
 
 BranchBase::~BranchBase() {}
 
+Long64_t BranchBase::getZipBytes() const {
+  if(!isValid())
+    return 0;
+  return branch->GetZipBytes("*");
+}
+
+Long64_t BranchBase::getEntries() const {
+  if(!isValid())
+    return 0;
+  return branch->GetEntries();
+}
+
 namespace {
   bool exactlyOneVector(const std::string& a, const std::string b) {
     int c = 0;
@@ -8,3 +8,22 @@ BranchManager::~BranchManager() {}
 void BranchManager::throwTypeMismatch(const std::string& name, const std::string& oldType, const std::string& newType) const {
   throw std::runtime_error("Trying to book branch "+name+" with a type '"+newType+"', but it is already booked with a different type '"+oldType+"'");
 }
+
+std::vector<std::string> BranchManager::getEnabledBranchNames() const {
+  std::vector<std::string> names;
+  for(auto&& branch: fBranches) {
+    if(branch->isValid())
+      names.push_back(branch->getName());
+  }
+  return names;
+}
+
+double BranchManager::getEnabledBytesPerEntry() const {
+  double bytes = 0;
+  for(auto&& branch: fBranches) {
+    Long64_t entries = branch->getEntries();
+    if(entries > 0)
+      bytes += static_cast<double>(branch->getZipBytes()) / entries;
+  }
+  return bytes;
+}
@@ -49,3 +49,9 @@ bool ParameterSet::exists(const std::string& name) const {
   if(!child) return false;
   return true;
 }
+
+std::string ParameterSet::serialize() const {
+  std::stringstream ss;
+  boost::property_tree::write_json(ss, fConfig, false);
+  return ss.str();
+}
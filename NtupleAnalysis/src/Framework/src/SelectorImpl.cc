@@ -3,6 +3,7 @@
 #include "Framework/interface/BranchManager.h"
 #include "Framework/interface/SelectorFactory.h"
 #include "Framework/interface/EventSaver.h"
+#include "Framework/interface/SharedSelections.h"
 
 #include "TROOT.h"
 #include "TProofServ.h"
@@ -15,6 +16,7 @@
 
 #include <iostream>
 #include <iomanip>
+#include <algorithm>
 #include <stdexcept>
 #include <sstream>
 #include <unordered_set>
@@ -34,6 +36,7 @@ SelectorImpl::SelectorImpl():
   fChain(nullptr),
   fProofFile(nullptr), fOutputFile(nullptr),
   fPrintStep(20000), fPrintLastTime(0), fPrintAdaptCount(0), fPrintStatus(false),
+  fTreeCacheMaxSize(0), fTreeCacheSize(0),
   fOptionString("{}"),
   bIsMC(true),
   bIsttbar(false),
@@ -69,6 +72,42 @@ void SelectorImpl::Init(TTree *tree) {
     selector->setIsttbar(bIsttbar);
     selector->setIsIntermediateNN(bIsIntermediateNN);
   }
+  if(fTreeCacheMaxSize > 0)
+    setupTreeCache(tree);
+}
+
+void SelectorImpl::setupTreeCache(TTree *tree) {
+  // Size the TTreeCache to hold one cluster of the branches the
+  // analyzers actually read, and cache only those branches (no
+  // learning phase)
+  fTreeCacheBranches = fBranchManager->getEnabledBranchNames();
+  if(fTreeCacheBranches.empty())
+    return;
+
+  // For TChain the current TTree was loaded by BranchManager
+  TTree *current = tree->GetTree();
+  if(!current)
+    current = tree;
+  Long64_t clusterEntries = current->GetAutoFlush();
+  if(clusterEntries < 0 && current->GetEntries() > 0 && current->GetZipBytes() > 0) {
+    // Negative value is the cluster size in compressed bytes of all branches
+    double allBytesPerEntry = static_cast<double>(current->GetZipBytes()) / current->GetEntries();
+    clusterEntries = static_cast<Long64_t>(-clusterEntries / allBytesPerEntry);
+  }
+  if(clusterEntries <= 0)
+    clusterEntries = 1000;
+
+  // 20 % margin for clusters with larger than average entries
+  const Long64_t minSize = 1024*1024;
+  Long64_t size = static_cast<Long64_t>(1.2 * fBranchManager->getEnabledBytesPerEntry() * clusterEntries);
+  size = std::min(std::max(size, minSize), fTreeCacheMaxSize);
+
+  tree->SetCacheSize(size);
+  for(const std::string& name: fTreeCacheBranches) {
+    tree->AddBranchToCache(name.c_str(), kTRUE);
+  }
+  tree->StopCacheLearningPhase();
+  fTreeCacheSize = size;
 }
 
 Bool_t SelectorImpl::Notify() {
@@ -135,6 +174,12 @@ void SelectorImpl::SlaveBegin(TTree * /*tree*/) {
   const TNamed* optionStr = dynamic_cast<const TNamed*>(fInput->FindObject("options"));
   if (optionStr != nullptr)
     fOptionString = optionStr->GetTitle();
+  const TNamed* treeCacheMaxSize = dynamic_cast<const TNamed*>(fInput->FindObject("treeCacheMaxSize"));
+  if (treeCacheMaxSize != nullptr)
+    fTreeCacheMaxSize = std::stoll(treeCacheMaxSize->GetTitle());
+  const TNamed* sharedSelections = dynamic_cast<const TNamed*>(fInput->FindObject("sharedSelections"));
+  SharedSelections::clear();
+  SharedSelections::setEnabled(sharedSelections != nullptr && sharedSelections->GetTitle()[0] == '1');
   hSkimCounters = dynamic_cast<TH1F*>(fInput->FindObject("SkimCounter"));
   //std::cout << "gDirectory" << gDirectory->GetList()->GetSize() << std::endl;
   hPUdata = dynamic_cast<TH1*>(fInput->FindObject("PileUpData"));  
@@ -270,6 +315,7 @@ Bool_t SelectorImpl::Process(Long64_t entry) {
 
   fEventSaver->beginEvent();
   fBranchManager->setEntry(entry);
+  SharedSelections::beginEvent();
   for(BaseSelector *selector: fSelectors) {
     selector->processInternal(entry);
   }
@@ -284,9 +330,24 @@ void SelectorImpl::SlaveTerminate() {
   // on each slave server.
 
   resetStatus();
+  if(SharedSelections::isEnabled())
+    SharedSelections::printReport(std::cout);
   for(BaseSelector *selector: fSelectors) {
     delete selector;
   }
+  SharedSelections::clear();
+  SharedSelections::setEnabled(false);
+  // Report the TTreeCache setup to the caller (not with PROOF, TNamed can not be merged)
+  if(fTreeCacheSize > 0 && !gProofServ) {
+    std::stringstream branches;
+    for(size_t i = 0; i < fTreeCacheBranches.size(); ++i) {
+      if(i > 0)
+        branches << ",";
+      branches << fTreeCacheBranches[i];
+    }
+    fOutput->Add(new TNamed("treeCacheSize", std::to_string(fTreeCacheSize).c_str()));
+    fOutput->Add(new TNamed("treeCacheBranches", branches.str().c_str()));
+  }
   fSelectors.clear();
   fEventSaver->terminate();
 
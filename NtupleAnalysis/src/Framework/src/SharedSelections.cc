@@ -0,0 +1,116 @@
+#include "Framework/interface/SharedSelections.h"
+#include "Framework/interface/HistoWrapper.h"
+#include "Framework/interface/EventCounter.h"
+
+#include <chrono>
+#include <cstring>
+#include <iomanip>
+
+bool SharedSelections::bEnabled = false;
+SharedSelections::Recording *SharedSelections::fRecording = nullptr;
+std::unordered_map<std::string, SharedSelections::Result> SharedSelections::fResults;
+std::map<std::string, SharedSelections::StageStatistics> SharedSelections::fStatistics;
+
+void SharedSelections::beginEvent() {
+  fResults.clear();
+}
+
+void SharedSelections::clear() {
+  fResults.clear();
+  fStatistics.clear();
+  fRecording = nullptr;
+}
+
+void SharedSelections::printReport(std::ostream& out) {
+  if (fStatistics.empty())
+    return;
+  out << "\n\tShared selection stages (evaluations / reuses, time in evaluation / replay):" << std::endl;
+  double saved = 0;
+  for (const auto& item: fStatistics) {
+    const StageStatistics& s = item.second;
+    double perEvaluation = s.evaluations > 0 ? s.evaluationTime / s.evaluations : 0;
+    double stageSaved = s.reuses * perEvaluation - s.replayTime;
+    saved += stageSaved;
+    out << "\t  " << std::left << std::setw(30) << item.first << std::right
+        << std::setw(12) << s.evaluations << " / " << std::setw(12) << s.reuses
+        << std::fixed << std::setprecision(2)
+        << std::setw(10) << s.evaluationTime << " s / " << std::setw(8) << s.replayTime << " s"
+        << " (saved " << stageSaved << " s)" << std::endl;
+  }
+  out << "\t  Estimated time saved: " << std::fixed << std::setprecision(2) << saved << " s" << std::endl;
+  out.unsetf(std::ios::floatfield);
+}
+
+void SharedSelections::append(Operation::Kind kind, const void *object, bool status, std::initializer_list<double> values) {
+  Operation op;
+  op.kind = kind;
+  op.object = const_cast<void*>(object);
+  op.status = status;
+  size_t i = 0;
+  for (double v: values) {
+    if (i < 4)
+      op.values[i] = v;
+    ++i;
+  }
+  for (; i < 4; ++i)
+    op.values[i] = 0.0;
+  fRecording->operations.push_back(op);
+}
+
+double SharedSelections::now() {
+  return std::chrono::duration<double>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+bool SharedSelections::Client::replay(const Recording& recording) {
+  // All objects must be known before anything is filled
+  std::vector<void*> objects;
+  objects.reserve(recording.operations.size());
+  for (const Operation& op: recording.operations) {
+    auto found = fObjects.find(op.object);
+    if (found == fObjects.end())
+      return false;
+    objects.push_back(found->second);
+  }
+
+  for (size_t i = 0; i < objects.size(); ++i) {
+    const Operation& op = recording.operations[i];
+    const double *v = op.values;
+    void *o = objects[i];
+    switch (op.kind) {
+    case Operation::kTH1:                 static_cast<WrappedTH1*>(o)->Fill(v[0]); break;
+    case Operation::kTH1Weighted:         static_cast<WrappedTH1*>(o)->Fill(v[0], v[1]); break;
+    case Operation::kTH2:                 static_cast<WrappedTH2*>(o)->Fill(v[0], v[1]); break;
+    case Operation::kTH2Weighted:         static_cast<WrappedTH2*>(o)->Fill(v[0], v[1], v[2]); break;
+    case Operation::kTH3:                 static_cast<WrappedTH3*>(o)->Fill(v[0], v[1], v[2]); break;
+    case Operation::kTH3Weighted:         static_cast<WrappedTH3*>(o)->Fill(v[0], v[1], v[2], v[3]); break;
+    case Operation::kUnfolded:            static_cast<WrappedUnfoldedFactorisationHisto*>(o)->Fill(v[0], static_cast<int>(v[1])); break;
+    case Operation::kUnfoldedWeighted:    static_cast<WrappedUnfoldedFactorisationHisto*>(o)->Fill(v[0], static_cast<int>(v[1]), v[2]); break;
+    case Operation::kTH1Triplet:          static_cast<WrappedTH1Triplet*>(o)->Fill(op.status, v[0]); break;
+    case Operation::kTH1TripletWeighted:  static_cast<WrappedTH1Triplet*>(o)->Fill(op.status, v[0], v[1]); break;
+    case Operation::kTH2Triplet:          static_cast<WrappedTH2Triplet*>(o)->Fill(op.status, v[0], v[1]); break;
+    case Operation::kTH2TripletWeighted:  static_cast<WrappedTH2Triplet*>(o)->Fill(op.status, v[0], v[1], v[2]); break;
+    case Operation::kTH3Triplet:          static_cast<WrappedTH3Triplet*>(o)->Fill(op.status, v[0], v[1], v[2]); break;
+    case Operation::kTH3TripletWeighted:  static_cast<WrappedTH3Triplet*>(o)->Fill(op.status, v[0], v[1], v[2], v[3]); break;
+    case Operation::kCount:               static_cast<Count*>(o)->increment(); break;
+    }
+  }
+  return true;
+}
+
+bool SharedSelections::Client::learn(const Recording& source, const Recording& own) {
+  // The stage is deterministic, so the recordings of identical stages must be identical apart from the objects
+  if (source.operations.size() != own.operations.size())
+    return false;
+  for (size_t i = 0; i < own.operations.size(); ++i) {
+    const Operation& a = source.operations[i];
+    const Operation& b = own.operations[i];
+    if (a.kind != b.kind || a.status != b.status || std::memcmp(a.values, b.values, sizeof(a.values)) != 0)
+      return false;
+  }
+  for (size_t i = 0; i < own.operations.size(); ++i) {
+    auto inserted = fObjects.insert(std::make_pair(source.operations[i].object, own.operations[i].object));
+    if (!inserted.second && inserted.first->second != own.operations[i].object)
+      return false;
+  }
+  return true;
+}
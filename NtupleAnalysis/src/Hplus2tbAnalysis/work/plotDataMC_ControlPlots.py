@@ -204,12 +204,19 @@ def main(opts):
             else:
                 myHistos.append(h)
 
+        # Collect the plots and save them in parallel at the end
+        if opts.nProcesses != 1:
+            plots.beginBatchRendering(nProcesses=opts.nProcesses if opts.nProcesses > 0 else None)
+
         for i, h in enumerate(myHistos, 1):
             # Plot the histograms!
             msg   = "{:<9} {:>3} {:<1} {:<3} {:<50}".format("Histogram", "%i" % i, "/", "%s:" % (len(myHistos)), h)
             Print(ShellStyles.SuccessStyle() + msg + ShellStyles.NormalStyle(), i==1)
 
             DataMCHistograms(datasetsMgr, h)
+
+        if opts.nProcesses != 1:
+            plots.endBatchRendering(report=opts.verbose)
         
     Print("All plots saved under directory %s" % (ShellStyles.NoteStyle() + aux.convertToURL(opts.saveDir, opts.url) + ShellStyles.NormalStyle()), True)    
     return
@@ -831,7 +838,7 @@ def SavePlot(plot, plotName, saveDir, saveFormats = [".C", ".png", ".pdf"]):
         saveNameURL = saveName + ext
         saveNameURL = aux.convertToURL(saveNameURL, opts.url)
         Verbose(saveNameURL, i==0)
-        plot.saveAs(saveName, formats=saveFormats)
+    plot.saveAs(saveName, formats=saveFormats)
     return
 
 #================================================================================================ 
@@ -871,6 +878,7 @@ if __name__ == "__main__":
     RATIO        = False
     HISTOLEVEL   = "Vital" # 'Vital' , 'Informative' , 'Debug' 
     FOLDER       = "ForDataDrivenCtrlPlots" # "topSelectionBDT_" #"ForDataDrivenCtrlPlots" #jetSelection_
+    NPROCESSES   = 1 # 0 for all cores
 
     
     # Define the available script options
@@ -930,6 +938,9 @@ if __name__ == "__main__":
     parser.add_option("--folder", dest="folder", type="string", default = FOLDER,
                       help="ROOT file folder under which all histograms to be plotted are located [default: %s]" % (FOLDER) )
 
+    parser.add_option("-j", "--nProcesses", dest="nProcesses", type=int, default = NPROCESSES,
+                      help="Number of processes for saving the plots (0 for all cores, 1 for saving each plot immediately) [default: %s]" % (NPROCESSES) )
+
     (opts, parseArgs) = parser.parse_args()
 
     # Require at least two arguments (script-name, path to multicrab)
@@ -15,6 +15,22 @@ uncert_missing2loopQCD = 0.02
 uncert_deltab          = 0.03
 uncert_missing_HO_tt   = 0.03
 
+# Grid variables of the database, queried with sorted indexes
+gridVariables = ["mHp", "tanb", "mu", "mA"]
+
+_comparison_re = re.compile("^\s*(?P<lhs>.+?)\s*(?P<op>==|!=|<=|>=|<|>)\s*(?P<rhs>.+?)\s*$")
+_expression_re = re.compile("^[\w\.\*\+\-/\(\) ]+$")
+_identifier_re = re.compile("(?<![\w\.])[A-Za-z_]\w*")
+_number_re     = re.compile("^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+_operators = {"==": numpy.equal, "!=": numpy.not_equal, "<=": numpy.less_equal,
+              ">=": numpy.greater_equal, "<": numpy.less, ">": numpy.greater}
+
+class UnsupportedExpression(Exception):
+    '''
+    Raised for expressions the column store can not evaluate (they are given to TTree::Draw instead)
+    '''
+    pass
+
 class BRXSDatabaseInterface:
     def __init__(self,rootfile, program="FeynHiggs", BRvariable= "BR_tHpb*BR_Hp_taunu", silentStatus=False):
         self.silentStatus = silentStatus
@@ -45,6 +61,9 @@ class BRXSDatabaseInterface:
             self.names.append(branch.GetName())
             self.variableDict[branch.GetName()] = variable
 
+        # Column arrays and sorted grid indexes, per tree name (filled on first use)
+        self._columnStore = {}
+
     def __delete__(self):
         self.close()
 
@@ -379,6 +398,129 @@ class BRXSDatabaseInterface:
                 selection+= "&&"+s
         return selection
 
+    def _getStore(self):
+        name = self.tree.GetName()
+        if name not in self._columnStore:
+            self._columnStore[name] = {"columns": {}, "indexes": {}, "branches": set([b.GetName() for b in self.tree.GetListOfBranches()])}
+        return self._columnStore[name]
+
+    def _column(self,name):
+        '''
+        Returns the values of a branch for all entries as a numpy array (read once per tree)
+        '''
+        store = self._getStore()
+        if name not in store["columns"]:
+            if name not in store["branches"]:
+                raise UnsupportedExpression("Unknown variable %s" % name)
+            n = int(self.tree.GetEntries())
+            self.tree.SetEstimate(n+1)
+            self.tree.Draw(name, "", "goff")
+            values = self.tree.GetV1()
+            if n == 0 or values == None:
+                store["columns"][name] = numpy.zeros(0)
+            else:
+                values.SetSize(n)
+                store["columns"][name] = numpy.frombuffer(values, dtype=numpy.float64, count=n).copy()
+        return store["columns"][name]
+
+    def _index(self,name):
+        '''
+        Returns (entry order, sorted values) of a grid variable
+        '''
+        store = self._getStore()
+        if name not in store["indexes"]:
+            values = self._column(name)
+            order = numpy.argsort(values, kind="mergesort")
+            order = order[~numpy.isnan(values[order])] # NaN never passes a comparison
+            store["indexes"][name] = (order, values[order])
+        return store["indexes"][name]
+
+    def _evaluate(self,expression,rows=None):
+        '''
+        Evaluates an arithmetic expression of branches (e.g. "2*BR_tHpb*BR_Hp_taunu") for the given entries
+        '''
+        expression = expression.strip()
+        if _number_re.match(expression):
+            return float(expression)
+        if not _expression_re.match(expression):
+            raise UnsupportedExpression(expression)
+        namespace = {}
+        for name in _identifier_re.findall(expression):
+            column = self._column(name)
+            if rows is not None:
+                column = column[rows]
+            namespace[name] = column
+        try:
+            return numpy.asarray(eval(expression, {"__builtins__": {}}, namespace), dtype=numpy.float64)
+        except (SyntaxError, NameError, TypeError):
+            raise UnsupportedExpression(expression)
+
+    def _selectRows(self,selection):
+        '''
+        Returns the entry numbers (in increasing order) passing a TTree::Draw style selection
+        of '&&'-separated comparisons. Bounds on grid variables are looked up from the sorted
+        indexes, the remaining comparisons are evaluated only for the entries left.
+        '''
+        terms = []
+        bounds = {}
+        for s in selection.split("&&"):
+            if s.strip() == "":
+                continue
+            if "|" in s or "!" in s.replace("!=", ""):
+                raise UnsupportedExpression(selection)
+            match = _comparison_re.match(s)
+            if not match:
+                raise UnsupportedExpression(selection)
+            lhs = match.group("lhs")
+            op  = match.group("op")
+            rhs = match.group("rhs")
+            if lhs in gridVariables and lhs in self._getStore()["branches"] and _number_re.match(rhs) and op != "!=":
+                low, high = bounds.get(lhs, (None, None))
+                value = float(rhs)
+                if op in ["==", ">", ">="] and (low is None or value > low[0] or (value == low[0] and op == ">")):
+                    low = (value, op == ">")
+                if op in ["==", "<", "<="] and (high is None or value < high[0] or (value == high[0] and op == "<")):
+                    high = (value, op == "<")
+                bounds[lhs] = (low, high)
+            else:
+                terms.append((lhs, op, rhs))
+
+        rows = None
+        for name, (low, high) in bounds.iteritems():
+            order, values = self._index(name)
+            first = 0
+            last = len(values)
+            if low is not None:
+                first = numpy.searchsorted(values, low[0], side="right" if low[1] else "left")
+            if high is not None:
+                last = numpy.searchsorted(values, high[0], side="left" if high[1] else "right")
+            selected = numpy.sort(order[first:max(first, last)])
+            if rows is None:
+                rows = selected
+            else:
+                rows = numpy.intersect1d(rows, selected, assume_unique=True)
+        if rows is None:
+            rows = numpy.arange(int(self.tree.GetEntries()))
+
+        for lhs, op, rhs in terms:
+            if len(rows) == 0:
+                break
+            mask = _operators[op](self._evaluate(lhs, rows), self._evaluate(rhs, rows))
+            if numpy.ndim(mask) == 0:
+                mask = numpy.repeat(bool(mask), len(rows))
+            rows = rows[mask]
+        return rows
+
+    def _getArrays(self,xVariable,yVariable,selection):
+        '''
+        Returns the x and y values of the entries passing the selection, sorted by x
+        '''
+        rows = self._selectRows(self.floatSelection(selection))
+        x = self._evaluate(xVariable, rows) * numpy.ones(len(rows))
+        y = self._evaluate(yVariable, rows) * numpy.ones(len(rows))
+        order = numpy.argsort(x, kind="mergesort")
+        return x[order], y[order]
+
     def get(self,variable1,variable2,selection):
 	if not self.selection == "":
 	    selection = self.selection+"&&"+selection
@@ -387,11 +529,28 @@ class BRXSDatabaseInterface:
     def getOLD(self,variable,selection):
         if not self.selection == "":
             selection = self.selection+"&&"+selection
-	nev = self.tree.GetEntries()
-	for i in range(nev):
-	    self.tree.GetEvent(i)
-	    if self.passed(selection):
-	        return self.getValue(variable)
+        # Vectorised version of looping the entries with self.passed()
+        epsilon = 0.001
+        sele_re = re.compile("(?P<variable>(\S+))==(?P<value>(-*\S+))")
+        rows = numpy.arange(int(self.tree.GetEntries()))
+        for s in selection.split("&&"):
+            match = sele_re.search(s)
+            if not match:
+                continue
+            values = self._evaluate(match.group("variable"), rows)
+            value = float(match.group("value"))
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                if value != 0:
+                    passed = numpy.where(values != 0, numpy.abs((values-value)/values) < epsilon, numpy.abs((values-value)/value) < epsilon)
+                else:
+                    passed = numpy.where(values != 0, numpy.abs((values-value)/values) < epsilon, True)
+            rows = rows[passed]
+        if len(rows) == 0:
+            return None
+        value = 1
+        for v in variable.split("*"):
+            value = value * self._column(v)[rows[0]]
+        return value
     
     def getValue(self,varname):
 	variables = varname.split("*")
@@ -2409,6 +2568,17 @@ class BRXSDatabaseInterface:
             graph.SetPoint(i, mA, tanb)
         
     def getGraph(self,xVariable,yVariable,selection):
+        try:
+            x, y = self._getArrays(xVariable,yVariable,selection)
+        except UnsupportedExpression:
+            return self._getGraphTTree(xVariable,yVariable,selection)
+        if len(x) == 0:
+            raise Exception("Error: could not find graph!")
+        graph = ROOT.TGraph(len(x),array("d",x),array("d",y))
+        graph.SetName("Graph")
+        return graph
+
+    def _getGraphTTree(self,xVariable,yVariable,selection):
         graph = ROOT.TGraph()
         #print "check getGraph",xVariable,yVariable,selection,self.floatSelection(selection)
         self.tree.Draw(yVariable+":"+xVariable,self.floatSelection(selection))
@@ -2509,18 +2679,23 @@ class BRXSDatabaseInterface:
         if not self.selection == "" and not selection == "":
             selection = self.selection+"&&"+selection
         values = []
-####        graph = self.getGraph("tanb",variable,self.floatSelection(selection))
+        xVariable = "tanb"
         if variable == "tanb":
-####            graph = self.getGraph("mHp",variable,selection)
-            graph = self.getGraph("mHp",variable,self.floatSelection(selection))
-        else:
-            graph = self.getGraph("tanb",variable,self.floatSelection(selection))
-        #print "check getValues N",graph.GetN()
-        for i in range(0,graph.GetN()):
-            value = graph.GetY()[i]
+            xVariable = "mHp"
+        try:
+            x, y = self._getArrays(xVariable,variable,selection)
+            if len(x) == 0:
+                raise Exception("Error: could not find graph!")
+            y = y.tolist()
+        except UnsupportedExpression:
+            graph = self._getGraphTTree(xVariable,variable,self.floatSelection(selection))
+            y = [graph.GetY()[i] for i in range(0,graph.GetN())]
+        seen = set()
+        for value in y:
             if roundValues >= 0:
                 value = round(value,roundValues)
-            if not value in values:
+            if not value in seen:
+                seen.add(value)
                 values.append(value)
         if sort or variable == "tanb":
             return sorted(values)
@@ -2542,9 +2717,10 @@ class BRXSDatabaseInterface:
     def getMinimum(self,variable,selection):
         min = 9999.
 #        print "check getMinimum",variable,selection,self.getValues(variable,selection,roundValues=-1)
-        for v in self.getValues(variable,selection,roundValues=-1):
-            if v < min and v > 0:
-                min = v
+        values = numpy.array(self.getValues(variable,selection,roundValues=-1))
+        values = values[(values > 0) & (values < min)]
+        if len(values) > 0:
+            min = values.min()
         return min
 
     def getMinimumTanb(self,variable,selection):
@@ -2645,9 +2821,10 @@ class BRXSDatabaseInterface:
     def getMaximum(self,variable,selection):
         max = -9999.
 #        print "check getMaximum",len(self.getValues(variable,selection,roundValues=-1)),variable,selection,self.getValues(variable,selection,roundValues=-1)
-        for v in self.getValues(variable,selection,roundValues=-1):
-            if v > max:
-                max = v
+        values = numpy.array(self.getValues(variable,selection,roundValues=-1))
+        values = values[values > max]
+        if len(values) > 0:
+            max = values.max()
         return max
 
     def getMinTanbInterpolation(self,xvariable,xvalue,yvariable,selection):
@@ -1,3 +1,5 @@
+import bisect
+
 from FeynHiggsBRdata import *
 
 def getBR_top2bHp(mHp,tanb,mu):
@@ -16,42 +18,44 @@ def interpolate(mHp,tanb,mu):
     return linearInterpolation(mHp,tanb,mu)
 
 def lowerTanBPoint(mHp,tanbRef,mu):
-    returnTanb = 0
-    for tanb in hplusBranchingRatio[mHp].keys():
-	if tanb == tanbRef:
-	    return tanb
-        if tanb > tanbRef: 
-	    return returnTanb
-	returnTanb = tanb
-    return 0
+    tanbs = brTable.getTanbs()
+    i = bisect.bisect_right(tanbs, tanbRef)
+    if i == 0 or i == len(tanbs) and tanbs[-1] != tanbRef:
+        return 0
+    return tanbs[i-1]
 
 def higherTanBPoint(mHp,tanbRef,mu):
-    if tanbRef < hplusBranchingRatio[mHp].keys()[0]:
-	return 0
-    for tanb in hplusBranchingRatio[mHp].keys():
-        if tanb >= tanbRef:
-            return tanb
-    return 0
+    tanbs = brTable.getTanbs()
+    i = bisect.bisect_left(tanbs, tanbRef)
+    if tanbRef < tanbs[0] or i == len(tanbs):
+        return 0
+    return tanbs[i]
 
 def linearInterpolation(mHp,tanb,mu):
-    tanb1 = lowerTanBPoint(mHp,tanb,mu)
-    tanb2 = higherTanBPoint(mHp,tanb,mu)
-
-    if (tanb1 == 0 or tanb2 == 0 or tanb1 > int(tanb) or tanb2 < int(tanb)) :
-	return BranchingRatio(0,0,0)
-
-    fraction = 1
-    if tanb1 < tanb2:
-        fraction = (tanb - tanb1)/(tanb2 - tanb1)
-
-    point1 = hplusBranchingRatio[mHp][tanb1][mu]
-    point2 = hplusBranchingRatio[mHp][tanb2][mu]
-
-    newBRt2bH    = point1.BRt2bH + (point2.BRt2bH - point1.BRt2bH)*fraction
-    newBRH2taunu = point1.BRH2taunu + (point2.BRH2taunu - point1.BRH2taunu)*fraction
-    newmA        = point1.mA + (point2.mA - point1.mA)*fraction
-
-    return BranchingRatio(newBRt2bH,newBRH2taunu,newmA)
+    iMass = brTable.massIndex(mHp)
+    iMu = brTable.muIndex(mu)
+    tanbs = brTable.getTanbs()
+    if tanb < tanbs[0] or tanb > tanbs[-1]:
+        return BranchingRatio(0,0,0)
+
+    i2 = bisect.bisect_left(tanbs, tanb)
+    point2 = brTable.getValues(iMass, i2, iMu)
+    if tanbs[i2] == tanb:
+        return BranchingRatio(*point2)
+    point1 = brTable.getValues(iMass, i2-1, iMu)
+    fraction = (tanb - tanbs[i2-1])/(tanbs[i2] - tanbs[i2-1])
+
+    return BranchingRatio(*[p1 + (p2 - p1)*fraction for p1, p2 in zip(point1, point2)])
+
+def interpolateArrays(mHp,tanbs,mu):
+    '''
+    Vectorised linearInterpolation() over an array of tanb values (needs numpy).
+    Returns the arrays (BRt2bH, BRH2taunu, mA), zero outside of the tanb range.
+    '''
+    import numpy
+    points = brTable.getArray()[brTable.massIndex(mHp), :, brTable.muIndex(mu), :]
+    tanbs = numpy.asarray(tanbs, dtype=float)
+    return tuple(numpy.interp(tanbs, brTable.getTanbs(), points[:, i], left=0, right=0) for i in xrange(3))
 
 def getTanb(mHp,mu,targetBRt2bH):
     tanb = 20 # initial guess
@@ -32,6 +32,7 @@ import random
 import shutil
 import tarfile
 import subprocess
+from multiprocessing.pool import ThreadPool
 
 import HiggsAnalysis.NtupleAnalysis.tools.multicrab as multicrab
 import HiggsAnalysis.NtupleAnalysis.tools.ShellStyles as ShellStyles
@@ -441,6 +442,18 @@ class MultiCrabCombine(commonLimitTools.LimitMultiCrabBase):
 
         
 
+        # Run the job scripts of all mass points concurrently, if requested
+
+        errors = {}
+
+        jobs = getattr(self.opts, "jobs", 1)
+
+        if jobs > 1 and len(self.massPoints) > 1:
+
+            errors = self._runScriptsInParallel(jobs)
+
+
+
         # For-loop: All mass points to run combine on
 
         for counter, mass in enumerate(self.massPoints, 1):
@@ -451,6 +464,14 @@ class MultiCrabCombine(commonLimitTools.LimitMultiCrabBase):
 
 
 
+            if mass in errors:
+
+                msg = "Combine failed for mass point %s, skipping ...\n\t%s" % (mass, errors[mass])
+
+                Print(ShellStyles.ErrorStyle() + msg + ShellStyles.NormalStyle(), True)
+
+                continue
+
             myResult = self.clsType.runCombine(mass)
 
             if myResult.failed:
@@ -497,6 +518,40 @@ class MultiCrabCombine(commonLimitTools.LimitMultiCrabBase):
 
 
 
+    def _runScriptsInParallel(self, jobs):
+        '''
+        Run the job scripts of all mass points with a pool of threads, one mass point
+        per thread (the scripts of a mass point are run in order). The threads only wait
+        for the combine subprocesses, the results are read afterwards in mass order.
+
+        \param jobs   Maximum number of mass points to run at the same time
+
+        \return dictionary of mass point -> error message for the mass points whose scripts failed
+        '''
+        def runScripts(mass):
+            try:
+                self.clsType.runScripts(mass)
+            except Exception, e:
+                return (mass, str(e))
+            return (mass, None)
+
+        self.clsType.finishedScripts.clear()
+        nThreads = min(jobs, len(self.massPoints))
+        Print("Running combine for %d mass points with %d parallel jobs" % (len(self.massPoints), nThreads), True)
+        errors = {}
+        pool = ThreadPool(nThreads)
+        for counter, (mass, error) in enumerate(pool.imap_unordered(runScripts, self.massPoints), 1):
+            if error is not None:
+                errors[mass] = error
+                status = ShellStyles.ErrorStyle() + "failed" + ShellStyles.NormalStyle()
+            else:
+                status = "done"
+            Print("Mass point %s %s (%d/%d)" % (mass, status, counter, len(self.massPoints)), False)
+        pool.close()
+        pool.join()
+        return errors
+
+
     def getResults(self):
 
         '''
@@ -685,6 +740,10 @@ class LHCTypeAsymptotic:
 
         self.signalInjectionScripts = {}
 
+        self.mlfitReadCommands      = {}
+
+        self.finishedScripts        = set()
+
 
 
         self.configuration = {}
@@ -1019,7 +1078,17 @@ class LHCTypeAsymptotic:
 
         command.append("python %s/src/HiggsAnalysis/CombinedLimit/test/diffNuisances.py %s %s/mlfit.root > %s/diffNuisances_largest_constraints.txt" % (os.environ["CMSSW_BASE"], opts2, outputdir, outputdir))
 
-        command.append("combineReadMLFit.py -f %s/diffNuisances.txt -c configuration.json -m %s -o mlfit.json" % (outputdir, mass))
+        readMLFit = "combineReadMLFit.py -f %s/diffNuisances.txt -c configuration.json -m %s -o mlfit.json" % (outputdir, mass)
+
+        if getattr(self.opts, "jobs", 1) > 1:
+
+            # The mass points run concurrently, mlfit.json is updated by _runMLFit() in the main thread
+
+            self.mlfitReadCommands[mass] = readMLFit
+
+        else:
+
+            command.append(readMLFit)
 
         opts3 = ""
 
@@ -1385,11 +1454,13 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
-    def _run(self, script, outputFile, errorFile):
+    def _run(self, script, outputFile, errorFile=None):
 
         '''
 
-        Helper method to run a script
+        Helper method to run a script in the multicrab directory (the working directory is
+
+        set only for the subprocess, so that scripts can be run from several threads)
 
         
 
@@ -1401,7 +1472,7 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
-        \param errorFiel   Path to a file to store the script stderr
+        \param errorFile   Path to a file to store the script stderr (None for stdout)
 
         
 
@@ -1409,23 +1480,27 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         '''
 
-        pwd = os.getcwd()
+        cmdList  = ["./" + script]
 
-        os.chdir(self.dirname)
+        outFile  = os.path.join(self.dirname, outputFile)
 
-        msg = "Changing directory to \"%s\". Current working directory is:\n\t\"%s\"" % (self.dirname, os.getcwd())
+        fileMode = "wb"
 
-        Verbose(msg, True)
 
 
+        if script in self.finishedScripts:
 
-        cmdList  = ["./" + script]
+            # Already run by runScripts(), only read the output
 
-        outFile  = os.path.join(os.getcwd(), outputFile)   
+            self.finishedScripts.discard(script)
 
-        errFile  = os.path.join(os.getcwd(), errorFile)
+            f = open(outFile)
 
-        fileMode = "wb"
+            output = f.read()
+
+            f.close()
+
+            return output
 
 
 
@@ -1433,15 +1508,23 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
         Verbose("Opening file \"%s\" in mode \"%s\"" % (outFile, fileMode), True)
 
-        with open(outFile, fileMode) as out, open(errFile, fileMode) as err:
+        with open(outFile, fileMode) as out:
 
-            Verbose("Executing command \"%s\"" % (" ".join(cmdList)), True)
+            err = subprocess.STDOUT
 
-            p = subprocess.Popen(cmdList, stdout=out, stderr=err)
+            if errorFile is not None:
 
-            output = p.communicate()[0]
+                err = open(os.path.join(self.dirname, errorFile), fileMode)
 
-            Verbose("Subprocess returned \"%s\"" % (output), True)
+            Verbose("Executing command \"%s\" in \"%s\"" % (" ".join(cmdList), self.dirname), True)
+
+            p = subprocess.Popen(cmdList, stdout=out, stderr=err, cwd=self.dirname)
+
+            p.wait()
+
+            if errorFile is not None:
+
+                err.close()
 
 
 
@@ -1453,25 +1536,65 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
 
 
-        os.chdir(pwd)
+        f = open(outFile)
 
-        msg = "Changed directory to \"%s\". Current working directory is:\n\t\"%s\"" % (pwd, os.getcwd())
+        output = f.read()
 
-        Verbose(msg, True)
+        f.close()
 
+        return output
 
 
-        if 0:
 
-            f = open(outFile, fileMode)
 
-            f.write(output)
 
-            f.write("\n")
+    def runScripts(self, mass):
 
-            f.close()
+        '''
 
-        return output
+        Run the job scripts (limit, ML fit, significance) of a single mass point, one after another
+
+        
+
+        The scripts only write files specific to the mass point, so that several mass points
+
+        can be run concurrently (see MultiCrabCombine.runCombineForAsymptotic()). The results
+
+        are read afterwards with runCombine(), which does not run the finished scripts again.
+
+        
+
+        \param mass   String for the mass point
+
+        '''
+
+        scripts = []
+
+        if self.opts.limit:
+
+            if self.opts.unblinded:
+
+                scripts.append((self.obsAndExpScripts[mass], "obsAndExp_m%s_stdout.txt" % mass, "obsAndExp_m%s_stderr.txt" % mass))
+
+            else:
+
+                scripts.append((self.blindedScripts[mass], "blinded_m%s_stdout.txt" % mass, "blinded_m%s_stderr.txt" % mass))
+
+        if mass in self.mlfitScripts.keys() and not self.opts.nomlfit:
+
+            scripts.append((self.mlfitScripts[mass], "mlfit_m_%s_output.txt" % mass, None))
+
+        if mass in self.significanceScripts:
+
+            scripts.append((self.significanceScripts[mass], "signif_m_%s_output.txt" % mass, None))
+
+        for script, outputFile, errorFile in scripts:
+
+            self._run(script, outputFile, errorFile)
+
+            self.finishedScripts.add(script)
+
+        return
 
 
 
@@ -1625,6 +1748,14 @@ hadd higgsCombineinj_m{MASS}.Asymptotic.mH{MASS}.root higgsCombineinj_m{MASS}.As
 
             self._run(script, "mlfit_m_%s_output.txt" % mass)
 
+            if mass in self.mlfitReadCommands:
+
+                # Run in the main thread after the job scripts, as all mass points write the same mlfit.json
+
+                with open(os.path.join(self.dirname, "mlfit_m_%s_output.txt" % mass), "ab") as out:
+
+                    subprocess.call(self.mlfitReadCommands[mass], shell=True, stdout=out, stderr=subprocess.STDOUT, cwd=self.dirname)
+
         return
 
 
@@ -290,6 +290,8 @@ def createOptionParser(lepDefault=None, lhcDefault=None, lhcasyDefault=None, ful
                       help="Disable ML fit")
     parser.add_option("--nolimit", dest="limit", action="store_false", default=True,
                       help="Disable limit calculation (for e.g. just ML fit or significance)")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Number of mass points to run in parallel for the asymptotic limits (default 1)")
     parser.add_option("--rmin", dest="rmin", action="store", default=None,
                       help="minimum r parameter for finding limit")
     parser.add_option("--rmax", dest="rmax", action="store", default=None,
@@ -7,12 +7,14 @@ import os
 import sys
 import cProfile
 import json
+import multiprocessing
 
 import HiggsAnalysis.NtupleAnalysis.tools.dataset as dataset
 import HiggsAnalysis.NtupleAnalysis.tools.counter as counter
 import HiggsAnalysis.NtupleAnalysis.tools.plots as plots
 
 import HiggsAnalysis.LimitCalc.DatacardColumn as DatacardColumn
+import HiggsAnalysis.LimitCalc.DataMiningCache as DataMiningCache
 import HiggsAnalysis.LimitCalc.Extractor as Extractor
 import HiggsAnalysis.LimitCalc.TableProducer as TableProducer
 import HiggsAnalysis.NtupleAnalysis.tools.ShellStyles as ShellStyles
@@ -24,6 +26,46 @@ import HiggsAnalysis.LimitCalc.MulticrabPathFinder as PathFinder
 import ROOT
 import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
 
+# DataCardGenerator whose columns are mined by the worker processes (inherited when the pool is forked)
+_miningGenerator = None
+# DatasetMgrCreatorManager of a worker process, see _initDataMiningWorker()
+_workerDsetMgrManager = None
+
+def _initDataMiningWorker():
+    '''
+    Opens the dataset managers of a data mining worker process
+
+    The ROOT files inherited from the main process are closed first, since
+    the worker would share their file offsets with the main process. The
+    dataset managers are then created (reopening the files) as in
+    DataCardGenerator.doDatacard().
+    '''
+    global _workerDsetMgrManager
+    myCreators = _miningGenerator._dsetMgrManager._dsetMgrCreators
+    for d in myCreators:
+        if d != None:
+            d.close()
+    (era, searchMode, optimizationMode) = _miningGenerator._dataMiningModule
+    _workerDsetMgrManager = DatasetMgrCreatorManager(_miningGenerator._opts, _miningGenerator._config, *myCreators)
+    _workerDsetMgrManager.obtainDatasetMgrs(era, searchMode, optimizationMode)
+    _workerDsetMgrManager.cacheMainCounterTables()
+    return
+
+def _mineColumn(index):
+    '''
+    Does the data mining of a column in a worker process and returns the pickled results
+    '''
+    gen = _miningGenerator
+    c = gen._columns[index]
+    dsetMgrIndex = gen._getDsetMgrIndexForColumnType(c)
+    c.doDataMining(gen._config,
+                   _workerDsetMgrManager.getDatasetMgr(dsetMgrIndex),
+                   _workerDsetMgrManager.getLuminosity(dsetMgrIndex),
+                   _workerDsetMgrManager.getMainCounterTable(dsetMgrIndex),
+                   gen._extractors,
+                   gen._controlPlotExtractors)
+    return c.getDataMiningResults()
+
 #================================================================================================
 # Class definition
 #================================================================================================
@@ -221,6 +263,14 @@ class DatasetMgrCreatorManager:
             raise Exception(ShellStyles.ErrorStyle() + msg + ShellStyles.NormalStyle())
         return self._dsetMgrs[i]
 
+    def getDatasetMgrCreator(self, i):
+        '''
+        Returns datasetMgrCreator object, index must conform to DatacardDatasetMgrSourceType.
+
+        Note: can return also a None object
+        '''
+        return self._dsetMgrCreators[i]
+
     def getDatasetMgrLabel(self, i):
         ''' 
         WARNING! This is dangerous! FIXME! santeri
@@ -343,6 +393,7 @@ class DataCardGenerator:
         self._columns = [] # Datacard column
         self._extractors = [] # Extractor objects
         self._controlPlotExtractors = [] # Control plot extractors
+        self._dataMiningModule = None # (era, searchMode, optimizationMode) of the data mining
         self._checkInputDatacard()
         self._outputPrefix = self._getBasicOutputPrefix()
         return
@@ -456,6 +507,7 @@ class DataCardGenerator:
 
         self.Verbose("Get dataset managers for the era / searchMode / optimizationMode combination")
         self._dsetMgrManager.obtainDatasetMgrs(era, searchMode, optimizationMode, self.verbose)
+        self._dataMiningModule = (era, searchMode, optimizationMode)
 
         self.Verbose("Create columns (dataset groups)")
         self.createDatacardColumns()
@@ -725,30 +777,136 @@ class DataCardGenerator:
         '''
         self.Verbose("Starting data mining")
 
-        if self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS) != None:
-            # Handle observation separately
-            myDsetMgr    = self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
-            myLuminosity = self._dsetMgrManager.getLuminosity(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
+        # The observation is mined only if the signal analysis is enabled
+        myMineObservation = self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS) != None
+        myColumnIndices = range(len(self._columns))
+
+        # Optionally, take the results of the columns with unchanged inputs from the data mining cache
+        myCache = self._getDataMiningCache()
+        myCacheKeys = {}
+        if myCache != None:
+            if myMineObservation:
+                myMineObservation = not self._setCachedDataMiningResults(myCache, self._observation, myCacheKeys)
+            myColumnIndices = [i for i in myColumnIndices if not self._setCachedDataMiningResults(myCache, self._columns[i], myCacheKeys)]
+            msg = "Data mining results of %d columns are taken from cache, %d columns will be mined" % (len(self._columns)-len(myColumnIndices), len(myColumnIndices))
+            self.Print(ShellStyles.NoteStyle() + msg + ShellStyles.NormalStyle(), True)
+
+        # Optionally, mine the columns in worker processes
+        nProcesses = getattr(self._opts, "nProcesses", 1)
+        if nProcesses == 0:
+            nProcesses = multiprocessing.cpu_count()
+        if nProcesses > 1 and len(myColumnIndices) > 1:
+            self._doDataMiningInPool(myColumnIndices, min(nProcesses, len(myColumnIndices)), myMineObservation)
+        else:
+            if myMineObservation:
+                self._doDataMiningForObservation()
 
-            myMainCounterTable = self._dsetMgrManager.getMainCounterTable(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
-            self._observation.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+            # For-loop: All columns
+            for i, index in enumerate(myColumnIndices, 1):
+                c = self._columns[index]
+                self.Verbose("Performing data-mining for column \"%s\"" % (c.getLabel()), i==1)
 
-        # For-loop: All columns
-        for i, c in enumerate(self._columns, 1):
-            self.Verbose("Performing data-mining for column \"%s\"" % (c.getLabel()), i==1)
+                # Determine dset manager index for the given column
+                dsetMgrIndex = self._getDsetMgrIndexForColumnType(c)
 
-            # Determine dset manager index for the given column
-            dsetMgrIndex = self._getDsetMgrIndexForColumnType(c)
+                # Do mining for datacard columns (separately for data-driven bkgs)
+                myDsetMgr          = self._dsetMgrManager.getDatasetMgr(dsetMgrIndex)
+                myLuminosity       = self._dsetMgrManager.getLuminosity(dsetMgrIndex)
+                myMainCounterTable = self._dsetMgrManager.getMainCounterTable(dsetMgrIndex)
+                c.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
 
-            # Do mining for datacard columns (separately for data-driven bkgs)
-            myDsetMgr          = self._dsetMgrManager.getDatasetMgr(dsetMgrIndex)
-            myLuminosity       = self._dsetMgrManager.getLuminosity(dsetMgrIndex)
-            myMainCounterTable = self._dsetMgrManager.getMainCounterTable(dsetMgrIndex)
-            c.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+        # Store the results of the mined columns to the cache
+        for c, key in myCacheKeys.iteritems():
+            myCache.put(key, c.getDataMiningResults())
 
         self.Verbose("Data mining has been finished, results (and histograms) have been ingeniously cached")
         return
 
+    def _doDataMiningForObservation(self):
+        '''
+        Do data mining for the observation column
+        '''
+        myDsetMgr          = self._dsetMgrManager.getDatasetMgr(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
+        myLuminosity       = self._dsetMgrManager.getLuminosity(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
+        myMainCounterTable = self._dsetMgrManager.getMainCounterTable(DatacardDatasetMgrSourceType.SIGNALANALYSIS)
+        self._observation.doDataMining(self._config, myDsetMgr, myLuminosity, myMainCounterTable, self._extractors, self._controlPlotExtractors)
+        return
+
+    def _doDataMiningInPool(self, columnIndices, nProcesses, mineObservation):
+        '''
+        Do data mining of the columns in a pool of worker processes
+
+        Each worker opens its own dataset managers and returns the results
+        of a column in a pickled form. The observation is mined in the main
+        process meanwhile. The results are set to the columns in the order
+        of the columns, so the rest of the datacard production is unchanged.
+        '''
+        global _miningGenerator
+        _miningGenerator = self
+        pool = multiprocessing.Pool(nProcesses, _initDataMiningWorker)
+        myResults = [pool.apply_async(_mineColumn, (index,)) for index in columnIndices]
+        pool.close()
+        self.Print("Submitted data mining of %d columns to %d processes" % (len(columnIndices), nProcesses), True)
+
+        try:
+            if mineObservation:
+                self._doDataMiningForObservation()
+
+            # For-loop: All mined columns
+            for i, (index, r) in enumerate(zip(columnIndices, myResults), 1):
+                c = self._columns[index]
+                self.Verbose("Collecting data-mining results for column \"%s\"" % (c.getLabel()), i==1)
+                c.setDataMiningResults(r.get())
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _miningGenerator = None
+        return
+
+    def _getDataMiningCache(self):
+        '''
+        Returns the data mining cache (in the input directory of the datacard), or None if it is not enabled
+        '''
+        if not getattr(self._opts, "miningCache", False):
+            return None
+        return DataMiningCache.DataMiningCache(os.path.join(self._config.Path, DataMiningCache.cacheDirName))
+
+    def _setCachedDataMiningResults(self, cache, column, cacheKeys):
+        '''
+        Sets the data mining results of a column from the cache
+
+        Returns True if the results were found. Otherwise the key of the
+        column is stored to cacheKeys for storing the results after mining.
+        '''
+        dsetMgrIndex = self._getDsetMgrIndexForColumnType(column)
+        myCreator    = self._dsetMgrManager.getDatasetMgrCreator(dsetMgrIndex)
+        myFileNames  = []
+        if myCreator != None:
+            myFileNames = myCreator.getFileNames()
+        myExtractors = [e for e in self._extractors if e.getId() in column.getNuisanceIds()]
+        myControlPlotExtractors = []
+        if self._config.OptionDoControlPlots:
+            myControlPlotExtractors = self._controlPlotExtractors
+        key = cache.getKey(myFileNames,
+                           self._dataMiningModule,
+                           dsetMgrIndex,
+                           self._dsetMgrManager.getLuminosity(dsetMgrIndex),
+                           column,
+                           myExtractors,
+                           myControlPlotExtractors,
+                           DataMiningCache.getConfigOptions(self._config))
+        if key == None:
+            return False
+        data = cache.get(key)
+        if data == None:
+            cacheKeys[column] = key
+            return False
+        self.Verbose("Taking data-mining results for column \"%s\" from cache" % (column.getLabel()), True)
+        column.setDataMiningResults(data)
+        return True
+
     def separateMCEWKTausAndFakes(self, targetColumn, targetColumnNewName, addColumnList, subtractColumnList):
         # Obtain column for embedding
         myEmbColumn = None
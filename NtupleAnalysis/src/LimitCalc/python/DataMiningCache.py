@@ -0,0 +1,270 @@
+'''
+DESCRIPTION:
+Cache of the data mining results of datacard columns
+
+Each entry holds the results of DatacardColumn.doDataMining() (in the
+form of DatacardColumn.getDataMiningResults()) for one column. It is keyed
+by a content hash of everything the mining of the column depends on: the
+sizes and modification times of the multicrab ROOT files, the column
+definition, the relevant config options, the settings of the extractors
+of the column and the source code of the mining modules. When the config
+changes only the columns whose inputs changed need to be mined again.
+
+USAGE:
+Imported by other python files (HiggsAnalysis/NtupleAnalysis/src/LimitCalc/python/DataCardGenerator.py)
+
+'''
+
+#================================================================================================
+# Import modules
+#================================================================================================
+import os
+import json
+import types
+import hashlib
+import functools
+
+import HiggsAnalysis.NtupleAnalysis.tools.dataset as dataset
+import HiggsAnalysis.NtupleAnalysis.tools.systematics as systematics
+import HiggsAnalysis.LimitCalc.DatacardColumn as DatacardColumn
+import HiggsAnalysis.LimitCalc.Extractor as Extractor
+
+# Name of the cache directory (in the input directory of the datacard)
+cacheDirName = "dataMiningCache"
+
+# Version of the cache entries
+_cacheVersion = 2
+
+# Modules whose source code affects the data mining results
+_sourceModules = [DatacardColumn, Extractor, dataset, systematics]
+
+# Attributes not describing the settings of an object
+_ignoredAttributes = ["_opts", "_verbose"]
+
+# Hash of the source code of _sourceModules, see _getSourceHash()
+_sourceHash = None
+
+def _getSourceHash():
+    '''
+    Returns the hash of the source code of the modules doing the data mining
+    '''
+    global _sourceHash
+    if _sourceHash is None:
+        h = hashlib.sha1()
+        for m in _sourceModules:
+            name = m.__file__
+            if name.endswith(".pyc"):
+                name = name[:-1]
+            f = open(name, "rb")
+            h.update(f.read())
+            f.close()
+        _sourceHash = h.hexdigest()
+    return _sourceHash
+
+def _fileStamp(fileName):
+    '''
+    Returns [name, size, mtime] of a local file, or only the name for remote files (e.g. root://)
+    '''
+    if not os.path.exists(fileName):
+        return [fileName]
+    st = os.stat(fileName)
+    return [os.path.abspath(fileName), st.st_size, int(st.st_mtime)]
+
+class _Uncacheable(Exception):
+    '''
+    Raised by describe() for an object without a description independent of its memory address
+    '''
+    pass
+
+def _describeCode(code):
+    '''
+    Describes a code object by its bytecode, constants and referenced names
+    '''
+    consts = []
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            consts.append(_describeCode(c))
+        else:
+            consts.append(describe(c))
+    return {"bytecode": hashlib.sha1(code.co_code).hexdigest(), "consts": consts, "names": list(code.co_names)}
+
+def _describeFunction(func):
+    '''
+    Describes a function (also a lambda) by its code, default arguments and closure
+    '''
+    closure = []
+    for cell in func.__closure__ or ():
+        try:
+            closure.append(describe(cell.cell_contents))
+        except ValueError: # empty cell
+            closure.append(None)
+    return {"function": func.__name__,
+            "code": _describeCode(func.__code__),
+            "defaults": describe(func.__defaults__ or ()),
+            "closure": closure}
+
+def describe(obj):
+    '''
+    Converts an object to a JSON-serializable description of its contents
+
+    Objects are described by their class and attributes, and functions by
+    their code, so that the description does not depend on memory
+    addresses. An object can give its description explicitly with a
+    getCacheKey() method. Raises _Uncacheable if no such description
+    can be made.
+    '''
+    if obj is None or isinstance(obj, (bool, int, long, float, basestring)):
+        return obj
+    if isinstance(obj, dict):
+        return dict([(str(k), describe(v)) for k, v in obj.iteritems()])
+    if isinstance(obj, (list, tuple)):
+        return [describe(v) for v in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted([describe(v) for v in obj])
+    if isinstance(obj, (type, types.ClassType)):
+        return {"type": "%s.%s" % (obj.__module__, obj.__name__)}
+    if hasattr(obj, "getCacheKey") and not isinstance(obj, types.ModuleType):
+        return {"class": obj.__class__.__name__, "key": describe(obj.getCacheKey())}
+    if isinstance(obj, types.FunctionType):
+        return _describeFunction(obj)
+    if isinstance(obj, types.MethodType):
+        return {"method": describe(obj.im_func), "self": describe(obj.im_self)}
+    if isinstance(obj, types.BuiltinFunctionType):
+        return {"builtin": "%s.%s" % (obj.__module__, obj.__name__)}
+    if isinstance(obj, functools.partial):
+        return {"partial": describe(obj.func), "args": describe(obj.args), "keywords": describe(obj.keywords or {})}
+    if isinstance(obj, types.ModuleType):
+        return {"module": obj.__name__}
+    if hasattr(obj, "__dict__"):
+        attrs = dict([(k, v) for k, v in vars(obj).iteritems() if k not in _ignoredAttributes])
+        return {"class": obj.__class__.__name__, "attributes": describe(attrs)}
+    r = repr(obj)
+    if " at 0x" in r:
+        raise _Uncacheable(r)
+    return r
+
+def getConfigOptions(config):
+    '''
+    Returns the Option* entries of the datacard config
+    '''
+    return dict([(k, getattr(config, k)) for k in dir(config) if k.startswith("Option")])
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class DataMiningCache:
+    '''
+    Data mining results of datacard columns, one file per entry in a directory
+
+    If the cache directory cannot be written the results are not cached.
+    '''
+    def __init__(self, directory):
+        self._directory = directory
+
+    def getKey(self, fileNames, *inputs):
+        '''
+        Returns the key of the results mined from the files with the given inputs (described with describe()),
+        or None if the inputs can not be described (the results are then not cached)
+        '''
+        try:
+            data = [_cacheVersion, _getSourceHash(), [_fileStamp(f) for f in fileNames], describe(inputs)]
+        except _Uncacheable, e:
+            print "Not caching the data mining results, no description for %s (define getCacheKey())" % str(e)
+            return None
+        return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+    def _fileName(self, key):
+        return os.path.join(self._directory, key+".pkl")
+
+    def get(self, key):
+        '''
+        Returns the cached results, or None if there are none with this key
+        '''
+        name = self._fileName(key)
+        if not os.path.exists(name):
+            return None
+        f = open(name, "rb")
+        data = f.read()
+        f.close()
+        return data
+
+    def put(self, key, data):
+        '''
+        Stores the results with a key
+        '''
+        tmpName = self._fileName(key)+".tmp%d" % os.getpid()
+        try:
+            if not os.path.exists(self._directory):
+                os.makedirs(self._directory)
+            f = open(tmpName, "wb")
+            f.write(data)
+            f.close()
+            os.rename(tmpName, self._fileName(key))
+        except (IOError, OSError), e:
+            print "Unable to write data mining cache %s: %s" % (self._directory, str(e))
+        return
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+    import shutil
+
+    class Scaler:
+        def __init__(self, factor):
+            self._factor = factor
+        def __call__(self, value):
+            return value*self._factor
+
+    class Slotted(object):
+        __slots__ = ["value"]
+        def __call__(self):
+            return self.value
+
+    class Keyed(Slotted):
+        __slots__ = []
+        def getCacheKey(self):
+            return ["slotted", 1]
+
+    class TestDescribe(unittest.TestCase):
+        def testLambdas(self):
+            self.assertEqual(describe(lambda x: x*2), describe(lambda x: x*2))
+            self.assertNotEqual(describe(lambda x: x*2), describe(lambda x: x*3))
+            self.assertNotEqual(describe(lambda x: x*2), describe(lambda x: x+2))
+            self.assertNotEqual(describe(lambda x: x*2), describe(lambda y=1: y*2))
+
+        def testClosure(self):
+            def makeFunction(factor):
+                return lambda x: x*factor
+            self.assertEqual(describe(makeFunction(2)), describe(makeFunction(2)))
+            self.assertNotEqual(describe(makeFunction(2)), describe(makeFunction(3)))
+
+        def testCallableInstances(self):
+            self.assertEqual(describe(Scaler(2)), describe(Scaler(2)))
+            self.assertNotEqual(describe(Scaler(2)), describe(Scaler(3)))
+            self.assertEqual(describe(Scaler(2).__call__), describe(Scaler(2).__call__))
+            self.assertNotEqual(describe(Scaler(2).__call__), describe(Scaler(3).__call__))
+            self.assertRaises(_Uncacheable, describe, Slotted())
+            self.assertEqual(describe(Keyed()), {"class": "Keyed", "key": ["slotted", 1]})
+
+    class TestDataMiningCache(unittest.TestCase):
+        def setUp(self):
+            self._dir = tempfile.mkdtemp()
+            self._cache = DataMiningCache(self._dir)
+
+        def tearDown(self):
+            shutil.rmtree(self._dir)
+
+        def testKey(self):
+            key = self._cache.getKey([], "column", lambda x: x*2)
+            self.assertEqual(key, self._cache.getKey([], "column", lambda x: x*2))
+            self.assertNotEqual(key, self._cache.getKey([], "column", lambda x: x*3))
+            self.assertNotEqual(key, self._cache.getKey([], "other", lambda x: x*2))
+            self.assertEqual(self._cache.getKey([], "column", Slotted()), None)
+
+        def testPutGet(self):
+            key = self._cache.getKey([], "column")
+            self.assertEqual(self._cache.get(key), None)
+            self._cache.put(key, "results")
+            self.assertEqual(self._cache.get(key), "results")
+
+    unittest.main()
@@ -12,6 +12,7 @@ Imported by other python files (HiggsAnalysis/NtupleAnalysis/src/LimitCalc/pytho
 #================================================================================================
 import os
 import sys
+import cPickle
 import ROOT
 import HiggsAnalysis.NtupleAnalysis.tools.dataset as dataset
 from HiggsAnalysis.LimitCalc.MulticrabPathFinder import MulticrabDirectoryDataType
@@ -27,6 +28,9 @@ from array import array
 
 _fineBinningSuffix = "_fineBinning"
 
+# Attributes of DatacardColumn filled by doDataMining()
+_dataMiningResultAttributes = ["_rateResult", "_nuisanceResults", "_controlPlots", "_cachedShapeRootHistogramWithUncertainties", "_purityForFinalShape"]
+
 #================================================================================================
 # Class definition
 #================================================================================================
@@ -433,6 +437,32 @@ class DatacardColumn():
         '''
         return self._cachedShapeRootHistogramWithUncertainties
 
+    def getDataMiningResults(self):
+        '''
+        Returns the results cached by doDataMining() as a pickled string,
+        e.g. for passing them from a worker process to the main process
+        (ROOT histograms are pickled by PyROOT)
+        '''
+        myResults = {}
+        for attr in _dataMiningResultAttributes:
+            myResults[attr] = getattr(self, attr, None)
+        return cPickle.dumps(myResults, cPickle.HIGHEST_PROTOCOL)
+
+    def setDataMiningResults(self, data):
+        '''
+        Sets the results of doDataMining() from a string of getDataMiningResults()
+        '''
+        # Do not attach the unpickled histograms to the current directory
+        addDirectory = ROOT.TH1.AddDirectoryStatus()
+        ROOT.TH1.AddDirectory(False)
+        try:
+            myResults = cPickle.loads(data)
+        finally:
+            ROOT.TH1.AddDirectory(addDirectory)
+        for attr in _dataMiningResultAttributes:
+            setattr(self, attr, myResults[attr])
+        return
+
     def getDatasetMgr(self):
         '''
         Returns dataset manager
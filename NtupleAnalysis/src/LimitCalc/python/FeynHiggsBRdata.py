@@ -1,6 +1,27 @@
 # Generated on Fri Jul  8 10:43:28 2011
 # by Top2HPlus using FeynHiggs 2.7.3 input
 # http://cmsdoc.cern.ch/~slehti/Top2HPlus.git
+#
+# The table is kept in FeynHiggsBRdata.bin next to this module, as
+# little-endian packed data:
+#   "FHBR", uint32 version, uint32 number of mH, tanb and mu points
+#   the mH, tanb and mu axes (doubles, ascending)
+#   (BRt2bH, BRH2taunu, mA) doubles for each [mH][tanb][mu] point
+# The file is memory-mapped on first access, nothing is read on import.
+# Invalid points have all values -1.
+
+import os
+import mmap
+import struct
+import bisect
+
+## Packed table file
+tableFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FeynHiggsBRdata.bin")
+
+_magic = "FHBR"
+_version = 1
+_headerFormat = "<4s4I"
+_pointFormat = "<3d"
 
 class BranchingRatio:
     def __init__(self, BRt2bH, BRH2taunu, mA):
@@ -8,9690 +29,149 @@ class BranchingRatio:
         self.BRH2taunu = BRH2taunu
         self.mA        = mA
 
+def _key(value):
+    '''
+    Axis values are stored as doubles, integral ones are returned as int as in the original dictionary
+    '''
+    if value == int(value):
+        return int(value)
+    return value
+
+def writeTable(fileName, table):
+    '''
+    Writes a nested dictionary [mH][tanb][mu] of BranchingRatio objects
+    (all masses must have the same tanb and mu points) to a packed table file
+    '''
+    masses = sorted(table.keys())
+    tanbs = sorted(table[masses[0]].keys())
+    mus = sorted(table[masses[0]][tanbs[0]].keys())
+    f = open(fileName, "wb")
+    f.write(struct.pack(_headerFormat, _magic, _version, len(masses), len(tanbs), len(mus)))
+    for axis in [masses, tanbs, mus]:
+        f.write(struct.pack("<%dd" % len(axis), *axis))
+    for mH in masses:
+        if sorted(table[mH].keys()) != tanbs:
+            raise Exception("The tanb points of mH=%s differ from those of mH=%s" % (mH, masses[0]))
+        for tanb in tanbs:
+            for mu in mus:
+                p = table[mH][tanb][mu]
+                f.write(struct.pack(_pointFormat, p.BRt2bH, p.BRH2taunu, p.mA))
+    f.close()
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class BranchingRatioTable:
+    '''
+    Read-only view to a packed table file, opened on first access
+    '''
+    def __init__(self, fileName):
+        self._fileName = fileName
+        self._buffer = None
+
+    def _load(self):
+        if self._buffer is not None:
+            return
+        f = open(self._fileName, "rb")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        (magic, version, nMass, nTanb, nMu) = struct.unpack_from(_headerFormat, buf, 0)
+        if magic != _magic or version != _version:
+            raise Exception("File %s is not a branching ratio table of version %d" % (self._fileName, _version))
+        offset = struct.calcsize(_headerFormat)
+        axes = []
+        for n in [nMass, nTanb, nMu]:
+            axes.append(list(struct.unpack_from("<%dd" % n, buf, offset)))
+            offset += 8*n
+        (self._masses, self._tanbs, self._mus) = axes
+        self._dataOffset = offset
+        self._buffer = buf
+
+    def getMasses(self):
+        self._load()
+        return self._masses
+
+    def getTanbs(self):
+        self._load()
+        return self._tanbs
+
+    def getMus(self):
+        self._load()
+        return self._mus
+
+    def index(self, axis, value):
+        '''
+        Index of an exact axis value, raises KeyError if the point does not exist
+        '''
+        i = bisect.bisect_left(axis, value)
+        if i == len(axis) or axis[i] != value:
+            raise KeyError(value)
+        return i
+
+    def massIndex(self, mH):
+        return self.index(self.getMasses(), mH)
+
+    def muIndex(self, mu):
+        return self.index(self.getMus(), mu)
+
+    def getValues(self, iMass, iTanb, iMu):
+        '''
+        (BRt2bH, BRH2taunu, mA) of a grid point given by indices
+        '''
+        self._load()
+        i = (iMass*len(self._tanbs) + iTanb)*len(self._mus) + iMu
+        return struct.unpack_from(_pointFormat, self._buffer, self._dataOffset + 24*i)
+
+    def getArray(self):
+        '''
+        The whole table as a numpy array [mH][tanb][mu][3] sharing the memory map (needs numpy)
+        '''
+        import numpy
+        self._load()
+        shape = (len(self._masses), len(self._tanbs), len(self._mus), 3)
+        return numpy.frombuffer(self._buffer, dtype="<f8", count=shape[0]*shape[1]*shape[2]*3, offset=self._dataOffset).reshape(shape)
+
+#================================================================================================
+# Class Definition
+#================================================================================================
+class _TableView:
+    '''
+    Dictionary-like access to one level of the table, keys in ascending order
+    '''
+    def __init__(self, table, indices):
+        self._table = table
+        self._indices = indices
+
+    def _axis(self):
+        return [self._table.getMasses, self._table.getTanbs, self._table.getMus][len(self._indices)]()
+
+    def keys(self):
+        return [_key(v) for v in self._axis()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._axis())
+
+    def __contains__(self, value):
+        try:
+            self._table.index(self._axis(), value)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __getitem__(self, value):
+        indices = self._indices + [self._table.index(self._axis(), value)]
+        if len(indices) < 3:
+            return _TableView(self._table, indices)
+        return BranchingRatio(*self._table.getValues(*indices))
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+## The table
+brTable = BranchingRatioTable(tableFileName)
+
 # Incides [mH][tanb][mu]
-hplusBranchingRatio = {
-    90: {
-        1.1: {
-            -1000:  BranchingRatio(0.333621, 0.607392, 40.4495),
-            -200:  BranchingRatio(0.333611, 0.620564, 40.4495),
-            200:  BranchingRatio(0.333603, 0.641514, 40.4495),
-            1000:  BranchingRatio(0.333592, 0.671009, 40.4495)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.296251, 0.63357, 40.4495),
-            -200:  BranchingRatio(0.296238, 0.657097, 40.4495),
-            200:  BranchingRatio(0.296228, 0.673927, 40.4495),
-            1000:  BranchingRatio(0.296215, 0.690999, 40.4495)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.264142, 0.653135, 40.4495),
-            -200:  BranchingRatio(0.264126, 0.686152, 40.4495),
-            200:  BranchingRatio(0.264114, 0.698819, 40.4495),
-            1000:  BranchingRatio(0.264099, 0.702372, 40.4495)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.236508, 0.668375, 40.4495),
-            -200:  BranchingRatio(0.236489, 0.709715, 40.4495),
-            200:  BranchingRatio(0.236476, 0.718567, 40.4495),
-            1000:  BranchingRatio(0.236457, 0.709419, 40.4495)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.212662, 0.680916, 40.4495),
-            -200:  BranchingRatio(0.212641, 0.729292, 40.4495),
-            200:  BranchingRatio(0.212625, 0.734844, 40.4495),
-            1000:  BranchingRatio(0.212603, 0.714647, 40.4495)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.192017, 0.69186, 40.4495),
-            -200:  BranchingRatio(0.191992, 0.745984, 40.4495),
-            200:  BranchingRatio(0.191974, 0.748796, 40.4495),
-            1000:  BranchingRatio(0.191949, 0.719422, 40.4495)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.174077, 0.701915, 40.4495),
-            -200:  BranchingRatio(0.174047, 0.76057, 40.4495),
-            200:  BranchingRatio(0.174027, 0.761176, 40.4495),
-            1000:  BranchingRatio(0.173999, 0.724429, 40.4495)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.158426, 0.711507, 40.4495),
-            -200:  BranchingRatio(0.158393, 0.773588, 40.4495),
-            200:  BranchingRatio(0.158369, 0.772465, 40.4495),
-            1000:  BranchingRatio(0.158337, 0.729954, 40.4495)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.144719, 0.72087, 40.4495),
-            -200:  BranchingRatio(0.144681, 0.785406, 40.4495),
-            200:  BranchingRatio(0.144655, 0.78296, 40.4495),
-            1000:  BranchingRatio(0.144619, 0.736065, 40.4495)
-        },
-        2: {
-            -1000:  BranchingRatio(0.132668, 0.730114, 40.4495),
-            -200:  BranchingRatio(0.132625, 0.796269, 40.4495),
-            200:  BranchingRatio(0.132596, 0.79284, 40.4495),
-            1000:  BranchingRatio(0.132555, 0.742716, 40.4495)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.122032, 0.739275, 40.4495),
-            -200:  BranchingRatio(0.121984, 0.806346, 40.4495),
-            200:  BranchingRatio(0.121951, 0.802206, 40.4495),
-            1000:  BranchingRatio(0.121905, 0.749807, 40.4495)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.11261, 0.748347, 40.4495),
-            -200:  BranchingRatio(0.112556, 0.815746, 40.4495),
-            200:  BranchingRatio(0.112519, 0.811118, 40.4495),
-            1000:  BranchingRatio(0.112469, 0.757224, 40.4495)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.104234, 0.757303, 40.4495),
-            -200:  BranchingRatio(0.104173, 0.824551, 40.4495),
-            200:  BranchingRatio(0.104133, 0.819607, 40.4495),
-            1000:  BranchingRatio(0.104077, 0.764849, 40.4495)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.096762, 0.766107, 40.4495),
-            -200:  BranchingRatio(0.0966947, 0.832819, 40.4495),
-            200:  BranchingRatio(0.0966502, 0.827693, 40.4495),
-            1000:  BranchingRatio(0.0965881, 0.772579, 40.4495)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0900756, 0.774725, 40.4495),
-            -200:  BranchingRatio(0.090001, 0.840592, 40.4495),
-            200:  BranchingRatio(0.089952, 0.835389, 40.4495),
-            1000:  BranchingRatio(0.0898837, 0.780325, 40.4495)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0840736, 0.783123, 40.4495),
-            -200:  BranchingRatio(0.0839912, 0.847906, 40.4495),
-            200:  BranchingRatio(0.0839374, 0.842705, 40.4495),
-            1000:  BranchingRatio(0.0838625, 0.788011, 40.4495)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0786705, 0.791275, 40.4495),
-            -200:  BranchingRatio(0.0785797, 0.854791, 40.4495),
-            200:  BranchingRatio(0.0785208, 0.849652, 40.4495),
-            1000:  BranchingRatio(0.0784388, 0.795579, 40.4495)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0737931, 0.799161, 40.4495),
-            -200:  BranchingRatio(0.0736935, 0.861274, 40.4495),
-            200:  BranchingRatio(0.0736291, 0.856239, 40.4495),
-            1000:  BranchingRatio(0.0735396, 0.802983, 40.4495)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0693793, 0.806766, 40.4495),
-            -200:  BranchingRatio(0.0692701, 0.867379, 40.4495),
-            200:  BranchingRatio(0.0691999, 0.86248, 40.4495),
-            1000:  BranchingRatio(0.0691025, 0.810188, 40.4495)
-        },
-        3: {
-            -1000:  BranchingRatio(0.0653752, 0.814081, 40.4495),
-            -200:  BranchingRatio(0.0652559, 0.873128, 40.4495),
-            200:  BranchingRatio(0.0651796, 0.868387, 40.4495),
-            1000:  BranchingRatio(0.0650737, 0.817169, 40.4495)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0617347, 0.821102, 40.4495),
-            -200:  BranchingRatio(0.0616047, 0.878543, 40.4495),
-            200:  BranchingRatio(0.0615218, 0.873974, 40.4495),
-            1000:  BranchingRatio(0.0614071, 0.82391, 40.4495)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.0584179, 0.827828, 40.4495),
-            -200:  BranchingRatio(0.0582764, 0.883644, 40.4495),
-            200:  BranchingRatio(0.0581867, 0.879255, 40.4495),
-            1000:  BranchingRatio(0.0580625, 0.8304, 40.4495)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0553901, 0.834261, 40.4495),
-            -200:  BranchingRatio(0.0552365, 0.88845, 40.4495),
-            200:  BranchingRatio(0.0551395, 0.884246, 40.4495),
-            1000:  BranchingRatio(0.0550054, 0.836634, 40.4495)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.0526211, 0.840407, 40.4495),
-            -200:  BranchingRatio(0.0524546, 0.89298, 40.4495),
-            200:  BranchingRatio(0.05235, 0.888961, 40.4495),
-            1000:  BranchingRatio(0.0522056, 0.842612, 40.4495)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0500847, 0.846273, 40.4495),
-            -200:  BranchingRatio(0.0499046, 0.89725, 40.4495),
-            200:  BranchingRatio(0.0497918, 0.893415, 40.4495),
-            1000:  BranchingRatio(0.0496365, 0.848334, 40.4495)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0477576, 0.851867, 40.4495),
-            -200:  BranchingRatio(0.0475631, 0.901278, 40.4495),
-            200:  BranchingRatio(0.0474419, 0.897622, 40.4495),
-            1000:  BranchingRatio(0.0472751, 0.853805, 40.4495)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0456198, 0.857198, 40.4495),
-            -200:  BranchingRatio(0.0454101, 0.905078, 40.4495),
-            200:  BranchingRatio(0.0452798, 0.901598, 40.4495),
-            1000:  BranchingRatio(0.045101, 0.859031, 40.4495)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.0436531, 0.862277, 40.4495),
-            -200:  BranchingRatio(0.0434274, 0.908665, 40.4495),
-            200:  BranchingRatio(0.0432878, 0.905354, 40.4495),
-            1000:  BranchingRatio(0.0430964, 0.864021, 40.4495)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.041842, 0.867113, 40.4495),
-            -200:  BranchingRatio(0.0415995, 0.912052, 40.4495),
-            200:  BranchingRatio(0.0414499, 0.908905, 40.4495),
-            1000:  BranchingRatio(0.0412454, 0.868781, 40.4495)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0401724, 0.871719, 40.4495),
-            -200:  BranchingRatio(0.0399121, 0.915253, 40.4495),
-            200:  BranchingRatio(0.0397522, 0.912263, 40.4495),
-            1000:  BranchingRatio(0.039534, 0.873321, 40.4495)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.0386319, 0.876104, 40.4495),
-            -200:  BranchingRatio(0.0383529, 0.91828, 40.4495),
-            200:  BranchingRatio(0.0381822, 0.91544, 40.4495),
-            1000:  BranchingRatio(0.0379497, 0.877651, 40.4495)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.0372094, 0.880279, 40.4495),
-            -200:  BranchingRatio(0.0369109, 0.921142, 40.4495),
-            200:  BranchingRatio(0.0367289, 0.918446, 40.4495),
-            1000:  BranchingRatio(0.0364813, 0.881778, 40.4495)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.0358952, 0.884254, 40.4495),
-            -200:  BranchingRatio(0.0355761, 0.923852, 40.4495),
-            200:  BranchingRatio(0.0353822, 0.921292, 40.4495),
-            1000:  BranchingRatio(0.0351191, 0.885714, 40.4495)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0346802, 0.88804, 40.4495),
-            -200:  BranchingRatio(0.0343396, 0.926419, 40.4495),
-            200:  BranchingRatio(0.0341334, 0.923988, 40.4495),
-            1000:  BranchingRatio(0.0338541, 0.889466, 40.4495)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.0335567, 0.891645, 40.4495),
-            -200:  BranchingRatio(0.0331936, 0.928851, 40.4495),
-            200:  BranchingRatio(0.0329744, 0.926544, 40.4495),
-            1000:  BranchingRatio(0.0326783, 0.893043, 40.4495)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0325175, 0.895081, 40.4495),
-            -200:  BranchingRatio(0.0321308, 0.931157, 40.4495),
-            200:  BranchingRatio(0.0318982, 0.928968, 40.4495),
-            1000:  BranchingRatio(0.0315846, 0.896456, 40.4495)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.0315563, 0.898354, 40.4495),
-            -200:  BranchingRatio(0.031145, 0.933346, 40.4495),
-            200:  BranchingRatio(0.0308984, 0.931268, 40.4495),
-            1000:  BranchingRatio(0.0305665, 0.899711, 40.4495)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.0306673, 0.901475, 40.4495),
-            -200:  BranchingRatio(0.0302301, 0.935424, 40.4495),
-            200:  BranchingRatio(0.029969, 0.933451, 40.4495),
-            1000:  BranchingRatio(0.0296183, 0.902817, 40.4495)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.0298452, 0.904451, 40.4495),
-            -200:  BranchingRatio(0.0293812, 0.937398, 40.4495),
-            200:  BranchingRatio(0.0291048, 0.935526, 40.4495),
-            1000:  BranchingRatio(0.0287346, 0.905782, 40.4495)
-        },
-        5: {
-            -1000:  BranchingRatio(0.0290853, 0.907289, 40.4495),
-            -200:  BranchingRatio(0.0285933, 0.939275, 40.4495),
-            200:  BranchingRatio(0.0283012, 0.937498, 40.4495),
-            1000:  BranchingRatio(0.0279107, 0.908612, 40.4495)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0283834, 0.909998, 40.4495),
-            -200:  BranchingRatio(0.0278621, 0.94106, 40.4495),
-            200:  BranchingRatio(0.0275537, 0.939373, 40.4495),
-            1000:  BranchingRatio(0.0271422, 0.911316, 40.4495)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0277355, 0.912584, 40.4495),
-            -200:  BranchingRatio(0.0271838, 0.942759, 40.4495),
-            200:  BranchingRatio(0.0268585, 0.941158, 40.4495),
-            1000:  BranchingRatio(0.0264253, 0.913899, 40.4495)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.0271381, 0.915054, 40.4495),
-            -200:  BranchingRatio(0.0265548, 0.944377, 40.4495),
-            200:  BranchingRatio(0.0262119, 0.942858, 40.4495),
-            1000:  BranchingRatio(0.0257563, 0.916369, 40.4495)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.0265881, 0.917413, 40.4495),
-            -200:  BranchingRatio(0.0259719, 0.94592, 40.4495),
-            200:  BranchingRatio(0.0256107, 0.944477, 40.4495),
-            1000:  BranchingRatio(0.025132, 0.91873, 40.4495)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.0260825, 0.919668, 40.4495),
-            -200:  BranchingRatio(0.025432, 0.94739, 40.4495),
-            200:  BranchingRatio(0.0250519, 0.946021, 40.4495),
-            1000:  BranchingRatio(0.0245493, 0.920989, 40.4495)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.0256185, 0.921824, 40.4495),
-            -200:  BranchingRatio(0.0249324, 0.948793, 40.4495),
-            200:  BranchingRatio(0.0245328, 0.947494, 40.4495),
-            1000:  BranchingRatio(0.0240055, 0.923151, 40.4495)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.0251937, 0.923887, 40.4495),
-            -200:  BranchingRatio(0.0244707, 0.950133, 40.4495),
-            200:  BranchingRatio(0.0240509, 0.948899, 40.4495),
-            1000:  BranchingRatio(0.0234981, 0.925221, 40.4495)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.0248058, 0.925861, 40.4495),
-            -200:  BranchingRatio(0.0240446, 0.951412, 40.4495),
-            200:  BranchingRatio(0.0236038, 0.950242, 40.4495),
-            1000:  BranchingRatio(0.0230249, 0.927204, 40.4495)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.0244529, 0.927751, 40.4495),
-            -200:  BranchingRatio(0.0236519, 0.952635, 40.4495),
-            200:  BranchingRatio(0.0231896, 0.951524, 40.4495),
-            1000:  BranchingRatio(0.0225836, 0.929104, 40.4495)
-        },
-        6: {
-            -1000:  BranchingRatio(0.0241329, 0.929561, 40.4495),
-            -200:  BranchingRatio(0.0232907, 0.953805, 40.4495),
-            200:  BranchingRatio(0.0228061, 0.952751, 40.4495),
-            1000:  BranchingRatio(0.0221723, 0.930925, 40.4495)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.0238442, 0.931295, 40.4495),
-            -200:  BranchingRatio(0.0229593, 0.954924, 40.4495),
-            200:  BranchingRatio(0.0224517, 0.953924, 40.4495),
-            1000:  BranchingRatio(0.0217893, 0.932672, 40.4495)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.023585, 0.932958, 40.4495),
-            -200:  BranchingRatio(0.0226561, 0.955995, 40.4495),
-            200:  BranchingRatio(0.0221247, 0.955047, 40.4495),
-            1000:  BranchingRatio(0.0214329, 0.934348, 40.4495)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.0233541, 0.934552, 40.4495),
-            -200:  BranchingRatio(0.0223794, 0.957021, 40.4495),
-            200:  BranchingRatio(0.0218235, 0.956122, 40.4495),
-            1000:  BranchingRatio(0.0211014, 0.935957, 40.4495)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.0231498, 0.936082, 40.4495),
-            -200:  BranchingRatio(0.0221279, 0.958004, 40.4495),
-            200:  BranchingRatio(0.0215468, 0.957152, 40.4495),
-            1000:  BranchingRatio(0.0207936, 0.937503, 40.4495)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.0229711, 0.93755, 40.4495),
-            -200:  BranchingRatio(0.0219002, 0.958947, 40.4495),
-            200:  BranchingRatio(0.0212932, 0.958139, 40.4495),
-            1000:  BranchingRatio(0.0205081, 0.938987, 40.4495)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0228167, 0.93896, 40.4495),
-            -200:  BranchingRatio(0.0216953, 0.959851, 40.4495),
-            200:  BranchingRatio(0.0210615, 0.959086, 40.4495),
-            1000:  BranchingRatio(0.0202436, 0.940414, 40.4495)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.0226855, 0.940314, 40.4495),
-            -200:  BranchingRatio(0.021512, 0.960719, 40.4495),
-            200:  BranchingRatio(0.0208505, 0.959995, 40.4495),
-            1000:  BranchingRatio(0.0199991, 0.941786, 40.4495)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.0225766, 0.941615, 40.4495),
-            -200:  BranchingRatio(0.0213491, 0.961552, 40.4495),
-            200:  BranchingRatio(0.0206594, 0.960867, 40.4495),
-            1000:  BranchingRatio(0.0197734, 0.943106, 40.4495)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.022489, 0.942865, 40.4495),
-            -200:  BranchingRatio(0.0212059, 0.962352, 40.4495),
-            200:  BranchingRatio(0.020487, 0.961705, 40.4495),
-            1000:  BranchingRatio(0.0195656, 0.944376, 40.4495)
-        },
-        7: {
-            -1000:  BranchingRatio(0.0224218, 0.944068, 40.4495),
-            -200:  BranchingRatio(0.0210813, 0.963121, 40.4495),
-            200:  BranchingRatio(0.0203324, 0.96251, 40.4495),
-            1000:  BranchingRatio(0.0193748, 0.945599, 40.4495)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.0223742, 0.945225, 40.4495),
-            -200:  BranchingRatio(0.0209745, 0.963861, 40.4495),
-            200:  BranchingRatio(0.0201949, 0.963284, 40.4495),
-            1000:  BranchingRatio(0.0192001, 0.946777, 40.4495)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.0223455, 0.946338, 40.4495),
-            -200:  BranchingRatio(0.0208848, 0.964572, 40.4495),
-            200:  BranchingRatio(0.0200735, 0.964029, 40.4495),
-            1000:  BranchingRatio(0.0190408, 0.947912, 40.4495)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.022335, 0.94741, 40.4495),
-            -200:  BranchingRatio(0.0208115, 0.965257, 40.4495),
-            200:  BranchingRatio(0.0199677, 0.964745, 40.4495),
-            1000:  BranchingRatio(0.018896, 0.949005, 40.4495)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.0223421, 0.948442, 40.4495),
-            -200:  BranchingRatio(0.0207538, 0.965916, 40.4495),
-            200:  BranchingRatio(0.0198766, 0.965435, 40.4495),
-            1000:  BranchingRatio(0.0187651, 0.95006, 40.4495)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.0223661, 0.949436, 40.4495),
-            -200:  BranchingRatio(0.0207111, 0.966551, 40.4495),
-            200:  BranchingRatio(0.0197997, 0.966099, 40.4495),
-            1000:  BranchingRatio(0.0186474, 0.951077, 40.4495)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.0224065, 0.950394, 40.4495),
-            -200:  BranchingRatio(0.0206827, 0.967163, 40.4495),
-            200:  BranchingRatio(0.0197363, 0.966738, 40.4495),
-            1000:  BranchingRatio(0.0185424, 0.952059, 40.4495)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.0224627, 0.951317, 40.4495),
-            -200:  BranchingRatio(0.0206683, 0.967752, 40.4495),
-            200:  BranchingRatio(0.0196859, 0.967355, 40.4495),
-            1000:  BranchingRatio(0.0184493, 0.953007, 40.4495)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.0225343, 0.952207, 40.4495),
-            -200:  BranchingRatio(0.0206672, 0.968321, 40.4495),
-            200:  BranchingRatio(0.0196479, 0.96795, 40.4495),
-            1000:  BranchingRatio(0.0183678, 0.953922, 40.4495)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.0226208, 0.953066, 40.4495),
-            -200:  BranchingRatio(0.020679, 0.968869, 40.4495),
-            200:  BranchingRatio(0.0196219, 0.968523, 40.4495),
-            1000:  BranchingRatio(0.0182973, 0.954806, 40.4495)
-        },
-        8: {
-            -1000:  BranchingRatio(0.0227218, 0.953895, 40.4495),
-            -200:  BranchingRatio(0.0207031, 0.969398, 40.4495),
-            200:  BranchingRatio(0.0196073, 0.969077, 40.4495),
-            1000:  BranchingRatio(0.0182372, 0.95566, 40.4495)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.0228368, 0.954695, 40.4495),
-            -200:  BranchingRatio(0.0207391, 0.969909, 40.4495),
-            200:  BranchingRatio(0.0196037, 0.969611, 40.4495),
-            1000:  BranchingRatio(0.0181873, 0.956486, 40.4495)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.0229656, 0.955467, 40.4495),
-            -200:  BranchingRatio(0.0207868, 0.970403, 40.4495),
-            200:  BranchingRatio(0.0196107, 0.970127, 40.4495),
-            1000:  BranchingRatio(0.0181469, 0.957284, 40.4495)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.0231078, 0.956212, 40.4495),
-            -200:  BranchingRatio(0.0208455, 0.970879, 40.4495),
-            200:  BranchingRatio(0.019628, 0.970625, 40.4495),
-            1000:  BranchingRatio(0.0181158, 0.958057, 40.4495)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.023263, 0.956932, 40.4495),
-            -200:  BranchingRatio(0.0209151, 0.97134, 40.4495),
-            200:  BranchingRatio(0.0196551, 0.971107, 40.4495),
-            1000:  BranchingRatio(0.0180936, 0.958805, 40.4495)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.0234309, 0.957628, 40.4495),
-            -200:  BranchingRatio(0.0209952, 0.971785, 40.4495),
-            200:  BranchingRatio(0.0196916, 0.971572, 40.4495),
-            1000:  BranchingRatio(0.0180799, 0.959528, 40.4495)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.0236112, 0.9583, 40.4495),
-            -200:  BranchingRatio(0.0210853, 0.972215, 40.4495),
-            200:  BranchingRatio(0.0197373, 0.972023, 40.4495),
-            1000:  BranchingRatio(0.0180744, 0.960229, 40.4495)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.0238038, 0.95895, 40.4495),
-            -200:  BranchingRatio(0.0211853, 0.972632, 40.4495),
-            200:  BranchingRatio(0.0197919, 0.972458, 40.4495),
-            1000:  BranchingRatio(0.0180767, 0.960908, 40.4495)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.0240082, 0.959579, 40.4495),
-            -200:  BranchingRatio(0.0212949, 0.973035, 40.4495),
-            200:  BranchingRatio(0.019855, 0.97288, 40.4495),
-            1000:  BranchingRatio(0.0180866, 0.961565, 40.4495)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.0242244, 0.960187, 40.4495),
-            -200:  BranchingRatio(0.0214138, 0.973425, 40.4495),
-            200:  BranchingRatio(0.0199264, 0.973288, 40.4495),
-            1000:  BranchingRatio(0.0181037, 0.962202, 40.4495)
-        },
-        9: {
-            -1000:  BranchingRatio(0.0244521, 0.960775, 40.4495),
-            -200:  BranchingRatio(0.0215416, 0.973802, 40.4495),
-            200:  BranchingRatio(0.0200058, 0.973683, 40.4495),
-            1000:  BranchingRatio(0.0181278, 0.96282, 40.4495)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.024691, 0.961343, 40.4495),
-            -200:  BranchingRatio(0.0216783, 0.974168, 40.4495),
-            200:  BranchingRatio(0.0200929, 0.974066, 40.4495),
-            1000:  BranchingRatio(0.0181587, 0.96342, 40.4495)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.024941, 0.961894, 40.4495),
-            -200:  BranchingRatio(0.0218235, 0.974522, 40.4495),
-            200:  BranchingRatio(0.0201876, 0.974437, 40.4495),
-            1000:  BranchingRatio(0.0181961, 0.964001, 40.4495)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.0252019, 0.962427, 40.4495),
-            -200:  BranchingRatio(0.0219771, 0.974866, 40.4495),
-            200:  BranchingRatio(0.0202895, 0.974796, 40.4495),
-            1000:  BranchingRatio(0.0182397, 0.964565, 40.4495)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.0254735, 0.962943, 40.4495),
-            -200:  BranchingRatio(0.0221387, 0.975199, 40.4495),
-            200:  BranchingRatio(0.0203986, 0.975145, 40.4495),
-            1000:  BranchingRatio(0.0182894, 0.965112, 40.4495)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.0257557, 0.963442, 40.4495),
-            -200:  BranchingRatio(0.0223084, 0.975521, 40.4495),
-            200:  BranchingRatio(0.0205145, 0.975483, 40.4495),
-            1000:  BranchingRatio(0.0183449, 0.965644, 40.4495)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.0260483, 0.963926, 40.4495),
-            -200:  BranchingRatio(0.0224857, 0.975834, 40.4495),
-            200:  BranchingRatio(0.020637, 0.97581, 40.4495),
-            1000:  BranchingRatio(0.0184061, 0.96616, 40.4495)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.0263512, 0.964395, 40.4495),
-            -200:  BranchingRatio(0.0226707, 0.976138, 40.4495),
-            200:  BranchingRatio(0.0207661, 0.976129, 40.4495),
-            1000:  BranchingRatio(0.0184727, 0.966662, 40.4495)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.0266643, 0.964848, 40.4495),
-            -200:  BranchingRatio(0.0228631, 0.976432, 40.4495),
-            200:  BranchingRatio(0.0209014, 0.976437, 40.4495),
-            1000:  BranchingRatio(0.0185446, 0.967149, 40.4495)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.0269874, 0.965288, 40.4495),
-            -200:  BranchingRatio(0.0230627, 0.976718, 40.4495),
-            200:  BranchingRatio(0.0210429, 0.976737, 40.4495),
-            1000:  BranchingRatio(0.0186215, 0.967622, 40.4495)
-        },
-        10: {
-            -1000:  BranchingRatio(0.0273204, 0.965715, 40.4495),
-            -200:  BranchingRatio(0.0232694, 0.976996, 40.4495),
-            200:  BranchingRatio(0.0211904, 0.977028, 40.4495),
-            1000:  BranchingRatio(0.0187034, 0.968083, 40.4495)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0311763, 0.969324, 40.4495),
-            -200:  BranchingRatio(0.0256987, 0.979373, 40.4495),
-            200:  BranchingRatio(0.0229641, 0.979528, 40.4495),
-            1000:  BranchingRatio(0.0197626, 0.972058, 40.4495)
-        },
-        12: {
-            -1000:  BranchingRatio(0.0359441, 0.971981, 40.4495),
-            -200:  BranchingRatio(0.0287154, 0.981182, 40.4495),
-            200:  BranchingRatio(0.0252039, 0.981441, 40.4495),
-            1000:  BranchingRatio(0.0211788, 0.975132, 40.4495)
-        },
-        13: {
-            -1000:  BranchingRatio(0.0415904, 0.973927, 40.4495),
-            -200:  BranchingRatio(0.0322465, 0.98258, 40.4495),
-            200:  BranchingRatio(0.0278287, 0.982935, 40.4495),
-            1000:  BranchingRatio(0.0228686, 0.977558, 40.4495)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0481069, 0.975318, 40.4495),
-            -200:  BranchingRatio(0.0362428, 0.983675, 40.4495),
-            200:  BranchingRatio(0.030782, 0.98412, 40.4495),
-            1000:  BranchingRatio(0.0247737, 0.979506, 40.4495)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0555001, 0.976249, 40.4495),
-            -200:  BranchingRatio(0.0406698, 0.984541, 40.4495),
-            200:  BranchingRatio(0.0340224, 0.985075, 40.4495),
-            1000:  BranchingRatio(0.0268519, 0.981099, 40.4495)
-        },
-        16: {
-            -1000:  BranchingRatio(0.0637857, 0.976763, 40.4495),
-            -200:  BranchingRatio(0.0455019, 0.985227, 40.4495),
-            200:  BranchingRatio(0.0375184, 0.985852, 40.4495),
-            1000:  BranchingRatio(0.0290716, 0.982413, 40.4495)
-        },
-        17: {
-            -1000:  BranchingRatio(0.0729849, 0.976857, 40.4495),
-            -200:  BranchingRatio(0.0507192, 0.985771, 40.4495),
-            200:  BranchingRatio(0.0412449, 0.986492, 40.4495),
-            1000:  BranchingRatio(0.0314081, 0.983507, 40.4495)
-        },
-        18: {
-            -1000:  BranchingRatio(0.0831214, 0.976483, 40.4495),
-            -200:  BranchingRatio(0.0563054, 0.986199, 40.4495),
-            200:  BranchingRatio(0.0451813, 0.987022, 40.4495),
-            1000:  BranchingRatio(0.0338419, 0.984432, 40.4495)
-        },
-        19: {
-            -1000:  BranchingRatio(0.09422, 0.975472, 40.4495),
-            -200:  BranchingRatio(0.0622465, 0.98653, 40.4495),
-            200:  BranchingRatio(0.0493101, 0.987464, 40.4495),
-            1000:  BranchingRatio(0.0363569, 0.98522, 40.4495)
-        },
-        20: {
-            -1000:  BranchingRatio(0.106305, 0.973286, 40.4495),
-            -200:  BranchingRatio(0.0685301, 0.986778, 40.4495),
-            200:  BranchingRatio(0.0536158, 0.987834, 40.4495),
-            1000:  BranchingRatio(0.03894, 0.985898, 40.4495)
-        },
-        21: {
-            -1000:  BranchingRatio(0.119397, 0.980801, 40.4495),
-            -200:  BranchingRatio(0.0751445, 0.986951, 40.4495),
-            200:  BranchingRatio(0.058085, 0.988145, 40.4495),
-            1000:  BranchingRatio(0.0415799, 0.986486, 40.4495)
-        },
-        22: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0820786, 0.987057, 40.4495),
-            200:  BranchingRatio(0.0627052, 0.988406, 40.4495),
-            1000:  BranchingRatio(0.0442669, 0.986999, 40.4495)
-        },
-        23: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0893214, 0.987097, 40.4495),
-            200:  BranchingRatio(0.0674652, 0.988624, 40.4495),
-            1000:  BranchingRatio(0.0469929, 0.987449, 40.4495)
-        },
-        24: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.096862, 0.987073, 40.4495),
-            200:  BranchingRatio(0.0723545, 0.988806, 40.4495),
-            1000:  BranchingRatio(0.0497505, 0.987847, 40.4495)
-        },
-        25: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.104689, 0.986979, 40.4495),
-            200:  BranchingRatio(0.0773631, 0.988956, 40.4495),
-            1000:  BranchingRatio(0.0525334, 0.988201, 40.4495)
-        },
-        26: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.112793, 0.986808, 40.4495),
-            200:  BranchingRatio(0.0824817, 0.989077, 40.4495),
-            1000:  BranchingRatio(0.055336, 0.988516, 40.4495)
-        },
-        27: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.12116, 0.986543, 40.4495),
-            200:  BranchingRatio(0.0877017, 0.989172, 40.4495),
-            1000:  BranchingRatio(0.0581532, 0.988798, 40.4495)
-        },
-        28: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.129781, 0.986156, 40.4495),
-            200:  BranchingRatio(0.0930147, 0.989243, 40.4495),
-            1000:  BranchingRatio(0.0609807, 0.989053, 40.4495)
-        },
-        29: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.138642, 0.985586, 40.4495),
-            200:  BranchingRatio(0.0984126, 0.989291, 40.4495),
-            1000:  BranchingRatio(0.0638144, 0.989283, 40.4495)
-        },
-        30: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.147732, 0.984673, 40.4495),
-            200:  BranchingRatio(0.103888, 0.989317, 40.4495),
-            1000:  BranchingRatio(0.0666508, 0.989491, 40.4495)
-        },
-        31: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.15704, 0.985185, 40.4495),
-            200:  BranchingRatio(0.109434, 0.989321, 40.4495),
-            1000:  BranchingRatio(0.0694866, 0.989681, 40.4495)
-        },
-        32: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.115042, 0.989301, 40.4495),
-            1000:  BranchingRatio(0.0723191, 0.989854, 40.4495)
-        },
-        33: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.120708, 0.989257, 40.4495),
-            1000:  BranchingRatio(0.0751456, 0.990012, 40.4495)
-        },
-        34: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.126424, 0.989184, 40.4495),
-            1000:  BranchingRatio(0.0779638, 0.990157, 40.4495)
-        },
-        35: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.132184, 0.989077, 40.4495),
-            1000:  BranchingRatio(0.0807716, 0.990291, 40.4495)
-        },
-        36: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.137983, 0.988926, 40.4495),
-            1000:  BranchingRatio(0.0835672, 0.990414, 40.4495)
-        },
-        37: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.143814, 0.988712, 40.4495),
-            1000:  BranchingRatio(0.0863489, 0.990527, 40.4495)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.149674, 0.988391, 40.4495),
-            1000:  BranchingRatio(0.0891151, 0.990632, 40.4495)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.155557, 0.987817, 40.4495),
-            1000:  BranchingRatio(0.0918646, 0.99073, 40.4495)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.161457, 0.9907, 40.4495),
-            1000:  BranchingRatio(0.0945962, 0.99082, 40.4495)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.0973087, 0.990904, 40.4495)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.100001, 0.990982, 40.4495)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.102673, 0.991055, 40.4495)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.105323, 0.991123, 40.4495)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.107951, 0.991186, 40.4495)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.110556, 0.991245, 40.4495)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.113138, 0.9913, 40.4495)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.115697, 0.991351, 40.4495)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.118231, 0.991399, 40.4495)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.120741, 0.991444, 40.4495)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.123227, 0.991486, 40.4495)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.125688, 0.991525, 40.4495)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.128124, 0.991561, 40.4495)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.130535, 0.991595, 40.4495)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.132921, 0.991627, 40.4495)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.135282, 0.991656, 40.4495)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.137617, 0.991683, 40.4495)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.139928, 0.991707, 40.4495)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.142214, 0.99173, 40.4495)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.144475, 0.991751, 40.4495)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.146711, 0.991769, 40.4495)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.148923, 0.991786, 40.4495)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.151109, 0.991801, 40.4495)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.153272, 0.991813, 40.4495)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.15541, 0.991824, 40.4495)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.157524, 0.991832, 40.4495)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.159614, 0.991838, 40.4495)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.161681, 0.991842, 40.4495)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.163724, 0.991843, 40.4495)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.165744, 0.991841, 40.4495)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.16774, 0.991835, 40.4495)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.169714, 0.991825, 40.4495)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.171665, 0.991809, 40.4495)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.173594, 0.991785, 40.4495)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.175501, 0.991841, 40.4495)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.177386, 0.992038, 40.4495)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.179249, 0.992251, 40.4495)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.181091, 0.992485, 40.4495)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.182911, 0.992467, 40.4495)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.184711, 0.991833, 40.4495)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.18649, 0.991844, 40.4495)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(-1, -1, -1)
-        }
-    },
-    100: {
-        1.1: {
-            -1000:  BranchingRatio(0.294161, 0.655101, 59.4656),
-            -200:  BranchingRatio(0.29415, 0.687782, 59.4656),
-            200:  BranchingRatio(0.294142, 0.694721, 59.4656),
-            1000:  BranchingRatio(0.294131, 0.67813, 59.4656)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.259498, 0.686108, 59.4656),
-            -200:  BranchingRatio(0.259485, 0.726814, 59.4656),
-            200:  BranchingRatio(0.259476, 0.730711, 59.4656),
-            1000:  BranchingRatio(0.259463, 0.707371, 59.4656)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.230079, 0.709119, 59.4656),
-            -200:  BranchingRatio(0.230064, 0.756312, 59.4656),
-            200:  BranchingRatio(0.230053, 0.757407, 59.4656),
-            1000:  BranchingRatio(0.230038, 0.727701, 59.4656)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.205026, 0.727302, 59.4656),
-            -200:  BranchingRatio(0.205008, 0.779314, 59.4656),
-            200:  BranchingRatio(0.204995, 0.778087, 59.4656),
-            1000:  BranchingRatio(0.204977, 0.74319, 59.4656)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.1836, 0.742693, 59.4656),
-            -200:  BranchingRatio(0.183579, 0.79795, 59.4656),
-            200:  BranchingRatio(0.183564, 0.794942, 59.4656),
-            1000:  BranchingRatio(0.183544, 0.756236, 59.4656)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.165193, 0.756494, 59.4656),
-            -200:  BranchingRatio(0.165169, 0.813626, 59.4656),
-            200:  BranchingRatio(0.165152, 0.809341, 59.4656),
-            1000:  BranchingRatio(0.165129, 0.768126, 59.4656)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.149304, 0.769356, 59.4656),
-            -200:  BranchingRatio(0.149277, 0.82723, 59.4656),
-            200:  BranchingRatio(0.149258, 0.822095, 59.4656),
-            1000:  BranchingRatio(0.149231, 0.779474, 59.4656)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.135524, 0.781612, 59.4656),
-            -200:  BranchingRatio(0.135493, 0.839309, 59.4656),
-            200:  BranchingRatio(0.135471, 0.833666, 59.4656),
-            1000:  BranchingRatio(0.135442, 0.790541, 59.4656)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.123516, 0.793356, 59.4656),
-            -200:  BranchingRatio(0.123481, 0.850201, 59.4656),
-            200:  BranchingRatio(0.123457, 0.844322, 59.4656),
-            1000:  BranchingRatio(0.123424, 0.801345, 59.4656)
-        },
-        2: {
-            -1000:  BranchingRatio(0.113005, 0.804632, 59.4656),
-            -200:  BranchingRatio(0.112966, 0.860128, 59.4656),
-            200:  BranchingRatio(0.112939, 0.854184, 59.4656),
-            1000:  BranchingRatio(0.112902, 0.811865, 59.4656)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.103765, 0.815424, 59.4656),
-            -200:  BranchingRatio(0.103721, 0.869206, 59.4656),
-            200:  BranchingRatio(0.103691, 0.863343, 59.4656),
-            1000:  BranchingRatio(0.10365, 0.822039, 59.4656)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0956072, 0.825707, 59.4656),
-            -200:  BranchingRatio(0.0955582, 0.87754, 59.4656),
-            200:  BranchingRatio(0.0955253, 0.871851, 59.4656),
-            1000:  BranchingRatio(0.0954795, 0.831806, 59.4656)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.0883771, 0.835458, 59.4656),
-            -200:  BranchingRatio(0.0883227, 0.8852, 59.4656),
-            200:  BranchingRatio(0.0882865, 0.879745, 59.4656),
-            1000:  BranchingRatio(0.088236, 0.841116, 59.4656)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.0819452, 0.844665, 59.4656),
-            -200:  BranchingRatio(0.081885, 0.892247, 59.4656),
-            200:  BranchingRatio(0.0818452, 0.887061, 59.4656),
-            1000:  BranchingRatio(0.0817897, 0.849937, 59.4656)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0762032, 0.853323, 59.4656),
-            -200:  BranchingRatio(0.0761368, 0.898729, 59.4656),
-            200:  BranchingRatio(0.0760932, 0.893831, 59.4656),
-            1000:  BranchingRatio(0.0760323, 0.858254, 59.4656)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0710602, 0.86144, 59.4656),
-            -200:  BranchingRatio(0.0709871, 0.904694, 59.4656),
-            200:  BranchingRatio(0.0709394, 0.900089, 59.4656),
-            1000:  BranchingRatio(0.0708728, 0.866063, 59.4656)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0664393, 0.86903, 59.4656),
-            -200:  BranchingRatio(0.0663591, 0.910185, 59.4656),
-            200:  BranchingRatio(0.066307, 0.90587, 59.4656),
-            1000:  BranchingRatio(0.0662344, 0.873373, 59.4656)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0622754, 0.876113, 59.4656),
-            -200:  BranchingRatio(0.0621876, 0.915239, 59.4656),
-            200:  BranchingRatio(0.0621309, 0.911206, 59.4656),
-            1000:  BranchingRatio(0.0620519, 0.880201, 59.4656)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0585131, 0.882713, 59.4656),
-            -200:  BranchingRatio(0.0584172, 0.919895, 59.4656),
-            200:  BranchingRatio(0.0583555, 0.916132, 59.4656),
-            1000:  BranchingRatio(0.0582698, 0.886566, 59.4656)
-        },
-        3: {
-            -1000:  BranchingRatio(0.055105, 0.888858, 59.4656),
-            -200:  BranchingRatio(0.0550005, 0.924186, 59.4656),
-            200:  BranchingRatio(0.0549336, 0.920679, 59.4656),
-            1000:  BranchingRatio(0.0548408, 0.892493, 59.4656)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0520104, 0.894576, 59.4656),
-            -200:  BranchingRatio(0.0518968, 0.928144, 59.4656),
-            200:  BranchingRatio(0.0518244, 0.924878, 59.4656),
-            1000:  BranchingRatio(0.051724, 0.898009, 59.4656)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.0491943, 0.899894, 59.4656),
-            -200:  BranchingRatio(0.049071, 0.931798, 59.4656),
-            200:  BranchingRatio(0.0489927, 0.928756, 59.4656),
-            1000:  BranchingRatio(0.0488844, 0.903141, 59.4656)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0466263, 0.904841, 59.4656),
-            -200:  BranchingRatio(0.0464927, 0.935174, 59.4656),
-            200:  BranchingRatio(0.0464083, 0.932342, 59.4656),
-            1000:  BranchingRatio(0.0462916, 0.907914, 59.4656)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.0442802, 0.909444, 59.4656),
-            -200:  BranchingRatio(0.0441357, 0.938297, 59.4656),
-            200:  BranchingRatio(0.0440448, 0.93566, 59.4656),
-            1000:  BranchingRatio(0.0439194, 0.912356, 59.4656)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0421331, 0.913728, 59.4656),
-            -200:  BranchingRatio(0.041977, 0.941189, 59.4656),
-            200:  BranchingRatio(0.0418793, 0.938733, 59.4656),
-            1000:  BranchingRatio(0.0417446, 0.91649, 59.4656)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0401648, 0.917718, 59.4656),
-            -200:  BranchingRatio(0.0399966, 0.94387, 59.4656),
-            200:  BranchingRatio(0.0398917, 0.941581, 59.4656),
-            1000:  BranchingRatio(0.0397473, 0.92034, 59.4656)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0383579, 0.921435, 59.4656),
-            -200:  BranchingRatio(0.0381769, 0.946359, 59.4656),
-            200:  BranchingRatio(0.0380644, 0.944224, 59.4656),
-            1000:  BranchingRatio(0.0379099, 0.923928, 59.4656)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.036697, 0.924902, 59.4656),
-            -200:  BranchingRatio(0.0365024, 0.948672, 59.4656),
-            200:  BranchingRatio(0.036382, 0.94668, 59.4656),
-            1000:  BranchingRatio(0.0362169, 0.927275, 59.4656)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.0351683, 0.928138, 59.4656),
-            -200:  BranchingRatio(0.0349595, 0.950824, 59.4656),
-            200:  BranchingRatio(0.0348308, 0.948964, 59.4656),
-            1000:  BranchingRatio(0.0346546, 0.930399, 59.4656)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0337599, 0.93116, 59.4656),
-            -200:  BranchingRatio(0.0335362, 0.952829, 59.4656),
-            200:  BranchingRatio(0.0333987, 0.951091, 59.4656),
-            1000:  BranchingRatio(0.0332109, 0.933317, 59.4656)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.0324612, 0.933986, 59.4656),
-            -200:  BranchingRatio(0.0322217, 0.9547, 59.4656),
-            200:  BranchingRatio(0.0320751, 0.953075, 59.4656),
-            1000:  BranchingRatio(0.0318753, 0.936047, 59.4656)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.0312626, 0.93663, 59.4656),
-            -200:  BranchingRatio(0.0310066, 0.956446, 59.4656),
-            200:  BranchingRatio(0.0308504, 0.954926, 59.4656),
-            1000:  BranchingRatio(0.030638, 0.938602, 59.4656)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.0301556, 0.939108, 59.4656),
-            -200:  BranchingRatio(0.0298824, 0.958079, 59.4656),
-            200:  BranchingRatio(0.0297162, 0.956655, 59.4656),
-            1000:  BranchingRatio(0.0294907, 0.940996, 59.4656)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0291328, 0.94143, 59.4656),
-            -200:  BranchingRatio(0.0288414, 0.959608, 59.4656),
-            200:  BranchingRatio(0.0286649, 0.958274, 59.4656),
-            1000:  BranchingRatio(0.0284257, 0.943241, 59.4656)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.0281874, 0.94361, 59.4656),
-            -200:  BranchingRatio(0.027877, 0.961041, 59.4656),
-            200:  BranchingRatio(0.0276896, 0.95979, 59.4656),
-            1000:  BranchingRatio(0.0274362, 0.945349, 59.4656)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0273132, 0.945658, 59.4656),
-            -200:  BranchingRatio(0.026983, 0.962385, 59.4656),
-            200:  BranchingRatio(0.0267843, 0.961211, 59.4656),
-            1000:  BranchingRatio(0.0265162, 0.947331, 59.4656)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.0265049, 0.947584, 59.4656),
-            -200:  BranchingRatio(0.0261539, 0.963648, 59.4656),
-            200:  BranchingRatio(0.0259434, 0.962546, 59.4656),
-            1000:  BranchingRatio(0.0256601, 0.949195, 59.4656)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.0257576, 0.949397, 59.4656),
-            -200:  BranchingRatio(0.0253849, 0.964836, 59.4656),
-            200:  BranchingRatio(0.0251622, 0.9638, 59.4656),
-            1000:  BranchingRatio(0.024863, 0.95095, 59.4656)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.0250667, 0.951104, 59.4656),
-            -200:  BranchingRatio(0.0246714, 0.965954, 59.4656),
-            200:  BranchingRatio(0.024436, 0.96498, 59.4656),
-            1000:  BranchingRatio(0.0241203, 0.952605, 59.4656)
-        },
-        5: {
-            -1000:  BranchingRatio(0.0244283, 0.952715, 59.4656),
-            -200:  BranchingRatio(0.0240095, 0.967008, 59.4656),
-            200:  BranchingRatio(0.0237608, 0.966091, 59.4656),
-            1000:  BranchingRatio(0.0234281, 0.954166, 59.4656)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0238387, 0.954235, 59.4656),
-            -200:  BranchingRatio(0.0233953, 0.968002, 59.4656),
-            200:  BranchingRatio(0.0231329, 0.967139, 59.4656),
-            1000:  BranchingRatio(0.0227826, 0.95564, 59.4656)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0232947, 0.955671, 59.4656),
-            -200:  BranchingRatio(0.0228258, 0.96894, 59.4656),
-            200:  BranchingRatio(0.0225491, 0.968128, 59.4656),
-            1000:  BranchingRatio(0.0221806, 0.957033, 59.4656)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.0227933, 0.957029, 59.4656),
-            -200:  BranchingRatio(0.0222977, 0.969827, 59.4656),
-            200:  BranchingRatio(0.0220062, 0.969062, 59.4656),
-            1000:  BranchingRatio(0.0216189, 0.958352, 59.4656)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.0223316, 0.958314, 59.4656),
-            -200:  BranchingRatio(0.0218084, 0.970666, 59.4656),
-            200:  BranchingRatio(0.0215016, 0.969945, 59.4656),
-            1000:  BranchingRatio(0.0210948, 0.9596, 59.4656)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.0219073, 0.959531, 59.4656),
-            -200:  BranchingRatio(0.0213553, 0.971461, 59.4656),
-            200:  BranchingRatio(0.0210326, 0.970781, 59.4656),
-            1000:  BranchingRatio(0.0206058, 0.960784, 59.4656)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.021518, 0.960685, 59.4656),
-            -200:  BranchingRatio(0.0209361, 0.972214, 59.4656),
-            200:  BranchingRatio(0.0205971, 0.971573, 59.4656),
-            1000:  BranchingRatio(0.0201495, 0.961906, 59.4656)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.0211617, 0.96178, 59.4656),
-            -200:  BranchingRatio(0.0205488, 0.972929, 59.4656),
-            200:  BranchingRatio(0.0201928, 0.972324, 59.4656),
-            1000:  BranchingRatio(0.0197239, 0.962972, 59.4656)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.0208364, 0.962819, 59.4656),
-            -200:  BranchingRatio(0.0201913, 0.973607, 59.4656),
-            200:  BranchingRatio(0.0198178, 0.973036, 59.4656),
-            1000:  BranchingRatio(0.0193269, 0.963985, 59.4656)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.0205404, 0.963807, 59.4656),
-            -200:  BranchingRatio(0.019862, 0.974252, 59.4656),
-            200:  BranchingRatio(0.0194703, 0.973713, 59.4656),
-            1000:  BranchingRatio(0.0189568, 0.964947, 59.4656)
-        },
-        6: {
-            -1000:  BranchingRatio(0.0202722, 0.964746, 59.4656),
-            -200:  BranchingRatio(0.0195592, 0.974865, 59.4656),
-            200:  BranchingRatio(0.0191488, 0.974356, 59.4656),
-            1000:  BranchingRatio(0.0186119, 0.965864, 59.4656)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.0200302, 0.965639, 59.4656),
-            -200:  BranchingRatio(0.0192813, 0.975448, 59.4656),
-            200:  BranchingRatio(0.0188516, 0.974968, 59.4656),
-            1000:  BranchingRatio(0.0182907, 0.966736, 59.4656)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.019813, 0.96649, 59.4656),
-            -200:  BranchingRatio(0.0190271, 0.976004, 59.4656),
-            200:  BranchingRatio(0.0185774, 0.975551, 59.4656),
-            1000:  BranchingRatio(0.0179919, 0.967568, 59.4656)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.0196194, 0.967301, 59.4656),
-            -200:  BranchingRatio(0.0187951, 0.976534, 59.4656),
-            200:  BranchingRatio(0.0183249, 0.976106, 59.4656),
-            1000:  BranchingRatio(0.017714, 0.968361, 59.4656)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.0194483, 0.968075, 59.4656),
-            -200:  BranchingRatio(0.0185843, 0.977039, 59.4656),
-            200:  BranchingRatio(0.018093, 0.976635, 59.4656),
-            1000:  BranchingRatio(0.017456, 0.969118, 59.4656)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.0192986, 0.968813, 59.4656),
-            -200:  BranchingRatio(0.0183936, 0.977521, 59.4656),
-            200:  BranchingRatio(0.0178804, 0.977139, 59.4656),
-            1000:  BranchingRatio(0.0172166, 0.969841, 59.4656)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0191693, 0.969517, 59.4656),
-            -200:  BranchingRatio(0.0182218, 0.977981, 59.4656),
-            200:  BranchingRatio(0.0176862, 0.977621, 59.4656),
-            1000:  BranchingRatio(0.0169949, 0.970532, 59.4656)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.0190595, 0.97019, 59.4656),
-            -200:  BranchingRatio(0.0180682, 0.978422, 59.4656),
-            200:  BranchingRatio(0.0175094, 0.978082, 59.4656),
-            1000:  BranchingRatio(0.01679, 0.971193, 59.4656)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.0189683, 0.970834, 59.4656),
-            -200:  BranchingRatio(0.0179318, 0.978842, 59.4656),
-            200:  BranchingRatio(0.0173492, 0.978522, 59.4656),
-            1000:  BranchingRatio(0.0166008, 0.971826, 59.4656)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.018895, 0.971449, 59.4656),
-            -200:  BranchingRatio(0.0178118, 0.979245, 59.4656),
-            200:  BranchingRatio(0.0172047, 0.978943, 59.4656),
-            1000:  BranchingRatio(0.0164267, 0.972431, 59.4656)
-        },
-        7: {
-            -1000:  BranchingRatio(0.0188389, 0.972039, 59.4656),
-            -200:  BranchingRatio(0.0177074, 0.979631, 59.4656),
-            200:  BranchingRatio(0.0170752, 0.979346, 59.4656),
-            1000:  BranchingRatio(0.0162668, 0.973011, 59.4656)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.0187992, 0.972603, 59.4656),
-            -200:  BranchingRatio(0.017618, 0.98, 59.4656),
-            200:  BranchingRatio(0.01696, 0.979732, 59.4656),
-            1000:  BranchingRatio(0.0161204, 0.973567, 59.4656)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.0187753, 0.973143, 59.4656),
-            -200:  BranchingRatio(0.0175428, 0.980354, 59.4656),
-            200:  BranchingRatio(0.0168583, 0.980102, 59.4656),
-            1000:  BranchingRatio(0.0159868, 0.974101, 59.4656)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.0187666, 0.973662, 59.4656),
-            -200:  BranchingRatio(0.0174814, 0.980694, 59.4656),
-            200:  BranchingRatio(0.0167696, 0.980457, 59.4656),
-            1000:  BranchingRatio(0.0158655, 0.974613, 59.4656)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.0187727, 0.974159, 59.4656),
-            -200:  BranchingRatio(0.0174331, 0.98102, 59.4656),
-            200:  BranchingRatio(0.0166933, 0.980798, 59.4656),
-            1000:  BranchingRatio(0.0157557, 0.975104, 59.4656)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.018793, 0.974636, 59.4656),
-            -200:  BranchingRatio(0.0173973, 0.981333, 59.4656),
-            200:  BranchingRatio(0.0166288, 0.981124, 59.4656),
-            1000:  BranchingRatio(0.0156571, 0.975577, 59.4656)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.018827, 0.975094, 59.4656),
-            -200:  BranchingRatio(0.0173737, 0.981634, 59.4656),
-            200:  BranchingRatio(0.0165757, 0.981438, 59.4656),
-            1000:  BranchingRatio(0.015569, 0.976031, 59.4656)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.0188743, 0.975534, 59.4656),
-            -200:  BranchingRatio(0.0173616, 0.981923, 59.4656),
-            200:  BranchingRatio(0.0165334, 0.98174, 59.4656),
-            1000:  BranchingRatio(0.015491, 0.976467, 59.4656)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.0189345, 0.975957, 59.4656),
-            -200:  BranchingRatio(0.0173607, 0.982201, 59.4656),
-            200:  BranchingRatio(0.0165016, 0.98203, 59.4656),
-            1000:  BranchingRatio(0.0154226, 0.976887, 59.4656)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.0190072, 0.976363, 59.4656),
-            -200:  BranchingRatio(0.0173706, 0.982469, 59.4656),
-            200:  BranchingRatio(0.0164798, 0.982309, 59.4656),
-            1000:  BranchingRatio(0.0153635, 0.977292, 59.4656)
-        },
-        8: {
-            -1000:  BranchingRatio(0.019092, 0.976754, 59.4656),
-            -200:  BranchingRatio(0.0173908, 0.982726, 59.4656),
-            200:  BranchingRatio(0.0164675, 0.982578, 59.4656),
-            1000:  BranchingRatio(0.0153131, 0.977682, 59.4656)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.0191887, 0.97713, 59.4656),
-            -200:  BranchingRatio(0.0174211, 0.982974, 59.4656),
-            200:  BranchingRatio(0.0164645, 0.982836, 59.4656),
-            1000:  BranchingRatio(0.0152712, 0.978057, 59.4656)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.0192968, 0.977493, 59.4656),
-            -200:  BranchingRatio(0.017461, 0.983213, 59.4656),
-            200:  BranchingRatio(0.0164703, 0.983085, 59.4656),
-            1000:  BranchingRatio(0.0152373, 0.978419, 59.4656)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.0194162, 0.977842, 59.4656),
-            -200:  BranchingRatio(0.0175103, 0.983443, 59.4656),
-            200:  BranchingRatio(0.0164847, 0.983325, 59.4656),
-            1000:  BranchingRatio(0.0152112, 0.978768, 59.4656)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.0195465, 0.978178, 59.4656),
-            -200:  BranchingRatio(0.0175686, 0.983665, 59.4656),
-            200:  BranchingRatio(0.0165074, 0.983557, 59.4656),
-            1000:  BranchingRatio(0.0151925, 0.979105, 59.4656)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.0196874, 0.978501, 59.4656),
-            -200:  BranchingRatio(0.0176357, 0.983879, 59.4656),
-            200:  BranchingRatio(0.016538, 0.98378, 59.4656),
-            1000:  BranchingRatio(0.0151809, 0.97943, 59.4656)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.0198389, 0.978814, 59.4656),
-            -200:  BranchingRatio(0.0177113, 0.984086, 59.4656),
-            200:  BranchingRatio(0.0165763, 0.983995, 59.4656),
-            1000:  BranchingRatio(0.0151761, 0.979744, 59.4656)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.0200005, 0.979115, 59.4656),
-            -200:  BranchingRatio(0.0177952, 0.984285, 59.4656),
-            200:  BranchingRatio(0.0166219, 0.984203, 59.4656),
-            1000:  BranchingRatio(0.015178, 0.980047, 59.4656)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.0201722, 0.979406, 59.4656),
-            -200:  BranchingRatio(0.017887, 0.984478, 59.4656),
-            200:  BranchingRatio(0.0166748, 0.984404, 59.4656),
-            1000:  BranchingRatio(0.0151861, 0.98034, 59.4656)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.0203537, 0.979686, 59.4656),
-            -200:  BranchingRatio(0.0179867, 0.984664, 59.4656),
-            200:  BranchingRatio(0.0167345, 0.984598, 59.4656),
-            1000:  BranchingRatio(0.0152004, 0.980623, 59.4656)
-        },
-        9: {
-            -1000:  BranchingRatio(0.0205448, 0.979957, 59.4656),
-            -200:  BranchingRatio(0.0180939, 0.984844, 59.4656),
-            200:  BranchingRatio(0.016801, 0.984786, 59.4656),
-            1000:  BranchingRatio(0.0152205, 0.980897, 59.4656)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.0207454, 0.980218, 59.4656),
-            -200:  BranchingRatio(0.0182084, 0.985018, 59.4656),
-            200:  BranchingRatio(0.016874, 0.984967, 59.4656),
-            1000:  BranchingRatio(0.0152462, 0.981163, 59.4656)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.0209554, 0.980471, 59.4656),
-            -200:  BranchingRatio(0.0183302, 0.985186, 59.4656),
-            200:  BranchingRatio(0.0169532, 0.985143, 59.4656),
-            1000:  BranchingRatio(0.0152774, 0.981419, 59.4656)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.0211744, 0.980715, 59.4656),
-            -200:  BranchingRatio(0.0184589, 0.985349, 59.4656),
-            200:  BranchingRatio(0.0170386, 0.985313, 59.4656),
-            1000:  BranchingRatio(0.0153138, 0.981668, 59.4656)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.0214025, 0.980951, 59.4656),
-            -200:  BranchingRatio(0.0185945, 0.985507, 59.4656),
-            200:  BranchingRatio(0.0171299, 0.985477, 59.4656),
-            1000:  BranchingRatio(0.0153553, 0.981909, 59.4656)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.0216396, 0.981179, 59.4656),
-            -200:  BranchingRatio(0.0187367, 0.985659, 59.4656),
-            200:  BranchingRatio(0.017227, 0.985636, 59.4656),
-            1000:  BranchingRatio(0.0154017, 0.982142, 59.4656)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.0218853, 0.9814, 59.4656),
-            -200:  BranchingRatio(0.0188855, 0.985807, 59.4656),
-            200:  BranchingRatio(0.0173296, 0.98579, 59.4656),
-            1000:  BranchingRatio(0.0154528, 0.982368, 59.4656)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.0221398, 0.981614, 59.4656),
-            -200:  BranchingRatio(0.0190405, 0.98595, 59.4656),
-            200:  BranchingRatio(0.0174377, 0.985939, 59.4656),
-            1000:  BranchingRatio(0.0155085, 0.982587, 59.4656)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.0224027, 0.98182, 59.4656),
-            -200:  BranchingRatio(0.0192019, 0.986089, 59.4656),
-            200:  BranchingRatio(0.0175511, 0.986084, 59.4656),
-            1000:  BranchingRatio(0.0155685, 0.9828, 59.4656)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.0226742, 0.98202, 59.4656),
-            -200:  BranchingRatio(0.0193693, 0.986223, 59.4656),
-            200:  BranchingRatio(0.0176696, 0.986224, 59.4656),
-            1000:  BranchingRatio(0.0156329, 0.983006, 59.4656)
-        },
-        10: {
-            -1000:  BranchingRatio(0.022954, 0.982214, 59.4656),
-            -200:  BranchingRatio(0.0195427, 0.986354, 59.4656),
-            200:  BranchingRatio(0.0177932, 0.98636, 59.4656),
-            1000:  BranchingRatio(0.0157013, 0.983206, 59.4656)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0261957, 0.983848, 59.4656),
-            -200:  BranchingRatio(0.021581, 0.987464, 59.4656),
-            200:  BranchingRatio(0.0192797, 0.987521, 59.4656),
-            1000:  BranchingRatio(0.0165873, 0.98492, 59.4656)
-        },
-        12: {
-            -1000:  BranchingRatio(0.0302095, 0.985052, 59.4656),
-            -200:  BranchingRatio(0.0241144, 0.988302, 59.4656),
-            200:  BranchingRatio(0.0211582, 0.988401, 59.4656),
-            1000:  BranchingRatio(0.0177729, 0.986227, 59.4656)
-        },
-        13: {
-            -1000:  BranchingRatio(0.0349709, 0.985947, 59.4656),
-            -200:  BranchingRatio(0.0270831, 0.988947, 59.4656),
-            200:  BranchingRatio(0.0233614, 0.989083, 59.4656),
-            1000:  BranchingRatio(0.0191884, 0.987248, 59.4656)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0404772, 0.986611, 59.4656),
-            -200:  BranchingRatio(0.0304472, 0.989452, 59.4656),
-            200:  BranchingRatio(0.0258428, 0.989622, 59.4656),
-            1000:  BranchingRatio(0.0207853, 0.988062, 59.4656)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0467388, 0.987095, 59.4656),
-            -200:  BranchingRatio(0.034179, 0.989851, 59.4656),
-            200:  BranchingRatio(0.0285683, 0.990054, 59.4656),
-            1000:  BranchingRatio(0.0225288, 0.98872, 59.4656)
-        },
-        16: {
-            -1000:  BranchingRatio(0.0537746, 0.987431, 59.4656),
-            -200:  BranchingRatio(0.0382587, 0.99017, 59.4656),
-            200:  BranchingRatio(0.0315121, 0.990406, 59.4656),
-            1000:  BranchingRatio(0.0243923, 0.989262, 59.4656)
-        },
-        17: {
-            -1000:  BranchingRatio(0.0616092, 0.98764, 59.4656),
-            -200:  BranchingRatio(0.042671, 0.990426, 59.4656),
-            200:  BranchingRatio(0.0346539, 0.990696, 59.4656),
-            1000:  BranchingRatio(0.0263554, 0.989712, 59.4656)
-        },
-        18: {
-            -1000:  BranchingRatio(0.0702703, 0.987731, 59.4656),
-            -200:  BranchingRatio(0.0474039, 0.990632, 59.4656),
-            200:  BranchingRatio(0.037977, 0.990936, 59.4656),
-            1000:  BranchingRatio(0.0284021, 0.990092, 59.4656)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0797875, 0.987708, 59.4656),
-            -200:  BranchingRatio(0.0524474, 0.990797, 59.4656),
-            200:  BranchingRatio(0.0414672, 0.991138, 59.4656),
-            1000:  BranchingRatio(0.0305189, 0.990415, 59.4656)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0901912, 0.987562, 59.4656),
-            -200:  BranchingRatio(0.0577926, 0.990927, 59.4656),
-            200:  BranchingRatio(0.0451123, 0.991308, 59.4656),
-            1000:  BranchingRatio(0.0326948, 0.990692, 59.4656)
-        },
-        21: {
-            -1000:  BranchingRatio(0.101511, 0.987277, 59.4656),
-            -200:  BranchingRatio(0.0634315, 0.991029, 59.4656),
-            200:  BranchingRatio(0.0489014, 0.991452, 59.4656),
-            1000:  BranchingRatio(0.0349206, 0.990932, 59.4656)
-        },
-        22: {
-            -1000:  BranchingRatio(0.113775, 0.986822, 59.4656),
-            -200:  BranchingRatio(0.0693566, 0.991105, 59.4656),
-            200:  BranchingRatio(0.0528246, 0.991574, 59.4656),
-            1000:  BranchingRatio(0.0371883, 0.991143, 59.4656)
-        },
-        23: {
-            -1000:  BranchingRatio(0.12701, 0.986137, 59.4656),
-            -200:  BranchingRatio(0.0755605, 0.991158, 59.4656),
-            200:  BranchingRatio(0.0568729, 0.991679, 59.4656),
-            1000:  BranchingRatio(0.0394909, 0.991328, 59.4656)
-        },
-        24: {
-            -1000:  BranchingRatio(0.141238, 0.98511, 59.4656),
-            -200:  BranchingRatio(0.0820357, 0.991191, 59.4656),
-            200:  BranchingRatio(0.061038, 0.991768, 59.4656),
-            1000:  BranchingRatio(0.0418225, 0.991489, 59.4656)
-        },
-        25: {
-            -1000:  BranchingRatio(0.156478, 0.983541, 59.4656),
-            -200:  BranchingRatio(0.0887748, 0.991205, 59.4656),
-            200:  BranchingRatio(0.0653119, 0.991844, 59.4656),
-            1000:  BranchingRatio(0.0441777, 0.991632, 59.4656)
-        },
-        26: {
-            -1000:  BranchingRatio(0.172745, 0.980916, 59.4656),
-            -200:  BranchingRatio(0.0957703, 0.991201, 59.4656),
-            200:  BranchingRatio(0.0696873, 0.991909, 59.4656),
-            1000:  BranchingRatio(0.0465518, 0.991759, 59.4656)
-        },
-        27: {
-            -1000:  BranchingRatio(0.190045, 0.975714, 59.4656),
-            -200:  BranchingRatio(0.103014, 0.991178, 59.4656),
-            200:  BranchingRatio(0.0741572, 0.991964, 59.4656),
-            1000:  BranchingRatio(0.0489406, 0.991873, 59.4656)
-        },
-        28: {
-            -1000:  BranchingRatio(0.208381, 0.925386, 59.4656),
-            -200:  BranchingRatio(0.110499, 0.991137, 59.4656),
-            200:  BranchingRatio(0.0787149, 0.992011, 59.4656),
-            1000:  BranchingRatio(0.0513404, 0.991976, 59.4656)
-        },
-        29: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.118216, 0.991076, 59.4656),
-            200:  BranchingRatio(0.083354, 0.99205, 59.4656),
-            1000:  BranchingRatio(0.0537479, 0.992069, 59.4656)
-        },
-        30: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.126157, 0.990995, 59.4656),
-            200:  BranchingRatio(0.0880684, 0.992082, 59.4656),
-            1000:  BranchingRatio(0.0561599, 0.992153, 59.4656)
-        },
-        31: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.134313, 0.99089, 59.4656),
-            200:  BranchingRatio(0.0928522, 0.992107, 59.4656),
-            1000:  BranchingRatio(0.0585739, 0.992229, 59.4656)
-        },
-        32: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.142676, 0.990759, 59.4656),
-            200:  BranchingRatio(0.0976998, 0.992127, 59.4656),
-            1000:  BranchingRatio(0.0609873, 0.992299, 59.4656)
-        },
-        33: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.151235, 0.990598, 59.4656),
-            200:  BranchingRatio(0.102606, 0.992142, 59.4656),
-            1000:  BranchingRatio(0.0633979, 0.992363, 59.4656)
-        },
-        34: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.159982, 0.9904, 59.4656),
-            200:  BranchingRatio(0.107565, 0.992151, 59.4656),
-            1000:  BranchingRatio(0.0658038, 0.992422, 59.4656)
-        },
-        35: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.168907, 0.990156, 59.4656),
-            200:  BranchingRatio(0.112573, 0.992156, 59.4656),
-            1000:  BranchingRatio(0.0682032, 0.992476, 59.4656)
-        },
-        36: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.177999, 0.989852, 59.4656),
-            200:  BranchingRatio(0.117624, 0.992156, 59.4656),
-            1000:  BranchingRatio(0.0705944, 0.992526, 59.4656)
-        },
-        37: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.18725, 0.989467, 59.4656),
-            200:  BranchingRatio(0.122714, 0.992152, 59.4656),
-            1000:  BranchingRatio(0.072976, 0.992573, 59.4656)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.196649, 0.988963, 59.4656),
-            200:  BranchingRatio(0.127839, 0.992143, 59.4656),
-            1000:  BranchingRatio(0.0753466, 0.992615, 59.4656)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.206187, 0.988255, 59.4656),
-            200:  BranchingRatio(0.132994, 0.99213, 59.4656),
-            1000:  BranchingRatio(0.0777051, 0.992655, 59.4656)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.215852, 0.987093, 59.4656),
-            200:  BranchingRatio(0.138176, 0.992112, 59.4656),
-            1000:  BranchingRatio(0.0800503, 0.992692, 59.4656)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.225634, 0.987837, 59.4656),
-            200:  BranchingRatio(0.143379, 0.99209, 59.4656),
-            1000:  BranchingRatio(0.0823814, 0.992727, 59.4656)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.235525, 0.973659, 59.4656),
-            200:  BranchingRatio(0.148602, 0.992063, 59.4656),
-            1000:  BranchingRatio(0.0846975, 0.992759, 59.4656)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.15384, 0.992031, 59.4656),
-            1000:  BranchingRatio(0.0869979, 0.99279, 59.4656)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.159089, 0.991993, 59.4656),
-            1000:  BranchingRatio(0.0892817, 0.992818, 59.4656)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.164347, 0.991949, 59.4656),
-            1000:  BranchingRatio(0.0915485, 0.992845, 59.4656)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.169611, 0.991898, 59.4656),
-            1000:  BranchingRatio(0.0937977, 0.99287, 59.4656)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.174877, 0.99184, 59.4656),
-            1000:  BranchingRatio(0.0960288, 0.992894, 59.4656)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.180143, 0.991773, 59.4656),
-            1000:  BranchingRatio(0.0982414, 0.992916, 59.4656)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.185406, 0.991696, 59.4656),
-            1000:  BranchingRatio(0.100435, 0.992937, 59.4656)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.190664, 0.991606, 59.4656),
-            1000:  BranchingRatio(0.10261, 0.992957, 59.4656)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.195914, 0.991501, 59.4656),
-            1000:  BranchingRatio(0.104765, 0.992976, 59.4656)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.201154, 0.991375, 59.4656),
-            1000:  BranchingRatio(0.106901, 0.992994, 59.4656)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.206381, 0.991222, 59.4656),
-            1000:  BranchingRatio(0.109017, 0.99301, 59.4656)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.211595, 0.991027, 59.4656),
-            1000:  BranchingRatio(0.111112, 0.993027, 59.4656)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.216792, 0.990763, 59.4656),
-            1000:  BranchingRatio(0.113188, 0.993042, 59.4656)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.221971, 0.990352, 59.4656),
-            1000:  BranchingRatio(0.115244, 0.993056, 59.4656)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.227131, 0.990854, 59.4656),
-            1000:  BranchingRatio(0.11728, 0.99307, 59.4656)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.232269, 0.990173, 59.4656),
-            1000:  BranchingRatio(0.119295, 0.993083, 59.4656)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.237384, 0.98585, 59.4656),
-            1000:  BranchingRatio(0.12129, 0.993096, 59.4656)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.242475, 0.980845, 59.4656),
-            1000:  BranchingRatio(0.123265, 0.993108, 59.4656)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.12522, 0.993119, 59.4656)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.127154, 0.99313, 59.4656)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.129069, 0.99314, 59.4656)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.130964, 0.99315, 59.4656)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.132839, 0.99316, 59.4656)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.134694, 0.993169, 59.4656)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.136529, 0.993178, 59.4656)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.138345, 0.993186, 59.4656)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.140142, 0.993194, 59.4656)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.141919, 0.993202, 59.4656)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.143677, 0.993209, 59.4656)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.145417, 0.993217, 59.4656)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.147137, 0.993223, 59.4656)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.148839, 0.99323, 59.4656)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.150523, 0.993236, 59.4656)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.152188, 0.993242, 59.4656)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.153836, 0.993248, 59.4656)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.155465, 0.993254, 59.4656)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.157077, 0.99326, 59.4656)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.158671, 0.993266, 59.4656)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.160248, 0.993271, 59.4656)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.161808, 0.993276, 59.4656)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.163351, 0.993281, 59.4656)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.164877, 0.993285, 59.4656)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.166387, 0.993289, 59.4656)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.16788, 0.993294, 59.4656)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.169357, 0.993298, 59.4656)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.170818, 0.993302, 59.4656)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.172264, 0.993306, 59.4656)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.173693, 0.99331, 59.4656)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.175108, 0.993313, 59.4656)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.176507, 0.993316, 59.4656)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.177891, 0.993319, 59.4656)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.17926, 0.993322, 59.4656)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.180615, 0.993324, 59.4656)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.181955, 0.993326, 59.4656)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.183281, 0.993329, 59.4656)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.184593, 0.99333, 59.4656)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.185891, 0.993332, 59.4656)
-        }
-    },
-    110: {
-        1.1: {
-            -1000:  BranchingRatio(0.249978, 0.644843, 75.0744),
-            -200:  BranchingRatio(0.249968, 0.689907, 75.0744),
-            200:  BranchingRatio(0.24996, 0.688596, 75.0744),
-            1000:  BranchingRatio(0.249949, 0.650442, 75.0744)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.218918, 0.681638, 75.0744),
-            -200:  BranchingRatio(0.218906, 0.732598, 75.0744),
-            200:  BranchingRatio(0.218896, 0.729058, 75.0744),
-            1000:  BranchingRatio(0.218884, 0.687976, 75.0744)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.192912, 0.710043, 75.0744),
-            -200:  BranchingRatio(0.192898, 0.765018, 75.0744),
-            200:  BranchingRatio(0.192887, 0.759664, 75.0744),
-            1000:  BranchingRatio(0.192873, 0.716554, 75.0744)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.171018, 0.733367, 75.0744),
-            -200:  BranchingRatio(0.171001, 0.790561, 75.0744),
-            200:  BranchingRatio(0.170988, 0.783919, 75.0744),
-            1000:  BranchingRatio(0.170972, 0.739849, 75.0744)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.152475, 0.753636, 75.0744),
-            -200:  BranchingRatio(0.152455, 0.811511, 75.0744),
-            200:  BranchingRatio(0.152441, 0.804087, 75.0744),
-            1000:  BranchingRatio(0.152422, 0.760041, 75.0744)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.136676, 0.771962, 75.0744),
-            -200:  BranchingRatio(0.136654, 0.829299, 75.0744),
-            200:  BranchingRatio(0.136638, 0.821514, 75.0744),
-            1000:  BranchingRatio(0.136617, 0.778284, 75.0744)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.123136, 0.788894, 75.0744),
-            -200:  BranchingRatio(0.123111, 0.844783, 75.0744),
-            200:  BranchingRatio(0.123093, 0.83696, 75.0744),
-            1000:  BranchingRatio(0.123069, 0.79513, 75.0744)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.111464, 0.804708, 75.0744),
-            -200:  BranchingRatio(0.111436, 0.858478, 75.0744),
-            200:  BranchingRatio(0.111416, 0.850845, 75.0744),
-            1000:  BranchingRatio(0.111389, 0.810847, 75.0744)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.101347, 0.819437, 75.0744),
-            -200:  BranchingRatio(0.101316, 0.870718, 75.0744),
-            200:  BranchingRatio(0.101294, 0.863429, 75.0744),
-            1000:  BranchingRatio(0.101264, 0.825451, 75.0744)
-        },
-        2: {
-            -1000:  BranchingRatio(0.092533, 0.833134, 75.0744),
-            -200:  BranchingRatio(0.092498, 0.881673, 75.0744),
-            200:  BranchingRatio(0.0924742, 0.874817, 75.0744),
-            1000:  BranchingRatio(0.0924411, 0.838998, 75.0744)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0848152, 0.845812, 75.0744),
-            -200:  BranchingRatio(0.0847764, 0.891511, 75.0744),
-            200:  BranchingRatio(0.0847501, 0.885131, 75.0744),
-            1000:  BranchingRatio(0.0847136, 0.851499, 75.0744)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0780262, 0.857491, 75.0744),
-            -200:  BranchingRatio(0.0779832, 0.900347, 75.0744),
-            200:  BranchingRatio(0.0779543, 0.894458, 75.0744),
-            1000:  BranchingRatio(0.0779141, 0.862978, 75.0744)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.0720281, 0.868204, 75.0744),
-            -200:  BranchingRatio(0.0719806, 0.908282, 75.0744),
-            200:  BranchingRatio(0.0719489, 0.902877, 75.0744),
-            1000:  BranchingRatio(0.0719048, 0.873473, 75.0744)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.066707, 0.877996, 75.0744),
-            -200:  BranchingRatio(0.0666547, 0.915408, 75.0744),
-            200:  BranchingRatio(0.0666201, 0.910466, 75.0744),
-            1000:  BranchingRatio(0.0665718, 0.883035, 75.0744)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0619685, 0.886923, 75.0744),
-            -200:  BranchingRatio(0.0619111, 0.921807, 75.0744),
-            200:  BranchingRatio(0.0618733, 0.9173, 75.0744),
-            1000:  BranchingRatio(0.0618206, 0.891725, 75.0744)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0577337, 0.895044, 75.0744),
-            -200:  BranchingRatio(0.0576707, 0.927555, 75.0744),
-            200:  BranchingRatio(0.0576296, 0.923451, 75.0744),
-            1000:  BranchingRatio(0.0575722, 0.899607, 75.0744)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0539363, 0.902424, 75.0744),
-            -200:  BranchingRatio(0.0538676, 0.932721, 75.0744),
-            200:  BranchingRatio(0.0538228, 0.928987, 75.0744),
-            1000:  BranchingRatio(0.0537605, 0.90675, 75.0744)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0505207, 0.909125, 75.0744),
-            -200:  BranchingRatio(0.0504457, 0.937369, 75.0744),
-            200:  BranchingRatio(0.0503971, 0.933972, 75.0744),
-            1000:  BranchingRatio(0.0503296, 0.913219, 75.0744)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0474395, 0.91521, 75.0744),
-            -200:  BranchingRatio(0.0473578, 0.941556, 75.0744),
-            200:  BranchingRatio(0.0473052, 0.938464, 75.0744),
-            1000:  BranchingRatio(0.0472321, 0.919079, 75.0744)
-        },
-        3: {
-            -1000:  BranchingRatio(0.0446524, 0.920737, 75.0744),
-            -200:  BranchingRatio(0.0445637, 0.945331, 75.0744),
-            200:  BranchingRatio(0.0445068, 0.942516, 75.0744),
-            1000:  BranchingRatio(0.0444279, 0.924389, 75.0744)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0421251, 0.925759, 75.0744),
-            -200:  BranchingRatio(0.0420288, 0.948742, 75.0744),
-            200:  BranchingRatio(0.0419675, 0.946176, 75.0744),
-            1000:  BranchingRatio(0.0418824, 0.929206, 75.0744)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.0398279, 0.930328, 75.0744),
-            -200:  BranchingRatio(0.0397238, 0.951829, 75.0744),
-            200:  BranchingRatio(0.0396577, 0.949487, 75.0744),
-            1000:  BranchingRatio(0.0395661, 0.933579, 75.0744)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0377355, 0.934488, 75.0744),
-            -200:  BranchingRatio(0.037623, 0.954626, 75.0744),
-            200:  BranchingRatio(0.0375518, 0.952486, 75.0744),
-            1000:  BranchingRatio(0.0374534, 0.937554, 75.0744)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.0358258, 0.938281, 75.0744),
-            -200:  BranchingRatio(0.0357043, 0.957167, 75.0744),
-            200:  BranchingRatio(0.0356279, 0.955209, 75.0744),
-            1000:  BranchingRatio(0.0355223, 0.941173, 75.0744)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0340796, 0.941743, 75.0744),
-            -200:  BranchingRatio(0.0339488, 0.959479, 75.0744),
-            200:  BranchingRatio(0.0338668, 0.957685, 75.0744),
-            1000:  BranchingRatio(0.0337537, 0.944474, 75.0744)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0324803, 0.94491, 75.0744),
-            -200:  BranchingRatio(0.0323395, 0.961586, 75.0744),
-            200:  BranchingRatio(0.0322516, 0.95994, 75.0744),
-            1000:  BranchingRatio(0.0321307, 0.947488, 75.0744)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0310132, 0.94781, 75.0744),
-            -200:  BranchingRatio(0.030862, 0.963511, 75.0744),
-            200:  BranchingRatio(0.0307679, 0.961998, 75.0744),
-            1000:  BranchingRatio(0.0306387, 0.950245, 75.0744)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.0296655, 0.950469, 75.0744),
-            -200:  BranchingRatio(0.0295033, 0.965273, 75.0744),
-            200:  BranchingRatio(0.0294029, 0.96388, 75.0744),
-            1000:  BranchingRatio(0.029265, 0.952772, 75.0744)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.028426, 0.952913, 75.0744),
-            -200:  BranchingRatio(0.0282523, 0.966888, 75.0744),
-            200:  BranchingRatio(0.028145, 0.965604, 75.0744),
-            1000:  BranchingRatio(0.0279982, 0.955092, 75.0744)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0272848, 0.955161, 75.0744),
-            -200:  BranchingRatio(0.0270989, 0.968372, 75.0744),
-            200:  BranchingRatio(0.0269845, 0.967187, 75.0744),
-            1000:  BranchingRatio(0.0268283, 0.957225, 75.0744)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.0262329, 0.957233, 75.0744),
-            -200:  BranchingRatio(0.0260342, 0.969737, 75.0744),
-            200:  BranchingRatio(0.0259125, 0.968642, 75.0744),
-            1000:  BranchingRatio(0.0257465, 0.95919, 75.0744)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.0252627, 0.959146, 75.0744),
-            -200:  BranchingRatio(0.0250506, 0.970997, 75.0744),
-            200:  BranchingRatio(0.0249211, 0.969983, 75.0744),
-            1000:  BranchingRatio(0.0247449, 0.961003, 75.0744)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.0243671, 0.960915, 75.0744),
-            -200:  BranchingRatio(0.024141, 0.97216, 75.0744),
-            200:  BranchingRatio(0.0240034, 0.97122, 75.0744),
-            1000:  BranchingRatio(0.0238166, 0.96268, 75.0744)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0235399, 0.962553, 75.0744),
-            -200:  BranchingRatio(0.0232991, 0.973236, 75.0744),
-            200:  BranchingRatio(0.0231531, 0.972364, 75.0744),
-            1000:  BranchingRatio(0.0229552, 0.964231, 75.0744)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.0227756, 0.964073, 75.0744),
-            -200:  BranchingRatio(0.0225194, 0.974233, 75.0744),
-            200:  BranchingRatio(0.0223646, 0.973423, 75.0744),
-            1000:  BranchingRatio(0.0221553, 0.965671, 75.0744)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0220692, 0.965484, 75.0744),
-            -200:  BranchingRatio(0.021797, 0.975159, 75.0744),
-            200:  BranchingRatio(0.021633, 0.974405, 75.0744),
-            1000:  BranchingRatio(0.0214118, 0.967007, 75.0744)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.0214163, 0.966797, 75.0744),
-            -200:  BranchingRatio(0.0211272, 0.97602, 75.0744),
-            200:  BranchingRatio(0.0209538, 0.975318, 75.0744),
-            1000:  BranchingRatio(0.0207201, 0.968251, 75.0744)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.0208128, 0.96802, 75.0744),
-            -200:  BranchingRatio(0.0205062, 0.976822, 75.0744),
-            200:  BranchingRatio(0.0203228, 0.976167, 75.0744),
-            1000:  BranchingRatio(0.0200763, 0.969409, 75.0744)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.0202551, 0.969161, 75.0744),
-            -200:  BranchingRatio(0.0199302, 0.97757, 75.0744),
-            200:  BranchingRatio(0.0197365, 0.976959, 75.0744),
-            1000:  BranchingRatio(0.0194767, 0.97049, 75.0744)
-        },
-        5: {
-            -1000:  BranchingRatio(0.0197399, 0.970227, 75.0744),
-            -200:  BranchingRatio(0.0193959, 0.978268, 75.0744),
-            200:  BranchingRatio(0.0191915, 0.977697, 75.0744),
-            1000:  BranchingRatio(0.018918, 0.9715, 75.0744)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0192642, 0.971224, 75.0744),
-            -200:  BranchingRatio(0.0189004, 0.978921, 75.0744),
-            200:  BranchingRatio(0.0186849, 0.978388, 75.0744),
-            1000:  BranchingRatio(0.0183971, 0.972445, 75.0744)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0188254, 0.972157, 75.0744),
-            -200:  BranchingRatio(0.0184409, 0.979533, 75.0744),
-            200:  BranchingRatio(0.0182139, 0.979034, 75.0744),
-            1000:  BranchingRatio(0.0179114, 0.97333, 75.0744)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.0184211, 0.973033, 75.0744),
-            -200:  BranchingRatio(0.018015, 0.980107, 75.0744),
-            200:  BranchingRatio(0.0177761, 0.979639, 75.0744),
-            1000:  BranchingRatio(0.0174584, 0.97416, 75.0744)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.0180489, 0.973855, 75.0744),
-            -200:  BranchingRatio(0.0176204, 0.980646, 75.0744),
-            200:  BranchingRatio(0.0173691, 0.980207, 75.0744),
-            1000:  BranchingRatio(0.0170357, 0.97494, 75.0744)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.0177069, 0.974628, 75.0744),
-            -200:  BranchingRatio(0.0172552, 0.981152, 75.0744),
-            200:  BranchingRatio(0.0169911, 0.980741, 75.0744),
-            1000:  BranchingRatio(0.0166415, 0.975674, 75.0744)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.0173931, 0.975355, 75.0744),
-            -200:  BranchingRatio(0.0169173, 0.981629, 75.0744),
-            200:  BranchingRatio(0.0166399, 0.981243, 75.0744),
-            1000:  BranchingRatio(0.0162736, 0.976364, 75.0744)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.0171061, 0.976041, 75.0744),
-            -200:  BranchingRatio(0.0166052, 0.982078, 75.0744),
-            200:  BranchingRatio(0.0163141, 0.981716, 75.0744),
-            1000:  BranchingRatio(0.0159306, 0.977015, 75.0744)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.016844, 0.976687, 75.0744),
-            -200:  BranchingRatio(0.0163172, 0.982502, 75.0744),
-            200:  BranchingRatio(0.0160119, 0.982162, 75.0744),
-            1000:  BranchingRatio(0.0156106, 0.97763, 75.0744)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.0166057, 0.977297, 75.0744),
-            -200:  BranchingRatio(0.0160518, 0.982903, 75.0744),
-            200:  BranchingRatio(0.015732, 0.982582, 75.0744),
-            1000:  BranchingRatio(0.0153124, 0.97821, 75.0744)
-        },
-        6: {
-            -1000:  BranchingRatio(0.0163897, 0.977874, 75.0744),
-            -200:  BranchingRatio(0.0158079, 0.983281, 75.0744),
-            200:  BranchingRatio(0.0154729, 0.98298, 75.0744),
-            1000:  BranchingRatio(0.0150345, 0.978759, 75.0744)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.0161948, 0.978419, 75.0744),
-            -200:  BranchingRatio(0.0155841, 0.983639, 75.0744),
-            200:  BranchingRatio(0.0152335, 0.983356, 75.0744),
-            1000:  BranchingRatio(0.0147757, 0.979278, 75.0744)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.01602, 0.978936, 75.0744),
-            -200:  BranchingRatio(0.0153793, 0.983978, 75.0744),
-            200:  BranchingRatio(0.0150127, 0.983712, 75.0744),
-            1000:  BranchingRatio(0.014535, 0.979771, 75.0744)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.0158643, 0.979425, 75.0744),
-            -200:  BranchingRatio(0.0151926, 0.9843, 75.0744),
-            200:  BranchingRatio(0.0148093, 0.984049, 75.0744),
-            1000:  BranchingRatio(0.0143112, 0.980237, 75.0744)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.0157266, 0.979889, 75.0744),
-            -200:  BranchingRatio(0.0150229, 0.984605, 75.0744),
-            200:  BranchingRatio(0.0146225, 0.984369, 75.0744),
-            1000:  BranchingRatio(0.0141033, 0.980681, 75.0744)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.0156062, 0.98033, 75.0744),
-            -200:  BranchingRatio(0.0148693, 0.984895, 75.0744),
-            200:  BranchingRatio(0.0144513, 0.984673, 75.0744),
-            1000:  BranchingRatio(0.0139105, 0.981102, 75.0744)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0155022, 0.980749, 75.0744),
-            -200:  BranchingRatio(0.0147311, 0.985171, 75.0744),
-            200:  BranchingRatio(0.014295, 0.984962, 75.0744),
-            1000:  BranchingRatio(0.013732, 0.981502, 75.0744)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.0154139, 0.981147, 75.0744),
-            -200:  BranchingRatio(0.0146074, 0.985433, 75.0744),
-            200:  BranchingRatio(0.0141526, 0.985236, 75.0744),
-            1000:  BranchingRatio(0.0135669, 0.981883, 75.0744)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.0153407, 0.981526, 75.0744),
-            -200:  BranchingRatio(0.0144976, 0.985683, 75.0744),
-            200:  BranchingRatio(0.0140237, 0.985498, 75.0744),
-            1000:  BranchingRatio(0.0134146, 0.982246, 75.0744)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.0152818, 0.981887, 75.0744),
-            -200:  BranchingRatio(0.014401, 0.985921, 75.0744),
-            200:  BranchingRatio(0.0139073, 0.985747, 75.0744),
-            1000:  BranchingRatio(0.0132744, 0.982592, 75.0744)
-        },
-        7: {
-            -1000:  BranchingRatio(0.0152368, 0.982231, 75.0744),
-            -200:  BranchingRatio(0.014317, 0.986148, 75.0744),
-            200:  BranchingRatio(0.0138031, 0.985984, 75.0744),
-            1000:  BranchingRatio(0.0131456, 0.982922, 75.0744)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.015205, 0.98256, 75.0744),
-            -200:  BranchingRatio(0.0142451, 0.986365, 75.0744),
-            200:  BranchingRatio(0.0137103, 0.98621, 75.0744),
-            1000:  BranchingRatio(0.0130277, 0.983238, 75.0744)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.0151859, 0.982873, 75.0744),
-            -200:  BranchingRatio(0.0141847, 0.986572, 75.0744),
-            200:  BranchingRatio(0.0136284, 0.986427, 75.0744),
-            1000:  BranchingRatio(0.0129201, 0.983539, 75.0744)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.0151791, 0.983172, 75.0744),
-            -200:  BranchingRatio(0.0141352, 0.98677, 75.0744),
-            200:  BranchingRatio(0.013557, 0.986633, 75.0744),
-            1000:  BranchingRatio(0.0128224, 0.983827, 75.0744)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.0151842, 0.983458, 75.0744),
-            -200:  BranchingRatio(0.0140964, 0.986959, 75.0744),
-            200:  BranchingRatio(0.0134956, 0.986831, 75.0744),
-            1000:  BranchingRatio(0.012734, 0.984102, 75.0744)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.0152007, 0.983731, 75.0744),
-            -200:  BranchingRatio(0.0140676, 0.98714, 75.0744),
-            200:  BranchingRatio(0.0134437, 0.98702, 75.0744),
-            1000:  BranchingRatio(0.0126546, 0.984366, 75.0744)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.0152283, 0.983993, 75.0744),
-            -200:  BranchingRatio(0.0140486, 0.987313, 75.0744),
-            200:  BranchingRatio(0.0134009, 0.9872, 75.0744),
-            1000:  BranchingRatio(0.0125836, 0.984618, 75.0744)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.0152666, 0.984243, 75.0744),
-            -200:  BranchingRatio(0.0140389, 0.987479, 75.0744),
-            200:  BranchingRatio(0.0133668, 0.987374, 75.0744),
-            1000:  BranchingRatio(0.0125207, 0.98486, 75.0744)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.0153152, 0.984483, 75.0744),
-            -200:  BranchingRatio(0.0140383, 0.987639, 75.0744),
-            200:  BranchingRatio(0.0133412, 0.98754, 75.0744),
-            1000:  BranchingRatio(0.0124656, 0.985093, 75.0744)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.0153739, 0.984713, 75.0744),
-            -200:  BranchingRatio(0.0140462, 0.987791, 75.0744),
-            200:  BranchingRatio(0.0133236, 0.987699, 75.0744),
-            1000:  BranchingRatio(0.0124179, 0.985316, 75.0744)
-        },
-        8: {
-            -1000:  BranchingRatio(0.0154424, 0.984934, 75.0744),
-            -200:  BranchingRatio(0.0140626, 0.987938, 75.0744),
-            200:  BranchingRatio(0.0133137, 0.987852, 75.0744),
-            1000:  BranchingRatio(0.0123773, 0.98553, 75.0744)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.0155204, 0.985145, 75.0744),
-            -200:  BranchingRatio(0.014087, 0.988079, 75.0744),
-            200:  BranchingRatio(0.0133112, 0.987999, 75.0744),
-            1000:  BranchingRatio(0.0123435, 0.985735, 75.0744)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.0156077, 0.985349, 75.0744),
-            -200:  BranchingRatio(0.0141192, 0.988214, 75.0744),
-            200:  BranchingRatio(0.0133159, 0.98814, 75.0744),
-            1000:  BranchingRatio(0.0123161, 0.985933, 75.0744)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.0157041, 0.985544, 75.0744),
-            -200:  BranchingRatio(0.0141589, 0.988344, 75.0744),
-            200:  BranchingRatio(0.0133274, 0.988275, 75.0744),
-            1000:  BranchingRatio(0.012295, 0.986123, 75.0744)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.0158092, 0.985731, 75.0744),
-            -200:  BranchingRatio(0.0142059, 0.988469, 75.0744),
-            200:  BranchingRatio(0.0133456, 0.988406, 75.0744),
-            1000:  BranchingRatio(0.0122798, 0.986306, 75.0744)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.015923, 0.985912, 75.0744),
-            -200:  BranchingRatio(0.0142599, 0.98859, 75.0744),
-            200:  BranchingRatio(0.0133702, 0.988531, 75.0744),
-            1000:  BranchingRatio(0.0122704, 0.986482, 75.0744)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.0160452, 0.986085, 75.0744),
-            -200:  BranchingRatio(0.0143208, 0.988706, 75.0744),
-            200:  BranchingRatio(0.013401, 0.988652, 75.0744),
-            1000:  BranchingRatio(0.0122664, 0.986652, 75.0744)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.0161756, 0.986252, 75.0744),
-            -200:  BranchingRatio(0.0143883, 0.988817, 75.0744),
-            200:  BranchingRatio(0.0134377, 0.988768, 75.0744),
-            1000:  BranchingRatio(0.0122678, 0.986816, 75.0744)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.0163141, 0.986413, 75.0744),
-            -200:  BranchingRatio(0.0144623, 0.988925, 75.0744),
-            200:  BranchingRatio(0.0134802, 0.988881, 75.0744),
-            1000:  BranchingRatio(0.0122742, 0.986973, 75.0744)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.0164605, 0.986568, 75.0744),
-            -200:  BranchingRatio(0.0145426, 0.989029, 75.0744),
-            200:  BranchingRatio(0.0135282, 0.988989, 75.0744),
-            1000:  BranchingRatio(0.0122856, 0.987126, 75.0744)
-        },
-        9: {
-            -1000:  BranchingRatio(0.0166147, 0.986717, 75.0744),
-            -200:  BranchingRatio(0.0146289, 0.989129, 75.0744),
-            200:  BranchingRatio(0.0135817, 0.989093, 75.0744),
-            1000:  BranchingRatio(0.0123016, 0.987273, 75.0744)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.0167766, 0.98686, 75.0744),
-            -200:  BranchingRatio(0.0147212, 0.989226, 75.0744),
-            200:  BranchingRatio(0.0136404, 0.989193, 75.0744),
-            1000:  BranchingRatio(0.0123222, 0.987414, 75.0744)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.016946, 0.986999, 75.0744),
-            -200:  BranchingRatio(0.0148193, 0.989319, 75.0744),
-            200:  BranchingRatio(0.0137041, 0.989291, 75.0744),
-            1000:  BranchingRatio(0.0123472, 0.987551, 75.0744)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.0171228, 0.987133, 75.0744),
-            -200:  BranchingRatio(0.014923, 0.989409, 75.0744),
-            200:  BranchingRatio(0.0137728, 0.989384, 75.0744),
-            1000:  BranchingRatio(0.0123763, 0.987684, 75.0744)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.0173068, 0.987262, 75.0744),
-            -200:  BranchingRatio(0.0150322, 0.989496, 75.0744),
-            200:  BranchingRatio(0.0138462, 0.989475, 75.0744),
-            1000:  BranchingRatio(0.0124096, 0.987812, 75.0744)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.0174981, 0.987386, 75.0744),
-            -200:  BranchingRatio(0.0151468, 0.98958, 75.0744),
-            200:  BranchingRatio(0.0139243, 0.989563, 75.0744),
-            1000:  BranchingRatio(0.0124468, 0.987935, 75.0744)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.0176965, 0.987506, 75.0744),
-            -200:  BranchingRatio(0.0152666, 0.989661, 75.0744),
-            200:  BranchingRatio(0.0140069, 0.989647, 75.0744),
-            1000:  BranchingRatio(0.0124878, 0.988055, 75.0744)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.0179018, 0.987622, 75.0744),
-            -200:  BranchingRatio(0.0153915, 0.98974, 75.0744),
-            200:  BranchingRatio(0.0140939, 0.989729, 75.0744),
-            1000:  BranchingRatio(0.0125324, 0.988171, 75.0744)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.0181141, 0.987735, 75.0744),
-            -200:  BranchingRatio(0.0155215, 0.989816, 75.0744),
-            200:  BranchingRatio(0.0141851, 0.989808, 75.0744),
-            1000:  BranchingRatio(0.0125806, 0.988283, 75.0744)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.0183332, 0.987843, 75.0744),
-            -200:  BranchingRatio(0.0156564, 0.98989, 75.0744),
-            200:  BranchingRatio(0.0142805, 0.989885, 75.0744),
-            1000:  BranchingRatio(0.0126323, 0.988392, 75.0744)
-        },
-        10: {
-            -1000:  BranchingRatio(0.0185591, 0.987948, 75.0744),
-            -200:  BranchingRatio(0.0157961, 0.989961, 75.0744),
-            200:  BranchingRatio(0.01438, 0.989959, 75.0744),
-            1000:  BranchingRatio(0.0126873, 0.988497, 75.0744)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0211778, 0.988827, 75.0744),
-            -200:  BranchingRatio(0.0174392, 0.990564, 75.0744),
-            200:  BranchingRatio(0.0155766, 0.990589, 75.0744),
-            1000:  BranchingRatio(0.0133989, 0.989391, 75.0744)
-        },
-        12: {
-            -1000:  BranchingRatio(0.0244245, 0.989469, 75.0744),
-            -200:  BranchingRatio(0.0194833, 0.991014, 75.0744),
-            200:  BranchingRatio(0.0170901, 0.99106, 75.0744),
-            1000:  BranchingRatio(0.014352, 0.990066, 75.0744)
-        },
-        13: {
-            -1000:  BranchingRatio(0.0282824, 0.989945, 75.0744),
-            -200:  BranchingRatio(0.021881, 0.991358, 75.0744),
-            200:  BranchingRatio(0.0188666, 0.991422, 75.0744),
-            1000:  BranchingRatio(0.0154908, 0.990587, 75.0744)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0327528, 0.990299, 75.0744),
-            -200:  BranchingRatio(0.0246016, 0.991626, 75.0744),
-            200:  BranchingRatio(0.0208694, 0.991706, 75.0744),
-            1000:  BranchingRatio(0.0167766, 0.991, 75.0744)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0378482, 0.99056, 75.0744),
-            -200:  BranchingRatio(0.0276238, 0.991837, 75.0744),
-            200:  BranchingRatio(0.0230715, 0.991933, 75.0744),
-            1000:  BranchingRatio(0.0181813, 0.991332, 75.0744)
-        },
-        16: {
-            -1000:  BranchingRatio(0.043589, 0.990747, 75.0744),
-            -200:  BranchingRatio(0.0309329, 0.992006, 75.0744),
-            200:  BranchingRatio(0.0254528, 0.992117, 75.0744),
-            1000:  BranchingRatio(0.019684, 0.991603, 75.0744)
-        },
-        17: {
-            -1000:  BranchingRatio(0.0500005, 0.990872, 75.0744),
-            -200:  BranchingRatio(0.0345179, 0.992141, 75.0744),
-            200:  BranchingRatio(0.0279975, 0.992268, 75.0744),
-            1000:  BranchingRatio(0.0212684, 0.991828, 75.0744)
-        },
-        18: {
-            -1000:  BranchingRatio(0.057112, 0.990942, 75.0744),
-            -200:  BranchingRatio(0.0383706, 0.99225, 75.0744),
-            200:  BranchingRatio(0.0306924, 0.992393, 75.0744),
-            1000:  BranchingRatio(0.0229215, 0.992017, 75.0744)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0649552, 0.990961, 75.0744),
-            -200:  BranchingRatio(0.0424841, 0.992338, 75.0744),
-            200:  BranchingRatio(0.0335268, 0.992498, 75.0744),
-            1000:  BranchingRatio(0.0246328, 0.992177, 75.0744)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0735635, 0.990928, 75.0744),
-            -200:  BranchingRatio(0.0468529, 0.992408, 75.0744),
-            200:  BranchingRatio(0.0364913, 0.992586, 75.0744),
-            1000:  BranchingRatio(0.0263934, 0.992314, 75.0744)
-        },
-        21: {
-            -1000:  BranchingRatio(0.0829712, 0.99084, 75.0744),
-            -200:  BranchingRatio(0.0514721, 0.992464, 75.0744),
-            200:  BranchingRatio(0.0395776, 0.992661, 75.0744),
-            1000:  BranchingRatio(0.0281961, 0.992432, 75.0744)
-        },
-        22: {
-            -1000:  BranchingRatio(0.0932131, 0.990689, 75.0744),
-            -200:  BranchingRatio(0.056337, 0.992508, 75.0744),
-            200:  BranchingRatio(0.0427781, 0.992725, 75.0744),
-            1000:  BranchingRatio(0.0300344, 0.992535, 75.0744)
-        },
-        23: {
-            -1000:  BranchingRatio(0.104323, 0.990463, 75.0744),
-            -200:  BranchingRatio(0.0614433, 0.99254, 75.0744),
-            200:  BranchingRatio(0.0460861, 0.99278, 75.0744),
-            1000:  BranchingRatio(0.0319028, 0.992625, 75.0744)
-        },
-        24: {
-            -1000:  BranchingRatio(0.116335, 0.99014, 75.0744),
-            -200:  BranchingRatio(0.0667868, 0.992563, 75.0744),
-            200:  BranchingRatio(0.0494951, 0.992826, 75.0744),
-            1000:  BranchingRatio(0.0337964, 0.992705, 75.0744)
-        },
-        25: {
-            -1000:  BranchingRatio(0.129279, 0.989687, 75.0744),
-            -200:  BranchingRatio(0.0723631, 0.992577, 75.0744),
-            200:  BranchingRatio(0.0529993, 0.992867, 75.0744),
-            1000:  BranchingRatio(0.0357112, 0.992776, 75.0744)
-        },
-        26: {
-            -1000:  BranchingRatio(0.143185, 0.989049, 75.0744),
-            -200:  BranchingRatio(0.0781677, 0.992582, 75.0744),
-            200:  BranchingRatio(0.056593, 0.992901, 75.0744),
-            1000:  BranchingRatio(0.0376431, 0.992839, 75.0744)
-        },
-        27: {
-            -1000:  BranchingRatio(0.158079, 0.988133, 75.0744),
-            -200:  BranchingRatio(0.0841962, 0.99258, 75.0744),
-            200:  BranchingRatio(0.0602709, 0.992931, 75.0744),
-            1000:  BranchingRatio(0.039589, 0.992896, 75.0744)
-        },
-        28: {
-            -1000:  BranchingRatio(0.173981, 0.986759, 75.0744),
-            -200:  BranchingRatio(0.0904437, 0.99257, 75.0744),
-            200:  BranchingRatio(0.064028, 0.992957, 75.0744),
-            1000:  BranchingRatio(0.0415457, 0.992947, 75.0744)
-        },
-        29: {
-            -1000:  BranchingRatio(0.19091, 0.98451, 75.0744),
-            -200:  BranchingRatio(0.0969052, 0.992552, 75.0744),
-            200:  BranchingRatio(0.0678593, 0.992979, 75.0744),
-            1000:  BranchingRatio(0.0435106, 0.992994, 75.0744)
-        },
-        30: {
-            -1000:  BranchingRatio(0.208875, 0.97989, 75.0744),
-            -200:  BranchingRatio(0.103576, 0.992527, 75.0744),
-            200:  BranchingRatio(0.0717603, 0.992997, 75.0744),
-            1000:  BranchingRatio(0.0454811, 0.993035, 75.0744)
-        },
-        31: {
-            -1000:  BranchingRatio(0.227882, 0.949146, 75.0744),
-            -200:  BranchingRatio(0.110449, 0.992494, 75.0744),
-            200:  BranchingRatio(0.0757265, 0.993013, 75.0744),
-            1000:  BranchingRatio(0.0474552, 0.993072, 75.0744)
-        },
-        32: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.117521, 0.992451, 75.0744),
-            200:  BranchingRatio(0.0797535, 0.993025, 75.0744),
-            1000:  BranchingRatio(0.0494308, 0.993107, 75.0744)
-        },
-        33: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.124784, 0.9924, 75.0744),
-            200:  BranchingRatio(0.0838372, 0.993036, 75.0744),
-            1000:  BranchingRatio(0.0514061, 0.993138, 75.0744)
-        },
-        34: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.132234, 0.992338, 75.0744),
-            200:  BranchingRatio(0.0879736, 0.993044, 75.0744),
-            1000:  BranchingRatio(0.0533795, 0.993167, 75.0744)
-        },
-        35: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.139863, 0.992265, 75.0744),
-            200:  BranchingRatio(0.0921588, 0.99305, 75.0744),
-            1000:  BranchingRatio(0.0553494, 0.993193, 75.0744)
-        },
-        36: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.147664, 0.992179, 75.0744),
-            200:  BranchingRatio(0.0963891, 0.993054, 75.0744),
-            1000:  BranchingRatio(0.0573145, 0.993218, 75.0744)
-        },
-        37: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.155632, 0.992078, 75.0744),
-            200:  BranchingRatio(0.100661, 0.993056, 75.0744),
-            1000:  BranchingRatio(0.0592737, 0.99324, 75.0744)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.163758, 0.991959, 75.0744),
-            200:  BranchingRatio(0.104971, 0.993057, 75.0744),
-            1000:  BranchingRatio(0.0612257, 0.993261, 75.0744)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.172037, 0.99182, 75.0744),
-            200:  BranchingRatio(0.109316, 0.993056, 75.0744),
-            1000:  BranchingRatio(0.0631697, 0.993281, 75.0744)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.18046, 0.991655, 75.0744),
-            200:  BranchingRatio(0.113692, 0.993053, 75.0744),
-            1000:  BranchingRatio(0.0651046, 0.993299, 75.0744)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.189021, 0.99146, 75.0744),
-            200:  BranchingRatio(0.118096, 0.993049, 75.0744),
-            1000:  BranchingRatio(0.0670296, 0.993316, 75.0744)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.197712, 0.991224, 75.0744),
-            200:  BranchingRatio(0.122526, 0.993043, 75.0744),
-            1000:  BranchingRatio(0.0689441, 0.993332, 75.0744)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.206525, 0.990937, 75.0744),
-            200:  BranchingRatio(0.126979, 0.993036, 75.0744),
-            1000:  BranchingRatio(0.0708474, 0.993347, 75.0744)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.215452, 0.990578, 75.0744),
-            200:  BranchingRatio(0.131451, 0.993028, 75.0744),
-            1000:  BranchingRatio(0.0727388, 0.993361, 75.0744)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.224487, 0.990113, 75.0744),
-            200:  BranchingRatio(0.13594, 0.993017, 75.0744),
-            1000:  BranchingRatio(0.0746178, 0.993374, 75.0744)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.23362, 0.98947, 75.0744),
-            200:  BranchingRatio(0.140444, 0.993006, 75.0744),
-            1000:  BranchingRatio(0.076484, 0.993386, 75.0744)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.242845, 0.98845, 75.0744),
-            200:  BranchingRatio(0.14496, 0.992992, 75.0744),
-            1000:  BranchingRatio(0.0783369, 0.993398, 75.0744)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.252153, 0.988136, 75.0744),
-            200:  BranchingRatio(0.149485, 0.992978, 75.0744),
-            1000:  BranchingRatio(0.0801761, 0.993409, 75.0744)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.261537, 0.980014, 75.0744),
-            200:  BranchingRatio(0.154018, 0.992961, 75.0744),
-            1000:  BranchingRatio(0.0820013, 0.993419, 75.0744)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.270988, 0.961832, 75.0744),
-            200:  BranchingRatio(0.158557, 0.992943, 75.0744),
-            1000:  BranchingRatio(0.0838122, 0.993429, 75.0744)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.2805, 0.941425, 75.0744),
-            200:  BranchingRatio(0.163098, 0.992923, 75.0744),
-            1000:  BranchingRatio(0.0856086, 0.993438, 75.0744)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.167641, 0.992901, 75.0744),
-            1000:  BranchingRatio(0.0873901, 0.993447, 75.0744)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.172183, 0.992877, 75.0744),
-            1000:  BranchingRatio(0.0891567, 0.993455, 75.0744)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.176723, 0.99285, 75.0744),
-            1000:  BranchingRatio(0.0909082, 0.993463, 75.0744)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.181258, 0.992821, 75.0744),
-            1000:  BranchingRatio(0.0926444, 0.993471, 75.0744)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.185788, 0.99279, 75.0744),
-            1000:  BranchingRatio(0.0943653, 0.993478, 75.0744)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.19031, 0.992756, 75.0744),
-            1000:  BranchingRatio(0.0960707, 0.993485, 75.0744)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.194823, 0.992718, 75.0744),
-            1000:  BranchingRatio(0.0977606, 0.993491, 75.0744)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.199326, 0.992677, 75.0744),
-            1000:  BranchingRatio(0.0994349, 0.993497, 75.0744)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.203817, 0.992632, 75.0744),
-            1000:  BranchingRatio(0.101094, 0.993503, 75.0744)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.208296, 0.992582, 75.0744),
-            1000:  BranchingRatio(0.102737, 0.993509, 75.0744)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.21276, 0.992527, 75.0744),
-            1000:  BranchingRatio(0.104364, 0.993515, 75.0744)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.217208, 0.992466, 75.0744),
-            1000:  BranchingRatio(0.105976, 0.99352, 75.0744)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.221641, 0.992396, 75.0744),
-            1000:  BranchingRatio(0.107573, 0.993525, 75.0744)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.226055, 0.992318, 75.0744),
-            1000:  BranchingRatio(0.109154, 0.99353, 75.0744)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.230452, 0.992227, 75.0744),
-            1000:  BranchingRatio(0.110719, 0.993534, 75.0744)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.234829, 0.992121, 75.0744),
-            1000:  BranchingRatio(0.112269, 0.993539, 75.0744)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.239186, 0.991993, 75.0744),
-            1000:  BranchingRatio(0.113804, 0.993543, 75.0744)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.243521, 0.991833, 75.0744),
-            1000:  BranchingRatio(0.115323, 0.993547, 75.0744)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.247835, 0.991619, 75.0744),
-            1000:  BranchingRatio(0.116828, 0.993552, 75.0744)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.252127, 0.991404, 75.0744),
-            1000:  BranchingRatio(0.118317, 0.993555, 75.0744)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.256395, 0.991571, 75.0744),
-            1000:  BranchingRatio(0.119791, 0.993559, 75.0744)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.260639, 0.991777, 75.0744),
-            1000:  BranchingRatio(0.121251, 0.993563, 75.0744)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.264859, 0.989458, 75.0744),
-            1000:  BranchingRatio(0.122696, 0.993566, 75.0744)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.269054, 0.98657, 75.0744),
-            1000:  BranchingRatio(0.124126, 0.99357, 75.0744)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.273224, 0.983378, 75.0744),
-            1000:  BranchingRatio(0.125542, 0.993573, 75.0744)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.277368, 0.980003, 75.0744),
-            1000:  BranchingRatio(0.126943, 0.993576, 75.0744)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.281485, 0.976546, 75.0744),
-            1000:  BranchingRatio(0.12833, 0.993579, 75.0744)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.285576, 0.973128, 75.0744),
-            1000:  BranchingRatio(0.129703, 0.993582, 75.0744)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.28964, 0.970051, 75.0744),
-            1000:  BranchingRatio(0.131062, 0.993585, 75.0744)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.132407, 0.993588, 75.0744)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.133738, 0.993591, 75.0744)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.135056, 0.993593, 75.0744)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.13636, 0.993595, 75.0744)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.137651, 0.993598, 75.0744)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.138929, 0.9936, 75.0744)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.140193, 0.993602, 75.0744)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.141445, 0.993604, 75.0744)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.142684, 0.993606, 75.0744)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.14391, 0.993608, 75.0744)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.145124, 0.99361, 75.0744)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.146326, 0.993612, 75.0744)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.147515, 0.993613, 75.0744)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.148692, 0.993615, 75.0744)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.149858, 0.993616, 75.0744)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.151011, 0.993618, 75.0744)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.152153, 0.993619, 75.0744)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.153283, 0.99362, 75.0744)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(-1, -1, -1),
-            1000:  BranchingRatio(0.154402, 0.993621, 75.0744)
-        }
-    },
-    120: {
-        1.1: {
-            -1000:  BranchingRatio(0.201798, 0.580384, 89.0851),
-            -200:  BranchingRatio(0.201788, 0.629491, 89.0851),
-            200:  BranchingRatio(0.20178, 0.623967, 89.0851),
-            1000:  BranchingRatio(0.20177, 0.580922, 89.0851)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.175339, 0.627524, 89.0851),
-            -200:  BranchingRatio(0.175327, 0.681541, 89.0851),
-            200:  BranchingRatio(0.175318, 0.67419, 89.0851),
-            1000:  BranchingRatio(0.175306, 0.62941, 89.0851)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.153505, 0.665733, 89.0851),
-            -200:  BranchingRatio(0.153492, 0.722773, 89.0851),
-            200:  BranchingRatio(0.153482, 0.714092, 89.0851),
-            1000:  BranchingRatio(0.153468, 0.668803, 89.0851)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.135345, 0.697966, 89.0851),
-            -200:  BranchingRatio(0.13533, 0.756318, 89.0851),
-            200:  BranchingRatio(0.135319, 0.74686, 89.0851),
-            1000:  BranchingRatio(0.135303, 0.702153, 89.0851)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.120122, 0.726345, 89.0851),
-            -200:  BranchingRatio(0.120104, 0.784396, 89.0851),
-            200:  BranchingRatio(0.120092, 0.774654, 89.0851),
-            1000:  BranchingRatio(0.120075, 0.731384, 89.0851)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.107263, 0.751911, 89.0851),
-            -200:  BranchingRatio(0.107243, 0.808434, 89.0851),
-            200:  BranchingRatio(0.107229, 0.798798, 89.0851),
-            1000:  BranchingRatio(0.10721, 0.757569, 89.0851)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.0963227, 0.775187, 89.0851),
-            -200:  BranchingRatio(0.0963008, 0.829321, 89.0851),
-            200:  BranchingRatio(0.0962854, 0.820068, 89.0851),
-            1000:  BranchingRatio(0.0962641, 0.781259, 89.0851)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.0869513, 0.796459, 89.0851),
-            -200:  BranchingRatio(0.0869269, 0.847618, 89.0851),
-            200:  BranchingRatio(0.0869099, 0.838923, 89.0851),
-            1000:  BranchingRatio(0.0868864, 0.80277, 89.0851)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.0788727, 0.815793, 89.0851),
-            -200:  BranchingRatio(0.0788455, 0.863725, 89.0851),
-            200:  BranchingRatio(0.0788269, 0.855686, 89.0851),
-            1000:  BranchingRatio(0.0788009, 0.822191, 89.0851)
-        },
-        2: {
-            -1000:  BranchingRatio(0.0718669, 0.833313, 89.0851),
-            -200:  BranchingRatio(0.0718368, 0.877884, 89.0851),
-            200:  BranchingRatio(0.0718164, 0.870538, 89.0851),
-            1000:  BranchingRatio(0.0717879, 0.839681, 89.0851)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0657577, 0.849113, 89.0851),
-            -200:  BranchingRatio(0.0657246, 0.890344, 89.0851),
-            200:  BranchingRatio(0.0657022, 0.883687, 89.0851),
-            1000:  BranchingRatio(0.065671, 0.855358, 89.0851)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.060403, 0.863298, 89.0851),
-            -200:  BranchingRatio(0.0603665, 0.9013, 89.0851),
-            200:  BranchingRatio(0.0603421, 0.895302, 89.0851),
-            1000:  BranchingRatio(0.0603079, 0.869353, 89.0851)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.0556869, 0.875987, 89.0851),
-            -200:  BranchingRatio(0.0556469, 0.910927, 89.0851),
-            200:  BranchingRatio(0.0556203, 0.905546, 89.0851),
-            1000:  BranchingRatio(0.055583, 0.881805, 89.0851)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.0515149, 0.887306, 89.0851),
-            -200:  BranchingRatio(0.0514711, 0.919385, 89.0851),
-            200:  BranchingRatio(0.0514421, 0.914569, 89.0851),
-            1000:  BranchingRatio(0.0514016, 0.892856, 89.0851)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0478088, 0.897383, 89.0851),
-            -200:  BranchingRatio(0.047761, 0.926818, 89.0851),
-            200:  BranchingRatio(0.0477295, 0.922513, 89.0851),
-            1000:  BranchingRatio(0.0476855, 0.90265, 89.0851)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.044504, 0.906346, 89.0851),
-            -200:  BranchingRatio(0.0444518, 0.933353, 89.0851),
-            200:  BranchingRatio(0.0444177, 0.929507, 89.0851),
-            1000:  BranchingRatio(0.04437, 0.911322, 89.0851)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0415464, 0.914315, 89.0851),
-            -200:  BranchingRatio(0.0414897, 0.939106, 89.0851),
-            200:  BranchingRatio(0.0414527, 0.935669, 89.0851),
-            1000:  BranchingRatio(0.0414012, 0.919, 89.0851)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0388909, 0.9214, 89.0851),
-            -200:  BranchingRatio(0.0388292, 0.944177, 89.0851),
-            200:  BranchingRatio(0.0387893, 0.941104, 89.0851),
-            1000:  BranchingRatio(0.0387337, 0.925803, 89.0851)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0364992, 0.927704, 89.0851),
-            -200:  BranchingRatio(0.0364323, 0.948654, 89.0851),
-            200:  BranchingRatio(0.0363892, 0.945903, 89.0851),
-            1000:  BranchingRatio(0.0363293, 0.931834, 89.0851)
-        },
-        3: {
-            -1000:  BranchingRatio(0.0343389, 0.93332, 89.0851),
-            -200:  BranchingRatio(0.0342665, 0.952616, 89.0851),
-            200:  BranchingRatio(0.0342201, 0.950149, 89.0851),
-            1000:  BranchingRatio(0.0341556, 0.937189, 89.0851)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0323825, 0.938329, 89.0851),
-            -200:  BranchingRatio(0.0323043, 0.956128, 89.0851),
-            200:  BranchingRatio(0.0322543, 0.953912, 89.0851),
-            1000:  BranchingRatio(0.032185, 0.941952, 89.0851)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.0306064, 0.942804, 89.0851),
-            -200:  BranchingRatio(0.030522, 0.959248, 89.0851),
-            200:  BranchingRatio(0.0304684, 0.957255, 89.0851),
-            1000:  BranchingRatio(0.030394, 0.946195, 89.0851)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0289904, 0.946809, 89.0851),
-            -200:  BranchingRatio(0.0288994, 0.962028, 89.0851),
-            200:  BranchingRatio(0.0288419, 0.960231, 89.0851),
-            1000:  BranchingRatio(0.0287622, 0.949983, 89.0851)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.0275168, 0.9504, 89.0851),
-            -200:  BranchingRatio(0.027419, 0.96451, 89.0851),
-            200:  BranchingRatio(0.0273573, 0.962887, 89.0851),
-            1000:  BranchingRatio(0.0272721, 0.953372, 89.0851)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0261707, 0.953627, 89.0851),
-            -200:  BranchingRatio(0.0260656, 0.966731, 89.0851),
-            200:  BranchingRatio(0.0259996, 0.965262, 89.0851),
-            1000:  BranchingRatio(0.0259086, 0.956411, 89.0851)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0249389, 0.956532, 89.0851),
-            -200:  BranchingRatio(0.024826, 0.968725, 89.0851),
-            200:  BranchingRatio(0.0247555, 0.967392, 89.0851),
-            1000:  BranchingRatio(0.0246584, 0.959142, 89.0851)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0238097, 0.959153, 89.0851),
-            -200:  BranchingRatio(0.0236888, 0.970517, 89.0851),
-            200:  BranchingRatio(0.0236135, 0.969307, 89.0851),
-            1000:  BranchingRatio(0.02351, 0.961602, 89.0851)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.0227732, 0.961524, 89.0851),
-            -200:  BranchingRatio(0.0226438, 0.972134, 89.0851),
-            200:  BranchingRatio(0.0225635, 0.971032, 89.0851),
-            1000:  BranchingRatio(0.0224533, 0.963822, 89.0851)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.0218205, 0.963672, 89.0851),
-            -200:  BranchingRatio(0.0216821, 0.973595, 89.0851),
-            200:  BranchingRatio(0.0215966, 0.972589, 89.0851),
-            1000:  BranchingRatio(0.0214795, 0.965832, 89.0851)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0209439, 0.965622, 89.0851),
-            -200:  BranchingRatio(0.020796, 0.974919, 89.0851),
-            200:  BranchingRatio(0.0207051, 0.974, 89.0851),
-            1000:  BranchingRatio(0.0205807, 0.967654, 89.0851)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.0201363, 0.967397, 89.0851),
-            -200:  BranchingRatio(0.0199787, 0.976121, 89.0851),
-            200:  BranchingRatio(0.019882, 0.975279, 89.0851),
-            1000:  BranchingRatio(0.01975, 0.96931, 89.0851)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.0193918, 0.969016, 89.0851),
-            -200:  BranchingRatio(0.0192238, 0.977216, 89.0851),
-            200:  BranchingRatio(0.0191211, 0.976443, 89.0851),
-            1000:  BranchingRatio(0.0189813, 0.970819, 89.0851)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.0187049, 0.970495, 89.0851),
-            -200:  BranchingRatio(0.018526, 0.978214, 89.0851),
-            200:  BranchingRatio(0.0184172, 0.977504, 89.0851),
-            1000:  BranchingRatio(0.0182691, 0.972197, 89.0851)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0180708, 0.971849, 89.0851),
-            -200:  BranchingRatio(0.0178806, 0.979127, 89.0851),
-            200:  BranchingRatio(0.0177652, 0.978473, 89.0851),
-            1000:  BranchingRatio(0.0176086, 0.973457, 89.0851)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.0174851, 0.973091, 89.0851),
-            -200:  BranchingRatio(0.017283, 0.979963, 89.0851),
-            200:  BranchingRatio(0.0171608, 0.97936, 89.0851),
-            1000:  BranchingRatio(0.0169955, 0.974612, 89.0851)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.016944, 0.974233, 89.0851),
-            -200:  BranchingRatio(0.0167295, 0.98073, 89.0851),
-            200:  BranchingRatio(0.0166003, 0.980173, 89.0851),
-            1000:  BranchingRatio(0.0164257, 0.975673, 89.0851)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.016444, 0.975284, 89.0851),
-            -200:  BranchingRatio(0.0162166, 0.981436, 89.0851),
-            200:  BranchingRatio(0.01608, 0.980921, 89.0851),
-            1000:  BranchingRatio(0.0158959, 0.97665, 89.0851)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.015982, 0.976253, 89.0851),
-            -200:  BranchingRatio(0.0157411, 0.982086, 89.0851),
-            200:  BranchingRatio(0.0155969, 0.981609, 89.0851),
-            1000:  BranchingRatio(0.015403, 0.97755, 89.0851)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.0155552, 0.977149, 89.0851),
-            -200:  BranchingRatio(0.0153002, 0.982687, 89.0851),
-            200:  BranchingRatio(0.0151481, 0.982245, 89.0851),
-            1000:  BranchingRatio(0.0149439, 0.978382, 89.0851)
-        },
-        5: {
-            -1000:  BranchingRatio(0.0151611, 0.977979, 89.0851),
-            -200:  BranchingRatio(0.0148914, 0.983242, 89.0851),
-            200:  BranchingRatio(0.0147311, 0.982832, 89.0851),
-            1000:  BranchingRatio(0.0145163, 0.979152, 89.0851)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0147973, 0.978748, 89.0851),
-            -200:  BranchingRatio(0.0145123, 0.983757, 89.0851),
-            200:  BranchingRatio(0.0143435, 0.983375, 89.0851),
-            1000:  BranchingRatio(0.0141178, 0.979865, 89.0851)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0144618, 0.979462, 89.0851),
-            -200:  BranchingRatio(0.0141609, 0.984234, 89.0851),
-            200:  BranchingRatio(0.0139832, 0.983879, 89.0851),
-            1000:  BranchingRatio(0.0137462, 0.980528, 89.0851)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.0141526, 0.980126, 89.0851),
-            -200:  BranchingRatio(0.0138353, 0.984678, 89.0851),
-            200:  BranchingRatio(0.0136484, 0.984347, 89.0851),
-            1000:  BranchingRatio(0.0133997, 0.981144, 89.0851)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.0138682, 0.980744, 89.0851),
-            -200:  BranchingRatio(0.0135336, 0.985092, 89.0851),
-            200:  BranchingRatio(0.0133373, 0.984783, 89.0851),
-            1000:  BranchingRatio(0.0130765, 0.981717, 89.0851)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.0136069, 0.981321, 89.0851),
-            -200:  BranchingRatio(0.0132545, 0.985477, 89.0851),
-            200:  BranchingRatio(0.0130482, 0.985188, 89.0851),
-            1000:  BranchingRatio(0.0127751, 0.982253, 89.0851)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.0133673, 0.98186, 89.0851),
-            -200:  BranchingRatio(0.0129963, 0.985837, 89.0851),
-            200:  BranchingRatio(0.0127799, 0.985567, 89.0851),
-            1000:  BranchingRatio(0.0124939, 0.982753, 89.0851)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.013148, 0.982364, 89.0851),
-            -200:  BranchingRatio(0.0127578, 0.986173, 89.0851),
-            200:  BranchingRatio(0.0125309, 0.985921, 89.0851),
-            1000:  BranchingRatio(0.0122317, 0.98322, 89.0851)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.0129479, 0.982836, 89.0851),
-            -200:  BranchingRatio(0.0125378, 0.986488, 89.0851),
-            200:  BranchingRatio(0.0123, 0.986252, 89.0851),
-            1000:  BranchingRatio(0.0119872, 0.983658, 89.0851)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.012766, 0.983278, 89.0851),
-            -200:  BranchingRatio(0.0123351, 0.986784, 89.0851),
-            200:  BranchingRatio(0.0120861, 0.986563, 89.0851),
-            1000:  BranchingRatio(0.0117593, 0.984069, 89.0851)
-        },
-        6: {
-            -1000:  BranchingRatio(0.0126011, 0.983694, 89.0851),
-            -200:  BranchingRatio(0.0121488, 0.987061, 89.0851),
-            200:  BranchingRatio(0.0118882, 0.986854, 89.0851),
-            1000:  BranchingRatio(0.011547, 0.984455, 89.0851)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.0124524, 0.984084, 89.0851),
-            -200:  BranchingRatio(0.0119779, 0.987322, 89.0851),
-            200:  BranchingRatio(0.0117054, 0.987127, 89.0851),
-            1000:  BranchingRatio(0.0113493, 0.984818, 89.0851)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.0123191, 0.984452, 89.0851),
-            -200:  BranchingRatio(0.0118216, 0.987567, 89.0851),
-            200:  BranchingRatio(0.0115367, 0.987385, 89.0851),
-            1000:  BranchingRatio(0.0111653, 0.98516, 89.0851)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.0122003, 0.984798, 89.0851),
-            -200:  BranchingRatio(0.011679, 0.987798, 89.0851),
-            200:  BranchingRatio(0.0113814, 0.987627, 89.0851),
-            1000:  BranchingRatio(0.0109943, 0.985482, 89.0851)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.0120953, 0.985125, 89.0851),
-            -200:  BranchingRatio(0.0115494, 0.988016, 89.0851),
-            200:  BranchingRatio(0.0112388, 0.987855, 89.0851),
-            1000:  BranchingRatio(0.0108356, 0.985786, 89.0851)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.0120035, 0.985433, 89.0851),
-            -200:  BranchingRatio(0.0114322, 0.988222, 89.0851),
-            200:  BranchingRatio(0.011108, 0.988071, 89.0851),
-            1000:  BranchingRatio(0.0106883, 0.986073, 89.0851)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0119243, 0.985725, 89.0851),
-            -200:  BranchingRatio(0.0113267, 0.988416, 89.0851),
-            200:  BranchingRatio(0.0109887, 0.988275, 89.0851),
-            1000:  BranchingRatio(0.010552, 0.986345, 89.0851)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.0118571, 0.986, 89.0851),
-            -200:  BranchingRatio(0.0112324, 0.9886, 89.0851),
-            200:  BranchingRatio(0.01088, 0.988467, 89.0851),
-            1000:  BranchingRatio(0.0104259, 0.986602, 89.0851)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.0118013, 0.986261, 89.0851),
-            -200:  BranchingRatio(0.0111486, 0.988775, 89.0851),
-            200:  BranchingRatio(0.0107815, 0.98865, 89.0851),
-            1000:  BranchingRatio(0.0103095, 0.986845, 89.0851)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.0117566, 0.986509, 89.0851),
-            -200:  BranchingRatio(0.0110749, 0.98894, 89.0851),
-            200:  BranchingRatio(0.0106927, 0.988822, 89.0851),
-            1000:  BranchingRatio(0.0102024, 0.987076, 89.0851)
-        },
-        7: {
-            -1000:  BranchingRatio(0.0117223, 0.986743, 89.0851),
-            -200:  BranchingRatio(0.0110109, 0.989097, 89.0851),
-            200:  BranchingRatio(0.0106131, 0.988986, 89.0851),
-            1000:  BranchingRatio(0.010104, 0.987296, 89.0851)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.0116983, 0.986966, 89.0851),
-            -200:  BranchingRatio(0.010956, 0.989246, 89.0851),
-            200:  BranchingRatio(0.0105422, 0.989142, 89.0851),
-            1000:  BranchingRatio(0.010014, 0.987504, 89.0851)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.0116839, 0.987178, 89.0851),
-            -200:  BranchingRatio(0.0109099, 0.989387, 89.0851),
-            200:  BranchingRatio(0.0104798, 0.98929, 89.0851),
-            1000:  BranchingRatio(0.00993178, 0.987702, 89.0851)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.0116789, 0.987379, 89.0851),
-            -200:  BranchingRatio(0.0108722, 0.989522, 89.0851),
-            200:  BranchingRatio(0.0104252, 0.98943, 89.0851),
-            1000:  BranchingRatio(0.0098571, 0.987891, 89.0851)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.011683, 0.987571, 89.0851),
-            -200:  BranchingRatio(0.0108426, 0.98965, 89.0851),
-            200:  BranchingRatio(0.0103783, 0.989564, 89.0851),
-            1000:  BranchingRatio(0.00978957, 0.98807, 89.0851)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.0116958, 0.987753, 89.0851),
-            -200:  BranchingRatio(0.0108207, 0.989772, 89.0851),
-            200:  BranchingRatio(0.0103387, 0.989692, 89.0851),
-            1000:  BranchingRatio(0.00972883, 0.988241, 89.0851)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.011717, 0.987927, 89.0851),
-            -200:  BranchingRatio(0.0108062, 0.989889, 89.0851),
-            200:  BranchingRatio(0.010306, 0.989813, 89.0851),
-            1000:  BranchingRatio(0.00967458, 0.988405, 89.0851)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.0117464, 0.988093, 89.0851),
-            -200:  BranchingRatio(0.0107989, 0.99, 89.0851),
-            200:  BranchingRatio(0.01028, 0.989929, 89.0851),
-            1000:  BranchingRatio(0.00962652, 0.988561, 89.0851)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.0117838, 0.988251, 89.0851),
-            -200:  BranchingRatio(0.0107984, 0.990106, 89.0851),
-            200:  BranchingRatio(0.0102604, 0.99004, 89.0851),
-            1000:  BranchingRatio(0.00958436, 0.98871, 89.0851)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.0118288, 0.988402, 89.0851),
-            -200:  BranchingRatio(0.0108046, 0.990208, 89.0851),
-            200:  BranchingRatio(0.0102469, 0.990145, 89.0851),
-            1000:  BranchingRatio(0.00954786, 0.988852, 89.0851)
-        },
-        8: {
-            -1000:  BranchingRatio(0.0118813, 0.988547, 89.0851),
-            -200:  BranchingRatio(0.0108171, 0.990305, 89.0851),
-            200:  BranchingRatio(0.0102393, 0.990246, 89.0851),
-            1000:  BranchingRatio(0.00951675, 0.988989, 89.0851)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.0119411, 0.988685, 89.0851),
-            -200:  BranchingRatio(0.0108357, 0.990398, 89.0851),
-            200:  BranchingRatio(0.0102374, 0.990343, 89.0851),
-            1000:  BranchingRatio(0.00949081, 0.989119, 89.0851)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.012008, 0.988817, 89.0851),
-            -200:  BranchingRatio(0.0108603, 0.990486, 89.0851),
-            200:  BranchingRatio(0.010241, 0.990436, 89.0851),
-            1000:  BranchingRatio(0.00946983, 0.989244, 89.0851)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.0120817, 0.988944, 89.0851),
-            -200:  BranchingRatio(0.0108907, 0.990572, 89.0851),
-            200:  BranchingRatio(0.0102497, 0.990524, 89.0851),
-            1000:  BranchingRatio(0.00945359, 0.989364, 89.0851)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.0121622, 0.989065, 89.0851),
-            -200:  BranchingRatio(0.0109266, 0.990653, 89.0851),
-            200:  BranchingRatio(0.0102636, 0.990609, 89.0851),
-            1000:  BranchingRatio(0.00944191, 0.989479, 89.0851)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.0122493, 0.989181, 89.0851),
-            -200:  BranchingRatio(0.0109679, 0.990732, 89.0851),
-            200:  BranchingRatio(0.0102823, 0.990691, 89.0851),
-            1000:  BranchingRatio(0.00943459, 0.989589, 89.0851)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.0123429, 0.989293, 89.0851),
-            -200:  BranchingRatio(0.0110144, 0.990807, 89.0851),
-            200:  BranchingRatio(0.0103057, 0.990769, 89.0851),
-            1000:  BranchingRatio(0.00943146, 0.989695, 89.0851)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.0124427, 0.9894, 89.0851),
-            -200:  BranchingRatio(0.011066, 0.990879, 89.0851),
-            200:  BranchingRatio(0.0103337, 0.990844, 89.0851),
-            1000:  BranchingRatio(0.00943237, 0.989797, 89.0851)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.0125487, 0.989502, 89.0851),
-            -200:  BranchingRatio(0.0111225, 0.990948, 89.0851),
-            200:  BranchingRatio(0.0103661, 0.990917, 89.0851),
-            1000:  BranchingRatio(0.00943716, 0.989895, 89.0851)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.0126608, 0.989601, 89.0851),
-            -200:  BranchingRatio(0.0111838, 0.991015, 89.0851),
-            200:  BranchingRatio(0.0104027, 0.990986, 89.0851),
-            1000:  BranchingRatio(0.00944568, 0.989989, 89.0851)
-        },
-        9: {
-            -1000:  BranchingRatio(0.0127788, 0.989696, 89.0851),
-            -200:  BranchingRatio(0.0112498, 0.991079, 89.0851),
-            200:  BranchingRatio(0.0104434, 0.991053, 89.0851),
-            1000:  BranchingRatio(0.00945779, 0.99008, 89.0851)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.0129027, 0.989787, 89.0851),
-            -200:  BranchingRatio(0.0113203, 0.991141, 89.0851),
-            200:  BranchingRatio(0.0104882, 0.991117, 89.0851),
-            1000:  BranchingRatio(0.00947336, 0.990167, 89.0851)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.0130324, 0.989874, 89.0851),
-            -200:  BranchingRatio(0.0113951, 0.9912, 89.0851),
-            200:  BranchingRatio(0.0105368, 0.991179, 89.0851),
-            1000:  BranchingRatio(0.00949227, 0.990251, 89.0851)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.0131677, 0.989959, 89.0851),
-            -200:  BranchingRatio(0.0114744, 0.991257, 89.0851),
-            200:  BranchingRatio(0.0105892, 0.991238, 89.0851),
-            1000:  BranchingRatio(0.0095144, 0.990332, 89.0851)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.0133086, 0.99004, 89.0851),
-            -200:  BranchingRatio(0.0115578, 0.991313, 89.0851),
-            200:  BranchingRatio(0.0106452, 0.991296, 89.0851),
-            1000:  BranchingRatio(0.00953964, 0.99041, 89.0851)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.013455, 0.990118, 89.0851),
-            -200:  BranchingRatio(0.0116453, 0.991366, 89.0851),
-            200:  BranchingRatio(0.0107047, 0.991351, 89.0851),
-            1000:  BranchingRatio(0.00956787, 0.990486, 89.0851)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.0136068, 0.990194, 89.0851),
-            -200:  BranchingRatio(0.0117369, 0.991417, 89.0851),
-            200:  BranchingRatio(0.0107677, 0.991404, 89.0851),
-            1000:  BranchingRatio(0.00959901, 0.990559, 89.0851)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.013764, 0.990266, 89.0851),
-            -200:  BranchingRatio(0.0118323, 0.991466, 89.0851),
-            200:  BranchingRatio(0.0108341, 0.991456, 89.0851),
-            1000:  BranchingRatio(0.00963294, 0.990629, 89.0851)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.0139265, 0.990336, 89.0851),
-            -200:  BranchingRatio(0.0119316, 0.991514, 89.0851),
-            200:  BranchingRatio(0.0109037, 0.991505, 89.0851),
-            1000:  BranchingRatio(0.00966959, 0.990697, 89.0851)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.0140943, 0.990404, 89.0851),
-            -200:  BranchingRatio(0.0120347, 0.99156, 89.0851),
-            200:  BranchingRatio(0.0109764, 0.991553, 89.0851),
-            1000:  BranchingRatio(0.00970885, 0.990763, 89.0851)
-        },
-        10: {
-            -1000:  BranchingRatio(0.0142673, 0.990469, 89.0851),
-            -200:  BranchingRatio(0.0121414, 0.991605, 89.0851),
-            200:  BranchingRatio(0.0110523, 0.9916, 89.0851),
-            1000:  BranchingRatio(0.00975066, 0.990826, 89.0851)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0162734, 0.99101, 89.0851),
-            -200:  BranchingRatio(0.0133974, 0.991978, 89.0851),
-            200:  BranchingRatio(0.0119656, 0.991989, 89.0851),
-            1000:  BranchingRatio(0.0102923, 0.99136, 89.0851)
-        },
-        12: {
-            -1000:  BranchingRatio(0.0187638, 0.991401, 89.0851),
-            -200:  BranchingRatio(0.0149611, 0.992252, 89.0851),
-            200:  BranchingRatio(0.0131216, 0.992275, 89.0851),
-            1000:  BranchingRatio(0.0110185, 0.991756, 89.0851)
-        },
-        13: {
-            -1000:  BranchingRatio(0.0217279, 0.991688, 89.0851),
-            -200:  BranchingRatio(0.0167973, 0.992459, 89.0851),
-            200:  BranchingRatio(0.0144797, 0.992492, 89.0851),
-            1000:  BranchingRatio(0.0118869, 0.992058, 89.0851)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0251691, 0.9919, 89.0851),
-            -200:  BranchingRatio(0.0188833, 0.992618, 89.0851),
-            200:  BranchingRatio(0.0160121, 0.992661, 89.0851),
-            1000:  BranchingRatio(0.0128681, 0.992295, 89.0851)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0291004, 0.992057, 89.0851),
-            -200:  BranchingRatio(0.0212037, 0.992743, 89.0851),
-            200:  BranchingRatio(0.0176989, 0.992794, 89.0851),
-            1000:  BranchingRatio(0.0139409, 0.992484, 89.0851)
-        },
-        16: {
-            -1000:  BranchingRatio(0.033541, 0.99217, 89.0851),
-            -200:  BranchingRatio(0.0237483, 0.992842, 89.0851),
-            200:  BranchingRatio(0.0195249, 0.992901, 89.0851),
-            1000:  BranchingRatio(0.0150894, 0.992637, 89.0851)
-        },
-        17: {
-            -1000:  BranchingRatio(0.038515, 0.992248, 89.0851),
-            -200:  BranchingRatio(0.0265097, 0.992921, 89.0851),
-            200:  BranchingRatio(0.0214786, 0.992989, 89.0851),
-            1000:  BranchingRatio(0.0163013, 0.992763, 89.0851)
-        },
-        18: {
-            -1000:  BranchingRatio(0.04405, 0.992295, 89.0851),
-            -200:  BranchingRatio(0.0294825, 0.992985, 89.0851),
-            200:  BranchingRatio(0.0235504, 0.993061, 89.0851),
-            1000:  BranchingRatio(0.0175669, 0.992869, 89.0851)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0501768, 0.992315, 89.0851),
-            -200:  BranchingRatio(0.0326628, 0.993037, 89.0851),
-            200:  BranchingRatio(0.0257324, 0.993121, 89.0851),
-            1000:  BranchingRatio(0.0188782, 0.992958, 89.0851)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0569283, 0.992308, 89.0851),
-            -200:  BranchingRatio(0.0360475, 0.993078, 89.0851),
-            200:  BranchingRatio(0.0280177, 0.993172, 89.0851),
-            1000:  BranchingRatio(0.0202285, 0.993034, 89.0851)
-        },
-        21: {
-            -1000:  BranchingRatio(0.0643393, 0.992272, 89.0851),
-            -200:  BranchingRatio(0.039634, 0.993111, 89.0851),
-            200:  BranchingRatio(0.0304004, 0.993215, 89.0851),
-            1000:  BranchingRatio(0.0216123, 0.993099, 89.0851)
-        },
-        22: {
-            -1000:  BranchingRatio(0.0724464, 0.992206, 89.0851),
-            -200:  BranchingRatio(0.04342, 0.993137, 89.0851),
-            200:  BranchingRatio(0.0328752, 0.993252, 89.0851),
-            1000:  BranchingRatio(0.0230247, 0.993156, 89.0851)
-        },
-        23: {
-            -1000:  BranchingRatio(0.0812872, 0.992105, 89.0851),
-            -200:  BranchingRatio(0.0474036, 0.993157, 89.0851),
-            200:  BranchingRatio(0.0354371, 0.993283, 89.0851),
-            1000:  BranchingRatio(0.0244616, 0.993206, 89.0851)
-        },
-        24: {
-            -1000:  BranchingRatio(0.0909, 0.991959, 89.0851),
-            -200:  BranchingRatio(0.0515829, 0.993171, 89.0851),
-            200:  BranchingRatio(0.0380817, 0.99331, 89.0851),
-            1000:  BranchingRatio(0.0259193, 0.993249, 89.0851)
-        },
-        25: {
-            -1000:  BranchingRatio(0.101324, 0.991757, 89.0851),
-            -200:  BranchingRatio(0.055956, 0.993181, 89.0851),
-            200:  BranchingRatio(0.0408047, 0.993333, 89.0851),
-            1000:  BranchingRatio(0.0273946, 0.993288, 89.0851)
-        },
-        26: {
-            -1000:  BranchingRatio(0.112597, 0.991481, 89.0851),
-            -200:  BranchingRatio(0.060521, 0.993186, 89.0851),
-            200:  BranchingRatio(0.0436021, 0.993353, 89.0851),
-            1000:  BranchingRatio(0.0288846, 0.993323, 89.0851)
-        },
-        27: {
-            -1000:  BranchingRatio(0.124758, 0.9911, 89.0851),
-            -200:  BranchingRatio(0.0652758, 0.993188, 89.0851),
-            200:  BranchingRatio(0.0464702, 0.99337, 89.0851),
-            1000:  BranchingRatio(0.0303868, 0.993353, 89.0851)
-        },
-        28: {
-            -1000:  BranchingRatio(0.137843, 0.990566, 89.0851),
-            -200:  BranchingRatio(0.0702182, 0.993185, 89.0851),
-            200:  BranchingRatio(0.0494054, 0.993385, 89.0851),
-            1000:  BranchingRatio(0.0318988, 0.993381, 89.0851)
-        },
-        29: {
-            -1000:  BranchingRatio(0.151889, 0.989795, 89.0851),
-            -200:  BranchingRatio(0.0753461, 0.993178, 89.0851),
-            200:  BranchingRatio(0.0524043, 0.993398, 89.0851),
-            1000:  BranchingRatio(0.0334186, 0.993406, 89.0851)
-        },
-        30: {
-            -1000:  BranchingRatio(0.166927, 0.988629, 89.0851),
-            -200:  BranchingRatio(0.080657, 0.993168, 89.0851),
-            200:  BranchingRatio(0.0554634, 0.993409, 89.0851),
-            1000:  BranchingRatio(0.0349443, 0.993429, 89.0851)
-        },
-        31: {
-            -1000:  BranchingRatio(0.182987, 0.986713, 89.0851),
-            -200:  BranchingRatio(0.0861482, 0.993153, 89.0851),
-            200:  BranchingRatio(0.0585797, 0.993418, 89.0851),
-            1000:  BranchingRatio(0.0364742, 0.99345, 89.0851)
-        },
-        32: {
-            -1000:  BranchingRatio(0.200094, 0.982892, 89.0851),
-            -200:  BranchingRatio(0.091817, 0.993135, 89.0851),
-            200:  BranchingRatio(0.0617501, 0.993426, 89.0851),
-            1000:  BranchingRatio(0.0380068, 0.993469, 89.0851)
-        },
-        33: {
-            -1000:  BranchingRatio(0.218269, 0.966678, 89.0851),
-            -200:  BranchingRatio(0.0976605, 0.993112, 89.0851),
-            200:  BranchingRatio(0.0649716, 0.993432, 89.0851),
-            1000:  BranchingRatio(0.0395407, 0.993486, 89.0851)
-        },
-        34: {
-            -1000:  BranchingRatio(0.237526, 0.829564, 89.0851),
-            -200:  BranchingRatio(0.103676, 0.993085, 89.0851),
-            200:  BranchingRatio(0.0682412, 0.993437, 89.0851),
-            1000:  BranchingRatio(0.0410746, 0.993503, 89.0851)
-        },
-        35: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.109859, 0.993052, 89.0851),
-            200:  BranchingRatio(0.0715563, 0.993442, 89.0851),
-            1000:  BranchingRatio(0.0426072, 0.993517, 89.0851)
-        },
-        36: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.116206, 0.993015, 89.0851),
-            200:  BranchingRatio(0.0749141, 0.993445, 89.0851),
-            1000:  BranchingRatio(0.0441377, 0.993531, 89.0851)
-        },
-        37: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.122714, 0.992971, 89.0851),
-            200:  BranchingRatio(0.078312, 0.993447, 89.0851),
-            1000:  BranchingRatio(0.045665, 0.993543, 89.0851)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.12938, 0.992921, 89.0851),
-            200:  BranchingRatio(0.0817477, 0.993448, 89.0851),
-            1000:  BranchingRatio(0.0471882, 0.993554, 89.0851)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.136198, 0.992863, 89.0851),
-            200:  BranchingRatio(0.0852183, 0.993449, 89.0851),
-            1000:  BranchingRatio(0.0487065, 0.993565, 89.0851)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.143164, 0.992797, 89.0851),
-            200:  BranchingRatio(0.0887217, 0.993449, 89.0851),
-            1000:  BranchingRatio(0.0502193, 0.993575, 89.0851)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.150275, 0.99272, 89.0851),
-            200:  BranchingRatio(0.0922556, 0.993448, 89.0851),
-            1000:  BranchingRatio(0.0517258, 0.993584, 89.0851)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.157525, 0.992632, 89.0851),
-            200:  BranchingRatio(0.0958176, 0.993446, 89.0851),
-            1000:  BranchingRatio(0.0532254, 0.993593, 89.0851)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.16491, 0.992531, 89.0851),
-            200:  BranchingRatio(0.0994057, 0.993444, 89.0851),
-            1000:  BranchingRatio(0.0547177, 0.993601, 89.0851)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.172424, 0.992413, 89.0851),
-            200:  BranchingRatio(0.103018, 0.993441, 89.0851),
-            1000:  BranchingRatio(0.0562021, 0.993608, 89.0851)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.180064, 0.992276, 89.0851),
-            200:  BranchingRatio(0.106652, 0.993437, 89.0851),
-            1000:  BranchingRatio(0.0576781, 0.993615, 89.0851)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.187823, 0.992114, 89.0851),
-            200:  BranchingRatio(0.110306, 0.993433, 89.0851),
-            1000:  BranchingRatio(0.0591454, 0.993622, 89.0851)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.195697, 0.991923, 89.0851),
-            200:  BranchingRatio(0.113978, 0.993428, 89.0851),
-            1000:  BranchingRatio(0.0606036, 0.993628, 89.0851)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.20368, 0.991693, 89.0851),
-            200:  BranchingRatio(0.117666, 0.993422, 89.0851),
-            1000:  BranchingRatio(0.0620523, 0.993634, 89.0851)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.211766, 0.991411, 89.0851),
-            200:  BranchingRatio(0.121369, 0.993415, 89.0851),
-            1000:  BranchingRatio(0.0634914, 0.99364, 89.0851)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.219951, 0.991056, 89.0851),
-            200:  BranchingRatio(0.125084, 0.993408, 89.0851),
-            1000:  BranchingRatio(0.0649204, 0.993645, 89.0851)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.228229, 0.99059, 89.0851),
-            200:  BranchingRatio(0.128811, 0.993401, 89.0851),
-            1000:  BranchingRatio(0.0663392, 0.99365, 89.0851)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.236593, 0.989933, 89.0851),
-            200:  BranchingRatio(0.132547, 0.993392, 89.0851),
-            1000:  BranchingRatio(0.0677477, 0.993655, 89.0851)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.245038, 0.988826, 89.0851),
-            200:  BranchingRatio(0.136292, 0.993383, 89.0851),
-            1000:  BranchingRatio(0.0691455, 0.99366, 89.0851)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.253559, 0.988735, 89.0851),
-            200:  BranchingRatio(0.140043, 0.993374, 89.0851),
-            1000:  BranchingRatio(0.0705325, 0.993664, 89.0851)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.26215, 0.979275, 89.0851),
-            200:  BranchingRatio(0.143799, 0.993363, 89.0851),
-            1000:  BranchingRatio(0.0719087, 0.993668, 89.0851)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.270805, 0.963234, 89.0851),
-            200:  BranchingRatio(0.147558, 0.993352, 89.0851),
-            1000:  BranchingRatio(0.0732738, 0.993672, 89.0851)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.279518, 0.944934, 89.0851),
-            200:  BranchingRatio(0.151321, 0.99334, 89.0851),
-            1000:  BranchingRatio(0.0746279, 0.993676, 89.0851)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.288284, 0.925937, 89.0851),
-            200:  BranchingRatio(0.155084, 0.993327, 89.0851),
-            1000:  BranchingRatio(0.0759707, 0.993679, 89.0851)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.297097, 0.911532, 89.0851),
-            200:  BranchingRatio(0.158847, 0.993313, 89.0851),
-            1000:  BranchingRatio(0.0773024, 0.993683, 89.0851)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.16261, 0.993298, 89.0851),
-            1000:  BranchingRatio(0.0786227, 0.993686, 89.0851)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.16637, 0.993283, 89.0851),
-            1000:  BranchingRatio(0.0799316, 0.993689, 89.0851)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.170126, 0.993266, 89.0851),
-            1000:  BranchingRatio(0.0812292, 0.993692, 89.0851)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.173878, 0.993248, 89.0851),
-            1000:  BranchingRatio(0.0825154, 0.993695, 89.0851)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.177625, 0.993229, 89.0851),
-            1000:  BranchingRatio(0.0837903, 0.993698, 89.0851)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.181366, 0.993209, 89.0851),
-            1000:  BranchingRatio(0.0850537, 0.993701, 89.0851)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.185099, 0.993187, 89.0851),
-            1000:  BranchingRatio(0.0863058, 0.993703, 89.0851)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.188824, 0.993164, 89.0851),
-            1000:  BranchingRatio(0.0875466, 0.993706, 89.0851)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.19254, 0.993139, 89.0851),
-            1000:  BranchingRatio(0.088776, 0.993708, 89.0851)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.196247, 0.993112, 89.0851),
-            1000:  BranchingRatio(0.0899941, 0.993711, 89.0851)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.199943, 0.993084, 89.0851),
-            1000:  BranchingRatio(0.0912011, 0.993713, 89.0851)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.203628, 0.993053, 89.0851),
-            1000:  BranchingRatio(0.0923968, 0.993715, 89.0851)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.207302, 0.99302, 89.0851),
-            1000:  BranchingRatio(0.0935814, 0.993717, 89.0851)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.210962, 0.992984, 89.0851),
-            1000:  BranchingRatio(0.094755, 0.993719, 89.0851)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.21461, 0.992944, 89.0851),
-            1000:  BranchingRatio(0.0959176, 0.993721, 89.0851)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.218244, 0.992901, 89.0851),
-            1000:  BranchingRatio(0.0970692, 0.993723, 89.0851)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.221864, 0.992854, 89.0851),
-            1000:  BranchingRatio(0.0982099, 0.993725, 89.0851)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.225469, 0.992802, 89.0851),
-            1000:  BranchingRatio(0.0993399, 0.993726, 89.0851)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.229059, 0.992743, 89.0851),
-            1000:  BranchingRatio(0.100459, 0.993728, 89.0851)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.232633, 0.992677, 89.0851),
-            1000:  BranchingRatio(0.101568, 0.993729, 89.0851)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.236192, 0.992602, 89.0851),
-            1000:  BranchingRatio(0.102666, 0.993731, 89.0851)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.239733, 0.992513, 89.0851),
-            1000:  BranchingRatio(0.103753, 0.993732, 89.0851)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.243258, 0.992408, 89.0851),
-            1000:  BranchingRatio(0.104831, 0.993734, 89.0851)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.246765, 0.992277, 89.0851),
-            1000:  BranchingRatio(0.105897, 0.993735, 89.0851)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.250255, 0.992103, 89.0851),
-            1000:  BranchingRatio(0.106954, 0.993737, 89.0851)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.253727, 0.992028, 89.0851),
-            1000:  BranchingRatio(0.108001, 0.993738, 89.0851)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.25718, 0.992076, 89.0851),
-            1000:  BranchingRatio(0.109037, 0.993739, 89.0851)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.260615, 0.992135, 89.0851),
-            1000:  BranchingRatio(0.110064, 0.99374, 89.0851)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.264031, 0.991128, 89.0851),
-            1000:  BranchingRatio(0.111081, 0.993741, 89.0851)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.267429, 0.98937, 89.0851),
-            1000:  BranchingRatio(0.112088, 0.993742, 89.0851)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.270806, 0.987412, 89.0851),
-            1000:  BranchingRatio(0.113085, 0.993744, 89.0851)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.274165, 0.985313, 89.0851),
-            1000:  BranchingRatio(0.114073, 0.993745, 89.0851)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.277503, 0.983116, 89.0851),
-            1000:  BranchingRatio(0.115051, 0.993745, 89.0851)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.280822, 0.980856, 89.0851),
-            1000:  BranchingRatio(0.11602, 0.993746, 89.0851)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.284121, 0.978563, 89.0851),
-            1000:  BranchingRatio(0.11698, 0.993747, 89.0851)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.2874, 0.976263, 89.0851),
-            1000:  BranchingRatio(0.117931, 0.993748, 89.0851)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.290658, 0.973982, 89.0851),
-            1000:  BranchingRatio(0.118872, 0.993749, 89.0851)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.293896, 0.971748, 89.0851),
-            1000:  BranchingRatio(0.119805, 0.99375, 89.0851)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.297113, 0.969598, 89.0851),
-            1000:  BranchingRatio(0.120728, 0.99375, 89.0851)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.30031, 0.967594, 89.0851),
-            1000:  BranchingRatio(0.121643, 0.993751, 89.0851)
-        }
-    },
-    130: {
-        1.1: {
-            -1000:  BranchingRatio(0.151139, 0.470014, 102.158),
-            -200:  BranchingRatio(0.15113, 0.512454, 102.158),
-            200:  BranchingRatio(0.151122, 0.50612, 102.158),
-            1000:  BranchingRatio(0.151113, 0.470605, 102.158)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.130253, 0.527379, 102.158),
-            -200:  BranchingRatio(0.130243, 0.576186, 102.158),
-            200:  BranchingRatio(0.130235, 0.568043, 102.158),
-            1000:  BranchingRatio(0.130224, 0.529879, 102.158)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.113278, 0.577222, 102.158),
-            -200:  BranchingRatio(0.113266, 0.630247, 102.158),
-            200:  BranchingRatio(0.113257, 0.620763, 102.158),
-            1000:  BranchingRatio(0.113245, 0.58137, 102.158)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.0993325, 0.621373, 102.158),
-            -200:  BranchingRatio(0.0993191, 0.676401, 102.158),
-            200:  BranchingRatio(0.0993092, 0.666136, 102.158),
-            1000:  BranchingRatio(0.0992959, 0.626784, 102.158)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.0877623, 0.66108, 102.158),
-            -200:  BranchingRatio(0.0877473, 0.716204, 102.158),
-            200:  BranchingRatio(0.0877365, 0.705683, 102.158),
-            1000:  BranchingRatio(0.0877217, 0.667377, 102.158)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.0780732, 0.696925, 102.158),
-            -200:  BranchingRatio(0.0780565, 0.750808, 102.158),
-            200:  BranchingRatio(0.0780446, 0.740454, 102.158),
-            1000:  BranchingRatio(0.0780283, 0.703911, 102.158)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.0698896, 0.729288, 102.158),
-            -200:  BranchingRatio(0.0698712, 0.781018, 102.158),
-            200:  BranchingRatio(0.0698582, 0.771133, 102.158),
-            1000:  BranchingRatio(0.0698403, 0.736816, 102.158)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.062923, 0.75857, 102.158),
-            -200:  BranchingRatio(0.0629026, 0.807418, 102.158),
-            200:  BranchingRatio(0.0628885, 0.798193, 102.158),
-            1000:  BranchingRatio(0.0628688, 0.766419, 102.158)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.0569492, 0.784867, 102.158),
-            -200:  BranchingRatio(0.0569268, 0.830481, 102.158),
-            200:  BranchingRatio(0.0569113, 0.822017, 102.158),
-            1000:  BranchingRatio(0.0568899, 0.792753, 102.158)
-        },
-        2: {
-            -1000:  BranchingRatio(0.0517924, 0.808368, 102.158),
-            -200:  BranchingRatio(0.0517678, 0.85056, 102.158),
-            200:  BranchingRatio(0.051751, 0.842892, 102.158),
-            1000:  BranchingRatio(0.0517276, 0.816163, 102.158)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0473134, 0.829247, 102.158),
-            -200:  BranchingRatio(0.0472865, 0.868016, 102.158),
-            200:  BranchingRatio(0.0472683, 0.861131, 102.158),
-            1000:  BranchingRatio(0.0472429, 0.836832, 102.158)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0434011, 0.847708, 102.158),
-            -200:  BranchingRatio(0.0433718, 0.883164, 102.158),
-            200:  BranchingRatio(0.043352, 0.877021, 102.158),
-            1000:  BranchingRatio(0.0433244, 0.854997, 102.158)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.039966, 0.86397, 102.158),
-            -200:  BranchingRatio(0.039934, 0.896293, 102.158),
-            200:  BranchingRatio(0.0399126, 0.890836, 102.158),
-            1000:  BranchingRatio(0.0398827, 0.87091, 102.158)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.0369353, 0.878257, 102.158),
-            -200:  BranchingRatio(0.0369004, 0.907666, 102.158),
-            200:  BranchingRatio(0.0368773, 0.902832, 102.158),
-            1000:  BranchingRatio(0.036845, 0.884817, 102.158)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0342494, 0.890788, 102.158),
-            -200:  BranchingRatio(0.0342116, 0.91752, 102.158),
-            200:  BranchingRatio(0.0341866, 0.913243, 102.158),
-            1000:  BranchingRatio(0.0341518, 0.896954, 102.158)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0318594, 0.901769, 102.158),
-            -200:  BranchingRatio(0.0318184, 0.926061, 102.158),
-            200:  BranchingRatio(0.0317915, 0.92228, 102.158),
-            1000:  BranchingRatio(0.0317539, 0.907542, 102.158)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0297246, 0.91139, 102.158),
-            -200:  BranchingRatio(0.0296802, 0.933474, 102.158),
-            200:  BranchingRatio(0.0296512, 0.930129, 102.158),
-            1000:  BranchingRatio(0.0296108, 0.916778, 102.158)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.027811, 0.919825, 102.158),
-            -200:  BranchingRatio(0.027763, 0.939917, 102.158),
-            200:  BranchingRatio(0.0277319, 0.936956, 102.158),
-            1000:  BranchingRatio(0.0276884, 0.924843, 102.158)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0260902, 0.927225, 102.158),
-            -200:  BranchingRatio(0.0260383, 0.945528, 102.158),
-            200:  BranchingRatio(0.0260049, 0.942903, 102.158),
-            1000:  BranchingRatio(0.0259583, 0.931893, 102.158)
-        },
-        3: {
-            -1000:  BranchingRatio(0.024538, 0.933727, 102.158),
-            -200:  BranchingRatio(0.0244821, 0.950424, 102.158),
-            200:  BranchingRatio(0.0244462, 0.948094, 102.158),
-            1000:  BranchingRatio(0.0243963, 0.938065, 102.158)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0231341, 0.93945, 102.158),
-            -200:  BranchingRatio(0.0230739, 0.954708, 102.158),
-            200:  BranchingRatio(0.0230355, 0.952635, 102.158),
-            1000:  BranchingRatio(0.022982, 0.943481, 102.158)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.021861, 0.944497, 102.158),
-            -200:  BranchingRatio(0.0217963, 0.958463, 102.158),
-            200:  BranchingRatio(0.0217552, 0.956616, 102.158),
-            1000:  BranchingRatio(0.021698, 0.948241, 102.158)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0207038, 0.948956, 102.158),
-            -200:  BranchingRatio(0.0206343, 0.961765, 102.158),
-            200:  BranchingRatio(0.0205903, 0.960115, 102.158),
-            1000:  BranchingRatio(0.0205294, 0.952436, 102.158)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.0196496, 0.952906, 102.158),
-            -200:  BranchingRatio(0.0195752, 0.964676, 102.158),
-            200:  BranchingRatio(0.0195282, 0.963198, 102.158),
-            1000:  BranchingRatio(0.0194632, 0.956141, 102.158)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0186875, 0.956411, 102.158),
-            -200:  BranchingRatio(0.0186077, 0.967248, 102.158),
-            200:  BranchingRatio(0.0185576, 0.965923, 102.158),
-            1000:  BranchingRatio(0.0184884, 0.959421, 102.158)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0178076, 0.959531, 102.158),
-            -200:  BranchingRatio(0.0177223, 0.969528, 102.158),
-            200:  BranchingRatio(0.0176689, 0.968336, 102.158),
-            1000:  BranchingRatio(0.0175953, 0.962334, 102.158)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0170017, 0.962313, 102.158),
-            -200:  BranchingRatio(0.0169105, 0.971555, 102.158),
-            200:  BranchingRatio(0.0168537, 0.97048, 102.158),
-            1000:  BranchingRatio(0.0167755, 0.964925, 102.158)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.0162625, 0.9648, 102.158),
-            -200:  BranchingRatio(0.0161651, 0.97336, 102.158),
-            200:  BranchingRatio(0.0161047, 0.972389, 102.158),
-            1000:  BranchingRatio(0.0160216, 0.967238, 102.158)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.0155834, 0.967029, 102.158),
-            -200:  BranchingRatio(0.0154796, 0.974972, 102.158),
-            200:  BranchingRatio(0.0154154, 0.974093, 102.158),
-            1000:  BranchingRatio(0.0153273, 0.969307, 102.158)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0149589, 0.969032, 102.158),
-            -200:  BranchingRatio(0.0148483, 0.976417, 102.158),
-            200:  BranchingRatio(0.0147801, 0.975619, 102.158),
-            1000:  BranchingRatio(0.0146868, 0.971162, 102.158)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.014384, 0.970835, 102.158),
-            -200:  BranchingRatio(0.0142662, 0.977714, 102.158),
-            200:  BranchingRatio(0.0141939, 0.976989, 102.158),
-            1000:  BranchingRatio(0.0140951, 0.972829, 102.158)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.0138541, 0.972462, 102.158),
-            -200:  BranchingRatio(0.0137289, 0.978882, 102.158),
-            200:  BranchingRatio(0.0136523, 0.978221, 102.158),
-            1000:  BranchingRatio(0.0135479, 0.974332, 102.158)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.0133655, 0.973935, 102.158),
-            -200:  BranchingRatio(0.0132325, 0.979935, 102.158),
-            200:  BranchingRatio(0.0131514, 0.979332, 102.158),
-            1000:  BranchingRatio(0.0130411, 0.975689, 102.158)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0129146, 0.975269, 102.158),
-            -200:  BranchingRatio(0.0127734, 0.980888, 102.158),
-            200:  BranchingRatio(0.0126877, 0.980336, 102.158),
-            1000:  BranchingRatio(0.0125712, 0.976918, 102.158)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.0124983, 0.976482, 102.158),
-            -200:  BranchingRatio(0.0123486, 0.981752, 102.158),
-            200:  BranchingRatio(0.012258, 0.981246, 102.158),
-            1000:  BranchingRatio(0.0121352, 0.978033, 102.158)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0121139, 0.977586, 102.158),
-            -200:  BranchingRatio(0.0119553, 0.982537, 102.158),
-            200:  BranchingRatio(0.0118596, 0.982073, 102.158),
-            1000:  BranchingRatio(0.0117302, 0.979048, 102.158)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.0117588, 0.978593, 102.158),
-            -200:  BranchingRatio(0.0115909, 0.983252, 102.158),
-            200:  BranchingRatio(0.01149, 0.982825, 102.158),
-            1000:  BranchingRatio(0.0113537, 0.979972, 102.158)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.0114308, 0.979514, 102.158),
-            -200:  BranchingRatio(0.0112532, 0.983904, 102.158),
-            200:  BranchingRatio(0.0111468, 0.983511, 102.158),
-            1000:  BranchingRatio(0.0110035, 0.980816, 102.158)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.0111279, 0.980357, 102.158),
-            -200:  BranchingRatio(0.0109402, 0.9845, 102.158),
-            200:  BranchingRatio(0.0108281, 0.984137, 102.158),
-            1000:  BranchingRatio(0.0106774, 0.981589, 102.158)
-        },
-        5: {
-            -1000:  BranchingRatio(0.0108482, 0.981131, 102.158),
-            -200:  BranchingRatio(0.01065, 0.985047, 102.158),
-            200:  BranchingRatio(0.010532, 0.984711, 102.158),
-            1000:  BranchingRatio(0.0103738, 0.982297, 102.158)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0105901, 0.981842, 102.158),
-            -200:  BranchingRatio(0.010381, 0.985548, 102.158),
-            200:  BranchingRatio(0.0102569, 0.985238, 102.158),
-            1000:  BranchingRatio(0.0100908, 0.982948, 102.158)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0103522, 0.982497, 102.158),
-            -200:  BranchingRatio(0.0101317, 0.986009, 102.158),
-            200:  BranchingRatio(0.0100012, 0.985722, 102.158),
-            1000:  BranchingRatio(0.00982708, 0.983547, 102.158)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.0101331, 0.983102, 102.158),
-            -200:  BranchingRatio(0.00990067, 0.986434, 102.158),
-            200:  BranchingRatio(0.00976365, 0.986168, 102.158),
-            1000:  BranchingRatio(0.00958117, 0.984099, 102.158)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.00993147, 0.983661, 102.158),
-            -200:  BranchingRatio(0.00968676, 0.986826, 102.158),
-            200:  BranchingRatio(0.00954295, 0.986579, 102.158),
-            1000:  BranchingRatio(0.00935184, 0.984609, 102.158)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.00974629, 0.984178, 102.158),
-            -200:  BranchingRatio(0.0094888, 0.987189, 102.158),
-            200:  BranchingRatio(0.00933796, 0.986959, 102.158),
-            1000:  BranchingRatio(0.00913796, 0.985081, 102.158)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.00957652, 0.984657, 102.158),
-            -200:  BranchingRatio(0.00930577, 0.987525, 102.158),
-            200:  BranchingRatio(0.00914765, 0.98731, 102.158),
-            1000:  BranchingRatio(0.00893849, 0.985519, 102.158)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.00942123, 0.985102, 102.158),
-            -200:  BranchingRatio(0.00913672, 0.987836, 102.158),
-            200:  BranchingRatio(0.00897109, 0.987636, 102.158),
-            1000:  BranchingRatio(0.00875249, 0.985924, 102.158)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.00927957, 0.985516, 102.158),
-            -200:  BranchingRatio(0.00898079, 0.988125, 102.158),
-            200:  BranchingRatio(0.0088074, 0.987939, 102.158),
-            1000:  BranchingRatio(0.00857907, 0.986302, 102.158)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.00915076, 0.985901, 102.158),
-            -200:  BranchingRatio(0.00883719, 0.988394, 102.158),
-            200:  BranchingRatio(0.00865578, 0.98822, 102.158),
-            1000:  BranchingRatio(0.00841744, 0.986653, 102.158)
-        },
-        6: {
-            -1000:  BranchingRatio(0.00903408, 0.986261, 102.158),
-            -200:  BranchingRatio(0.0087052, 0.988645, 102.158),
-            200:  BranchingRatio(0.00851551, 0.988482, 102.158),
-            1000:  BranchingRatio(0.00826687, 0.986981, 102.158)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.00892888, 0.986596, 102.158),
-            -200:  BranchingRatio(0.00858414, 0.988878, 102.158),
-            200:  BranchingRatio(0.00838592, 0.988726, 102.158),
-            1000:  BranchingRatio(0.00812669, 0.987286, 102.158)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.00883456, 0.98691, 102.158),
-            -200:  BranchingRatio(0.00847341, 0.989097, 102.158),
-            200:  BranchingRatio(0.00826639, 0.988954, 102.158),
-            1000:  BranchingRatio(0.00799627, 0.987572, 102.158)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.00875057, 0.987203, 102.158),
-            -200:  BranchingRatio(0.00837243, 0.989301, 102.158),
-            200:  BranchingRatio(0.00815634, 0.989168, 102.158),
-            1000:  BranchingRatio(0.00787504, 0.98784, 102.158)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.00867638, 0.987479, 102.158),
-            -200:  BranchingRatio(0.00828069, 0.989492, 102.158),
-            200:  BranchingRatio(0.00805525, 0.989367, 102.158),
-            1000:  BranchingRatio(0.00776246, 0.988091, 102.158)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.00861154, 0.987737, 102.158),
-            -200:  BranchingRatio(0.0081977, 0.989672, 102.158),
-            200:  BranchingRatio(0.00796264, 0.989555, 102.158),
-            1000:  BranchingRatio(0.00765806, 0.988326, 102.158)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.00855559, 0.987979, 102.158),
-            -200:  BranchingRatio(0.00812301, 0.98984, 102.158),
-            200:  BranchingRatio(0.00787805, 0.98973, 102.158),
-            1000:  BranchingRatio(0.00756136, 0.988547, 102.158)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.00850816, 0.988207, 102.158),
-            -200:  BranchingRatio(0.00805621, 0.989998, 102.158),
-            200:  BranchingRatio(0.00780105, 0.989895, 102.158),
-            1000:  BranchingRatio(0.00747195, 0.988755, 102.158)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.00846886, 0.988422, 102.158),
-            -200:  BranchingRatio(0.00799692, 0.990147, 102.158),
-            200:  BranchingRatio(0.00773128, 0.99005, 102.158),
-            1000:  BranchingRatio(0.00738945, 0.988951, 102.158)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.00843734, 0.988625, 102.158),
-            -200:  BranchingRatio(0.00794478, 0.990287, 102.158),
-            200:  BranchingRatio(0.00766836, 0.990197, 102.158),
-            1000:  BranchingRatio(0.00731348, 0.989135, 102.158)
-        },
-        7: {
-            -1000:  BranchingRatio(0.0084133, 0.988815, 102.158),
-            -200:  BranchingRatio(0.00789945, 0.99042, 102.158),
-            200:  BranchingRatio(0.00761195, 0.990334, 102.158),
-            1000:  BranchingRatio(0.00724371, 0.98931, 102.158)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.00839642, 0.988996, 102.158),
-            -200:  BranchingRatio(0.00786064, 0.990544, 102.158),
-            200:  BranchingRatio(0.00756175, 0.990464, 102.158),
-            1000:  BranchingRatio(0.00717982, 0.989474, 102.158)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.00838645, 0.989166, 102.158),
-            -200:  BranchingRatio(0.00782805, 0.990662, 102.158),
-            200:  BranchingRatio(0.00751747, 0.990587, 102.158),
-            1000:  BranchingRatio(0.00712152, 0.98963, 102.158)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.00838312, 0.989327, 102.158),
-            -200:  BranchingRatio(0.00780141, 0.990774, 102.158),
-            200:  BranchingRatio(0.00747883, 0.990703, 102.158),
-            1000:  BranchingRatio(0.00706853, 0.989777, 102.158)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.00838621, 0.98948, 102.158),
-            -200:  BranchingRatio(0.00778048, 0.99088, 102.158),
-            200:  BranchingRatio(0.00744558, 0.990813, 102.158),
-            1000:  BranchingRatio(0.0070206, 0.989917, 102.158)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.00839548, 0.989625, 102.158),
-            -200:  BranchingRatio(0.00776502, 0.99098, 102.158),
-            200:  BranchingRatio(0.00741748, 0.990917, 102.158),
-            1000:  BranchingRatio(0.00697748, 0.990049, 102.158)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.00841074, 0.989762, 102.158),
-            -200:  BranchingRatio(0.00775481, 0.991075, 102.158),
-            200:  BranchingRatio(0.00739431, 0.991016, 102.158),
-            1000:  BranchingRatio(0.00693895, 0.990175, 102.158)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.00843178, 0.989892, 102.158),
-            -200:  BranchingRatio(0.00774965, 0.991165, 102.158),
-            200:  BranchingRatio(0.00737586, 0.99111, 102.158),
-            1000:  BranchingRatio(0.00690481, 0.990294, 102.158)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.00845845, 0.990016, 102.158),
-            -200:  BranchingRatio(0.00774936, 0.99125, 102.158),
-            200:  BranchingRatio(0.00736194, 0.991199, 102.158),
-            1000:  BranchingRatio(0.00687484, 0.990407, 102.158)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.00849056, 0.990134, 102.158),
-            -200:  BranchingRatio(0.00775375, 0.991332, 102.158),
-            200:  BranchingRatio(0.00735236, 0.991283, 102.158),
-            1000:  BranchingRatio(0.00684888, 0.990515, 102.158)
-        },
-        8: {
-            -1000:  BranchingRatio(0.00852797, 0.990246, 102.158),
-            -200:  BranchingRatio(0.00776264, 0.991409, 102.158),
-            200:  BranchingRatio(0.00734695, 0.991364, 102.158),
-            1000:  BranchingRatio(0.00682673, 0.990618, 102.158)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.00857054, 0.990353, 102.158),
-            -200:  BranchingRatio(0.0077759, 0.991483, 102.158),
-            200:  BranchingRatio(0.00734556, 0.99144, 102.158),
-            1000:  BranchingRatio(0.00680825, 0.990716, 102.158)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.00861812, 0.990454, 102.158),
-            -200:  BranchingRatio(0.00779336, 0.991553, 102.158),
-            200:  BranchingRatio(0.00734802, 0.991513, 102.158),
-            1000:  BranchingRatio(0.00679326, 0.99081, 102.158)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.0086706, 0.990551, 102.158),
-            -200:  BranchingRatio(0.0078149, 0.99162, 102.158),
-            200:  BranchingRatio(0.0073542, 0.991583, 102.158),
-            1000:  BranchingRatio(0.00678164, 0.990899, 102.158)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.00872786, 0.990644, 102.158),
-            -200:  BranchingRatio(0.00784037, 0.991684, 102.158),
-            200:  BranchingRatio(0.00736396, 0.991649, 102.158),
-            1000:  BranchingRatio(0.00677324, 0.990984, 102.158)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.00878979, 0.990732, 102.158),
-            -200:  BranchingRatio(0.00786965, 0.991745, 102.158),
-            200:  BranchingRatio(0.00737717, 0.991712, 102.158),
-            1000:  BranchingRatio(0.00676793, 0.991065, 102.158)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.00885628, 0.990816, 102.158),
-            -200:  BranchingRatio(0.00790264, 0.991803, 102.158),
-            200:  BranchingRatio(0.00739372, 0.991773, 102.158),
-            1000:  BranchingRatio(0.00676559, 0.991143, 102.158)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.00892725, 0.990897, 102.158),
-            -200:  BranchingRatio(0.00793922, 0.991859, 102.158),
-            200:  BranchingRatio(0.00741349, 0.991831, 102.158),
-            1000:  BranchingRatio(0.0067661, 0.991218, 102.158)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.00900261, 0.990974, 102.158),
-            -200:  BranchingRatio(0.00797929, 0.991912, 102.158),
-            200:  BranchingRatio(0.00743637, 0.991886, 102.158),
-            1000:  BranchingRatio(0.00676935, 0.991289, 102.158)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.00908227, 0.991048, 102.158),
-            -200:  BranchingRatio(0.00802275, 0.991963, 102.158),
-            200:  BranchingRatio(0.00746226, 0.991939, 102.158),
-            1000:  BranchingRatio(0.00677525, 0.991357, 102.158)
-        },
-        9: {
-            -1000:  BranchingRatio(0.00916616, 0.991118, 102.158),
-            -200:  BranchingRatio(0.00806951, 0.992012, 102.158),
-            200:  BranchingRatio(0.00749107, 0.99199, 102.158),
-            1000:  BranchingRatio(0.00678369, 0.991423, 102.158)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.0092542, 0.991186, 102.158),
-            -200:  BranchingRatio(0.00811948, 0.992059, 102.158),
-            200:  BranchingRatio(0.00752271, 0.992039, 102.158),
-            1000:  BranchingRatio(0.00679458, 0.991486, 102.158)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.00934634, 0.991251, 102.158),
-            -200:  BranchingRatio(0.00817258, 0.992104, 102.158),
-            200:  BranchingRatio(0.00755709, 0.992085, 102.158),
-            1000:  BranchingRatio(0.00680783, 0.991546, 102.158)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.00944249, 0.991313, 102.158),
-            -200:  BranchingRatio(0.00822874, 0.992147, 102.158),
-            200:  BranchingRatio(0.00759412, 0.99213, 102.158),
-            1000:  BranchingRatio(0.00682336, 0.991604, 102.158)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.00954262, 0.991373, 102.158),
-            -200:  BranchingRatio(0.00828788, 0.992188, 102.158),
-            200:  BranchingRatio(0.00763374, 0.992173, 102.158),
-            1000:  BranchingRatio(0.00684108, 0.99166, 102.158)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.00964667, 0.991431, 102.158),
-            -200:  BranchingRatio(0.00834993, 0.992228, 102.158),
-            200:  BranchingRatio(0.00767587, 0.992214, 102.158),
-            1000:  BranchingRatio(0.00686093, 0.991713, 102.158)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.00975457, 0.991486, 102.158),
-            -200:  BranchingRatio(0.00841483, 0.992266, 102.158),
-            200:  BranchingRatio(0.00772043, 0.992254, 102.158),
-            1000:  BranchingRatio(0.00688284, 0.991765, 102.158)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.0098663, 0.991539, 102.158),
-            -200:  BranchingRatio(0.00848251, 0.992303, 102.158),
-            200:  BranchingRatio(0.00776737, 0.992292, 102.158),
-            1000:  BranchingRatio(0.00690672, 0.991814, 102.158)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.00998181, 0.99159, 102.158),
-            -200:  BranchingRatio(0.00855291, 0.992339, 102.158),
-            200:  BranchingRatio(0.00781662, 0.992329, 102.158),
-            1000:  BranchingRatio(0.00693252, 0.991862, 102.158)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.0101011, 0.991639, 102.158),
-            -200:  BranchingRatio(0.00862599, 0.992373, 102.158),
-            200:  BranchingRatio(0.00786812, 0.992364, 102.158),
-            1000:  BranchingRatio(0.00696018, 0.991908, 102.158)
-        },
-        10: {
-            -1000:  BranchingRatio(0.010224, 0.991686, 102.158),
-            -200:  BranchingRatio(0.00870168, 0.992405, 102.158),
-            200:  BranchingRatio(0.00792181, 0.992398, 102.158),
-            1000:  BranchingRatio(0.00698964, 0.991952, 102.158)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0116505, 0.992073, 102.158),
-            -200:  BranchingRatio(0.00959251, 0.992676, 102.158),
-            200:  BranchingRatio(0.00856845, 0.992679, 102.158),
-            1000:  BranchingRatio(0.00737177, 0.99232, 102.158)
-        },
-        12: {
-            -1000:  BranchingRatio(0.0134233, 0.992346, 102.158),
-            -200:  BranchingRatio(0.0107025, 0.992869, 102.158),
-            200:  BranchingRatio(0.00938746, 0.99288, 102.158),
-            1000:  BranchingRatio(0.00788475, 0.992586, 102.158)
-        },
-        13: {
-            -1000:  BranchingRatio(0.0155363, 0.992543, 102.158),
-            -200:  BranchingRatio(0.0120071, 0.993012, 102.158),
-            200:  BranchingRatio(0.0103505, 0.99303, 102.158),
-            1000:  BranchingRatio(0.00849871, 0.992785, 102.158)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0179938, 0.992688, 102.158),
-            -200:  BranchingRatio(0.0134908, 0.99312, 102.158),
-            200:  BranchingRatio(0.0114381, 0.993143, 102.158),
-            1000:  BranchingRatio(0.00919299, 0.992938, 102.158)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0208071, 0.992794, 102.158),
-            -200:  BranchingRatio(0.0151434, 0.993203, 102.158),
-            200:  BranchingRatio(0.0126365, 0.993232, 102.158),
-            1000:  BranchingRatio(0.00995271, 0.993058, 102.158)
-        },
-        16: {
-            -1000:  BranchingRatio(0.0239927, 0.992872, 102.158),
-            -200:  BranchingRatio(0.0169583, 0.993269, 102.158),
-            200:  BranchingRatio(0.0139353, 0.993303, 102.158),
-            1000:  BranchingRatio(0.0107667, 0.993155, 102.158)
-        },
-        17: {
-            -1000:  BranchingRatio(0.0275706, 0.992926, 102.158),
-            -200:  BranchingRatio(0.0189308, 0.993321, 102.158),
-            200:  BranchingRatio(0.0153264, 0.99336, 102.158),
-            1000:  BranchingRatio(0.0116264, 0.993234, 102.158)
-        },
-        18: {
-            -1000:  BranchingRatio(0.0315645, 0.992961, 102.158),
-            -200:  BranchingRatio(0.0210581, 0.993363, 102.158),
-            200:  BranchingRatio(0.0168034, 0.993406, 102.158),
-            1000:  BranchingRatio(0.0125248, 0.9933, 102.158)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0360006, 0.992978, 102.158),
-            -200:  BranchingRatio(0.0233379, 0.993396, 102.158),
-            200:  BranchingRatio(0.0183609, 0.993445, 102.158),
-            1000:  BranchingRatio(0.0134564, 0.993354, 102.158)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0409078, 0.99298, 102.158),
-            -200:  BranchingRatio(0.025769, 0.993423, 102.158),
-            200:  BranchingRatio(0.0199944, 0.993477, 102.158),
-            1000:  BranchingRatio(0.0144166, 0.993401, 102.158)
-        },
-        21: {
-            -1000:  BranchingRatio(0.0463171, 0.992965, 102.158),
-            -200:  BranchingRatio(0.0283503, 0.993444, 102.158),
-            200:  BranchingRatio(0.0217, 0.993504, 102.158),
-            1000:  BranchingRatio(0.0154015, 0.993441, 102.158)
-        },
-        22: {
-            -1000:  BranchingRatio(0.052262, 0.992932, 102.158),
-            -200:  BranchingRatio(0.0310813, 0.993461, 102.158),
-            200:  BranchingRatio(0.023474, 0.993527, 102.158),
-            1000:  BranchingRatio(0.0164076, 0.993475, 102.158)
-        },
-        23: {
-            -1000:  BranchingRatio(0.0587781, 0.99288, 102.158),
-            -200:  BranchingRatio(0.0339616, 0.993475, 102.158),
-            200:  BranchingRatio(0.0253133, 0.993547, 102.158),
-            1000:  BranchingRatio(0.0174321, 0.993505, 102.158)
-        },
-        24: {
-            -1000:  BranchingRatio(0.0659028, 0.992805, 102.158),
-            -200:  BranchingRatio(0.0369907, 0.993484, 102.158),
-            200:  BranchingRatio(0.0272149, 0.993563, 102.158),
-            1000:  BranchingRatio(0.0184723, 0.993531, 102.158)
-        },
-        25: {
-            -1000:  BranchingRatio(0.0736755, 0.9927, 102.158),
-            -200:  BranchingRatio(0.0401684, 0.993491, 102.158),
-            200:  BranchingRatio(0.029176, 0.993578, 102.158),
-            1000:  BranchingRatio(0.019526, 0.993554, 102.158)
-        },
-        26: {
-            -1000:  BranchingRatio(0.0821373, 0.992557, 102.158),
-            -200:  BranchingRatio(0.0434944, 0.993496, 102.158),
-            200:  BranchingRatio(0.0311941, 0.99359, 102.158),
-            1000:  BranchingRatio(0.0205913, 0.993575, 102.158)
-        },
-        27: {
-            -1000:  BranchingRatio(0.0913309, 0.992362, 102.158),
-            -200:  BranchingRatio(0.0469685, 0.993497, 102.158),
-            200:  BranchingRatio(0.0332668, 0.993601, 102.158),
-            1000:  BranchingRatio(0.0216662, 0.993593, 102.158)
-        },
-        28: {
-            -1000:  BranchingRatio(0.101301, 0.992096, 102.158),
-            -200:  BranchingRatio(0.0505903, 0.993497, 102.158),
-            200:  BranchingRatio(0.0353916, 0.99361, 102.158),
-            1000:  BranchingRatio(0.0227492, 0.993609, 102.158)
-        },
-        29: {
-            -1000:  BranchingRatio(0.112091, 0.991723, 102.158),
-            -200:  BranchingRatio(0.0543594, 0.993494, 102.158),
-            200:  BranchingRatio(0.0375664, 0.993618, 102.158),
-            1000:  BranchingRatio(0.0238387, 0.993624, 102.158)
-        },
-        30: {
-            -1000:  BranchingRatio(0.123749, 0.991188, 102.158),
-            -200:  BranchingRatio(0.0582753, 0.993489, 102.158),
-            200:  BranchingRatio(0.039789, 0.993625, 102.158),
-            1000:  BranchingRatio(0.0249335, 0.993638, 102.158)
-        },
-        31: {
-            -1000:  BranchingRatio(0.13632, 0.990389, 102.158),
-            -200:  BranchingRatio(0.0623375, 0.993482, 102.158),
-            200:  BranchingRatio(0.0420574, 0.993631, 102.158),
-            1000:  BranchingRatio(0.0260324, 0.99365, 102.158)
-        },
-        32: {
-            -1000:  BranchingRatio(0.14985, 0.989116, 102.158),
-            -200:  BranchingRatio(0.0665453, 0.993473, 102.158),
-            200:  BranchingRatio(0.0443695, 0.993636, 102.158),
-            1000:  BranchingRatio(0.0271342, 0.993661, 102.158)
-        },
-        33: {
-            -1000:  BranchingRatio(0.164385, 0.986836, 102.158),
-            -200:  BranchingRatio(0.070898, 0.993461, 102.158),
-            200:  BranchingRatio(0.0467233, 0.99364, 102.158),
-            1000:  BranchingRatio(0.028238, 0.993671, 102.158)
-        },
-        34: {
-            -1000:  BranchingRatio(0.179969, 0.981076, 102.158),
-            -200:  BranchingRatio(0.0753947, 0.993447, 102.158),
-            200:  BranchingRatio(0.0491172, 0.993644, 102.158),
-            1000:  BranchingRatio(0.0293428, 0.993681, 102.158)
-        },
-        35: {
-            -1000:  BranchingRatio(0.196644, 0.913331, 102.158),
-            -200:  BranchingRatio(0.0800342, 0.993431, 102.158),
-            200:  BranchingRatio(0.0515491, 0.993647, 102.158),
-            1000:  BranchingRatio(0.0304477, 0.993689, 102.158)
-        },
-        36: {
-            -1000:  BranchingRatio(0.214449, 0.751656, 102.158),
-            -200:  BranchingRatio(0.0848155, 0.993411, 102.158),
-            200:  BranchingRatio(0.0540174, 0.993649, 102.158),
-            1000:  BranchingRatio(0.0315521, 0.993697, 102.158)
-        },
-        37: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0897372, 0.993389, 102.158),
-            200:  BranchingRatio(0.0565202, 0.993651, 102.158),
-            1000:  BranchingRatio(0.0326553, 0.993705, 102.158)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.094798, 0.993363, 102.158),
-            200:  BranchingRatio(0.0590562, 0.993652, 102.158),
-            1000:  BranchingRatio(0.0337565, 0.993712, 102.158)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0999964, 0.993334, 102.158),
-            200:  BranchingRatio(0.0616233, 0.993652, 102.158),
-            1000:  BranchingRatio(0.0348552, 0.993718, 102.158)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.105331, 0.9933, 102.158),
-            200:  BranchingRatio(0.0642202, 0.993653, 102.158),
-            1000:  BranchingRatio(0.0359509, 0.993724, 102.158)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.110799, 0.993263, 102.158),
-            200:  BranchingRatio(0.0668452, 0.993653, 102.158),
-            1000:  BranchingRatio(0.0370431, 0.99373, 102.158)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.116399, 0.993219, 102.158),
-            200:  BranchingRatio(0.069497, 0.993652, 102.158),
-            1000:  BranchingRatio(0.0381313, 0.993735, 102.158)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.12213, 0.99317, 102.158),
-            200:  BranchingRatio(0.0721739, 0.993651, 102.158),
-            1000:  BranchingRatio(0.0392151, 0.993739, 102.158)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.127988, 0.993115, 102.158),
-            200:  BranchingRatio(0.0748747, 0.99365, 102.158),
-            1000:  BranchingRatio(0.0402941, 0.993744, 102.158)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.133972, 0.993051, 102.158),
-            200:  BranchingRatio(0.0775979, 0.993648, 102.158),
-            1000:  BranchingRatio(0.0413681, 0.993748, 102.158)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.14008, 0.992978, 102.158),
-            200:  BranchingRatio(0.0803423, 0.993646, 102.158),
-            1000:  BranchingRatio(0.0424367, 0.993752, 102.158)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.146307, 0.992895, 102.158),
-            200:  BranchingRatio(0.0831064, 0.993644, 102.158),
-            1000:  BranchingRatio(0.0434995, 0.993756, 102.158)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.152653, 0.992799, 102.158),
-            200:  BranchingRatio(0.085889, 0.993641, 102.158),
-            1000:  BranchingRatio(0.0445565, 0.993759, 102.158)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.159114, 0.992688, 102.158),
-            200:  BranchingRatio(0.0886889, 0.993638, 102.158),
-            1000:  BranchingRatio(0.0456073, 0.993762, 102.158)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.165686, 0.992558, 102.158),
-            200:  BranchingRatio(0.0915049, 0.993635, 102.158),
-            1000:  BranchingRatio(0.0466516, 0.993766, 102.158)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.172368, 0.992406, 102.158),
-            200:  BranchingRatio(0.0943358, 0.993631, 102.158),
-            1000:  BranchingRatio(0.0476895, 0.993768, 102.158)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.179156, 0.992225, 102.158),
-            200:  BranchingRatio(0.0971805, 0.993627, 102.158),
-            1000:  BranchingRatio(0.0487206, 0.993771, 102.158)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.186047, 0.992008, 102.158),
-            200:  BranchingRatio(0.100038, 0.993623, 102.158),
-            1000:  BranchingRatio(0.0497448, 0.993774, 102.158)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.193037, 0.99174, 102.158),
-            200:  BranchingRatio(0.102907, 0.993618, 102.158),
-            1000:  BranchingRatio(0.050762, 0.993777, 102.158)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.200123, 0.991402, 102.158),
-            200:  BranchingRatio(0.105787, 0.993613, 102.158),
-            1000:  BranchingRatio(0.051772, 0.993779, 102.158)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.207301, 0.990956, 102.158),
-            200:  BranchingRatio(0.108676, 0.993608, 102.158),
-            1000:  BranchingRatio(0.0527748, 0.993781, 102.158)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.214569, 0.990318, 102.158),
-            200:  BranchingRatio(0.111574, 0.993602, 102.158),
-            1000:  BranchingRatio(0.0537703, 0.993784, 102.158)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.221921, 0.989259, 102.158),
-            200:  BranchingRatio(0.114479, 0.993596, 102.158),
-            1000:  BranchingRatio(0.0547583, 0.993786, 102.158)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.229356, 0.989152, 102.158),
-            200:  BranchingRatio(0.117392, 0.99359, 102.158),
-            1000:  BranchingRatio(0.0557389, 0.993788, 102.158)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.236867, 0.980218, 102.158),
-            200:  BranchingRatio(0.12031, 0.993583, 102.158),
-            1000:  BranchingRatio(0.056712, 0.99379, 102.158)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.244453, 0.96624, 102.158),
-            200:  BranchingRatio(0.123234, 0.993576, 102.158),
-            1000:  BranchingRatio(0.0576774, 0.993792, 102.158)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.252109, 0.950201, 102.158),
-            200:  BranchingRatio(0.126161, 0.993568, 102.158),
-            1000:  BranchingRatio(0.0586353, 0.993793, 102.158)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.259831, 0.933071, 102.158),
-            200:  BranchingRatio(0.129092, 0.99356, 102.158),
-            1000:  BranchingRatio(0.0595855, 0.993795, 102.158)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.267615, 0.915692, 102.158),
-            200:  BranchingRatio(0.132026, 0.993552, 102.158),
-            1000:  BranchingRatio(0.060528, 0.993797, 102.158)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.275457, 0.899261, 102.158),
-            200:  BranchingRatio(0.134962, 0.993543, 102.158),
-            1000:  BranchingRatio(0.0614628, 0.993798, 102.158)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.137898, 0.993533, 102.158),
-            1000:  BranchingRatio(0.06239, 0.9938, 102.158)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.140836, 0.993523, 102.158),
-            1000:  BranchingRatio(0.0633094, 0.993801, 102.158)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.143773, 0.993513, 102.158),
-            1000:  BranchingRatio(0.0642212, 0.993803, 102.158)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.146709, 0.993502, 102.158),
-            1000:  BranchingRatio(0.0651252, 0.993804, 102.158)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.149644, 0.993491, 102.158),
-            1000:  BranchingRatio(0.0660216, 0.993805, 102.158)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.152577, 0.993478, 102.158),
-            1000:  BranchingRatio(0.0669104, 0.993806, 102.158)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.155508, 0.993466, 102.158),
-            1000:  BranchingRatio(0.0677915, 0.993808, 102.158)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.158435, 0.993452, 102.158),
-            1000:  BranchingRatio(0.068665, 0.993809, 102.158)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.161359, 0.993438, 102.158),
-            1000:  BranchingRatio(0.0695309, 0.99381, 102.158)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.164278, 0.993423, 102.158),
-            1000:  BranchingRatio(0.0703893, 0.993811, 102.158)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.167192, 0.993407, 102.158),
-            1000:  BranchingRatio(0.0712402, 0.993812, 102.158)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.170102, 0.99339, 102.158),
-            1000:  BranchingRatio(0.0720837, 0.993813, 102.158)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.173005, 0.993373, 102.158),
-            1000:  BranchingRatio(0.0729197, 0.993814, 102.158)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.175903, 0.993354, 102.158),
-            1000:  BranchingRatio(0.0737483, 0.993815, 102.158)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.178794, 0.993334, 102.158),
-            1000:  BranchingRatio(0.0745696, 0.993816, 102.158)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.181678, 0.993313, 102.158),
-            1000:  BranchingRatio(0.0753836, 0.993817, 102.158)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.184555, 0.99329, 102.158),
-            1000:  BranchingRatio(0.0761904, 0.993817, 102.158)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.187425, 0.993266, 102.158),
-            1000:  BranchingRatio(0.07699, 0.993818, 102.158)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.190286, 0.993241, 102.158),
-            1000:  BranchingRatio(0.0777825, 0.993819, 102.158)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.193139, 0.993213, 102.158),
-            1000:  BranchingRatio(0.0785679, 0.99382, 102.158)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.195983, 0.993183, 102.158),
-            1000:  BranchingRatio(0.0793462, 0.99382, 102.158)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.198818, 0.993151, 102.158),
-            1000:  BranchingRatio(0.0801176, 0.993821, 102.158)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.201644, 0.993116, 102.158),
-            1000:  BranchingRatio(0.0808821, 0.993822, 102.158)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.20446, 0.993078, 102.158),
-            1000:  BranchingRatio(0.0816398, 0.993822, 102.158)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.207266, 0.993036, 102.158),
-            1000:  BranchingRatio(0.0823906, 0.993823, 102.158)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.210062, 0.99299, 102.158),
-            1000:  BranchingRatio(0.0831347, 0.993824, 102.158)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.212848, 0.992938, 102.158),
-            1000:  BranchingRatio(0.0838721, 0.993824, 102.158)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.215623, 0.992879, 102.158),
-            1000:  BranchingRatio(0.0846029, 0.993825, 102.158)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.218388, 0.992811, 102.158),
-            1000:  BranchingRatio(0.0853272, 0.993825, 102.158)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.221141, 0.992731, 102.158),
-            1000:  BranchingRatio(0.0860449, 0.993826, 102.158)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.223883, 0.992633, 102.158),
-            1000:  BranchingRatio(0.0867562, 0.993826, 102.158)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.226614, 0.992509, 102.158),
-            1000:  BranchingRatio(0.0874611, 0.993827, 102.158)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.229333, 0.992438, 102.158),
-            1000:  BranchingRatio(0.0881597, 0.993827, 102.158)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.23204, 0.992445, 102.158),
-            1000:  BranchingRatio(0.088852, 0.993827, 102.158)
-        }
-    },
-    140: {
-        1.1: {
-            -1000:  BranchingRatio(0.100668, 0.339126, 114.613),
-            -200:  BranchingRatio(0.10066, 0.368835, 114.613),
-            200:  BranchingRatio(0.100654, 0.363853, 114.613),
-            1000:  BranchingRatio(0.100645, 0.341004, 114.613)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.086067, 0.399253, 114.613),
-            -200:  BranchingRatio(0.0860581, 0.43613, 114.613),
-            200:  BranchingRatio(0.0860512, 0.42936, 114.613),
-            1000:  BranchingRatio(0.0860421, 0.403059, 114.613)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.0743741, 0.455846, 114.613),
-            -200:  BranchingRatio(0.0743642, 0.498508, 114.613),
-            200:  BranchingRatio(0.0743568, 0.490224, 114.613),
-            1000:  BranchingRatio(0.0743468, 0.461511, 114.613)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.0648836, 0.509013, 114.613),
-            -200:  BranchingRatio(0.0648727, 0.555605, 114.613),
-            200:  BranchingRatio(0.0648646, 0.546263, 114.613),
-            1000:  BranchingRatio(0.0648537, 0.516275, 114.613)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.0570866, 0.55887, 114.613),
-            -200:  BranchingRatio(0.0570746, 0.607475, 114.613),
-            200:  BranchingRatio(0.0570659, 0.59758, 114.613),
-            1000:  BranchingRatio(0.0570539, 0.567361, 114.613)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.0506105, 0.605371, 114.613),
-            -200:  BranchingRatio(0.0505973, 0.654284, 114.613),
-            200:  BranchingRatio(0.0505878, 0.644295, 114.613),
-            1000:  BranchingRatio(0.0505749, 0.614699, 114.613)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.0451781, 0.648377, 114.613),
-            -200:  BranchingRatio(0.0451636, 0.696226, 114.613),
-            200:  BranchingRatio(0.0451534, 0.686503, 114.613),
-            1000:  BranchingRatio(0.0451393, 0.658161, 114.613)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.0405802, 0.687778, 114.613),
-            -200:  BranchingRatio(0.0405644, 0.733525, 114.613),
-            200:  BranchingRatio(0.0405534, 0.724321, 114.613),
-            1000:  BranchingRatio(0.0405381, 0.697654, 114.613)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.036657, 0.723338, 114.613),
-            -200:  BranchingRatio(0.0366397, 0.766465, 114.613),
-            200:  BranchingRatio(0.0366279, 0.757931, 114.613),
-            1000:  BranchingRatio(0.0366113, 0.733188, 114.613)
-        },
-        2: {
-            -1000:  BranchingRatio(0.0332846, 0.755241, 114.613),
-            -200:  BranchingRatio(0.0332659, 0.795345, 114.613),
-            200:  BranchingRatio(0.0332531, 0.787561, 114.613),
-            1000:  BranchingRatio(0.0332353, 0.764833, 114.613)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0303663, 0.783513, 114.613),
-            -200:  BranchingRatio(0.030346, 0.820538, 114.613),
-            200:  BranchingRatio(0.0303322, 0.813519, 114.613),
-            1000:  BranchingRatio(0.030313, 0.7928, 114.613)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0278253, 0.808478, 114.613),
-            -200:  BranchingRatio(0.0278033, 0.842418, 114.613),
-            200:  BranchingRatio(0.0277885, 0.836142, 114.613),
-            1000:  BranchingRatio(0.0277678, 0.817358, 114.613)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.0256005, 0.830408, 114.613),
-            -200:  BranchingRatio(0.0255766, 0.861362, 114.613),
-            200:  BranchingRatio(0.0255607, 0.855785, 114.613),
-            1000:  BranchingRatio(0.0255385, 0.838818, 114.613)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.0236423, 0.849598, 114.613),
-            -200:  BranchingRatio(0.0236166, 0.877732, 114.613),
-            200:  BranchingRatio(0.0235995, 0.872795, 114.613),
-            1000:  BranchingRatio(0.0235756, 0.857505, 114.613)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0219108, 0.866348, 114.613),
-            -200:  BranchingRatio(0.021883, 0.891863, 114.613),
-            200:  BranchingRatio(0.0218647, 0.887505, 114.613),
-            1000:  BranchingRatio(0.0218391, 0.87374, 114.613)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0203729, 0.880946, 114.613),
-            -200:  BranchingRatio(0.020343, 0.90406, 114.613),
-            200:  BranchingRatio(0.0203234, 0.900216, 114.613),
-            1000:  BranchingRatio(0.0202959, 0.887828, 114.613)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.0190016, 0.893661, 114.613),
-            -200:  BranchingRatio(0.0189694, 0.914591, 114.613),
-            200:  BranchingRatio(0.0189484, 0.911204, 114.613),
-            1000:  BranchingRatio(0.0189191, 0.900049, 114.613)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0177743, 0.904737, 114.613),
-            -200:  BranchingRatio(0.0177397, 0.923696, 114.613),
-            200:  BranchingRatio(0.0177173, 0.920709, 114.613),
-            1000:  BranchingRatio(0.0176859, 0.910655, 114.613)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.0166722, 0.914393, 114.613),
-            -200:  BranchingRatio(0.016635, 0.931579, 114.613),
-            200:  BranchingRatio(0.016611, 0.928942, 114.613),
-            1000:  BranchingRatio(0.0165776, 0.919867, 114.613)
-        },
-        3: {
-            -1000:  BranchingRatio(0.0156793, 0.92282, 114.613),
-            -200:  BranchingRatio(0.0156395, 0.938416, 114.613),
-            200:  BranchingRatio(0.0156139, 0.936086, 114.613),
-            1000:  BranchingRatio(0.0155782, 0.92788, 114.613)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.0147822, 0.930186, 114.613),
-            -200:  BranchingRatio(0.0147396, 0.944359, 114.613),
-            200:  BranchingRatio(0.0147123, 0.942296, 114.613),
-            1000:  BranchingRatio(0.0146743, 0.934863, 114.613)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.0139696, 0.936636, 114.613),
-            -200:  BranchingRatio(0.013924, 0.949537, 114.613),
-            200:  BranchingRatio(0.0138949, 0.947707, 114.613),
-            1000:  BranchingRatio(0.0138545, 0.940959, 114.613)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.0132317, 0.942296, 114.613),
-            -200:  BranchingRatio(0.0131829, 0.95406, 114.613),
-            200:  BranchingRatio(0.013152, 0.952433, 114.613),
-            1000:  BranchingRatio(0.013109, 0.946293, 114.613)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.01256, 0.947273, 114.613),
-            -200:  BranchingRatio(0.0125079, 0.95802, 114.613),
-            200:  BranchingRatio(0.012475, 0.95657, 114.613),
-            1000:  BranchingRatio(0.0124294, 0.950971, 114.613)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.0119475, 0.951659, 114.613),
-            -200:  BranchingRatio(0.0118919, 0.961496, 114.613),
-            200:  BranchingRatio(0.0118569, 0.960202, 114.613),
-            1000:  BranchingRatio(0.0118085, 0.955084, 114.613)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.0113877, 0.955535, 114.613),
-            -200:  BranchingRatio(0.0113285, 0.964556, 114.613),
-            200:  BranchingRatio(0.0112914, 0.963398, 114.613),
-            1000:  BranchingRatio(0.0112401, 0.958709, 114.613)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.0108754, 0.958966, 114.613),
-            -200:  BranchingRatio(0.0108123, 0.967257, 114.613),
-            200:  BranchingRatio(0.0107729, 0.966218, 114.613),
-            1000:  BranchingRatio(0.0107186, 0.961912, 114.613)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.0104057, 0.962013, 114.613),
-            -200:  BranchingRatio(0.0103386, 0.969646, 114.613),
-            200:  BranchingRatio(0.0102968, 0.968713, 114.613),
-            1000:  BranchingRatio(0.0102394, 0.96475, 114.613)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.00997444, 0.964724, 114.613),
-            -200:  BranchingRatio(0.00990311, 0.971767, 114.613),
-            200:  BranchingRatio(0.00985891, 0.970925, 114.613),
-            1000:  BranchingRatio(0.00979818, 0.96727, 114.613)
-        },
-        4: {
-            -1000:  BranchingRatio(0.00957806, 0.967142, 114.613),
-            -200:  BranchingRatio(0.00950231, 0.973652, 114.613),
-            200:  BranchingRatio(0.00945554, 0.972893, 114.613),
-            1000:  BranchingRatio(0.0093914, 0.969514, 114.613)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.00921332, 0.969305, 114.613),
-            -200:  BranchingRatio(0.00913293, 0.975334, 114.613),
-            200:  BranchingRatio(0.00908348, 0.974647, 114.613),
-            1000:  BranchingRatio(0.0090158, 0.971516, 114.613)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.00887736, 0.971243, 114.613),
-            -200:  BranchingRatio(0.00879212, 0.976838, 114.613),
-            200:  BranchingRatio(0.00873988, 0.976214, 114.613),
-            1000:  BranchingRatio(0.00866852, 0.973308, 114.613)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.00856767, 0.972984, 114.613),
-            -200:  BranchingRatio(0.00847736, 0.978185, 114.613),
-            200:  BranchingRatio(0.00842222, 0.977618, 114.613),
-            1000:  BranchingRatio(0.00834703, 0.974915, 114.613)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.00828201, 0.974552, 114.613),
-            -200:  BranchingRatio(0.00818641, 0.979395, 114.613),
-            200:  BranchingRatio(0.00812823, 0.978879, 114.613),
-            1000:  BranchingRatio(0.00804908, 0.97636, 114.613)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.00801837, 0.975966, 114.613),
-            -200:  BranchingRatio(0.00791725, 0.980485, 114.613),
-            200:  BranchingRatio(0.00785592, 0.980014, 114.613),
-            1000:  BranchingRatio(0.00777266, 0.977662, 114.613)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.00777499, 0.977246, 114.613),
-            -200:  BranchingRatio(0.0076681, 0.981468, 114.613),
-            200:  BranchingRatio(0.0076035, 0.981037, 114.613),
-            1000:  BranchingRatio(0.00751598, 0.978837, 114.613)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.00755026, 0.978405, 114.613),
-            -200:  BranchingRatio(0.00743736, 0.982357, 114.613),
-            200:  BranchingRatio(0.00736936, 0.981963, 114.613),
-            1000:  BranchingRatio(0.00727742, 0.979901, 114.613)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.00734275, 0.979458, 114.613),
-            -200:  BranchingRatio(0.00722359, 0.983163, 114.613),
-            200:  BranchingRatio(0.00715205, 0.982801, 114.613),
-            1000:  BranchingRatio(0.00705555, 0.980865, 114.613)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.00715116, 0.980416, 114.613),
-            -200:  BranchingRatio(0.00702548, 0.983894, 114.613),
-            200:  BranchingRatio(0.00695028, 0.983562, 114.613),
-            1000:  BranchingRatio(0.00684906, 0.981742, 114.613)
-        },
-        5: {
-            -1000:  BranchingRatio(0.00697433, 0.981289, 114.613),
-            -200:  BranchingRatio(0.00684187, 0.98456, 114.613),
-            200:  BranchingRatio(0.00676288, 0.984254, 114.613),
-            1000:  BranchingRatio(0.00665678, 0.982541, 114.613)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.00681123, 0.982086, 114.613),
-            -200:  BranchingRatio(0.00667171, 0.985167, 114.613),
-            200:  BranchingRatio(0.00658878, 0.984885, 114.613),
-            1000:  BranchingRatio(0.00647764, 0.983269, 114.613)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.00666089, 0.982816, 114.613),
-            -200:  BranchingRatio(0.00651403, 0.985722, 114.613),
-            200:  BranchingRatio(0.00642702, 0.985461, 114.613),
-            1000:  BranchingRatio(0.00631068, 0.983935, 114.613)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.00652244, 0.983485, 114.613),
-            -200:  BranchingRatio(0.00636797, 0.986229, 114.613),
-            200:  BranchingRatio(0.00627674, 0.985988, 114.613),
-            1000:  BranchingRatio(0.00615502, 0.984544, 114.613)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.00639512, 0.9841, 114.613),
-            -200:  BranchingRatio(0.00623273, 0.986694, 114.613),
-            200:  BranchingRatio(0.00613714, 0.986471, 114.613),
-            1000:  BranchingRatio(0.00600989, 0.985104, 114.613)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.00627821, 0.984665, 114.613),
-            -200:  BranchingRatio(0.00610761, 0.987121, 114.613),
-            200:  BranchingRatio(0.0060075, 0.986915, 114.613),
-            1000:  BranchingRatio(0.00587454, 0.985618, 114.613)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.00617106, 0.985186, 114.613),
-            -200:  BranchingRatio(0.00599194, 0.987514, 114.613),
-            200:  BranchingRatio(0.00588716, 0.987322, 114.613),
-            1000:  BranchingRatio(0.00574832, 0.986091, 114.613)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.00607308, 0.985666, 114.613),
-            -200:  BranchingRatio(0.00588512, 0.987876, 114.613),
-            200:  BranchingRatio(0.00577552, 0.987698, 114.613),
-            1000:  BranchingRatio(0.00563063, 0.986527, 114.613)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.00598372, 0.98611, 114.613),
-            -200:  BranchingRatio(0.00578661, 0.98821, 114.613),
-            200:  BranchingRatio(0.00567203, 0.988044, 114.613),
-            1000:  BranchingRatio(0.0055209, 0.98693, 114.613)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.0059025, 0.986521, 114.613),
-            -200:  BranchingRatio(0.0056959, 0.988519, 114.613),
-            200:  BranchingRatio(0.00557619, 0.988364, 114.613),
-            1000:  BranchingRatio(0.00541864, 0.987303, 114.613)
-        },
-        6: {
-            -1000:  BranchingRatio(0.00582895, 0.986902, 114.613),
-            -200:  BranchingRatio(0.00561254, 0.988805, 114.613),
-            200:  BranchingRatio(0.00548752, 0.98866, 114.613),
-            1000:  BranchingRatio(0.00532338, 0.987648, 114.613)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.00576267, 0.987255, 114.613),
-            -200:  BranchingRatio(0.00553609, 0.989069, 114.613),
-            200:  BranchingRatio(0.00540561, 0.988935, 114.613),
-            1000:  BranchingRatio(0.00523469, 0.987968, 114.613)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.00570326, 0.987584, 114.613),
-            -200:  BranchingRatio(0.00546618, 0.989315, 114.613),
-            200:  BranchingRatio(0.00533006, 0.98919, 114.613),
-            1000:  BranchingRatio(0.00515218, 0.988265, 114.613)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.00565038, 0.98789, 114.613),
-            -200:  BranchingRatio(0.00540243, 0.989544, 114.613),
-            200:  BranchingRatio(0.00526051, 0.989426, 114.613),
-            1000:  BranchingRatio(0.00507547, 0.988542, 114.613)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.00560371, 0.988175, 114.613),
-            -200:  BranchingRatio(0.00534452, 0.989756, 114.613),
-            200:  BranchingRatio(0.00519662, 0.989646, 114.613),
-            1000:  BranchingRatio(0.00500424, 0.988799, 114.613)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.00556294, 0.988441, 114.613),
-            -200:  BranchingRatio(0.00529214, 0.989954, 114.613),
-            200:  BranchingRatio(0.00513809, 0.989852, 114.613),
-            1000:  BranchingRatio(0.00493817, 0.98904, 114.613)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0055278, 0.988689, 114.613),
-            -200:  BranchingRatio(0.00524501, 0.990139, 114.613),
-            200:  BranchingRatio(0.00508463, 0.990043, 114.613),
-            1000:  BranchingRatio(0.00487698, 0.989264, 114.613)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.00549804, 0.988921, 114.613),
-            -200:  BranchingRatio(0.00520287, 0.990312, 114.613),
-            200:  BranchingRatio(0.00503597, 0.990222, 114.613),
-            1000:  BranchingRatio(0.00482039, 0.989474, 114.613)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.00547341, 0.989139, 114.613),
-            -200:  BranchingRatio(0.00516546, 0.990473, 114.613),
-            200:  BranchingRatio(0.00499187, 0.990389, 114.613),
-            1000:  BranchingRatio(0.00476817, 0.98967, 114.613)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.00545371, 0.989343, 114.613),
-            -200:  BranchingRatio(0.00513258, 0.990625, 114.613),
-            200:  BranchingRatio(0.0049521, 0.990545, 114.613),
-            1000:  BranchingRatio(0.00472007, 0.989854, 114.613)
-        },
-        7: {
-            -1000:  BranchingRatio(0.00543872, 0.989534, 114.613),
-            -200:  BranchingRatio(0.005104, 0.990766, 114.613),
-            200:  BranchingRatio(0.00491645, 0.990692, 114.613),
-            1000:  BranchingRatio(0.00467589, 0.990026, 114.613)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.00542827, 0.989714, 114.613),
-            -200:  BranchingRatio(0.00507953, 0.990899, 114.613),
-            200:  BranchingRatio(0.00488472, 0.990829, 114.613),
-            1000:  BranchingRatio(0.00463542, 0.990188, 114.613)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.00542218, 0.989883, 114.613),
-            -200:  BranchingRatio(0.00505899, 0.991024, 114.613),
-            200:  BranchingRatio(0.00485672, 0.990958, 114.613),
-            1000:  BranchingRatio(0.00459848, 0.990341, 114.613)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.00542029, 0.990042, 114.613),
-            -200:  BranchingRatio(0.00504222, 0.991142, 114.613),
-            200:  BranchingRatio(0.00483229, 0.99108, 114.613),
-            1000:  BranchingRatio(0.0045649, 0.990484, 114.613)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.00542244, 0.990192, 114.613),
-            -200:  BranchingRatio(0.00502904, 0.991252, 114.613),
-            200:  BranchingRatio(0.00481125, 0.991194, 114.613),
-            1000:  BranchingRatio(0.00453451, 0.990619, 114.613)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.00542851, 0.990333, 114.613),
-            -200:  BranchingRatio(0.00501932, 0.991356, 114.613),
-            200:  BranchingRatio(0.00479348, 0.991302, 114.613),
-            1000:  BranchingRatio(0.00450716, 0.990746, 114.613)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.00543835, 0.990466, 114.613),
-            -200:  BranchingRatio(0.00501293, 0.991455, 114.613),
-            200:  BranchingRatio(0.00477881, 0.991403, 114.613),
-            1000:  BranchingRatio(0.00448271, 0.990867, 114.613)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.00545186, 0.990592, 114.613),
-            -200:  BranchingRatio(0.00500971, 0.991547, 114.613),
-            200:  BranchingRatio(0.00476712, 0.991499, 114.613),
-            1000:  BranchingRatio(0.00446102, 0.99098, 114.613)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.00546892, 0.990712, 114.613),
-            -200:  BranchingRatio(0.00500957, 0.991635, 114.613),
-            200:  BranchingRatio(0.00475829, 0.991589, 114.613),
-            1000:  BranchingRatio(0.00444197, 0.991087, 114.613)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.00548942, 0.990824, 114.613),
-            -200:  BranchingRatio(0.00501239, 0.991718, 114.613),
-            200:  BranchingRatio(0.00475221, 0.991675, 114.613),
-            1000:  BranchingRatio(0.00442545, 0.991189, 114.613)
-        },
-        8: {
-            -1000:  BranchingRatio(0.00551326, 0.990931, 114.613),
-            -200:  BranchingRatio(0.00501805, 0.991796, 114.613),
-            200:  BranchingRatio(0.00474876, 0.991756, 114.613),
-            1000:  BranchingRatio(0.00441134, 0.991285, 114.613)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.00554037, 0.991032, 114.613),
-            -200:  BranchingRatio(0.00502646, 0.99187, 114.613),
-            200:  BranchingRatio(0.00474783, 0.991832, 114.613),
-            1000:  BranchingRatio(0.00439953, 0.991376, 114.613)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.00557065, 0.991128, 114.613),
-            -200:  BranchingRatio(0.00503754, 0.991941, 114.613),
-            200:  BranchingRatio(0.00474935, 0.991905, 114.613),
-            1000:  BranchingRatio(0.00438994, 0.991463, 114.613)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.00560402, 0.991219, 114.613),
-            -200:  BranchingRatio(0.00505118, 0.992007, 114.613),
-            200:  BranchingRatio(0.00475321, 0.991974, 114.613),
-            1000:  BranchingRatio(0.00438247, 0.991545, 114.613)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.00564042, 0.991306, 114.613),
-            -200:  BranchingRatio(0.00506731, 0.992071, 114.613),
-            200:  BranchingRatio(0.00475933, 0.992039, 114.613),
-            1000:  BranchingRatio(0.00437703, 0.991623, 114.613)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.00567976, 0.991388, 114.613),
-            -200:  BranchingRatio(0.00508585, 0.992131, 114.613),
-            200:  BranchingRatio(0.00476763, 0.992102, 114.613),
-            1000:  BranchingRatio(0.00437355, 0.991697, 114.613)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.005722, 0.991466, 114.613),
-            -200:  BranchingRatio(0.00510672, 0.992188, 114.613),
-            200:  BranchingRatio(0.00477804, 0.992161, 114.613),
-            1000:  BranchingRatio(0.00437193, 0.991768, 114.613)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.00576707, 0.991541, 114.613),
-            -200:  BranchingRatio(0.00512987, 0.992242, 114.613),
-            200:  BranchingRatio(0.00479048, 0.992217, 114.613),
-            1000:  BranchingRatio(0.00437212, 0.991835, 114.613)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.00581491, 0.991612, 114.613),
-            -200:  BranchingRatio(0.00515522, 0.992294, 114.613),
-            200:  BranchingRatio(0.00480488, 0.99227, 114.613),
-            1000:  BranchingRatio(0.00437404, 0.9919, 114.613)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.00586548, 0.99168, 114.613),
-            -200:  BranchingRatio(0.00518271, 0.992344, 114.613),
-            200:  BranchingRatio(0.00482119, 0.992321, 114.613),
-            1000:  BranchingRatio(0.00437762, 0.991961, 114.613)
-        },
-        9: {
-            -1000:  BranchingRatio(0.00591872, 0.991744, 114.613),
-            -200:  BranchingRatio(0.00521228, 0.992391, 114.613),
-            200:  BranchingRatio(0.00483934, 0.99237, 114.613),
-            1000:  BranchingRatio(0.00438281, 0.992019, 114.613)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.00597459, 0.991806, 114.613),
-            -200:  BranchingRatio(0.00524389, 0.992436, 114.613),
-            200:  BranchingRatio(0.00485927, 0.992416, 114.613),
-            1000:  BranchingRatio(0.00438955, 0.992075, 114.613)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.00603305, 0.991864, 114.613),
-            -200:  BranchingRatio(0.00527747, 0.992478, 114.613),
-            200:  BranchingRatio(0.00488094, 0.99246, 114.613),
-            1000:  BranchingRatio(0.00439778, 0.992128, 114.613)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.00609406, 0.991921, 114.613),
-            -200:  BranchingRatio(0.00531299, 0.992519, 114.613),
-            200:  BranchingRatio(0.00490428, 0.992503, 114.613),
-            1000:  BranchingRatio(0.00440744, 0.992179, 114.613)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.00615759, 0.991974, 114.613),
-            -200:  BranchingRatio(0.00535039, 0.992558, 114.613),
-            200:  BranchingRatio(0.00492925, 0.992543, 114.613),
-            1000:  BranchingRatio(0.00441849, 0.992228, 114.613)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.0062236, 0.992026, 114.613),
-            -200:  BranchingRatio(0.00538963, 0.992596, 114.613),
-            200:  BranchingRatio(0.00495581, 0.992582, 114.613),
-            1000:  BranchingRatio(0.00443089, 0.992274, 114.613)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.00629205, 0.992075, 114.613),
-            -200:  BranchingRatio(0.00543068, 0.992632, 114.613),
-            200:  BranchingRatio(0.00498391, 0.992618, 114.613),
-            1000:  BranchingRatio(0.00444458, 0.992319, 114.613)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.00636293, 0.992122, 114.613),
-            -200:  BranchingRatio(0.00547348, 0.992666, 114.613),
-            200:  BranchingRatio(0.00501351, 0.992654, 114.613),
-            1000:  BranchingRatio(0.00445951, 0.992362, 114.613)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.00643621, 0.992167, 114.613),
-            -200:  BranchingRatio(0.00551801, 0.992699, 114.613),
-            200:  BranchingRatio(0.00504457, 0.992688, 114.613),
-            1000:  BranchingRatio(0.00447567, 0.992403, 114.613)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.00651185, 0.99221, 114.613),
-            -200:  BranchingRatio(0.00556422, 0.99273, 114.613),
-            200:  BranchingRatio(0.00507705, 0.99272, 114.613),
-            1000:  BranchingRatio(0.00449299, 0.992442, 114.613)
-        },
-        10: {
-            -1000:  BranchingRatio(0.00658984, 0.992252, 114.613),
-            -200:  BranchingRatio(0.00561209, 0.99276, 114.613),
-            200:  BranchingRatio(0.00511091, 0.992751, 114.613),
-            1000:  BranchingRatio(0.00451145, 0.99248, 114.613)
-        },
-        11: {
-            -1000:  BranchingRatio(0.00749502, 0.992586, 114.613),
-            -200:  BranchingRatio(0.00617562, 0.993004, 114.613),
-            200:  BranchingRatio(0.00551899, 0.993003, 114.613),
-            1000:  BranchingRatio(0.00475134, 0.992786, 114.613)
-        },
-        12: {
-            -1000:  BranchingRatio(0.00862073, 0.992816, 114.613),
-            -200:  BranchingRatio(0.00687818, 0.993172, 114.613),
-            200:  BranchingRatio(0.00603623, 0.993176, 114.613),
-            1000:  BranchingRatio(0.00507396, 0.993001, 114.613)
-        },
-        13: {
-            -1000:  BranchingRatio(0.00996403, 0.992978, 114.613),
-            -200:  BranchingRatio(0.00770463, 0.993292, 114.613),
-            200:  BranchingRatio(0.0066449, 0.993301, 114.613),
-            1000:  BranchingRatio(0.00546053, 0.993156, 114.613)
-        },
-        14: {
-            -1000:  BranchingRatio(0.0115287, 0.993095, 114.613),
-            -200:  BranchingRatio(0.00864545, 0.99338, 114.613),
-            200:  BranchingRatio(0.00733291, 0.993393, 114.613),
-            1000:  BranchingRatio(0.00589809, 0.993272, 114.613)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0133232, 0.99318, 114.613),
-            -200:  BranchingRatio(0.00969457, 0.993447, 114.613),
-            200:  BranchingRatio(0.00809167, 0.993464, 114.613),
-            1000:  BranchingRatio(0.00637729, 0.993362, 114.613)
-        },
-        16: {
-            -1000:  BranchingRatio(0.0153594, 0.993242, 114.613),
-            -200:  BranchingRatio(0.0108481, 0.993498, 114.613),
-            200:  BranchingRatio(0.00891477, 0.993518, 114.613),
-            1000:  BranchingRatio(0.00689114, 0.993432, 114.613)
-        },
-        17: {
-            -1000:  BranchingRatio(0.0176519, 0.993286, 114.613),
-            -200:  BranchingRatio(0.0121036, 0.993538, 114.613),
-            200:  BranchingRatio(0.00979732, 0.993561, 114.613),
-            1000:  BranchingRatio(0.00743424, 0.993488, 114.613)
-        },
-        18: {
-            -1000:  BranchingRatio(0.020218, 0.993316, 114.613),
-            -200:  BranchingRatio(0.0134596, 0.99357, 114.613),
-            200:  BranchingRatio(0.0107354, 0.993596, 114.613),
-            1000:  BranchingRatio(0.0080023, 0.993534, 114.613)
-        },
-        19: {
-            -1000:  BranchingRatio(0.023077, 0.993333, 114.613),
-            -200:  BranchingRatio(0.0149153, 0.993595, 114.613),
-            200:  BranchingRatio(0.0117258, 0.993625, 114.613),
-            1000:  BranchingRatio(0.00859183, 0.993572, 114.613)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0262506, 0.99334, 114.613),
-            -200:  BranchingRatio(0.0164702, 0.993615, 114.613),
-            200:  BranchingRatio(0.0127657, 0.993648, 114.613),
-            1000:  BranchingRatio(0.00919992, 0.993604, 114.613)
-        },
-        21: {
-            -1000:  BranchingRatio(0.0297623, 0.993335, 114.613),
-            -200:  BranchingRatio(0.0181244, 0.993631, 114.613),
-            200:  BranchingRatio(0.0138529, 0.993668, 114.613),
-            1000:  BranchingRatio(0.00982412, 0.993631, 114.613)
-        },
-        22: {
-            -1000:  BranchingRatio(0.0336381, 0.99332, 114.613),
-            -200:  BranchingRatio(0.0198779, 0.993644, 114.613),
-            200:  BranchingRatio(0.0149853, 0.993684, 114.613),
-            1000:  BranchingRatio(0.0104623, 0.993654, 114.613)
-        },
-        23: {
-            -1000:  BranchingRatio(0.0379061, 0.993292, 114.613),
-            -200:  BranchingRatio(0.0217311, 0.993654, 114.613),
-            200:  BranchingRatio(0.0161609, 0.993698, 114.613),
-            1000:  BranchingRatio(0.0111127, 0.993674, 114.613)
-        },
-        24: {
-            -1000:  BranchingRatio(0.0425968, 0.993251, 114.613),
-            -200:  BranchingRatio(0.0236844, 0.993662, 114.613),
-            200:  BranchingRatio(0.017378, 0.99371, 114.613),
-            1000:  BranchingRatio(0.0117736, 0.993692, 114.613)
-        },
-        25: {
-            -1000:  BranchingRatio(0.0477431, 0.993192, 114.613),
-            -200:  BranchingRatio(0.0257383, 0.993667, 114.613),
-            200:  BranchingRatio(0.0186352, 0.99372, 114.613),
-            1000:  BranchingRatio(0.0124437, 0.993707, 114.613)
-        },
-        26: {
-            -1000:  BranchingRatio(0.0533802, 0.993111, 114.613),
-            -200:  BranchingRatio(0.0278934, 0.993671, 114.613),
-            200:  BranchingRatio(0.0199308, 0.993728, 114.613),
-            1000:  BranchingRatio(0.0131217, 0.99372, 114.613)
-        },
-        27: {
-            -1000:  BranchingRatio(0.0595463, 0.993001, 114.613),
-            -200:  BranchingRatio(0.0301501, 0.993673, 114.613),
-            200:  BranchingRatio(0.0212634, 0.993736, 114.613),
-            1000:  BranchingRatio(0.0138064, 0.993732, 114.613)
-        },
-        28: {
-            -1000:  BranchingRatio(0.0662821, 0.992851, 114.613),
-            -200:  BranchingRatio(0.0325092, 0.993674, 114.613),
-            200:  BranchingRatio(0.0226318, 0.993742, 114.613),
-            1000:  BranchingRatio(0.0144968, 0.993743, 114.613)
-        },
-        29: {
-            -1000:  BranchingRatio(0.0736312, 0.992645, 114.613),
-            -200:  BranchingRatio(0.034971, 0.993673, 114.613),
-            200:  BranchingRatio(0.0240347, 0.993748, 114.613),
-            1000:  BranchingRatio(0.015192, 0.993752, 114.613)
-        },
-        30: {
-            -1000:  BranchingRatio(0.0816399, 0.992355, 114.613),
-            -200:  BranchingRatio(0.0375362, 0.993671, 114.613),
-            200:  BranchingRatio(0.0254708, 0.993753, 114.613),
-            1000:  BranchingRatio(0.0158912, 0.993761, 114.613)
-        },
-        31: {
-            -1000:  BranchingRatio(0.0903578, 0.991937, 114.613),
-            -200:  BranchingRatio(0.0402053, 0.993667, 114.613),
-            200:  BranchingRatio(0.0269389, 0.993757, 114.613),
-            1000:  BranchingRatio(0.0165935, 0.993769, 114.613)
-        },
-        32: {
-            -1000:  BranchingRatio(0.0998371, 0.991308, 114.613),
-            -200:  BranchingRatio(0.0429788, 0.993662, 114.613),
-            200:  BranchingRatio(0.028438, 0.99376, 114.613),
-            1000:  BranchingRatio(0.0172984, 0.993776, 114.613)
-        },
-        33: {
-            -1000:  BranchingRatio(0.110133, 0.9903, 114.613),
-            -200:  BranchingRatio(0.045857, 0.993656, 114.613),
-            200:  BranchingRatio(0.0299668, 0.993763, 114.613),
-            1000:  BranchingRatio(0.0180051, 0.993782, 114.613)
-        },
-        34: {
-            -1000:  BranchingRatio(0.121305, 0.988511, 114.613),
-            -200:  BranchingRatio(0.0488407, 0.993648, 114.613),
-            200:  BranchingRatio(0.0315244, 0.993765, 114.613),
-            1000:  BranchingRatio(0.018713, 0.993788, 114.613)
-        },
-        35: {
-            -1000:  BranchingRatio(0.133413, 0.984429, 114.613),
-            -200:  BranchingRatio(0.0519298, 0.993639, 114.613),
-            200:  BranchingRatio(0.0331097, 0.993768, 114.613),
-            1000:  BranchingRatio(0.0194217, 0.993794, 114.613)
-        },
-        36: {
-            -1000:  BranchingRatio(0.146521, 0.946, 114.613),
-            -200:  BranchingRatio(0.0551248, 0.993628, 114.613),
-            200:  BranchingRatio(0.0347217, 0.993769, 114.613),
-            1000:  BranchingRatio(0.0201306, 0.993799, 114.613)
-        },
-        37: {
-            -1000:  BranchingRatio(0.160696, 0.777573, 114.613),
-            -200:  BranchingRatio(0.058426, 0.993616, 114.613),
-            200:  BranchingRatio(0.0363594, 0.99377, 114.613),
-            1000:  BranchingRatio(0.0208393, 0.993803, 114.613)
-        },
-        38: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0618334, 0.993601, 114.613),
-            200:  BranchingRatio(0.038022, 0.993771, 114.613),
-            1000:  BranchingRatio(0.0215474, 0.993807, 114.613)
-        },
-        39: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0653474, 0.993585, 114.613),
-            200:  BranchingRatio(0.0397082, 0.993772, 114.613),
-            1000:  BranchingRatio(0.0222545, 0.993811, 114.613)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0689679, 0.993566, 114.613),
-            200:  BranchingRatio(0.0414174, 0.993773, 114.613),
-            1000:  BranchingRatio(0.0229602, 0.993815, 114.613)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0726949, 0.993545, 114.613),
-            200:  BranchingRatio(0.0431485, 0.993773, 114.613),
-            1000:  BranchingRatio(0.0236642, 0.993819, 114.613)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0765285, 0.993521, 114.613),
-            200:  BranchingRatio(0.0449008, 0.993773, 114.613),
-            1000:  BranchingRatio(0.0243663, 0.993822, 114.613)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0804684, 0.993494, 114.613),
-            200:  BranchingRatio(0.0466734, 0.993772, 114.613),
-            1000:  BranchingRatio(0.0250661, 0.993826, 114.613)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0845144, 0.993464, 114.613),
-            200:  BranchingRatio(0.0484654, 0.993772, 114.613),
-            1000:  BranchingRatio(0.0257635, 0.993828, 114.613)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0886664, 0.993429, 114.613),
-            200:  BranchingRatio(0.0502761, 0.993771, 114.613),
-            1000:  BranchingRatio(0.0264581, 0.993831, 114.613)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0929238, 0.99339, 114.613),
-            200:  BranchingRatio(0.0521047, 0.99377, 114.613),
-            1000:  BranchingRatio(0.0271498, 0.993834, 114.613)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0972864, 0.993346, 114.613),
-            200:  BranchingRatio(0.0539503, 0.993769, 114.613),
-            1000:  BranchingRatio(0.0278384, 0.993836, 114.613)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.101754, 0.993296, 114.613),
-            200:  BranchingRatio(0.0558122, 0.993767, 114.613),
-            1000:  BranchingRatio(0.0285237, 0.993838, 114.613)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.106325, 0.99324, 114.613),
-            200:  BranchingRatio(0.0576898, 0.993766, 114.613),
-            1000:  BranchingRatio(0.0292055, 0.99384, 114.613)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.110999, 0.993175, 114.613),
-            200:  BranchingRatio(0.0595822, 0.993764, 114.613),
-            1000:  BranchingRatio(0.0298838, 0.993842, 114.613)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.115776, 0.993101, 114.613),
-            200:  BranchingRatio(0.0614888, 0.993762, 114.613),
-            1000:  BranchingRatio(0.0305583, 0.993844, 114.613)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.120655, 0.993016, 114.613),
-            200:  BranchingRatio(0.063409, 0.99376, 114.613),
-            1000:  BranchingRatio(0.031229, 0.993846, 114.613)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.125635, 0.992917, 114.613),
-            200:  BranchingRatio(0.0653419, 0.993757, 114.613),
-            1000:  BranchingRatio(0.0318957, 0.993847, 114.613)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.130715, 0.992803, 114.613),
-            200:  BranchingRatio(0.067287, 0.993755, 114.613),
-            1000:  BranchingRatio(0.0325584, 0.993849, 114.613)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.135894, 0.992669, 114.613),
-            200:  BranchingRatio(0.0692437, 0.993752, 114.613),
-            1000:  BranchingRatio(0.033217, 0.99385, 114.613)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.14117, 0.99251, 114.613),
-            200:  BranchingRatio(0.0712113, 0.993749, 114.613),
-            1000:  BranchingRatio(0.0338713, 0.993852, 114.613)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.146543, 0.99232, 114.613),
-            200:  BranchingRatio(0.0731892, 0.993746, 114.613),
-            1000:  BranchingRatio(0.0345213, 0.993853, 114.613)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.152012, 0.992087, 114.613),
-            200:  BranchingRatio(0.0751768, 0.993743, 114.613),
-            1000:  BranchingRatio(0.035167, 0.993854, 114.613)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.157574, 0.991796, 114.613),
-            200:  BranchingRatio(0.0771736, 0.99374, 114.613),
-            1000:  BranchingRatio(0.0358083, 0.993856, 114.613)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.163228, 0.991416, 114.613),
-            200:  BranchingRatio(0.0791791, 0.993736, 114.613),
-            1000:  BranchingRatio(0.0364452, 0.993857, 114.613)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.168974, 0.990889, 114.613),
-            200:  BranchingRatio(0.0811925, 0.993732, 114.613),
-            1000:  BranchingRatio(0.0370775, 0.993858, 114.613)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.174809, 0.990042, 114.613),
-            200:  BranchingRatio(0.0832135, 0.993728, 114.613),
-            1000:  BranchingRatio(0.0377053, 0.993859, 114.613)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.180731, 0.989606, 114.613),
-            200:  BranchingRatio(0.0852415, 0.993724, 114.613),
-            1000:  BranchingRatio(0.0383286, 0.99386, 114.613)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.186739, 0.984298, 114.613),
-            200:  BranchingRatio(0.0872761, 0.993719, 114.613),
-            1000:  BranchingRatio(0.0389473, 0.993861, 114.613)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.192832, 0.973698, 114.613),
-            200:  BranchingRatio(0.0893166, 0.993715, 114.613),
-            1000:  BranchingRatio(0.0395613, 0.993862, 114.613)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.199006, 0.960159, 114.613),
-            200:  BranchingRatio(0.0913627, 0.99371, 114.613),
-            1000:  BranchingRatio(0.0401708, 0.993863, 114.613)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.205261, 0.945266, 114.613),
-            200:  BranchingRatio(0.0934139, 0.993705, 114.613),
-            1000:  BranchingRatio(0.0407756, 0.993864, 114.613)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.211594, 0.929624, 114.613),
-            200:  BranchingRatio(0.0954697, 0.993699, 114.613),
-            1000:  BranchingRatio(0.0413758, 0.993865, 114.613)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.218003, 0.91374, 114.613),
-            200:  BranchingRatio(0.0975297, 0.993694, 114.613),
-            1000:  BranchingRatio(0.0419714, 0.993866, 114.613)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.224486, 0.898141, 114.613),
-            200:  BranchingRatio(0.0995935, 0.993688, 114.613),
-            1000:  BranchingRatio(0.0425623, 0.993866, 114.613)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.231041, 0.883645, 114.613),
-            200:  BranchingRatio(0.101661, 0.993682, 114.613),
-            1000:  BranchingRatio(0.0431485, 0.993867, 114.613)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.237666, 0.874998, 114.613),
-            200:  BranchingRatio(0.103731, 0.993675, 114.613),
-            1000:  BranchingRatio(0.0437302, 0.993868, 114.613)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.105803, 0.993669, 114.613),
-            1000:  BranchingRatio(0.0443072, 0.993869, 114.613)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.107878, 0.993662, 114.613),
-            1000:  BranchingRatio(0.0448795, 0.993869, 114.613)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.109955, 0.993654, 114.613),
-            1000:  BranchingRatio(0.0454473, 0.99387, 114.613)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.112033, 0.993647, 114.613),
-            1000:  BranchingRatio(0.0460105, 0.993871, 114.613)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.114112, 0.993639, 114.613),
-            1000:  BranchingRatio(0.0465691, 0.993871, 114.613)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.116192, 0.99363, 114.613),
-            1000:  BranchingRatio(0.0471232, 0.993872, 114.613)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.118272, 0.993622, 114.613),
-            1000:  BranchingRatio(0.0476727, 0.993872, 114.613)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.120353, 0.993613, 114.613),
-            1000:  BranchingRatio(0.0482177, 0.993873, 114.613)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.122433, 0.993603, 114.613),
-            1000:  BranchingRatio(0.0487582, 0.993873, 114.613)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.124513, 0.993593, 114.613),
-            1000:  BranchingRatio(0.0492942, 0.993874, 114.613)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.126592, 0.993583, 114.613),
-            1000:  BranchingRatio(0.0498258, 0.993874, 114.613)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.12867, 0.993572, 114.613),
-            1000:  BranchingRatio(0.050353, 0.993875, 114.613)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.130746, 0.993561, 114.613),
-            1000:  BranchingRatio(0.0508757, 0.993875, 114.613)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.132822, 0.993549, 114.613),
-            1000:  BranchingRatio(0.0513942, 0.993876, 114.613)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.134895, 0.993536, 114.613),
-            1000:  BranchingRatio(0.0519082, 0.993876, 114.613)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.136966, 0.993523, 114.613),
-            1000:  BranchingRatio(0.052418, 0.993877, 114.613)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.139035, 0.99351, 114.613),
-            1000:  BranchingRatio(0.0529235, 0.993877, 114.613)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.141101, 0.993495, 114.613),
-            1000:  BranchingRatio(0.0534248, 0.993877, 114.613)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.143164, 0.99348, 114.613),
-            1000:  BranchingRatio(0.0539219, 0.993878, 114.613)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.145224, 0.993464, 114.613),
-            1000:  BranchingRatio(0.0544147, 0.993878, 114.613)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.147282, 0.993447, 114.613),
-            1000:  BranchingRatio(0.0549034, 0.993878, 114.613)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.149335, 0.993429, 114.613),
-            1000:  BranchingRatio(0.0553881, 0.993879, 114.613)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.151385, 0.99341, 114.613),
-            1000:  BranchingRatio(0.0558686, 0.993879, 114.613)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.153432, 0.993389, 114.613),
-            1000:  BranchingRatio(0.0563451, 0.993879, 114.613)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.155474, 0.993368, 114.613),
-            1000:  BranchingRatio(0.0568176, 0.99388, 114.613)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.157512, 0.993345, 114.613),
-            1000:  BranchingRatio(0.057286, 0.99388, 114.613)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.159546, 0.99332, 114.613),
-            1000:  BranchingRatio(0.0577506, 0.99388, 114.613)
-        }
-    },
-    150: {
-        1.1: {
-            -1000:  BranchingRatio(0.054536, 0.218444, 126.634),
-            -200:  BranchingRatio(0.0545298, 0.236538, 126.634),
-            200:  BranchingRatio(0.054525, 0.233336, 126.634),
-            1000:  BranchingRatio(0.0545187, 0.221205, 126.634)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.0463001, 0.269763, 126.634),
-            -200:  BranchingRatio(0.0462934, 0.294259, 126.634),
-            200:  BranchingRatio(0.0462883, 0.289546, 126.634),
-            1000:  BranchingRatio(0.0462814, 0.274442, 126.634)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.0397921, 0.322511, 126.634),
-            -200:  BranchingRatio(0.0397847, 0.35303, 126.634),
-            200:  BranchingRatio(0.0397793, 0.346838, 126.634),
-            1000:  BranchingRatio(0.0397719, 0.329146, 126.634)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.0345659, 0.376073, 126.634),
-            -200:  BranchingRatio(0.034558, 0.411526, 126.634),
-            200:  BranchingRatio(0.0345521, 0.404109, 126.634),
-            1000:  BranchingRatio(0.0345442, 0.384465, 126.634)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.0303095, 0.429701, 126.634),
-            -200:  BranchingRatio(0.0303009, 0.468637, 126.634),
-            200:  BranchingRatio(0.0302946, 0.460374, 126.634),
-            1000:  BranchingRatio(0.0302861, 0.439516, 126.634)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.0267994, 0.482482, 126.634),
-            -200:  BranchingRatio(0.02679, 0.52339, 126.634),
-            200:  BranchingRatio(0.0267833, 0.514689, 126.634),
-            1000:  BranchingRatio(0.0267741, 0.493337, 126.634)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.0238723, 0.533456, 126.634),
-            -200:  BranchingRatio(0.0238622, 0.574968, 126.634),
-            200:  BranchingRatio(0.0238551, 0.566196, 126.634),
-            1000:  BranchingRatio(0.0238452, 0.544979, 126.634)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.0214073, 0.581784, 126.634),
-            -200:  BranchingRatio(0.0213964, 0.622761, 126.634),
-            200:  BranchingRatio(0.0213888, 0.61421, 126.634),
-            1000:  BranchingRatio(0.0213782, 0.593627, 126.634)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.0193129, 0.626819, 126.634),
-            -200:  BranchingRatio(0.0193011, 0.666395, 126.634),
-            200:  BranchingRatio(0.019293, 0.658274, 126.634),
-            1000:  BranchingRatio(0.0192817, 0.63869, 126.634)
-        },
-        2: {
-            -1000:  BranchingRatio(0.017519, 0.668149, 126.634),
-            -200:  BranchingRatio(0.0175064, 0.705724, 126.634),
-            200:  BranchingRatio(0.0174977, 0.698164, 126.634),
-            1000:  BranchingRatio(0.0174856, 0.679811, 126.634)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0159716, 0.705603, 126.634),
-            -200:  BranchingRatio(0.0159579, 0.740794, 126.634),
-            200:  BranchingRatio(0.0159487, 0.733866, 126.634),
-            1000:  BranchingRatio(0.0159358, 0.71687, 126.634)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0146278, 0.739195, 126.634),
-            -200:  BranchingRatio(0.0146132, 0.7718, 126.634),
-            200:  BranchingRatio(0.0146033, 0.765524, 126.634),
-            1000:  BranchingRatio(0.0145896, 0.74993, 126.634)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.013454, 0.769072, 126.634),
-            -200:  BranchingRatio(0.0134383, 0.799032, 126.634),
-            200:  BranchingRatio(0.0134278, 0.793397, 126.634),
-            1000:  BranchingRatio(0.0134132, 0.779186, 126.634)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.0124231, 0.795409, 126.634),
-            -200:  BranchingRatio(0.0124063, 0.822832, 126.634),
-            200:  BranchingRatio(0.0123951, 0.817804, 126.634),
-            1000:  BranchingRatio(0.0123795, 0.804918, 126.634)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.0115131, 0.818567, 126.634),
-            -200:  BranchingRatio(0.0114952, 0.843562, 126.634),
-            200:  BranchingRatio(0.0114833, 0.839095, 126.634),
-            1000:  BranchingRatio(0.0114667, 0.82745, 126.634)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.0107063, 0.838865, 126.634),
-            -200:  BranchingRatio(0.0106871, 0.861578, 126.634),
-            200:  BranchingRatio(0.0106745, 0.857621, 126.634),
-            1000:  BranchingRatio(0.0106568, 0.84712, 126.634)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.00998784, 0.856635, 126.634),
-            -200:  BranchingRatio(0.00996734, 0.877218, 126.634),
-            200:  BranchingRatio(0.00995394, 0.873719, 126.634),
-            1000:  BranchingRatio(0.00993517, 0.86426, 126.634)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.0093457, 0.872121, 126.634),
-            -200:  BranchingRatio(0.00932383, 0.890792, 126.634),
-            200:  BranchingRatio(0.0093096, 0.8877, 126.634),
-            1000:  BranchingRatio(0.00928969, 0.879181, 126.634)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.00876971, 0.885644, 126.634),
-            -200:  BranchingRatio(0.0087464, 0.902576, 126.634),
-            200:  BranchingRatio(0.0087313, 0.899844, 126.634),
-            1000:  BranchingRatio(0.0087102, 0.89217, 126.634)
-        },
-        3: {
-            -1000:  BranchingRatio(0.00825137, 0.897456, 126.634),
-            -200:  BranchingRatio(0.00822654, 0.912817, 126.634),
-            200:  BranchingRatio(0.00821054, 0.910401, 126.634),
-            1000:  BranchingRatio(0.00818819, 0.903483, 126.634)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.00778352, 0.907783, 126.634),
-            -200:  BranchingRatio(0.0077571, 0.921729, 126.634),
-            200:  BranchingRatio(0.00774014, 0.919589, 126.634),
-            1000:  BranchingRatio(0.00771649, 0.913345, 126.634)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.00736008, 0.916821, 126.634),
-            -200:  BranchingRatio(0.00733198, 0.929496, 126.634),
-            200:  BranchingRatio(0.00731403, 0.9276, 126.634),
-            1000:  BranchingRatio(0.00728901, 0.921955, 126.634)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.00697586, 0.924745, 126.634),
-            -200:  BranchingRatio(0.00694599, 0.936279, 126.634),
-            200:  BranchingRatio(0.006927, 0.934596, 126.634),
-            1000:  BranchingRatio(0.00690057, 0.929483, 126.634)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.00662641, 0.931703, 126.634),
-            -200:  BranchingRatio(0.0065947, 0.942216, 126.634),
-            200:  BranchingRatio(0.00657462, 0.940718, 126.634),
-            1000:  BranchingRatio(0.00654671, 0.93608, 126.634)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.00630792, 0.937826, 126.634),
-            -200:  BranchingRatio(0.00627428, 0.947423, 126.634),
-            200:  BranchingRatio(0.00625305, 0.946088, 126.634),
-            1000:  BranchingRatio(0.00622361, 0.941871, 126.634)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.00601708, 0.943224, 126.634),
-            -200:  BranchingRatio(0.00598141, 0.952, 126.634),
-            200:  BranchingRatio(0.00595899, 0.950808, 126.634),
-            1000:  BranchingRatio(0.00592794, 0.946967, 126.634)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.00575101, 0.947994, 126.634),
-            -200:  BranchingRatio(0.00571322, 0.956034, 126.634),
-            200:  BranchingRatio(0.00568956, 0.954967, 126.634),
-            1000:  BranchingRatio(0.00565685, 0.951461, 126.634)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.00550722, 0.952218, 126.634),
-            -200:  BranchingRatio(0.00546721, 0.959597, 126.634),
-            200:  BranchingRatio(0.00544226, 0.95864, 126.634),
-            1000:  BranchingRatio(0.00540782, 0.955433, 126.634)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.00528353, 0.955968, 126.634),
-            -200:  BranchingRatio(0.0052412, 0.962752, 126.634),
-            200:  BranchingRatio(0.0052149, 0.961891, 126.634),
-            1000:  BranchingRatio(0.00517866, 0.958952, 126.634)
-        },
-        4: {
-            -1000:  BranchingRatio(0.00507801, 0.959303, 126.634),
-            -200:  BranchingRatio(0.00503325, 0.965553, 126.634),
-            200:  BranchingRatio(0.00500555, 0.964777, 126.634),
-            1000:  BranchingRatio(0.00496744, 0.962076, 126.634)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.00488897, 0.962276, 126.634),
-            -200:  BranchingRatio(0.00484168, 0.968044, 126.634),
-            200:  BranchingRatio(0.00481252, 0.967343, 126.634),
-            1000:  BranchingRatio(0.00477248, 0.964858, 126.634)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.00471493, 0.964933, 126.634),
-            -200:  BranchingRatio(0.004665, 0.970265, 126.634),
-            200:  BranchingRatio(0.00463431, 0.969631, 126.634),
-            1000:  BranchingRatio(0.00459227, 0.967339, 126.634)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.00455456, 0.967312, 126.634),
-            -200:  BranchingRatio(0.00450187, 0.972251, 126.634),
-            200:  BranchingRatio(0.0044696, 0.971676, 126.634),
-            1000:  BranchingRatio(0.00442548, 0.969558, 126.634)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.0044067, 0.969448, 126.634),
-            -200:  BranchingRatio(0.00435113, 0.974029, 126.634),
-            200:  BranchingRatio(0.00431722, 0.973507, 126.634),
-            1000:  BranchingRatio(0.00427095, 0.971546, 126.634)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.00427029, 0.971368, 126.634),
-            -200:  BranchingRatio(0.00421172, 0.975626, 126.634),
-            200:  BranchingRatio(0.00417611, 0.975151, 126.634),
-            1000:  BranchingRatio(0.00412761, 0.973331, 126.634)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0041444, 0.973099, 126.634),
-            -200:  BranchingRatio(0.00408272, 0.977063, 126.634),
-            200:  BranchingRatio(0.00404533, 0.976629, 126.634),
-            1000:  BranchingRatio(0.00399453, 0.974938, 126.634)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.0040282, 0.974662, 126.634),
-            -200:  BranchingRatio(0.00396327, 0.978358, 126.634),
-            200:  BranchingRatio(0.00392405, 0.977962, 126.634),
-            1000:  BranchingRatio(0.00387087, 0.976388, 126.634)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.00392094, 0.976076, 126.634),
-            -200:  BranchingRatio(0.00385264, 0.979528, 126.634),
-            200:  BranchingRatio(0.00381151, 0.979166, 126.634),
-            1000:  BranchingRatio(0.00375588, 0.977697, 126.634)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.00382195, 0.977359, 126.634),
-            -200:  BranchingRatio(0.00375013, 0.980588, 126.634),
-            200:  BranchingRatio(0.00370704, 0.980255, 126.634),
-            1000:  BranchingRatio(0.00364886, 0.978883, 126.634)
-        },
-        5: {
-            -1000:  BranchingRatio(0.00373061, 0.978523, 126.634),
-            -200:  BranchingRatio(0.00365515, 0.981548, 126.634),
-            200:  BranchingRatio(0.00361002, 0.981243, 126.634),
-            1000:  BranchingRatio(0.00354922, 0.979959, 126.634)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.0036464, 0.979583, 126.634),
-            -200:  BranchingRatio(0.00356714, 0.982421, 126.634),
-            200:  BranchingRatio(0.0035199, 0.982141, 126.634),
-            1000:  BranchingRatio(0.0034564, 0.980937, 126.634)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.0035688, 0.98055, 126.634),
-            -200:  BranchingRatio(0.00348561, 0.983216, 126.634),
-            200:  BranchingRatio(0.00343618, 0.982957, 126.634),
-            1000:  BranchingRatio(0.00336989, 0.981828, 126.634)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.00349737, 0.981433, 126.634),
-            -200:  BranchingRatio(0.0034101, 0.983941, 126.634),
-            200:  BranchingRatio(0.00335841, 0.983702, 126.634),
-            1000:  BranchingRatio(0.00328925, 0.98264, 126.634)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.0034317, 0.98224, 126.634),
-            -200:  BranchingRatio(0.0033402, 0.984603, 126.634),
-            200:  BranchingRatio(0.00328617, 0.984382, 126.634),
-            1000:  BranchingRatio(0.00321405, 0.983383, 126.634)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.00337142, 0.98298, 126.634),
-            -200:  BranchingRatio(0.00327553, 0.985209, 126.634),
-            200:  BranchingRatio(0.0032191, 0.985005, 126.634),
-            1000:  BranchingRatio(0.00314393, 0.984062, 126.634)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.0033162, 0.983659, 126.634),
-            -200:  BranchingRatio(0.00321576, 0.985764, 126.634),
-            200:  BranchingRatio(0.00315684, 0.985575, 126.634),
-            1000:  BranchingRatio(0.00307854, 0.984685, 126.634)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.00326572, 0.984283, 126.634),
-            -200:  BranchingRatio(0.00316058, 0.986274, 126.634),
-            200:  BranchingRatio(0.00309909, 0.986098, 126.634),
-            1000:  BranchingRatio(0.00301756, 0.985257, 126.634)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.00321972, 0.984858, 126.634),
-            -200:  BranchingRatio(0.00310969, 0.986743, 126.634),
-            200:  BranchingRatio(0.00304555, 0.98658, 126.634),
-            1000:  BranchingRatio(0.00296071, 0.985783, 126.634)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.00317792, 0.985387, 126.634),
-            -200:  BranchingRatio(0.00306285, 0.987174, 126.634),
-            200:  BranchingRatio(0.00299597, 0.987023, 126.634),
-            1000:  BranchingRatio(0.00290772, 0.986268, 126.634)
-        },
-        6: {
-            -1000:  BranchingRatio(0.00314009, 0.985877, 126.634),
-            -200:  BranchingRatio(0.0030198, 0.987572, 126.634),
-            200:  BranchingRatio(0.00295011, 0.987431, 126.634),
-            1000:  BranchingRatio(0.00285835, 0.986715, 126.634)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.00310602, 0.986329, 126.634),
-            -200:  BranchingRatio(0.00298033, 0.98794, 126.634),
-            200:  BranchingRatio(0.00290774, 0.987808, 126.634),
-            1000:  BranchingRatio(0.00281238, 0.987128, 126.634)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.00307551, 0.986747, 126.634),
-            -200:  BranchingRatio(0.00294424, 0.988279, 126.634),
-            200:  BranchingRatio(0.00286866, 0.988156, 126.634),
-            1000:  BranchingRatio(0.00276961, 0.98751, 126.634)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.00304838, 0.987136, 126.634),
-            -200:  BranchingRatio(0.00291134, 0.988594, 126.634),
-            200:  BranchingRatio(0.00283268, 0.988479, 126.634),
-            1000:  BranchingRatio(0.00272984, 0.987863, 126.634)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.00302445, 0.987496, 126.634),
-            -200:  BranchingRatio(0.00288146, 0.988885, 126.634),
-            200:  BranchingRatio(0.00279963, 0.988778, 126.634),
-            1000:  BranchingRatio(0.0026929, 0.988191, 126.634)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.00300358, 0.987831, 126.634),
-            -200:  BranchingRatio(0.00285444, 0.989156, 126.634),
-            200:  BranchingRatio(0.00276935, 0.989056, 126.634),
-            1000:  BranchingRatio(0.00265863, 0.988496, 126.634)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.00298562, 0.988142, 126.634),
-            -200:  BranchingRatio(0.00283013, 0.989408, 126.634),
-            200:  BranchingRatio(0.0027417, 0.989314, 126.634),
-            1000:  BranchingRatio(0.00262689, 0.988779, 126.634)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.00297044, 0.988432, 126.634),
-            -200:  BranchingRatio(0.0028084, 0.989642, 126.634),
-            200:  BranchingRatio(0.00271652, 0.989554, 126.634),
-            1000:  BranchingRatio(0.00259752, 0.989043, 126.634)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.00295791, 0.988703, 126.634),
-            -200:  BranchingRatio(0.00278912, 0.98986, 126.634),
-            200:  BranchingRatio(0.0026937, 0.989777, 126.634),
-            1000:  BranchingRatio(0.00257041, 0.989288, 126.634)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.00294793, 0.988956, 126.634),
-            -200:  BranchingRatio(0.00277217, 0.990063, 126.634),
-            200:  BranchingRatio(0.00267312, 0.989986, 126.634),
-            1000:  BranchingRatio(0.00254543, 0.989517, 126.634)
-        },
-        7: {
-            -1000:  BranchingRatio(0.00294039, 0.989192, 126.634),
-            -200:  BranchingRatio(0.00275745, 0.990253, 126.634),
-            200:  BranchingRatio(0.00265467, 0.99018, 126.634),
-            1000:  BranchingRatio(0.00252248, 0.989731, 126.634)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.00293519, 0.989413, 126.634),
-            -200:  BranchingRatio(0.00274485, 0.99043, 126.634),
-            200:  BranchingRatio(0.00263824, 0.990362, 126.634),
-            1000:  BranchingRatio(0.00250144, 0.989931, 126.634)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.00293225, 0.98962, 126.634),
-            -200:  BranchingRatio(0.00273429, 0.990596, 126.634),
-            200:  BranchingRatio(0.00262374, 0.990532, 126.634),
-            1000:  BranchingRatio(0.00248223, 0.990119, 126.634)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.00293147, 0.989814, 126.634),
-            -200:  BranchingRatio(0.00272566, 0.990752, 126.634),
-            200:  BranchingRatio(0.00261108, 0.990691, 126.634),
-            1000:  BranchingRatio(0.00246475, 0.990294, 126.634)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.00293279, 0.989996, 126.634),
-            -200:  BranchingRatio(0.0027189, 0.990897, 126.634),
-            200:  BranchingRatio(0.00260018, 0.99084, 126.634),
-            1000:  BranchingRatio(0.00244892, 0.990459, 126.634)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.00293613, 0.990167, 126.634),
-            -200:  BranchingRatio(0.00271392, 0.991034, 126.634),
-            200:  BranchingRatio(0.00259096, 0.99098, 126.634),
-            1000:  BranchingRatio(0.00243466, 0.990613, 126.634)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.00294143, 0.990327, 126.634),
-            -200:  BranchingRatio(0.00271066, 0.991162, 126.634),
-            200:  BranchingRatio(0.00258334, 0.991112, 126.634),
-            1000:  BranchingRatio(0.0024219, 0.990758, 126.634)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.00294861, 0.990479, 126.634),
-            -200:  BranchingRatio(0.00270905, 0.991283, 126.634),
-            200:  BranchingRatio(0.00257727, 0.991236, 126.634),
-            1000:  BranchingRatio(0.00241057, 0.990895, 126.634)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.00295764, 0.990621, 126.634),
-            -200:  BranchingRatio(0.00270902, 0.991397, 126.634),
-            200:  BranchingRatio(0.00257267, 0.991352, 126.634),
-            1000:  BranchingRatio(0.0024006, 0.991023, 126.634)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.00296844, 0.990756, 126.634),
-            -200:  BranchingRatio(0.00271052, 0.991504, 126.634),
-            200:  BranchingRatio(0.00256949, 0.991461, 126.634),
-            1000:  BranchingRatio(0.00239193, 0.991144, 126.634)
-        },
-        8: {
-            -1000:  BranchingRatio(0.00298097, 0.990882, 126.634),
-            -200:  BranchingRatio(0.00271348, 0.991604, 126.634),
-            200:  BranchingRatio(0.00256767, 0.991565, 126.634),
-            1000:  BranchingRatio(0.00238451, 0.991258, 126.634)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.00299519, 0.991002, 126.634),
-            -200:  BranchingRatio(0.00271787, 0.991699, 126.634),
-            200:  BranchingRatio(0.00256715, 0.991662, 126.634),
-            1000:  BranchingRatio(0.00237828, 0.991366, 126.634)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.00301105, 0.991115, 126.634),
-            -200:  BranchingRatio(0.00272364, 0.991789, 126.634),
-            200:  BranchingRatio(0.00256789, 0.991754, 126.634),
-            1000:  BranchingRatio(0.0023732, 0.991468, 126.634)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.00302851, 0.991222, 126.634),
-            -200:  BranchingRatio(0.00273073, 0.991874, 126.634),
-            200:  BranchingRatio(0.00256985, 0.991841, 126.634),
-            1000:  BranchingRatio(0.00236921, 0.991564, 126.634)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.00304753, 0.991323, 126.634),
-            -200:  BranchingRatio(0.0027391, 0.991954, 126.634),
-            200:  BranchingRatio(0.00257297, 0.991923, 126.634),
-            1000:  BranchingRatio(0.00236627, 0.991655, 126.634)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.00306808, 0.991419, 126.634),
-            -200:  BranchingRatio(0.00274872, 0.99203, 126.634),
-            200:  BranchingRatio(0.00257722, 0.992, 126.634),
-            1000:  BranchingRatio(0.00236433, 0.991741, 126.634)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.00309012, 0.99151, 126.634),
-            -200:  BranchingRatio(0.00275955, 0.992102, 126.634),
-            200:  BranchingRatio(0.00258255, 0.992074, 126.634),
-            1000:  BranchingRatio(0.00236337, 0.991823, 126.634)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.00311363, 0.991596, 126.634),
-            -200:  BranchingRatio(0.00277155, 0.99217, 126.634),
-            200:  BranchingRatio(0.00258894, 0.992143, 126.634),
-            1000:  BranchingRatio(0.00236333, 0.9919, 126.634)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.00313858, 0.991677, 126.634),
-            -200:  BranchingRatio(0.00278469, 0.992234, 126.634),
-            200:  BranchingRatio(0.00259634, 0.992209, 126.634),
-            1000:  BranchingRatio(0.00236419, 0.991974, 126.634)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.00316493, 0.991755, 126.634),
-            -200:  BranchingRatio(0.00279894, 0.992295, 126.634),
-            200:  BranchingRatio(0.00260472, 0.992272, 126.634),
-            1000:  BranchingRatio(0.0023659, 0.992043, 126.634)
-        },
-        9: {
-            -1000:  BranchingRatio(0.00319268, 0.991829, 126.634),
-            -200:  BranchingRatio(0.00281426, 0.992353, 126.634),
-            200:  BranchingRatio(0.00261406, 0.992331, 126.634),
-            1000:  BranchingRatio(0.00236845, 0.992109, 126.634)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.00322178, 0.991899, 126.634),
-            -200:  BranchingRatio(0.00283064, 0.992409, 126.634),
-            200:  BranchingRatio(0.00262431, 0.992388, 126.634),
-            1000:  BranchingRatio(0.0023718, 0.992172, 126.634)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.00325222, 0.991966, 126.634),
-            -200:  BranchingRatio(0.00284804, 0.992461, 126.634),
-            200:  BranchingRatio(0.00263546, 0.992442, 126.634),
-            1000:  BranchingRatio(0.00237591, 0.992232, 126.634)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.00328399, 0.992029, 126.634),
-            -200:  BranchingRatio(0.00286643, 0.992511, 126.634),
-            200:  BranchingRatio(0.00264748, 0.992493, 126.634),
-            1000:  BranchingRatio(0.00238077, 0.992289, 126.634)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.00331706, 0.99209, 126.634),
-            -200:  BranchingRatio(0.0028858, 0.992559, 126.634),
-            200:  BranchingRatio(0.00266034, 0.992541, 126.634),
-            1000:  BranchingRatio(0.00238635, 0.992344, 126.634)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.00335141, 0.992147, 126.634),
-            -200:  BranchingRatio(0.00290612, 0.992604, 126.634),
-            200:  BranchingRatio(0.00267402, 0.992588, 126.634),
-            1000:  BranchingRatio(0.00239261, 0.992395, 126.634)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.00338703, 0.992202, 126.634),
-            -200:  BranchingRatio(0.00292737, 0.992647, 126.634),
-            200:  BranchingRatio(0.0026885, 0.992632, 126.634),
-            1000:  BranchingRatio(0.00239955, 0.992445, 126.634)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.00342391, 0.992255, 126.634),
-            -200:  BranchingRatio(0.00294954, 0.992688, 126.634),
-            200:  BranchingRatio(0.00270375, 0.992674, 126.634),
-            1000:  BranchingRatio(0.00240713, 0.992492, 126.634)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.00346203, 0.992305, 126.634),
-            -200:  BranchingRatio(0.00297259, 0.992727, 126.634),
-            200:  BranchingRatio(0.00271976, 0.992714, 126.634),
-            1000:  BranchingRatio(0.00241534, 0.992537, 126.634)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.00350139, 0.992353, 126.634),
-            -200:  BranchingRatio(0.00299652, 0.992765, 126.634),
-            200:  BranchingRatio(0.0027365, 0.992753, 126.634),
-            1000:  BranchingRatio(0.00242416, 0.99258, 126.634)
-        },
-        10: {
-            -1000:  BranchingRatio(0.00354195, 0.992398, 126.634),
-            -200:  BranchingRatio(0.00302131, 0.992801, 126.634),
-            200:  BranchingRatio(0.00275395, 0.992789, 126.634),
-            1000:  BranchingRatio(0.00243356, 0.992621, 126.634)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0040127, 0.992761, 126.634),
-            -200:  BranchingRatio(0.0033131, 0.993084, 126.634),
-            200:  BranchingRatio(0.00296443, 0.993079, 126.634),
-            1000:  BranchingRatio(0.00255616, 0.992947, 126.634)
-        },
-        12: {
-            -1000:  BranchingRatio(0.00459824, 0.993003, 126.634),
-            -200:  BranchingRatio(0.003677, 0.993272, 126.634),
-            200:  BranchingRatio(0.00323143, 0.993272, 126.634),
-            1000:  BranchingRatio(0.00272155, 0.993166, 126.634)
-        },
-        13: {
-            -1000:  BranchingRatio(0.00529742, 0.99317, 126.634),
-            -200:  BranchingRatio(0.00410531, 0.993402, 126.634),
-            200:  BranchingRatio(0.00354588, 0.993406, 126.634),
-            1000:  BranchingRatio(0.00292008, 0.993319, 126.634)
-        },
-        14: {
-            -1000:  BranchingRatio(0.00611265, 0.993288, 126.634),
-            -200:  BranchingRatio(0.00459325, 0.993494, 126.634),
-            200:  BranchingRatio(0.00390159, 0.993502, 126.634),
-            1000:  BranchingRatio(0.00314507, 0.99343, 126.634)
-        },
-        15: {
-            -1000:  BranchingRatio(0.00704885, 0.993372, 126.634),
-            -200:  BranchingRatio(0.00513783, 0.993562, 126.634),
-            200:  BranchingRatio(0.00429419, 0.993572, 126.634),
-            1000:  BranchingRatio(0.00339172, 0.993512, 126.634)
-        },
-        16: {
-            -1000:  BranchingRatio(0.00811287, 0.993434, 126.634),
-            -200:  BranchingRatio(0.00573723, 0.993613, 126.634),
-            200:  BranchingRatio(0.00472046, 0.993625, 126.634),
-            1000:  BranchingRatio(0.00365645, 0.993575, 126.634)
-        },
-        17: {
-            -1000:  BranchingRatio(0.00931315, 0.993478, 126.634),
-            -200:  BranchingRatio(0.00639033, 0.993652, 126.634),
-            200:  BranchingRatio(0.00517792, 0.993667, 126.634),
-            1000:  BranchingRatio(0.00393648, 0.993624, 126.634)
-        },
-        18: {
-            -1000:  BranchingRatio(0.0106596, 0.99351, 126.634),
-            -200:  BranchingRatio(0.00709658, 0.993683, 126.634),
-            200:  BranchingRatio(0.00566462, 0.993699, 126.634),
-            1000:  BranchingRatio(0.00422962, 0.993663, 126.634)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0121635, 0.99353, 126.634),
-            -200:  BranchingRatio(0.00785574, 0.993706, 126.634),
-            200:  BranchingRatio(0.00617897, 0.993725, 126.634),
-            1000:  BranchingRatio(0.00453408, 0.993695, 126.634)
-        },
-        20: {
-            -1000:  BranchingRatio(0.0138375, 0.993541, 126.634),
-            -200:  BranchingRatio(0.00866784, 0.993725, 126.634),
-            200:  BranchingRatio(0.00671963, 0.993745, 126.634),
-            1000:  BranchingRatio(0.00484836, 0.99372, 126.634)
-        },
-        21: {
-            -1000:  BranchingRatio(0.0156958, 0.993544, 126.634),
-            -200:  BranchingRatio(0.00953309, 0.99374, 126.634),
-            200:  BranchingRatio(0.00728544, 0.993763, 126.634),
-            1000:  BranchingRatio(0.00517121, 0.993742, 126.634)
-        },
-        22: {
-            -1000:  BranchingRatio(0.0177541, 0.99354, 126.634),
-            -200:  BranchingRatio(0.0104518, 0.993752, 126.634),
-            200:  BranchingRatio(0.00787542, 0.993777, 126.634),
-            1000:  BranchingRatio(0.00550155, 0.99376, 126.634)
-        },
-        23: {
-            -1000:  BranchingRatio(0.0200295, 0.993526, 126.634),
-            -200:  BranchingRatio(0.0114245, 0.993761, 126.634),
-            200:  BranchingRatio(0.00848864, 0.993788, 126.634),
-            1000:  BranchingRatio(0.00583845, 0.993776, 126.634)
-        },
-        24: {
-            -1000:  BranchingRatio(0.0225411, 0.993503, 126.634),
-            -200:  BranchingRatio(0.0124516, 0.993768, 126.634),
-            200:  BranchingRatio(0.00912431, 0.993798, 126.634),
-            1000:  BranchingRatio(0.00618108, 0.993789, 126.634)
-        },
-        25: {
-            -1000:  BranchingRatio(0.0253098, 0.99347, 126.634),
-            -200:  BranchingRatio(0.0135337, 0.993774, 126.634),
-            200:  BranchingRatio(0.00978165, 0.993807, 126.634),
-            1000:  BranchingRatio(0.00652871, 0.9938, 126.634)
-        },
-        26: {
-            -1000:  BranchingRatio(0.0283588, 0.993422, 126.634),
-            -200:  BranchingRatio(0.0146714, 0.993778, 126.634),
-            200:  BranchingRatio(0.01046, 0.993814, 126.634),
-            1000:  BranchingRatio(0.0068807, 0.99381, 126.634)
-        },
-        27: {
-            -1000:  BranchingRatio(0.0317132, 0.993357, 126.634),
-            -200:  BranchingRatio(0.0158653, 0.99378, 126.634),
-            200:  BranchingRatio(0.0111586, 0.99382, 126.634),
-            1000:  BranchingRatio(0.00723644, 0.993819, 126.634)
-        },
-        28: {
-            -1000:  BranchingRatio(0.0354011, 0.993268, 126.634),
-            -200:  BranchingRatio(0.0171162, 0.993782, 126.634),
-            200:  BranchingRatio(0.011877, 0.993825, 126.634),
-            1000:  BranchingRatio(0.00759543, 0.993827, 126.634)
-        },
-        29: {
-            -1000:  BranchingRatio(0.0394529, 0.993145, 126.634),
-            -200:  BranchingRatio(0.0184247, 0.993782, 126.634),
-            200:  BranchingRatio(0.0126144, 0.99383, 126.634),
-            1000:  BranchingRatio(0.00795718, 0.993834, 126.634)
-        },
-        30: {
-            -1000:  BranchingRatio(0.0439026, 0.992973, 126.634),
-            -200:  BranchingRatio(0.0197916, 0.993782, 126.634),
-            200:  BranchingRatio(0.0133704, 0.993833, 126.634),
-            1000:  BranchingRatio(0.00832125, 0.99384, 126.634)
-        },
-        31: {
-            -1000:  BranchingRatio(0.048787, 0.99273, 126.634),
-            -200:  BranchingRatio(0.0212174, 0.99378, 126.634),
-            200:  BranchingRatio(0.0141444, 0.993837, 126.634),
-            1000:  BranchingRatio(0.00868726, 0.993845, 126.634)
-        },
-        32: {
-            -1000:  BranchingRatio(0.0541472, 0.992373, 126.634),
-            -200:  BranchingRatio(0.022703, 0.993778, 126.634),
-            200:  BranchingRatio(0.0149358, 0.993839, 126.634),
-            1000:  BranchingRatio(0.00905484, 0.99385, 126.634)
-        },
-        33: {
-            -1000:  BranchingRatio(0.0600281, 0.991824, 126.634),
-            -200:  BranchingRatio(0.024249, 0.993775, 126.634),
-            200:  BranchingRatio(0.0157442, 0.993842, 126.634),
-            1000:  BranchingRatio(0.00942366, 0.993855, 126.634)
-        },
-        34: {
-            -1000:  BranchingRatio(0.0664793, 0.990924, 126.634),
-            -200:  BranchingRatio(0.0258563, 0.99377, 126.634),
-            200:  BranchingRatio(0.016569, 0.993844, 126.634),
-            1000:  BranchingRatio(0.0097934, 0.993859, 126.634)
-        },
-        35: {
-            -1000:  BranchingRatio(0.0735555, 0.989276, 126.634),
-            -200:  BranchingRatio(0.0275254, 0.993765, 126.634),
-            200:  BranchingRatio(0.0174099, 0.993846, 126.634),
-            1000:  BranchingRatio(0.0101638, 0.993863, 126.634)
-        },
-        36: {
-            -1000:  BranchingRatio(0.081317, 0.985346, 126.634),
-            -200:  BranchingRatio(0.0292571, 0.993759, 126.634),
-            200:  BranchingRatio(0.0182662, 0.993847, 126.634),
-            1000:  BranchingRatio(0.0105346, 0.993866, 126.634)
-        },
-        37: {
-            -1000:  BranchingRatio(0.0898303, 0.943076, 126.634),
-            -200:  BranchingRatio(0.0310522, 0.993751, 126.634),
-            200:  BranchingRatio(0.0191376, 0.993848, 126.634),
-            1000:  BranchingRatio(0.0109056, 0.993869, 126.634)
-        },
-        38: {
-            -1000:  BranchingRatio(0.0991691, 0.765418, 126.634),
-            -200:  BranchingRatio(0.0329113, 0.993743, 126.634),
-            200:  BranchingRatio(0.0200237, 0.993849, 126.634),
-            1000:  BranchingRatio(0.0112765, 0.993872, 126.634)
-        },
-        39: {
-            -1000:  BranchingRatio(0.109415, 0.604667, 126.634),
-            -200:  BranchingRatio(0.0348351, 0.993733, 126.634),
-            200:  BranchingRatio(0.0209239, 0.99385, 126.634),
-            1000:  BranchingRatio(0.0116471, 0.993875, 126.634)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0368243, 0.993722, 126.634),
-            200:  BranchingRatio(0.0218379, 0.99385, 126.634),
-            1000:  BranchingRatio(0.0120173, 0.993877, 126.634)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0388796, 0.99371, 126.634),
-            200:  BranchingRatio(0.0227653, 0.99385, 126.634),
-            1000:  BranchingRatio(0.012387, 0.99388, 126.634)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0410018, 0.993696, 126.634),
-            200:  BranchingRatio(0.0237055, 0.993851, 126.634),
-            1000:  BranchingRatio(0.0127558, 0.993882, 126.634)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0431913, 0.99368, 126.634),
-            200:  BranchingRatio(0.0246584, 0.993851, 126.634),
-            1000:  BranchingRatio(0.0131237, 0.993884, 126.634)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0454489, 0.993662, 126.634),
-            200:  BranchingRatio(0.0256234, 0.99385, 126.634),
-            1000:  BranchingRatio(0.0134906, 0.993886, 126.634)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0477752, 0.993641, 126.634),
-            200:  BranchingRatio(0.0266003, 0.99385, 126.634),
-            1000:  BranchingRatio(0.0138563, 0.993888, 126.634)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0501709, 0.993619, 126.634),
-            200:  BranchingRatio(0.0275885, 0.99385, 126.634),
-            1000:  BranchingRatio(0.0142207, 0.99389, 126.634)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0526364, 0.993593, 126.634),
-            200:  BranchingRatio(0.0285878, 0.993849, 126.634),
-            1000:  BranchingRatio(0.0145837, 0.993891, 126.634)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0551725, 0.993564, 126.634),
-            200:  BranchingRatio(0.0295979, 0.993848, 126.634),
-            1000:  BranchingRatio(0.0149453, 0.993893, 126.634)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0577796, 0.993532, 126.634),
-            200:  BranchingRatio(0.0306183, 0.993847, 126.634),
-            1000:  BranchingRatio(0.0153053, 0.993894, 126.634)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0604583, 0.993495, 126.634),
-            200:  BranchingRatio(0.0316487, 0.993846, 126.634),
-            1000:  BranchingRatio(0.0156636, 0.993896, 126.634)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0632091, 0.993454, 126.634),
-            200:  BranchingRatio(0.0326889, 0.993845, 126.634),
-            1000:  BranchingRatio(0.0160202, 0.993897, 126.634)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0660326, 0.993407, 126.634),
-            200:  BranchingRatio(0.0337384, 0.993844, 126.634),
-            1000:  BranchingRatio(0.016375, 0.993898, 126.634)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0689291, 0.993354, 126.634),
-            200:  BranchingRatio(0.034797, 0.993843, 126.634),
-            1000:  BranchingRatio(0.016728, 0.993899, 126.634)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0718991, 0.993293, 126.634),
-            200:  BranchingRatio(0.0358643, 0.993841, 126.634),
-            1000:  BranchingRatio(0.0170791, 0.9939, 126.634)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0749432, 0.993223, 126.634),
-            200:  BranchingRatio(0.0369401, 0.99384, 126.634),
-            1000:  BranchingRatio(0.0174282, 0.993901, 126.634)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0780615, 0.993143, 126.634),
-            200:  BranchingRatio(0.038024, 0.993838, 126.634),
-            1000:  BranchingRatio(0.0177753, 0.993902, 126.634)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0812546, 0.99305, 126.634),
-            200:  BranchingRatio(0.0391158, 0.993836, 126.634),
-            1000:  BranchingRatio(0.0181203, 0.993903, 126.634)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0845228, 0.992942, 126.634),
-            200:  BranchingRatio(0.0402152, 0.993834, 126.634),
-            1000:  BranchingRatio(0.0184633, 0.993904, 126.634)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0878664, 0.992815, 126.634),
-            200:  BranchingRatio(0.0413218, 0.993832, 126.634),
-            1000:  BranchingRatio(0.0188041, 0.993905, 126.634)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0912856, 0.992664, 126.634),
-            200:  BranchingRatio(0.0424355, 0.99383, 126.634),
-            1000:  BranchingRatio(0.0191429, 0.993905, 126.634)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0947808, 0.992483, 126.634),
-            200:  BranchingRatio(0.0435559, 0.993828, 126.634),
-            1000:  BranchingRatio(0.0194794, 0.993906, 126.634)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0983521, 0.992261, 126.634),
-            200:  BranchingRatio(0.0446829, 0.993826, 126.634),
-            1000:  BranchingRatio(0.0198137, 0.993907, 126.634)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.102, 0.991981, 126.634),
-            200:  BranchingRatio(0.045816, 0.993823, 126.634),
-            1000:  BranchingRatio(0.0201459, 0.993907, 126.634)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.105724, 0.991615, 126.634),
-            200:  BranchingRatio(0.0469552, 0.993821, 126.634),
-            1000:  BranchingRatio(0.0204758, 0.993908, 126.634)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.109525, 0.991096, 126.634),
-            200:  BranchingRatio(0.0481, 0.993818, 126.634),
-            1000:  BranchingRatio(0.0208034, 0.993909, 126.634)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.113402, 0.990233, 126.634),
-            200:  BranchingRatio(0.0492504, 0.993815, 126.634),
-            1000:  BranchingRatio(0.0211288, 0.993909, 126.634)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.117356, 0.989958, 126.634),
-            200:  BranchingRatio(0.0504061, 0.993812, 126.634),
-            1000:  BranchingRatio(0.0214519, 0.99391, 126.634)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.121387, 0.984772, 126.634),
-            200:  BranchingRatio(0.0515668, 0.993809, 126.634),
-            1000:  BranchingRatio(0.0217727, 0.99391, 126.634)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.125494, 0.974502, 126.634),
-            200:  BranchingRatio(0.0527323, 0.993806, 126.634),
-            1000:  BranchingRatio(0.0220912, 0.993911, 126.634)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.129678, 0.962388, 126.634),
-            200:  BranchingRatio(0.0539024, 0.993803, 126.634),
-            1000:  BranchingRatio(0.0224074, 0.993911, 126.634)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.133939, 0.949072, 126.634),
-            200:  BranchingRatio(0.0550768, 0.993799, 126.634),
-            1000:  BranchingRatio(0.0227214, 0.993912, 126.634)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.138276, 0.935012, 126.634),
-            200:  BranchingRatio(0.0562555, 0.993796, 126.634),
-            1000:  BranchingRatio(0.023033, 0.993912, 126.634)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.142689, 0.920575, 126.634),
-            200:  BranchingRatio(0.0574381, 0.993792, 126.634),
-            1000:  BranchingRatio(0.0233424, 0.993913, 126.634)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.147178, 0.906084, 126.634),
-            200:  BranchingRatio(0.0586244, 0.993788, 126.634),
-            1000:  BranchingRatio(0.0236494, 0.993913, 126.634)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.151742, 0.891845, 126.634),
-            200:  BranchingRatio(0.0598144, 0.993784, 126.634),
-            1000:  BranchingRatio(0.0239541, 0.993914, 126.634)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.156382, 0.878557, 126.634),
-            200:  BranchingRatio(0.0610077, 0.99378, 126.634),
-            1000:  BranchingRatio(0.0242566, 0.993914, 126.634)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.161097, 0.866696, 126.634),
-            200:  BranchingRatio(0.0622042, 0.993775, 126.634),
-            1000:  BranchingRatio(0.0245568, 0.993915, 126.634)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.165886, 0.85788, 126.634),
-            200:  BranchingRatio(0.0634037, 0.993771, 126.634),
-            1000:  BranchingRatio(0.0248546, 0.993915, 126.634)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.064606, 0.993766, 126.634),
-            1000:  BranchingRatio(0.0251503, 0.993915, 126.634)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.065811, 0.993761, 126.634),
-            1000:  BranchingRatio(0.0254436, 0.993916, 126.634)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0670185, 0.993756, 126.634),
-            1000:  BranchingRatio(0.0257347, 0.993916, 126.634)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0682282, 0.993751, 126.634),
-            1000:  BranchingRatio(0.0260235, 0.993916, 126.634)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0694402, 0.993745, 126.634),
-            1000:  BranchingRatio(0.0263101, 0.993917, 126.634)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0706541, 0.993739, 126.634),
-            1000:  BranchingRatio(0.0265945, 0.993917, 126.634)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0718699, 0.993733, 126.634),
-            1000:  BranchingRatio(0.0268766, 0.993917, 126.634)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0730873, 0.993727, 126.634),
-            1000:  BranchingRatio(0.0271566, 0.993918, 126.634)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0743063, 0.993721, 126.634),
-            1000:  BranchingRatio(0.0274343, 0.993918, 126.634)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0755267, 0.993714, 126.634),
-            1000:  BranchingRatio(0.0277099, 0.993918, 126.634)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0767483, 0.993707, 126.634),
-            1000:  BranchingRatio(0.0279833, 0.993918, 126.634)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0779711, 0.9937, 126.634),
-            1000:  BranchingRatio(0.0282545, 0.993919, 126.634)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0791948, 0.993693, 126.634),
-            1000:  BranchingRatio(0.0285236, 0.993919, 126.634)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0804194, 0.993685, 126.634),
-            1000:  BranchingRatio(0.0287906, 0.993919, 126.634)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0816447, 0.993677, 126.634),
-            1000:  BranchingRatio(0.0290554, 0.993919, 126.634)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0828706, 0.993669, 126.634),
-            1000:  BranchingRatio(0.0293182, 0.993919, 126.634)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.084097, 0.99366, 126.634),
-            1000:  BranchingRatio(0.0295788, 0.99392, 126.634)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0853237, 0.993651, 126.634),
-            1000:  BranchingRatio(0.0298374, 0.99392, 126.634)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0865507, 0.993641, 126.634),
-            1000:  BranchingRatio(0.0300939, 0.99392, 126.634)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0877778, 0.993632, 126.634),
-            1000:  BranchingRatio(0.0303484, 0.99392, 126.634)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0890049, 0.993621, 126.634),
-            1000:  BranchingRatio(0.0306009, 0.99392, 126.634)
-        }
-    },
-    155: {
-        1.1: {
-            -1000:  BranchingRatio(0.0348379, 0.167534, 132.519),
-            -200:  BranchingRatio(0.0348329, 0.181639, 132.519),
-            200:  BranchingRatio(0.034829, 0.17913, 132.519),
-            1000:  BranchingRatio(0.0348239, 0.170709, 132.519)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.029495, 0.211116, 132.519),
-            -200:  BranchingRatio(0.0294897, 0.23105, 132.519),
-            200:  BranchingRatio(0.0294856, 0.227197, 132.519),
-            1000:  BranchingRatio(0.0294801, 0.21631, 132.519)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.0252968, 0.257969, 132.519),
-            -200:  BranchingRatio(0.025291, 0.283621, 132.519),
-            200:  BranchingRatio(0.0252867, 0.278383, 132.519),
-            1000:  BranchingRatio(0.0252808, 0.265189, 132.519)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.0219407, 0.307713, 132.519),
-            -200:  BranchingRatio(0.0219344, 0.338247, 132.519),
-            200:  BranchingRatio(0.0219298, 0.3318, 132.519),
-            1000:  BranchingRatio(0.0219235, 0.316703, 132.519)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.0192171, 0.359567, 132.519),
-            -200:  BranchingRatio(0.0192103, 0.393771, 132.519),
-            200:  BranchingRatio(0.0192054, 0.386427, 132.519),
-            1000:  BranchingRatio(0.0191988, 0.369963, 132.519)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.0169776, 0.412406, 132.519),
-            -200:  BranchingRatio(0.0169704, 0.448978, 132.519),
-            200:  BranchingRatio(0.0169652, 0.441093, 132.519),
-            1000:  BranchingRatio(0.016958, 0.423832, 132.519)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.0151148, 0.464978, 132.519),
-            -200:  BranchingRatio(0.015107, 0.502696, 132.519),
-            200:  BranchingRatio(0.0151015, 0.494606, 132.519),
-            1000:  BranchingRatio(0.0150939, 0.477082, 132.519)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.0135492, 0.516101, 132.519),
-            -200:  BranchingRatio(0.0135409, 0.55391, 132.519),
-            200:  BranchingRatio(0.013535, 0.545896, 132.519),
-            1000:  BranchingRatio(0.0135269, 0.528566, 132.519)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.0122213, 0.564796, 132.519),
-            -200:  BranchingRatio(0.0122123, 0.601841, 132.519),
-            200:  BranchingRatio(0.0122061, 0.59412, 132.519),
-            1000:  BranchingRatio(0.0121975, 0.577346, 132.519)
-        },
-        2: {
-            -1000:  BranchingRatio(0.0110857, 0.610346, 132.519),
-            -200:  BranchingRatio(0.0110761, 0.645983, 132.519),
-            200:  BranchingRatio(0.0110695, 0.638702, 132.519),
-            1000:  BranchingRatio(0.0110603, 0.622748, 132.519)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0101073, 0.652307, 132.519),
-            -200:  BranchingRatio(0.010097, 0.686084, 132.519),
-            200:  BranchingRatio(0.01009, 0.679333, 132.519),
-            1000:  BranchingRatio(0.0100803, 0.664372, 132.519)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.0092586, 0.690468, 132.519),
-            -200:  BranchingRatio(0.00924763, 0.722108, 132.519),
-            200:  BranchingRatio(0.00924023, 0.715931, 132.519),
-            1000:  BranchingRatio(0.00922986, 0.702057, 132.519)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.00851799, 0.724818, 132.519),
-            -200:  BranchingRatio(0.00850628, 0.754181, 132.519),
-            200:  BranchingRatio(0.00849844, 0.748586, 132.519),
-            1000:  BranchingRatio(0.00848744, 0.735833, 132.519)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.00786807, 0.755488, 132.519),
-            -200:  BranchingRatio(0.00785559, 0.78254, 132.519),
-            200:  BranchingRatio(0.00784729, 0.777511, 132.519),
-            1000:  BranchingRatio(0.00783564, 0.765864, 132.519)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.00729484, 0.782702, 132.519),
-            -200:  BranchingRatio(0.00728156, 0.807484, 132.519),
-            200:  BranchingRatio(0.00727276, 0.802989, 132.519),
-            1000:  BranchingRatio(0.00726043, 0.792405, 132.519)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.00678691, 0.806754, 132.519),
-            -200:  BranchingRatio(0.00677278, 0.829345, 132.519),
-            200:  BranchingRatio(0.00676348, 0.825342, 132.519),
-            1000:  BranchingRatio(0.00675043, 0.815757, 132.519)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.00633493, 0.827871, 132.519),
-            -200:  BranchingRatio(0.0063199, 0.848457, 132.519),
-            200:  BranchingRatio(0.00631006, 0.844902, 132.519),
-            1000:  BranchingRatio(0.00629627, 0.83624, 132.519)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.00593115, 0.846415, 132.519),
-            -200:  BranchingRatio(0.00591519, 0.865142, 132.519),
-            200:  BranchingRatio(0.00590479, 0.86199, 132.519),
-            1000:  BranchingRatio(0.00589022, 0.854173, 132.519)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.00556914, 0.862681, 132.519),
-            -200:  BranchingRatio(0.0055522, 0.879701, 132.519),
-            200:  BranchingRatio(0.00554122, 0.876907, 132.519),
-            1000:  BranchingRatio(0.00552584, 0.869857, 132.519)
-        },
-        3: {
-            -1000:  BranchingRatio(0.00524351, 0.876942, 132.519),
-            -200:  BranchingRatio(0.00522555, 0.892406, 132.519),
-            200:  BranchingRatio(0.00521395, 0.889929, 132.519),
-            1000:  BranchingRatio(0.00519773, 0.883569, 132.519)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.00494973, 0.889447, 132.519),
-            -200:  BranchingRatio(0.00493068, 0.9035, 132.519),
-            200:  BranchingRatio(0.00491844, 0.901304, 132.519),
-            1000:  BranchingRatio(0.00490134, 0.895564, 132.519)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.00468392, 0.900422, 132.519),
-            -200:  BranchingRatio(0.00466375, 0.913199, 132.519),
-            200:  BranchingRatio(0.00465084, 0.911249, 132.519),
-            1000:  BranchingRatio(0.00463283, 0.906063, 132.519)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.00444282, 0.910067, 132.519),
-            -200:  BranchingRatio(0.00442147, 0.921689, 132.519),
-            200:  BranchingRatio(0.00440786, 0.919957, 132.519),
-            1000:  BranchingRatio(0.0043889, 0.915265, 132.519)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.00422361, 0.918544, 132.519),
-            -200:  BranchingRatio(0.00420102, 0.929135, 132.519),
-            200:  BranchingRatio(0.00418669, 0.927592, 132.519),
-            1000:  BranchingRatio(0.00416674, 0.923341, 132.519)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.00402388, 0.926007, 132.519),
-            -200:  BranchingRatio(0.004, 0.935676, 132.519),
-            200:  BranchingRatio(0.00398491, 0.9343, 132.519),
-            1000:  BranchingRatio(0.00396394, 0.930443, 132.519)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.00384154, 0.932593, 132.519),
-            -200:  BranchingRatio(0.00381631, 0.941434, 132.519),
-            200:  BranchingRatio(0.00380044, 0.940205, 132.519),
-            1000:  BranchingRatio(0.0037784, 0.936698, 132.519)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.00367477, 0.938417, 132.519),
-            -200:  BranchingRatio(0.00364814, 0.946514, 132.519),
-            200:  BranchingRatio(0.00363144, 0.945413, 132.519),
-            1000:  BranchingRatio(0.0036083, 0.94222, 132.519)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.00352201, 0.943577, 132.519),
-            -200:  BranchingRatio(0.00349391, 0.951004, 132.519),
-            200:  BranchingRatio(0.00347636, 0.950017, 132.519),
-            1000:  BranchingRatio(0.00345207, 0.947103, 132.519)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.00338188, 0.948159, 132.519),
-            -200:  BranchingRatio(0.00335224, 0.954983, 132.519),
-            200:  BranchingRatio(0.0033338, 0.954096, 132.519),
-            1000:  BranchingRatio(0.00330833, 0.951432, 132.519)
-        },
-        4: {
-            -1000:  BranchingRatio(0.00325316, 0.952235, 132.519),
-            -200:  BranchingRatio(0.00322192, 0.958516, 132.519),
-            200:  BranchingRatio(0.00320255, 0.957717, 132.519),
-            1000:  BranchingRatio(0.00317585, 0.955277, 132.519)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.00313479, 0.955869, 132.519),
-            -200:  BranchingRatio(0.00310189, 0.96166, 132.519),
-            200:  BranchingRatio(0.00308156, 0.960939, 132.519),
-            1000:  BranchingRatio(0.00305359, 0.9587, 132.519)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.00302583, 0.959115, 132.519),
-            -200:  BranchingRatio(0.00299119, 0.964464, 132.519),
-            200:  BranchingRatio(0.00296986, 0.963812, 132.519),
-            1000:  BranchingRatio(0.00294058, 0.961753, 132.519)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.00292545, 0.962022, 132.519),
-            -200:  BranchingRatio(0.00288901, 0.966971, 132.519),
-            200:  BranchingRatio(0.00286665, 0.966379, 132.519),
-            1000:  BranchingRatio(0.002836, 0.964483, 132.519)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.00283292, 0.96463, 132.519),
-            -200:  BranchingRatio(0.0027946, 0.969216, 132.519),
-            200:  BranchingRatio(0.00277116, 0.968679, 132.519),
-            1000:  BranchingRatio(0.00273911, 0.966929, 132.519)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.00274758, 0.966974, 132.519),
-            -200:  BranchingRatio(0.0027073, 0.971232, 132.519),
-            200:  BranchingRatio(0.00268274, 0.970743, 132.519),
-            1000:  BranchingRatio(0.00264924, 0.969124, 132.519)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.00266883, 0.969086, 132.519),
-            -200:  BranchingRatio(0.00262652, 0.973044, 132.519),
-            200:  BranchingRatio(0.00260081, 0.972599, 132.519),
-            1000:  BranchingRatio(0.00256581, 0.9711, 132.519)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.00259617, 0.970992, 132.519),
-            -200:  BranchingRatio(0.00255173, 0.974678, 132.519),
-            200:  BranchingRatio(0.00252483, 0.974271, 132.519),
-            1000:  BranchingRatio(0.00248828, 0.97288, 132.519)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.0025291, 0.972715, 132.519),
-            -200:  BranchingRatio(0.00248248, 0.976154, 132.519),
-            200:  BranchingRatio(0.00245434, 0.975782, 132.519),
-            1000:  BranchingRatio(0.00241618, 0.974489, 132.519)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.00246722, 0.974277, 132.519),
-            -200:  BranchingRatio(0.00241831, 0.977489, 132.519),
-            200:  BranchingRatio(0.0023889, 0.977148, 132.519),
-            1000:  BranchingRatio(0.00234909, 0.975944, 132.519)
-        },
-        5: {
-            -1000:  BranchingRatio(0.00241014, 0.975694, 132.519),
-            -200:  BranchingRatio(0.00235887, 0.978699, 132.519),
-            200:  BranchingRatio(0.00232813, 0.978386, 132.519),
-            1000:  BranchingRatio(0.00228663, 0.977263, 132.519)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.00235752, 0.976983, 132.519),
-            -200:  BranchingRatio(0.00230379, 0.979798, 132.519),
-            200:  BranchingRatio(0.00227168, 0.97951, 132.519),
-            1000:  BranchingRatio(0.00222843, 0.978462, 132.519)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.00230905, 0.978156, 132.519),
-            -200:  BranchingRatio(0.00225277, 0.980798, 132.519),
-            200:  BranchingRatio(0.00221925, 0.980533, 132.519),
-            1000:  BranchingRatio(0.00217419, 0.979552, 132.519)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.00226444, 0.979228, 132.519),
-            -200:  BranchingRatio(0.00220552, 0.981709, 132.519),
-            200:  BranchingRatio(0.00217054, 0.981465, 132.519),
-            1000:  BranchingRatio(0.00212363, 0.980546, 132.519)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.00222344, 0.980206, 132.519),
-            -200:  BranchingRatio(0.00216179, 0.982541, 132.519),
-            200:  BranchingRatio(0.0021253, 0.982315, 132.519),
-            1000:  BranchingRatio(0.00207648, 0.981453, 132.519)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.00218582, 0.981103, 132.519),
-            -200:  BranchingRatio(0.00212134, 0.983302, 132.519),
-            200:  BranchingRatio(0.00208329, 0.983093, 132.519),
-            1000:  BranchingRatio(0.00203251, 0.982282, 132.519)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.00215137, 0.981924, 132.519),
-            -200:  BranchingRatio(0.00208395, 0.983998, 132.519),
-            200:  BranchingRatio(0.0020443, 0.983805, 132.519),
-            1000:  BranchingRatio(0.0019915, 0.983042, 132.519)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.00211989, 0.982679, 132.519),
-            -200:  BranchingRatio(0.00204944, 0.984637, 132.519),
-            200:  BranchingRatio(0.00200813, 0.984458, 132.519),
-            1000:  BranchingRatio(0.00195325, 0.983739, 132.519)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.0020912, 0.983372, 132.519),
-            -200:  BranchingRatio(0.00201761, 0.985224, 132.519),
-            200:  BranchingRatio(0.00197461, 0.985058, 132.519),
-            1000:  BranchingRatio(0.00191759, 0.984379, 132.519)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.00206515, 0.984011, 132.519),
-            -200:  BranchingRatio(0.00198832, 0.985764, 132.519),
-            200:  BranchingRatio(0.00194356, 0.985609, 132.519),
-            1000:  BranchingRatio(0.00188435, 0.984969, 132.519)
-        },
-        6: {
-            -1000:  BranchingRatio(0.00204159, 0.984601, 132.519),
-            -200:  BranchingRatio(0.0019614, 0.986262, 132.519),
-            200:  BranchingRatio(0.00191483, 0.986117, 132.519),
-            1000:  BranchingRatio(0.00185337, 0.985511, 132.519)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.00202038, 0.985145, 132.519),
-            -200:  BranchingRatio(0.00193673, 0.98672, 132.519),
-            200:  BranchingRatio(0.00188829, 0.986586, 132.519),
-            1000:  BranchingRatio(0.00182453, 0.986012, 132.519)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.0020014, 0.985648, 132.519),
-            -200:  BranchingRatio(0.00191417, 0.987144, 132.519),
-            200:  BranchingRatio(0.00186382, 0.987019, 132.519),
-            1000:  BranchingRatio(0.00179768, 0.986475, 132.519)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.00198454, 0.986114, 132.519),
-            -200:  BranchingRatio(0.00189361, 0.987536, 132.519),
-            200:  BranchingRatio(0.00184128, 0.987419, 132.519),
-            1000:  BranchingRatio(0.00177272, 0.986903, 132.519)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.00196968, 0.986546, 132.519),
-            -200:  BranchingRatio(0.00187493, 0.987899, 132.519),
-            200:  BranchingRatio(0.00182058, 0.98779, 132.519),
-            1000:  BranchingRatio(0.00174952, 0.987299, 132.519)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.00195674, 0.986947, 132.519),
-            -200:  BranchingRatio(0.00185805, 0.988236, 132.519),
-            200:  BranchingRatio(0.00180161, 0.988134, 132.519),
-            1000:  BranchingRatio(0.001728, 0.987667, 132.519)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.00194561, 0.987319, 132.519),
-            -200:  BranchingRatio(0.00184286, 0.988548, 132.519),
-            200:  BranchingRatio(0.00178428, 0.988453, 132.519),
-            1000:  BranchingRatio(0.00170806, 0.988008, 132.519)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.00193623, 0.987666, 132.519),
-            -200:  BranchingRatio(0.00182929, 0.988839, 132.519),
-            200:  BranchingRatio(0.00176851, 0.988749, 132.519),
-            1000:  BranchingRatio(0.0016896, 0.988325, 132.519)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.00192851, 0.987989, 132.519),
-            -200:  BranchingRatio(0.00181725, 0.989109, 132.519),
-            200:  BranchingRatio(0.00175421, 0.989025, 132.519),
-            1000:  BranchingRatio(0.00167256, 0.98862, 132.519)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.00192238, 0.98829, 132.519),
-            -200:  BranchingRatio(0.00180667, 0.989361, 132.519),
-            200:  BranchingRatio(0.00174131, 0.989282, 132.519),
-            1000:  BranchingRatio(0.00165685, 0.988896, 132.519)
-        },
-        7: {
-            -1000:  BranchingRatio(0.00191778, 0.988571, 132.519),
-            -200:  BranchingRatio(0.00179749, 0.989596, 132.519),
-            200:  BranchingRatio(0.00172974, 0.989521, 132.519),
-            1000:  BranchingRatio(0.00164241, 0.989152, 132.519)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.00191464, 0.988833, 132.519),
-            -200:  BranchingRatio(0.00178963, 0.989815, 132.519),
-            200:  BranchingRatio(0.00171944, 0.989745, 132.519),
-            1000:  BranchingRatio(0.00162917, 0.989392, 132.519)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.00191292, 0.989079, 132.519),
-            -200:  BranchingRatio(0.00178304, 0.990019, 132.519),
-            200:  BranchingRatio(0.00171034, 0.989954, 132.519),
-            1000:  BranchingRatio(0.00161707, 0.989616, 132.519)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.00191255, 0.989309, 132.519),
-            -200:  BranchingRatio(0.00177767, 0.990211, 132.519),
-            200:  BranchingRatio(0.0017024, 0.990149, 132.519),
-            1000:  BranchingRatio(0.00160606, 0.989825, 132.519)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.0019135, 0.989524, 132.519),
-            -200:  BranchingRatio(0.00177347, 0.99039, 132.519),
-            200:  BranchingRatio(0.00169556, 0.990332, 132.519),
-            1000:  BranchingRatio(0.00159608, 0.990021, 132.519)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.00191571, 0.989727, 132.519),
-            -200:  BranchingRatio(0.00177038, 0.990558, 132.519),
-            200:  BranchingRatio(0.00168977, 0.990503, 132.519),
-            1000:  BranchingRatio(0.00158708, 0.990205, 132.519)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.00191914, 0.989916, 132.519),
-            -200:  BranchingRatio(0.00176836, 0.990716, 132.519),
-            200:  BranchingRatio(0.00168498, 0.990664, 132.519),
-            1000:  BranchingRatio(0.00157902, 0.990377, 132.519)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.00192376, 0.990095, 132.519),
-            -200:  BranchingRatio(0.00176738, 0.990864, 132.519),
-            200:  BranchingRatio(0.00168116, 0.990815, 132.519),
-            1000:  BranchingRatio(0.00157185, 0.990539, 132.519)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.00192953, 0.990262, 132.519),
-            -200:  BranchingRatio(0.00176739, 0.991003, 132.519),
-            200:  BranchingRatio(0.00167826, 0.990957, 132.519),
-            1000:  BranchingRatio(0.00156553, 0.990692, 132.519)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.00193641, 0.99042, 132.519),
-            -200:  BranchingRatio(0.00176835, 0.991134, 132.519),
-            200:  BranchingRatio(0.00167625, 0.99109, 132.519),
-            1000:  BranchingRatio(0.00156003, 0.990835, 132.519)
-        },
-        8: {
-            -1000:  BranchingRatio(0.00194437, 0.990569, 132.519),
-            -200:  BranchingRatio(0.00177023, 0.991257, 132.519),
-            200:  BranchingRatio(0.00167508, 0.991216, 132.519),
-            1000:  BranchingRatio(0.00155531, 0.99097, 132.519)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.00195339, 0.990709, 132.519),
-            -200:  BranchingRatio(0.001773, 0.991373, 132.519),
-            200:  BranchingRatio(0.00167474, 0.991334, 132.519),
-            1000:  BranchingRatio(0.00155134, 0.991097, 132.519)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.00196344, 0.990842, 132.519),
-            -200:  BranchingRatio(0.00177663, 0.991482, 132.519),
-            200:  BranchingRatio(0.00167518, 0.991445, 132.519),
-            1000:  BranchingRatio(0.00154808, 0.991217, 132.519)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.00197449, 0.990967, 132.519),
-            -200:  BranchingRatio(0.00178109, 0.991585, 132.519),
-            200:  BranchingRatio(0.00167638, 0.99155, 132.519),
-            1000:  BranchingRatio(0.0015455, 0.99133, 132.519)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.00198652, 0.991085, 132.519),
-            -200:  BranchingRatio(0.00178636, 0.991682, 132.519),
-            200:  BranchingRatio(0.00167831, 0.99165, 132.519),
-            1000:  BranchingRatio(0.00154359, 0.991436, 132.519)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.0019995, 0.991196, 132.519),
-            -200:  BranchingRatio(0.00179241, 0.991774, 132.519),
-            200:  BranchingRatio(0.00168095, 0.991744, 132.519),
-            1000:  BranchingRatio(0.0015423, 0.991537, 132.519)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.00201342, 0.991302, 132.519),
-            -200:  BranchingRatio(0.00179921, 0.991861, 132.519),
-            200:  BranchingRatio(0.00168426, 0.991832, 132.519),
-            1000:  BranchingRatio(0.00154161, 0.991633, 132.519)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.00202826, 0.991402, 132.519),
-            -200:  BranchingRatio(0.00180674, 0.991944, 132.519),
-            200:  BranchingRatio(0.00168823, 0.991916, 132.519),
-            1000:  BranchingRatio(0.00154151, 0.991723, 132.519)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.00204399, 0.991497, 132.519),
-            -200:  BranchingRatio(0.00181499, 0.992021, 132.519),
-            200:  BranchingRatio(0.00169284, 0.991996, 132.519),
-            1000:  BranchingRatio(0.00154197, 0.991809, 132.519)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.00206062, 0.991587, 132.519),
-            -200:  BranchingRatio(0.00182393, 0.992095, 132.519),
-            200:  BranchingRatio(0.00169806, 0.992071, 132.519),
-            1000:  BranchingRatio(0.00154297, 0.99189, 132.519)
-        },
-        9: {
-            -1000:  BranchingRatio(0.0020781, 0.991672, 132.519),
-            -200:  BranchingRatio(0.00183354, 0.992165, 132.519),
-            200:  BranchingRatio(0.00170388, 0.992142, 132.519),
-            1000:  BranchingRatio(0.00154449, 0.991967, 132.519)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.00209645, 0.991753, 132.519),
-            -200:  BranchingRatio(0.00184381, 0.992232, 132.519),
-            200:  BranchingRatio(0.00171027, 0.99221, 132.519),
-            1000:  BranchingRatio(0.0015465, 0.99204, 132.519)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.00211563, 0.99183, 132.519),
-            -200:  BranchingRatio(0.00185473, 0.992295, 132.519),
-            200:  BranchingRatio(0.00171723, 0.992274, 132.519),
-            1000:  BranchingRatio(0.001549, 0.992109, 132.519)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.00213564, 0.991904, 132.519),
-            -200:  BranchingRatio(0.00186626, 0.992355, 132.519),
-            200:  BranchingRatio(0.00172472, 0.992335, 132.519),
-            1000:  BranchingRatio(0.00155196, 0.992175, 132.519)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.00215646, 0.991973, 132.519),
-            -200:  BranchingRatio(0.00187841, 0.992412, 132.519),
-            200:  BranchingRatio(0.00173275, 0.992393, 132.519),
-            1000:  BranchingRatio(0.00155537, 0.992238, 132.519)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.00217809, 0.99204, 132.519),
-            -200:  BranchingRatio(0.00189115, 0.992466, 132.519),
-            200:  BranchingRatio(0.00174128, 0.992449, 132.519),
-            1000:  BranchingRatio(0.00155922, 0.992298, 132.519)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.00220052, 0.992103, 132.519),
-            -200:  BranchingRatio(0.00190448, 0.992517, 132.519),
-            200:  BranchingRatio(0.00175032, 0.992501, 132.519),
-            1000:  BranchingRatio(0.00156348, 0.992355, 132.519)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.00222374, 0.992163, 132.519),
-            -200:  BranchingRatio(0.00191837, 0.992566, 132.519),
-            200:  BranchingRatio(0.00175984, 0.992551, 132.519),
-            1000:  BranchingRatio(0.00156815, 0.992409, 132.519)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.00224773, 0.99222, 132.519),
-            -200:  BranchingRatio(0.00193282, 0.992613, 132.519),
-            200:  BranchingRatio(0.00176983, 0.992599, 132.519),
-            1000:  BranchingRatio(0.00157321, 0.99246, 132.519)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.00227249, 0.992275, 132.519),
-            -200:  BranchingRatio(0.00194783, 0.992658, 132.519),
-            200:  BranchingRatio(0.00178028, 0.992644, 132.519),
-            1000:  BranchingRatio(0.00157865, 0.992509, 132.519)
-        },
-        10: {
-            -1000:  BranchingRatio(0.00229802, 0.992327, 132.519),
-            -200:  BranchingRatio(0.00196336, 0.9927, 132.519),
-            200:  BranchingRatio(0.00179118, 0.992688, 132.519),
-            1000:  BranchingRatio(0.00158445, 0.992556, 132.519)
-        },
-        11: {
-            -1000:  BranchingRatio(0.0025941, 0.992739, 132.519),
-            -200:  BranchingRatio(0.00214625, 0.993034, 132.519),
-            200:  BranchingRatio(0.00192266, 0.993028, 132.519),
-            1000:  BranchingRatio(0.00166041, 0.992926, 132.519)
-        },
-        12: {
-            -1000:  BranchingRatio(0.00296225, 0.993009, 132.519),
-            -200:  BranchingRatio(0.00237433, 0.993252, 132.519),
-            200:  BranchingRatio(0.00208954, 0.993251, 132.519),
-            1000:  BranchingRatio(0.00176316, 0.99317, 132.519)
-        },
-        13: {
-            -1000:  BranchingRatio(0.00340184, 0.993194, 132.519),
-            -200:  BranchingRatio(0.0026428, 0.993401, 132.519),
-            200:  BranchingRatio(0.00228617, 0.993403, 132.519),
-            1000:  BranchingRatio(0.00188667, 0.993337, 132.519)
-        },
-        14: {
-            -1000:  BranchingRatio(0.00391449, 0.993323, 132.519),
-            -200:  BranchingRatio(0.00294874, 0.993506, 132.519),
-            200:  BranchingRatio(0.00250868, 0.993511, 132.519),
-            1000:  BranchingRatio(0.00202679, 0.993456, 132.519)
-        },
-        15: {
-            -1000:  BranchingRatio(0.00450344, 0.993415, 132.519),
-            -200:  BranchingRatio(0.00329029, 0.993582, 132.519),
-            200:  BranchingRatio(0.00275436, 0.993589, 132.519),
-            1000:  BranchingRatio(0.0021805, 0.993544, 132.519)
-        },
-        16: {
-            -1000:  BranchingRatio(0.00517314, 0.993482, 132.519),
-            -200:  BranchingRatio(0.00366635, 0.993638, 132.519),
-            200:  BranchingRatio(0.00302121, 0.993647, 132.519),
-            1000:  BranchingRatio(0.00234558, 0.993609, 132.519)
-        },
-        17: {
-            -1000:  BranchingRatio(0.00592909, 0.993531, 132.519),
-            -200:  BranchingRatio(0.00407628, 0.99368, 132.519),
-            200:  BranchingRatio(0.0033077, 0.993691, 132.519),
-            1000:  BranchingRatio(0.00252029, 0.99366, 132.519)
-        },
-        18: {
-            -1000:  BranchingRatio(0.00677778, 0.993566, 132.519),
-            -200:  BranchingRatio(0.00451977, 0.993713, 132.519),
-            200:  BranchingRatio(0.00361262, 0.993726, 132.519),
-            1000:  BranchingRatio(0.00270326, 0.993699, 132.519)
-        },
-        19: {
-            -1000:  BranchingRatio(0.00772659, 0.993589, 132.519),
-            -200:  BranchingRatio(0.00499674, 0.993738, 132.519),
-            200:  BranchingRatio(0.00393501, 0.993753, 132.519),
-            1000:  BranchingRatio(0.00289337, 0.993731, 132.519)
-        },
-        20: {
-            -1000:  BranchingRatio(0.00878387, 0.993604, 132.519),
-            -200:  BranchingRatio(0.00550724, 0.993758, 132.519),
-            200:  BranchingRatio(0.00427402, 0.993775, 132.519),
-            1000:  BranchingRatio(0.0030897, 0.993756, 132.519)
-        },
-        21: {
-            -1000:  BranchingRatio(0.00995895, 0.993611, 132.519),
-            -200:  BranchingRatio(0.00605149, 0.993774, 132.519),
-            200:  BranchingRatio(0.00462898, 0.993792, 132.519),
-            1000:  BranchingRatio(0.00329146, 0.993777, 132.519)
-        },
-        22: {
-            -1000:  BranchingRatio(0.0112622, 0.993611, 132.519),
-            -200:  BranchingRatio(0.00662975, 0.993786, 132.519),
-            200:  BranchingRatio(0.00499926, 0.993807, 132.519),
-            1000:  BranchingRatio(0.00349798, 0.993795, 132.519)
-        },
-        23: {
-            -1000:  BranchingRatio(0.0127053, 0.993603, 132.519),
-            -200:  BranchingRatio(0.00724237, 0.993796, 132.519),
-            200:  BranchingRatio(0.00538432, 0.993818, 132.519),
-            1000:  BranchingRatio(0.00370868, 0.993809, 132.519)
-        },
-        24: {
-            -1000:  BranchingRatio(0.0143009, 0.993587, 132.519),
-            -200:  BranchingRatio(0.00788975, 0.993804, 132.519),
-            200:  BranchingRatio(0.00578367, 0.993828, 132.519),
-            1000:  BranchingRatio(0.00392304, 0.993822, 132.519)
-        },
-        25: {
-            -1000:  BranchingRatio(0.0160632, 0.993562, 132.519),
-            -200:  BranchingRatio(0.00857233, 0.99381, 132.519),
-            200:  BranchingRatio(0.00619684, 0.993837, 132.519),
-            1000:  BranchingRatio(0.0041406, 0.993832, 132.519)
-        },
-        26: {
-            -1000:  BranchingRatio(0.018008, 0.993526, 132.519),
-            -200:  BranchingRatio(0.00929058, 0.993814, 132.519),
-            200:  BranchingRatio(0.00662343, 0.993844, 132.519),
-            1000:  BranchingRatio(0.00436096, 0.993842, 132.519)
-        },
-        27: {
-            -1000:  BranchingRatio(0.0201527, 0.993475, 132.519),
-            -200:  BranchingRatio(0.010045, 0.993818, 132.519),
-            200:  BranchingRatio(0.00706303, 0.99385, 132.519),
-            1000:  BranchingRatio(0.00458375, 0.99385, 132.519)
-        },
-        28: {
-            -1000:  BranchingRatio(0.0225167, 0.993405, 132.519),
-            -200:  BranchingRatio(0.0108361, 0.99382, 132.519),
-            200:  BranchingRatio(0.00751527, 0.993855, 132.519),
-            1000:  BranchingRatio(0.00480865, 0.993857, 132.519)
-        },
-        29: {
-            -1000:  BranchingRatio(0.0251216, 0.993309, 132.519),
-            -200:  BranchingRatio(0.0116644, 0.993821, 132.519),
-            200:  BranchingRatio(0.00797981, 0.993859, 132.519),
-            1000:  BranchingRatio(0.00503536, 0.993863, 132.519)
-        },
-        30: {
-            -1000:  BranchingRatio(0.0279914, 0.993174, 132.519),
-            -200:  BranchingRatio(0.0125305, 0.993821, 132.519),
-            200:  BranchingRatio(0.00845629, 0.993863, 132.519),
-            1000:  BranchingRatio(0.0052636, 0.993868, 132.519)
-        },
-        31: {
-            -1000:  BranchingRatio(0.0311527, 0.992984, 132.519),
-            -200:  BranchingRatio(0.013435, 0.99382, 132.519),
-            200:  BranchingRatio(0.0089444, 0.993866, 132.519),
-            1000:  BranchingRatio(0.00549313, 0.993873, 132.519)
-        },
-        32: {
-            -1000:  BranchingRatio(0.0346352, 0.992707, 132.519),
-            -200:  BranchingRatio(0.0143783, 0.993819, 132.519),
-            200:  BranchingRatio(0.00944383, 0.993869, 132.519),
-            1000:  BranchingRatio(0.00572372, 0.993878, 132.519)
-        },
-        33: {
-            -1000:  BranchingRatio(0.0384725, 0.992285, 132.519),
-            -200:  BranchingRatio(0.0153612, 0.993817, 132.519),
-            200:  BranchingRatio(0.00995427, 0.993871, 132.519),
-            1000:  BranchingRatio(0.00595516, 0.993882, 132.519)
-        },
-        34: {
-            -1000:  BranchingRatio(0.0427016, 0.991609, 132.519),
-            -200:  BranchingRatio(0.0163842, 0.993814, 132.519),
-            200:  BranchingRatio(0.0104754, 0.993873, 132.519),
-            1000:  BranchingRatio(0.00618726, 0.993885, 132.519)
-        },
-        35: {
-            -1000:  BranchingRatio(0.0473645, 0.990421, 132.519),
-            -200:  BranchingRatio(0.0174479, 0.99381, 132.519),
-            200:  BranchingRatio(0.011007, 0.993874, 132.519),
-            1000:  BranchingRatio(0.00641984, 0.993889, 132.519)
-        },
-        36: {
-            -1000:  BranchingRatio(0.0525082, 0.987942, 132.519),
-            -200:  BranchingRatio(0.0185529, 0.993805, 132.519),
-            200:  BranchingRatio(0.0115488, 0.993876, 132.519),
-            1000:  BranchingRatio(0.00665275, 0.993892, 132.519)
-        },
-        37: {
-            -1000:  BranchingRatio(0.0581856, 0.98124, 132.519),
-            -200:  BranchingRatio(0.0196999, 0.993799, 132.519),
-            200:  BranchingRatio(0.0121005, 0.993877, 132.519),
-            1000:  BranchingRatio(0.00688584, 0.993894, 132.519)
-        },
-        38: {
-            -1000:  BranchingRatio(0.0644565, 0.843323, 132.519),
-            -200:  BranchingRatio(0.0208894, 0.993793, 132.519),
-            200:  BranchingRatio(0.0126618, 0.993878, 132.519),
-            1000:  BranchingRatio(0.00711896, 0.993897, 132.519)
-        },
-        39: {
-            -1000:  BranchingRatio(0.0713889, 0.656115, 132.519),
-            -200:  BranchingRatio(0.022122, 0.993785, 132.519),
-            200:  BranchingRatio(0.0132324, 0.993879, 132.519),
-            1000:  BranchingRatio(0.007352, 0.993899, 132.519)
-        },
-        40: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0233985, 0.993777, 132.519),
-            200:  BranchingRatio(0.0138122, 0.993879, 132.519),
-            1000:  BranchingRatio(0.00758483, 0.993901, 132.519)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0247194, 0.993767, 132.519),
-            200:  BranchingRatio(0.0144009, 0.993879, 132.519),
-            1000:  BranchingRatio(0.00781735, 0.993903, 132.519)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0260854, 0.993756, 132.519),
-            200:  BranchingRatio(0.0149982, 0.99388, 132.519),
-            1000:  BranchingRatio(0.00804945, 0.993905, 132.519)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0274972, 0.993744, 132.519),
-            200:  BranchingRatio(0.015604, 0.99388, 132.519),
-            1000:  BranchingRatio(0.00828105, 0.993907, 132.519)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0289552, 0.99373, 132.519),
-            200:  BranchingRatio(0.0162179, 0.99388, 132.519),
-            1000:  BranchingRatio(0.00851207, 0.993908, 132.519)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0304603, 0.993714, 132.519),
-            200:  BranchingRatio(0.0168398, 0.99388, 132.519),
-            1000:  BranchingRatio(0.00874241, 0.99391, 132.519)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.032013, 0.993696, 132.519),
-            200:  BranchingRatio(0.0174695, 0.993879, 132.519),
-            1000:  BranchingRatio(0.00897202, 0.993911, 132.519)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.033614, 0.993676, 132.519),
-            200:  BranchingRatio(0.0181067, 0.993879, 132.519),
-            1000:  BranchingRatio(0.00920082, 0.993913, 132.519)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0352639, 0.993654, 132.519),
-            200:  BranchingRatio(0.0187512, 0.993878, 132.519),
-            1000:  BranchingRatio(0.00942876, 0.993914, 132.519)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0369633, 0.993629, 132.519),
-            200:  BranchingRatio(0.0194028, 0.993878, 132.519),
-            1000:  BranchingRatio(0.00965577, 0.993915, 132.519)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.038713, 0.993601, 132.519),
-            200:  BranchingRatio(0.0200614, 0.993877, 132.519),
-            1000:  BranchingRatio(0.00988181, 0.993916, 132.519)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0405136, 0.993569, 132.519),
-            200:  BranchingRatio(0.0207267, 0.993876, 132.519),
-            1000:  BranchingRatio(0.0101068, 0.993918, 132.519)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0423656, 0.993533, 132.519),
-            200:  BranchingRatio(0.0213985, 0.993875, 132.519),
-            1000:  BranchingRatio(0.0103308, 0.993918, 132.519)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0442697, 0.993492, 132.519),
-            200:  BranchingRatio(0.0220767, 0.993874, 132.519),
-            1000:  BranchingRatio(0.0105536, 0.993919, 132.519)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0462266, 0.993446, 132.519),
-            200:  BranchingRatio(0.0227611, 0.993873, 132.519),
-            1000:  BranchingRatio(0.0107753, 0.99392, 132.519)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0482369, 0.993393, 132.519),
-            200:  BranchingRatio(0.0234514, 0.993872, 132.519),
-            1000:  BranchingRatio(0.0109959, 0.993921, 132.519)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0503012, 0.993333, 132.519),
-            200:  BranchingRatio(0.0241475, 0.993871, 132.519),
-            1000:  BranchingRatio(0.0112152, 0.993922, 132.519)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0524201, 0.993264, 132.519),
-            200:  BranchingRatio(0.0248492, 0.99387, 132.519),
-            1000:  BranchingRatio(0.0114333, 0.993923, 132.519)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0545943, 0.993185, 132.519),
-            200:  BranchingRatio(0.0255565, 0.993868, 132.519),
-            1000:  BranchingRatio(0.0116501, 0.993923, 132.519)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0568243, 0.993093, 132.519),
-            200:  BranchingRatio(0.026269, 0.993867, 132.519),
-            1000:  BranchingRatio(0.0118657, 0.993924, 132.519)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0591107, 0.992986, 132.519),
-            200:  BranchingRatio(0.0269866, 0.993865, 132.519),
-            1000:  BranchingRatio(0.0120799, 0.993925, 132.519)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0614543, 0.99286, 132.519),
-            200:  BranchingRatio(0.0277092, 0.993863, 132.519),
-            1000:  BranchingRatio(0.0122929, 0.993925, 132.519)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0638554, 0.99271, 132.519),
-            200:  BranchingRatio(0.0284366, 0.993861, 132.519),
-            1000:  BranchingRatio(0.0125045, 0.993926, 132.519)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0663148, 0.992529, 132.519),
-            200:  BranchingRatio(0.0291687, 0.99386, 132.519),
-            1000:  BranchingRatio(0.0127147, 0.993927, 132.519)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.068833, 0.992306, 132.519),
-            200:  BranchingRatio(0.0299053, 0.993858, 132.519),
-            1000:  BranchingRatio(0.0129236, 0.993927, 132.519)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0714106, 0.992023, 132.519),
-            200:  BranchingRatio(0.0306463, 0.993856, 132.519),
-            1000:  BranchingRatio(0.0131312, 0.993928, 132.519)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.074048, 0.991647, 132.519),
-            200:  BranchingRatio(0.0313914, 0.993853, 132.519),
-            1000:  BranchingRatio(0.0133373, 0.993928, 132.519)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0767459, 0.991104, 132.519),
-            200:  BranchingRatio(0.0321407, 0.993851, 132.519),
-            1000:  BranchingRatio(0.0135421, 0.993929, 132.519)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0795048, 0.990326, 132.519),
-            200:  BranchingRatio(0.0328938, 0.993849, 132.519),
-            1000:  BranchingRatio(0.0137454, 0.993929, 132.519)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0823251, 0.990082, 132.519),
-            200:  BranchingRatio(0.0336508, 0.993846, 132.519),
-            1000:  BranchingRatio(0.0139474, 0.99393, 132.519)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0852075, 0.983541, 132.519),
-            200:  BranchingRatio(0.0344115, 0.993844, 132.519),
-            1000:  BranchingRatio(0.014148, 0.99393, 132.519)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0881524, 0.973495, 132.519),
-            200:  BranchingRatio(0.0351756, 0.993841, 132.519),
-            1000:  BranchingRatio(0.0143471, 0.993931, 132.519)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0911602, 0.961837, 132.519),
-            200:  BranchingRatio(0.0359432, 0.993838, 132.519),
-            1000:  BranchingRatio(0.0145448, 0.993931, 132.519)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0942314, 0.949108, 132.519),
-            200:  BranchingRatio(0.0367141, 0.993835, 132.519),
-            1000:  BranchingRatio(0.0147412, 0.993931, 132.519)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0973665, 0.935697, 132.519),
-            200:  BranchingRatio(0.0374881, 0.993832, 132.519),
-            1000:  BranchingRatio(0.0149361, 0.993932, 132.519)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.100566, 0.921923, 132.519),
-            200:  BranchingRatio(0.0382651, 0.993829, 132.519),
-            1000:  BranchingRatio(0.0151296, 0.993932, 132.519)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.10383, 0.908057, 132.519),
-            200:  BranchingRatio(0.0390451, 0.993826, 132.519),
-            1000:  BranchingRatio(0.0153217, 0.993932, 132.519)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.107159, 0.894344, 132.519),
-            200:  BranchingRatio(0.0398279, 0.993823, 132.519),
-            1000:  BranchingRatio(0.0155124, 0.993933, 132.519)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.110554, 0.881227, 132.519),
-            200:  BranchingRatio(0.0406134, 0.993819, 132.519),
-            1000:  BranchingRatio(0.0157017, 0.993933, 132.519)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.114014, 0.869405, 132.519),
-            200:  BranchingRatio(0.0414014, 0.993815, 132.519),
-            1000:  BranchingRatio(0.0158896, 0.993933, 132.519)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.117541, 0.85612, 132.519),
-            200:  BranchingRatio(0.042192, 0.993812, 132.519),
-            1000:  BranchingRatio(0.0160761, 0.993934, 132.519)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.121134, 0.932444, 132.519),
-            200:  BranchingRatio(0.0429849, 0.993808, 132.519),
-            1000:  BranchingRatio(0.0162612, 0.993934, 132.519)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.04378, 0.993804, 132.519),
-            1000:  BranchingRatio(0.0164449, 0.993934, 132.519)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0445774, 0.9938, 132.519),
-            1000:  BranchingRatio(0.0166272, 0.993934, 132.519)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0453767, 0.993795, 132.519),
-            1000:  BranchingRatio(0.0168081, 0.993935, 132.519)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0461781, 0.993791, 132.519),
-            1000:  BranchingRatio(0.0169877, 0.993935, 132.519)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0469813, 0.993786, 132.519),
-            1000:  BranchingRatio(0.0171659, 0.993935, 132.519)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0477863, 0.993781, 132.519),
-            1000:  BranchingRatio(0.0173428, 0.993935, 132.519)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0485929, 0.993776, 132.519),
-            1000:  BranchingRatio(0.0175182, 0.993936, 132.519)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0494012, 0.993771, 132.519),
-            1000:  BranchingRatio(0.0176924, 0.993936, 132.519)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0502109, 0.993766, 132.519),
-            1000:  BranchingRatio(0.0178652, 0.993936, 132.519)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0510221, 0.993761, 132.519),
-            1000:  BranchingRatio(0.0180367, 0.993936, 132.519)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0518346, 0.993755, 132.519),
-            1000:  BranchingRatio(0.0182069, 0.993936, 132.519)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0526484, 0.993749, 132.519),
-            1000:  BranchingRatio(0.0183757, 0.993937, 132.519)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0534633, 0.993743, 132.519),
-            1000:  BranchingRatio(0.0185433, 0.993937, 132.519)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0542793, 0.993736, 132.519),
-            1000:  BranchingRatio(0.0187095, 0.993937, 132.519)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0550964, 0.99373, 132.519),
-            1000:  BranchingRatio(0.0188745, 0.993937, 132.519)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0559144, 0.993723, 132.519),
-            1000:  BranchingRatio(0.0190382, 0.993937, 132.519)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0567332, 0.993716, 132.519),
-            1000:  BranchingRatio(0.0192006, 0.993937, 132.519)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0575529, 0.993709, 132.519),
-            1000:  BranchingRatio(0.0193617, 0.993937, 132.519)
-        }
-    },
-    160: {
-        1.1: {
-            -1000:  BranchingRatio(0.0184926, 0.122753, 138.334),
-            -200:  BranchingRatio(0.018489, 0.134926, 138.334),
-            200:  BranchingRatio(0.0184862, 0.132868, 138.334),
-            1000:  BranchingRatio(0.0184825, 0.127065, 138.334)
-        },
-        1.2: {
-            -1000:  BranchingRatio(0.0156266, 0.157412, 138.334),
-            -200:  BranchingRatio(0.0156227, 0.174925, 138.334),
-            200:  BranchingRatio(0.0156198, 0.17161, 138.334),
-            1000:  BranchingRatio(0.0156159, 0.163808, 138.334)
-        },
-        1.3: {
-            -1000:  BranchingRatio(0.0133851, 0.195682, 138.334),
-            -200:  BranchingRatio(0.0133809, 0.21928, 138.334),
-            200:  BranchingRatio(0.0133778, 0.214649, 138.334),
-            1000:  BranchingRatio(0.0133736, 0.204907, 138.334)
-        },
-        1.4: {
-            -1000:  BranchingRatio(0.0115997, 0.239463, 138.334),
-            -200:  BranchingRatio(0.0115952, 0.267406, 138.334),
-            200:  BranchingRatio(0.011592, 0.261635, 138.334),
-            1000:  BranchingRatio(0.0115875, 0.250235, 138.334)
-        },
-        1.5: {
-            -1000:  BranchingRatio(0.0101551, 0.287376, 138.334),
-            -200:  BranchingRatio(0.0101503, 0.318428, 138.334),
-            200:  BranchingRatio(0.0101469, 0.31181, 138.334),
-            1000:  BranchingRatio(0.0101422, 0.299141, 138.334)
-        },
-        1.6: {
-            -1000:  BranchingRatio(0.00897017, 0.3381, 138.334),
-            -200:  BranchingRatio(0.00896508, 0.371193, 138.334),
-            200:  BranchingRatio(0.00896145, 0.364042, 138.334),
-            1000:  BranchingRatio(0.00895645, 0.350516, 138.334)
-        },
-        1.7: {
-            -1000:  BranchingRatio(0.00798648, 0.390199, 138.334),
-            -200:  BranchingRatio(0.00798106, 0.424413, 138.334),
-            200:  BranchingRatio(0.00797722, 0.417016, 138.334),
-            1000:  BranchingRatio(0.00797192, 0.403031, 138.334)
-        },
-        1.8: {
-            -1000:  BranchingRatio(0.00716115, 0.442303, 138.334),
-            -200:  BranchingRatio(0.00715536, 0.476838, 138.334),
-            200:  BranchingRatio(0.00715132, 0.469436, 138.334),
-            1000:  BranchingRatio(0.0071457, 0.455352, 138.334)
-        },
-        1.9: {
-            -1000:  BranchingRatio(0.00646211, 0.493207, 138.334),
-            -200:  BranchingRatio(0.00645594, 0.527376, 138.334),
-            200:  BranchingRatio(0.00645167, 0.520161, 138.334),
-            1000:  BranchingRatio(0.00644573, 0.506289, 138.334)
-        },
-        2: {
-            -1000:  BranchingRatio(0.00586501, 0.541933, 138.334),
-            -200:  BranchingRatio(0.00585844, 0.575171, 138.334),
-            200:  BranchingRatio(0.00585394, 0.568284, 138.334),
-            1000:  BranchingRatio(0.00584766, 0.554867, 138.334)
-        },
-        2.1: {
-            -1000:  BranchingRatio(0.0053511, 0.587763, 138.334),
-            -200:  BranchingRatio(0.00534412, 0.619633, 138.334),
-            200:  BranchingRatio(0.00533938, 0.613172, 138.334),
-            1000:  BranchingRatio(0.00533273, 0.600397, 138.334)
-        },
-        2.2: {
-            -1000:  BranchingRatio(0.00490575, 0.630234, 138.334),
-            -200:  BranchingRatio(0.00489834, 0.660426, 138.334),
-            200:  BranchingRatio(0.00489334, 0.654447, 138.334),
-            1000:  BranchingRatio(0.00488633, 0.642439, 138.334)
-        },
-        2.3: {
-            -1000:  BranchingRatio(0.00451741, 0.669105, 138.334),
-            -200:  BranchingRatio(0.00450956, 0.697426, 138.334),
-            200:  BranchingRatio(0.00450429, 0.691954, 138.334),
-            1000:  BranchingRatio(0.00449689, 0.680784, 138.334)
-        },
-        2.4: {
-            -1000:  BranchingRatio(0.00417688, 0.704329, 138.334),
-            -200:  BranchingRatio(0.00416855, 0.730678, 138.334),
-            200:  BranchingRatio(0.00416299, 0.725713, 138.334),
-            1000:  BranchingRatio(0.0041552, 0.715409, 138.334)
-        },
-        2.5: {
-            -1000:  BranchingRatio(0.00387671, 0.735987, 138.334),
-            -200:  BranchingRatio(0.00386789, 0.760345, 138.334),
-            200:  BranchingRatio(0.00386204, 0.75587, 138.334),
-            1000:  BranchingRatio(0.00385383, 0.746426, 138.334)
-        },
-        2.6: {
-            -1000:  BranchingRatio(0.00361088, 0.76426, 138.334),
-            -200:  BranchingRatio(0.00360155, 0.786668, 138.334),
-            200:  BranchingRatio(0.0035954, 0.782654, 138.334),
-            1000:  BranchingRatio(0.00358676, 0.774041, 138.334)
-        },
-        2.7: {
-            -1000:  BranchingRatio(0.00337446, 0.789392, 138.334),
-            -200:  BranchingRatio(0.00336459, 0.809928, 138.334),
-            200:  BranchingRatio(0.00335812, 0.806341, 138.334),
-            1000:  BranchingRatio(0.00334903, 0.798514, 138.334)
-        },
-        2.8: {
-            -1000:  BranchingRatio(0.00316335, 0.811655, 138.334),
-            -200:  BranchingRatio(0.00315292, 0.830424, 138.334),
-            200:  BranchingRatio(0.00314611, 0.827225, 138.334),
-            1000:  BranchingRatio(0.00313656, 0.820131, 138.334)
-        },
-        2.9: {
-            -1000:  BranchingRatio(0.00297415, 0.831331, 138.334),
-            -200:  BranchingRatio(0.00296314, 0.848452, 138.334),
-            200:  BranchingRatio(0.00295599, 0.845604, 138.334),
-            1000:  BranchingRatio(0.00294596, 0.839184, 138.334)
-        },
-        3: {
-            -1000:  BranchingRatio(0.00280404, 0.848708, 138.334),
-            -200:  BranchingRatio(0.00279242, 0.864293, 138.334),
-            200:  BranchingRatio(0.00278491, 0.861758, 138.334),
-            1000:  BranchingRatio(0.00277438, 0.855953, 138.334)
-        },
-        3.1: {
-            -1000:  BranchingRatio(0.00265062, 0.864004, 138.334),
-            -200:  BranchingRatio(0.00263836, 0.878208, 138.334),
-            200:  BranchingRatio(0.00263048, 0.875953, 138.334),
-            1000:  BranchingRatio(0.00261943, 0.870706, 138.334)
-        },
-        3.2: {
-            -1000:  BranchingRatio(0.00251185, 0.877484, 138.334),
-            -200:  BranchingRatio(0.00249894, 0.890436, 138.334),
-            200:  BranchingRatio(0.00249066, 0.888429, 138.334),
-            1000:  BranchingRatio(0.00247908, 0.883684, 138.334)
-        },
-        3.3: {
-            -1000:  BranchingRatio(0.00238603, 0.889372, 138.334),
-            -200:  BranchingRatio(0.00237242, 0.901188, 138.334),
-            200:  BranchingRatio(0.00236374, 0.8994, 138.334),
-            1000:  BranchingRatio(0.00235161, 0.895107, 138.334)
-        },
-        3.4: {
-            -1000:  BranchingRatio(0.00227166, 0.899865, 138.334),
-            -200:  BranchingRatio(0.00225734, 0.910653, 138.334),
-            200:  BranchingRatio(0.00224823, 0.909058, 138.334),
-            1000:  BranchingRatio(0.00223553, 0.90517, 138.334)
-        },
-        3.5: {
-            -1000:  BranchingRatio(0.00216748, 0.909137, 138.334),
-            -200:  BranchingRatio(0.00215242, 0.918995, 138.334),
-            200:  BranchingRatio(0.00214288, 0.91757, 138.334),
-            1000:  BranchingRatio(0.00212958, 0.914046, 138.334)
-        },
-        3.6: {
-            -1000:  BranchingRatio(0.00207241, 0.917341, 138.334),
-            -200:  BranchingRatio(0.00205656, 0.92636, 138.334),
-            200:  BranchingRatio(0.00204657, 0.925085, 138.334),
-            1000:  BranchingRatio(0.00203266, 0.921886, 138.334)
-        },
-        3.7: {
-            -1000:  BranchingRatio(0.00198548, 0.92461, 138.334),
-            -200:  BranchingRatio(0.00196882, 0.932873, 138.334),
-            200:  BranchingRatio(0.00195835, 0.93173, 138.334),
-            1000:  BranchingRatio(0.00194381, 0.928821, 138.334)
-        },
-        3.8: {
-            -1000:  BranchingRatio(0.00190586, 0.931062, 138.334),
-            -200:  BranchingRatio(0.00188837, 0.938643, 138.334),
-            200:  BranchingRatio(0.00187741, 0.937617, 138.334),
-            1000:  BranchingRatio(0.00186222, 0.934968, 138.334)
-        },
-        3.9: {
-            -1000:  BranchingRatio(0.00183285, 0.936799, 138.334),
-            -200:  BranchingRatio(0.00181448, 0.943764, 138.334),
-            200:  BranchingRatio(0.00180302, 0.942841, 138.334),
-            1000:  BranchingRatio(0.00178715, 0.940425, 138.334)
-        },
-        4: {
-            -1000:  BranchingRatio(0.0017658, 0.941909, 138.334),
-            -200:  BranchingRatio(0.00174652, 0.948318, 138.334),
-            200:  BranchingRatio(0.00173453, 0.947486, 138.334),
-            1000:  BranchingRatio(0.00171797, 0.945279, 138.334)
-        },
-        4.1: {
-            -1000:  BranchingRatio(0.00170416, 0.94647, 138.334),
-            -200:  BranchingRatio(0.00168394, 0.952376, 138.334),
-            200:  BranchingRatio(0.0016714, 0.951625, 138.334),
-            1000:  BranchingRatio(0.00165412, 0.949605, 138.334)
-        },
-        4.2: {
-            -1000:  BranchingRatio(0.00164744, 0.950548, 138.334),
-            -200:  BranchingRatio(0.00162623, 0.956, 138.334),
-            200:  BranchingRatio(0.00161313, 0.95532, 138.334),
-            1000:  BranchingRatio(0.0015951, 0.953469, 138.334)
-        },
-        4.3: {
-            -1000:  BranchingRatio(0.00159519, 0.954202, 138.334),
-            -200:  BranchingRatio(0.00157297, 0.959241, 138.334),
-            200:  BranchingRatio(0.00155929, 0.958626, 138.334),
-            1000:  BranchingRatio(0.00154049, 0.956925, 138.334)
-        },
-        4.4: {
-            -1000:  BranchingRatio(0.00154704, 0.957485, 138.334),
-            -200:  BranchingRatio(0.00152376, 0.962147, 138.334),
-            200:  BranchingRatio(0.00150948, 0.961588, 138.334),
-            1000:  BranchingRatio(0.00148989, 0.960024, 138.334)
-        },
-        4.5: {
-            -1000:  BranchingRatio(0.00150265, 0.960432, 138.334),
-            -200:  BranchingRatio(0.00147827, 0.964757, 138.334),
-            200:  BranchingRatio(0.00146336, 0.964249, 138.334),
-            1000:  BranchingRatio(0.00144296, 0.962807, 138.334)
-        },
-        4.6: {
-            -1000:  BranchingRatio(0.0014617, 0.963087, 138.334),
-            -200:  BranchingRatio(0.00143618, 0.967106, 138.334),
-            200:  BranchingRatio(0.00142063, 0.966642, 138.334),
-            1000:  BranchingRatio(0.00139939, 0.965312, 138.334)
-        },
-        4.7: {
-            -1000:  BranchingRatio(0.00142391, 0.965484, 138.334),
-            -200:  BranchingRatio(0.00139722, 0.969224, 138.334),
-            200:  BranchingRatio(0.001381, 0.9688, 138.334),
-            1000:  BranchingRatio(0.00135889, 0.96757, 138.334)
-        },
-        4.8: {
-            -1000:  BranchingRatio(0.00138906, 0.967651, 138.334),
-            -200:  BranchingRatio(0.00136114, 0.971137, 138.334),
-            200:  BranchingRatio(0.00134423, 0.97075, 138.334),
-            1000:  BranchingRatio(0.00132124, 0.96961, 138.334)
-        },
-        4.9: {
-            -1000:  BranchingRatio(0.00135691, 0.969615, 138.334),
-            -200:  BranchingRatio(0.00132772, 0.972868, 138.334),
-            200:  BranchingRatio(0.0013101, 0.972513, 138.334),
-            1000:  BranchingRatio(0.00128619, 0.971456, 138.334)
-        },
-        5: {
-            -1000:  BranchingRatio(0.00132726, 0.971397, 138.334),
-            -200:  BranchingRatio(0.00129676, 0.974438, 138.334),
-            200:  BranchingRatio(0.00127841, 0.974112, 138.334),
-            1000:  BranchingRatio(0.00125356, 0.973129, 138.334)
-        },
-        5.1: {
-            -1000:  BranchingRatio(0.00129994, 0.973017, 138.334),
-            -200:  BranchingRatio(0.00126808, 0.975863, 138.334),
-            200:  BranchingRatio(0.00124897, 0.975564, 138.334),
-            1000:  BranchingRatio(0.00122315, 0.974649, 138.334)
-        },
-        5.2: {
-            -1000:  BranchingRatio(0.00127478, 0.974492, 138.334),
-            -200:  BranchingRatio(0.00124151, 0.97716, 138.334),
-            200:  BranchingRatio(0.00122163, 0.976884, 138.334),
-            1000:  BranchingRatio(0.00119481, 0.976032, 138.334)
-        },
-        5.3: {
-            -1000:  BranchingRatio(0.00125164, 0.975837, 138.334),
-            -200:  BranchingRatio(0.00121691, 0.978341, 138.334),
-            200:  BranchingRatio(0.00119622, 0.978087, 138.334),
-            1000:  BranchingRatio(0.00116838, 0.977291, 138.334)
-        },
-        5.4: {
-            -1000:  BranchingRatio(0.00123038, 0.977067, 138.334),
-            -200:  BranchingRatio(0.00119415, 0.97942, 138.334),
-            200:  BranchingRatio(0.00117263, 0.979185, 138.334),
-            1000:  BranchingRatio(0.00114374, 0.978441, 138.334)
-        },
-        5.5: {
-            -1000:  BranchingRatio(0.00121088, 0.978191, 138.334),
-            -200:  BranchingRatio(0.00117309, 0.980405, 138.334),
-            200:  BranchingRatio(0.00115072, 0.980188, 138.334),
-            1000:  BranchingRatio(0.00112075, 0.979492, 138.334)
-        },
-        5.6: {
-            -1000:  BranchingRatio(0.00119303, 0.979222, 138.334),
-            -200:  BranchingRatio(0.00115364, 0.981308, 138.334),
-            200:  BranchingRatio(0.00113038, 0.981107, 138.334),
-            1000:  BranchingRatio(0.0010993, 0.980454, 138.334)
-        },
-        5.7: {
-            -1000:  BranchingRatio(0.00117673, 0.980168, 138.334),
-            -200:  BranchingRatio(0.00113568, 0.982136, 138.334),
-            200:  BranchingRatio(0.00111152, 0.981949, 138.334),
-            1000:  BranchingRatio(0.0010793, 0.981336, 138.334)
-        },
-        5.8: {
-            -1000:  BranchingRatio(0.00116189, 0.981037, 138.334),
-            -200:  BranchingRatio(0.00111912, 0.982896, 138.334),
-            200:  BranchingRatio(0.00109403, 0.982722, 138.334),
-            1000:  BranchingRatio(0.00106065, 0.982146, 138.334)
-        },
-        5.9: {
-            -1000:  BranchingRatio(0.00114843, 0.981838, 138.334),
-            -200:  BranchingRatio(0.00110388, 0.983594, 138.334),
-            200:  BranchingRatio(0.00107783, 0.983433, 138.334),
-            1000:  BranchingRatio(0.00104325, 0.982891, 138.334)
-        },
-        6: {
-            -1000:  BranchingRatio(0.00113626, 0.982575, 138.334),
-            -200:  BranchingRatio(0.00108988, 0.984238, 138.334),
-            200:  BranchingRatio(0.00106284, 0.984088, 138.334),
-            1000:  BranchingRatio(0.00102704, 0.983577, 138.334)
-        },
-        6.1: {
-            -1000:  BranchingRatio(0.00112532, 0.983256, 138.334),
-            -200:  BranchingRatio(0.00107705, 0.984831, 138.334),
-            200:  BranchingRatio(0.001049, 0.984692, 138.334),
-            1000:  BranchingRatio(0.00101193, 0.984209, 138.334)
-        },
-        6.2: {
-            -1000:  BranchingRatio(0.00111554, 0.983884, 138.334),
-            -200:  BranchingRatio(0.00106532, 0.985379, 138.334),
-            200:  BranchingRatio(0.00103622, 0.985249, 138.334),
-            1000:  BranchingRatio(0.000997872, 0.984793, 138.334)
-        },
-        6.3: {
-            -1000:  BranchingRatio(0.00110686, 0.984466, 138.334),
-            -200:  BranchingRatio(0.00105463, 0.985885, 138.334),
-            200:  BranchingRatio(0.00102447, 0.985764, 138.334),
-            1000:  BranchingRatio(0.000984792, 0.985333, 138.334)
-        },
-        6.4: {
-            -1000:  BranchingRatio(0.00109922, 0.985005, 138.334),
-            -200:  BranchingRatio(0.00104492, 0.986354, 138.334),
-            200:  BranchingRatio(0.00101366, 0.98624, 138.334),
-            1000:  BranchingRatio(0.000972634, 0.985832, 138.334)
-        },
-        6.5: {
-            -1000:  BranchingRatio(0.00109259, 0.985505, 138.334),
-            -200:  BranchingRatio(0.00103615, 0.986788, 138.334),
-            200:  BranchingRatio(0.00100376, 0.986682, 138.334),
-            1000:  BranchingRatio(0.000961348, 0.986295, 138.334)
-        },
-        6.6: {
-            -1000:  BranchingRatio(0.0010869, 0.985969, 138.334),
-            -200:  BranchingRatio(0.00102827, 0.987191, 138.334),
-            200:  BranchingRatio(0.000994709, 0.987092, 138.334),
-            1000:  BranchingRatio(0.000950884, 0.986724, 138.334)
-        },
-        6.7: {
-            -1000:  BranchingRatio(0.00108212, 0.986401, 138.334),
-            -200:  BranchingRatio(0.00102122, 0.987565, 138.334),
-            200:  BranchingRatio(0.000986471, 0.987472, 138.334),
-            1000:  BranchingRatio(0.000941197, 0.987123, 138.334)
-        },
-        6.8: {
-            -1000:  BranchingRatio(0.00107821, 0.986802, 138.334),
-            -200:  BranchingRatio(0.00101497, 0.987913, 138.334),
-            200:  BranchingRatio(0.000979001, 0.987826, 138.334),
-            1000:  BranchingRatio(0.000932244, 0.987494, 138.334)
-        },
-        6.9: {
-            -1000:  BranchingRatio(0.00107513, 0.987177, 138.334),
-            -200:  BranchingRatio(0.00100948, 0.988237, 138.334),
-            200:  BranchingRatio(0.00097226, 0.988155, 138.334),
-            1000:  BranchingRatio(0.000923988, 0.987839, 138.334)
-        },
-        7: {
-            -1000:  BranchingRatio(0.00107284, 0.987525, 138.334),
-            -200:  BranchingRatio(0.00100472, 0.988539, 138.334),
-            200:  BranchingRatio(0.000966213, 0.988462, 138.334),
-            1000:  BranchingRatio(0.000916391, 0.988161, 138.334)
-        },
-        7.1: {
-            -1000:  BranchingRatio(0.00107132, 0.987851, 138.334),
-            -200:  BranchingRatio(0.00100065, 0.988821, 138.334),
-            200:  BranchingRatio(0.000960826, 0.988748, 138.334),
-            1000:  BranchingRatio(0.00090942, 0.988461, 138.334)
-        },
-        7.2: {
-            -1000:  BranchingRatio(0.00107053, 0.988155, 138.334),
-            -200:  BranchingRatio(0.000997247, 0.989084, 138.334),
-            200:  BranchingRatio(0.000956067, 0.989015, 138.334),
-            1000:  BranchingRatio(0.000903044, 0.988741, 138.334)
-        },
-        7.3: {
-            -1000:  BranchingRatio(0.00107045, 0.98844, 138.334),
-            -200:  BranchingRatio(0.000994474, 0.989329, 138.334),
-            200:  BranchingRatio(0.000951909, 0.989265, 138.334),
-            1000:  BranchingRatio(0.000897233, 0.989003, 138.334)
-        },
-        7.4: {
-            -1000:  BranchingRatio(0.00107106, 0.988707, 138.334),
-            -200:  BranchingRatio(0.000992307, 0.989559, 138.334),
-            200:  BranchingRatio(0.000948324, 0.989498, 138.334),
-            1000:  BranchingRatio(0.000891959, 0.989248, 138.334)
-        },
-        7.5: {
-            -1000:  BranchingRatio(0.00107232, 0.988957, 138.334),
-            -200:  BranchingRatio(0.000990722, 0.989774, 138.334),
-            200:  BranchingRatio(0.000945286, 0.989717, 138.334),
-            1000:  BranchingRatio(0.000887198, 0.989477, 138.334)
-        },
-        7.6: {
-            -1000:  BranchingRatio(0.00107422, 0.989191, 138.334),
-            -200:  BranchingRatio(0.000989695, 0.989976, 138.334),
-            200:  BranchingRatio(0.000942772, 0.989922, 138.334),
-            1000:  BranchingRatio(0.000882924, 0.989692, 138.334)
-        },
-        7.7: {
-            -1000:  BranchingRatio(0.00107674, 0.989411, 138.334),
-            -200:  BranchingRatio(0.000989206, 0.990165, 138.334),
-            200:  BranchingRatio(0.000940759, 0.990114, 138.334),
-            1000:  BranchingRatio(0.000879116, 0.989894, 138.334)
-        },
-        7.8: {
-            -1000:  BranchingRatio(0.00107986, 0.989617, 138.334),
-            -200:  BranchingRatio(0.000989233, 0.990343, 138.334),
-            200:  BranchingRatio(0.000939228, 0.990295, 138.334),
-            1000:  BranchingRatio(0.000875753, 0.990084, 138.334)
-        },
-        7.9: {
-            -1000:  BranchingRatio(0.00108356, 0.989812, 138.334),
-            -200:  BranchingRatio(0.000989758, 0.99051, 138.334),
-            200:  BranchingRatio(0.000938158, 0.990464, 138.334),
-            1000:  BranchingRatio(0.000872815, 0.990261, 138.334)
-        },
-        8: {
-            -1000:  BranchingRatio(0.00108782, 0.989995, 138.334),
-            -200:  BranchingRatio(0.000990762, 0.990667, 138.334),
-            200:  BranchingRatio(0.000937531, 0.990624, 138.334),
-            1000:  BranchingRatio(0.000870282, 0.990429, 138.334)
-        },
-        8.1: {
-            -1000:  BranchingRatio(0.00109264, 0.990167, 138.334),
-            -200:  BranchingRatio(0.00099223, 0.990814, 138.334),
-            200:  BranchingRatio(0.00093733, 0.990774, 138.334),
-            1000:  BranchingRatio(0.000868139, 0.990586, 138.334)
-        },
-        8.2: {
-            -1000:  BranchingRatio(0.00109798, 0.990329, 138.334),
-            -200:  BranchingRatio(0.000994145, 0.990954, 138.334),
-            200:  BranchingRatio(0.000937539, 0.990915, 138.334),
-            1000:  BranchingRatio(0.000866367, 0.990735, 138.334)
-        },
-        8.3: {
-            -1000:  BranchingRatio(0.00110386, 0.990483, 138.334),
-            -200:  BranchingRatio(0.000996493, 0.991085, 138.334),
-            200:  BranchingRatio(0.000938143, 0.991048, 138.334),
-            1000:  BranchingRatio(0.000864953, 0.990875, 138.334)
-        },
-        8.4: {
-            -1000:  BranchingRatio(0.00111024, 0.990627, 138.334),
-            -200:  BranchingRatio(0.00099926, 0.991208, 138.334),
-            200:  BranchingRatio(0.000939127, 0.991174, 138.334),
-            1000:  BranchingRatio(0.000863881, 0.991007, 138.334)
-        },
-        8.5: {
-            -1000:  BranchingRatio(0.00111712, 0.990764, 138.334),
-            -200:  BranchingRatio(0.00100243, 0.991325, 138.334),
-            200:  BranchingRatio(0.000940478, 0.991293, 138.334),
-            1000:  BranchingRatio(0.000863137, 0.991131, 138.334)
-        },
-        8.6: {
-            -1000:  BranchingRatio(0.00112449, 0.990893, 138.334),
-            -200:  BranchingRatio(0.001006, 0.991435, 138.334),
-            200:  BranchingRatio(0.000942183, 0.991405, 138.334),
-            1000:  BranchingRatio(0.000862709, 0.991249, 138.334)
-        },
-        8.7: {
-            -1000:  BranchingRatio(0.00113233, 0.991015, 138.334),
-            -200:  BranchingRatio(0.00100995, 0.99154, 138.334),
-            200:  BranchingRatio(0.000944231, 0.991511, 138.334),
-            1000:  BranchingRatio(0.000862584, 0.99136, 138.334)
-        },
-        8.8: {
-            -1000:  BranchingRatio(0.00114065, 0.991131, 138.334),
-            -200:  BranchingRatio(0.00101427, 0.991638, 138.334),
-            200:  BranchingRatio(0.000946609, 0.991611, 138.334),
-            1000:  BranchingRatio(0.000862751, 0.991466, 138.334)
-        },
-        8.9: {
-            -1000:  BranchingRatio(0.00114943, 0.99124, 138.334),
-            -200:  BranchingRatio(0.00101895, 0.991732, 138.334),
-            200:  BranchingRatio(0.000949308, 0.991706, 138.334),
-            1000:  BranchingRatio(0.000863198, 0.991565, 138.334)
-        },
-        9: {
-            -1000:  BranchingRatio(0.00115866, 0.991344, 138.334),
-            -200:  BranchingRatio(0.00102398, 0.99182, 138.334),
-            200:  BranchingRatio(0.000952317, 0.991795, 138.334),
-            1000:  BranchingRatio(0.000863915, 0.99166, 138.334)
-        },
-        9.1: {
-            -1000:  BranchingRatio(0.00116833, 0.991443, 138.334),
-            -200:  BranchingRatio(0.00102936, 0.991904, 138.334),
-            200:  BranchingRatio(0.000955626, 0.991881, 138.334),
-            1000:  BranchingRatio(0.000864893, 0.991749, 138.334)
-        },
-        9.2: {
-            -1000:  BranchingRatio(0.00117844, 0.991536, 138.334),
-            -200:  BranchingRatio(0.00103506, 0.991983, 138.334),
-            200:  BranchingRatio(0.000959227, 0.991961, 138.334),
-            1000:  BranchingRatio(0.000866122, 0.991834, 138.334)
-        },
-        9.3: {
-            -1000:  BranchingRatio(0.00118899, 0.991625, 138.334),
-            -200:  BranchingRatio(0.0010411, 0.992059, 138.334),
-            200:  BranchingRatio(0.00096311, 0.992038, 138.334),
-            1000:  BranchingRatio(0.000867593, 0.991915, 138.334)
-        },
-        9.4: {
-            -1000:  BranchingRatio(0.00119996, 0.99171, 138.334),
-            -200:  BranchingRatio(0.00104745, 0.992131, 138.334),
-            200:  BranchingRatio(0.000967269, 0.992111, 138.334),
-            1000:  BranchingRatio(0.000869298, 0.991991, 138.334)
-        },
-        9.5: {
-            -1000:  BranchingRatio(0.00121135, 0.99179, 138.334),
-            -200:  BranchingRatio(0.00105411, 0.992199, 138.334),
-            200:  BranchingRatio(0.000971694, 0.99218, 138.334),
-            1000:  BranchingRatio(0.000871229, 0.992064, 138.334)
-        },
-        9.6: {
-            -1000:  BranchingRatio(0.00122316, 0.991866, 138.334),
-            -200:  BranchingRatio(0.00106108, 0.992263, 138.334),
-            200:  BranchingRatio(0.000976378, 0.992246, 138.334),
-            1000:  BranchingRatio(0.000873378, 0.992133, 138.334)
-        },
-        9.7: {
-            -1000:  BranchingRatio(0.00123537, 0.991939, 138.334),
-            -200:  BranchingRatio(0.00106834, 0.992325, 138.334),
-            200:  BranchingRatio(0.000981316, 0.992308, 138.334),
-            1000:  BranchingRatio(0.000875737, 0.992199, 138.334)
-        },
-        9.8: {
-            -1000:  BranchingRatio(0.001248, 0.992008, 138.334),
-            -200:  BranchingRatio(0.00107589, 0.992383, 138.334),
-            200:  BranchingRatio(0.000986499, 0.992368, 138.334),
-            1000:  BranchingRatio(0.000878301, 0.992262, 138.334)
-        },
-        9.9: {
-            -1000:  BranchingRatio(0.00126103, 0.992074, 138.334),
-            -200:  BranchingRatio(0.00108373, 0.992439, 138.334),
-            200:  BranchingRatio(0.000991922, 0.992424, 138.334),
-            1000:  BranchingRatio(0.000881063, 0.992322, 138.334)
-        },
-        10: {
-            -1000:  BranchingRatio(0.00127445, 0.992137, 138.334),
-            -200:  BranchingRatio(0.00109185, 0.992492, 138.334),
-            200:  BranchingRatio(0.000997579, 0.992478, 138.334),
-            1000:  BranchingRatio(0.000884016, 0.992379, 138.334)
-        },
-        11: {
-            -1000:  BranchingRatio(0.00143001, 0.992629, 138.334),
-            -200:  BranchingRatio(0.00118738, 0.992907, 138.334),
-            200:  BranchingRatio(0.00106586, 0.9929, 138.334),
-            1000:  BranchingRatio(0.000922877, 0.992824, 138.334)
-        },
-        12: {
-            -1000:  BranchingRatio(0.00162323, 0.99295, 138.334),
-            -200:  BranchingRatio(0.00130648, 0.993176, 138.334),
-            200:  BranchingRatio(0.0011526, 0.993173, 138.334),
-            1000:  BranchingRatio(0.000975717, 0.993113, 138.334)
-        },
-        13: {
-            -1000:  BranchingRatio(0.00185383, 0.993166, 138.334),
-            -200:  BranchingRatio(0.00144668, 0.993357, 138.334),
-            200:  BranchingRatio(0.00125485, 0.993358, 138.334),
-            1000:  BranchingRatio(0.00103939, 0.993309, 138.334)
-        },
-        14: {
-            -1000:  BranchingRatio(0.00212271, 0.993317, 138.334),
-            -200:  BranchingRatio(0.00160644, 0.993483, 138.334),
-            200:  BranchingRatio(0.00137062, 0.993486, 138.334),
-            1000:  BranchingRatio(0.00111174, 0.993446, 138.334)
-        },
-        15: {
-            -1000:  BranchingRatio(0.0024316, 0.993424, 138.334),
-            -200:  BranchingRatio(0.00178483, 0.993573, 138.334),
-            200:  BranchingRatio(0.00149849, 0.993578, 138.334),
-            1000:  BranchingRatio(0.0011912, 0.993545, 138.334)
-        },
-        16: {
-            -1000:  BranchingRatio(0.00278291, 0.993501, 138.334),
-            -200:  BranchingRatio(0.00198128, 0.993639, 138.334),
-            200:  BranchingRatio(0.00163743, 0.993646, 138.334),
-            1000:  BranchingRatio(0.0012766, 0.993619, 138.334)
-        },
-        17: {
-            -1000:  BranchingRatio(0.00317961, 0.993558, 138.334),
-            -200:  BranchingRatio(0.00219549, 0.993689, 138.334),
-            200:  BranchingRatio(0.00178666, 0.993697, 138.334),
-            1000:  BranchingRatio(0.00136706, 0.993674, 138.334)
-        },
-        18: {
-            -1000:  BranchingRatio(0.00362517, 0.993599, 138.334),
-            -200:  BranchingRatio(0.00242732, 0.993727, 138.334),
-            200:  BranchingRatio(0.00194555, 0.993737, 138.334),
-            1000:  BranchingRatio(0.00146185, 0.993718, 138.334)
-        },
-        19: {
-            -1000:  BranchingRatio(0.0041236, 0.993627, 138.334),
-            -200:  BranchingRatio(0.00267673, 0.993756, 138.334),
-            200:  BranchingRatio(0.0021136, 0.993767, 138.334),
-            1000:  BranchingRatio(0.00156039, 0.993751, 138.334)
-        },
-        20: {
-            -1000:  BranchingRatio(0.00467942, 0.993647, 138.334),
-            -200:  BranchingRatio(0.0029438, 0.993778, 138.334),
-            200:  BranchingRatio(0.00229039, 0.993791, 138.334),
-            1000:  BranchingRatio(0.00166221, 0.993778, 138.334)
-        },
-        21: {
-            -1000:  BranchingRatio(0.00529771, 0.993658, 138.334),
-            -200:  BranchingRatio(0.00322864, 0.993796, 138.334),
-            200:  BranchingRatio(0.00247556, 0.993811, 138.334),
-            1000:  BranchingRatio(0.00176689, 0.9938, 138.334)
-        },
-        22: {
-            -1000:  BranchingRatio(0.00598414, 0.993663, 138.334),
-            -200:  BranchingRatio(0.00353143, 0.99381, 138.334),
-            200:  BranchingRatio(0.0026688, 0.993827, 138.334),
-            1000:  BranchingRatio(0.00187409, 0.993818, 138.334)
-        },
-        23: {
-            -1000:  BranchingRatio(0.00674506, 0.99366, 138.334),
-            -200:  BranchingRatio(0.00385239, 0.993822, 138.334),
-            200:  BranchingRatio(0.00286984, 0.993839, 138.334),
-            1000:  BranchingRatio(0.0019835, 0.993833, 138.334)
-        },
-        24: {
-            -1000:  BranchingRatio(0.00758751, 0.99365, 138.334),
-            -200:  BranchingRatio(0.00419175, 0.99383, 138.334),
-            200:  BranchingRatio(0.00307843, 0.99385, 138.334),
-            1000:  BranchingRatio(0.00209486, 0.993846, 138.334)
-        },
-        25: {
-            -1000:  BranchingRatio(0.00851939, 0.993632, 138.334),
-            -200:  BranchingRatio(0.00454977, 0.993837, 138.334),
-            200:  BranchingRatio(0.00329433, 0.993859, 138.334),
-            1000:  BranchingRatio(0.00220792, 0.993857, 138.334)
-        },
-        26: {
-            -1000:  BranchingRatio(0.00954946, 0.993604, 138.334),
-            -200:  BranchingRatio(0.00492675, 0.993843, 138.334),
-            200:  BranchingRatio(0.00351734, 0.993866, 138.334),
-            1000:  BranchingRatio(0.00232248, 0.993866, 138.334)
-        },
-        27: {
-            -1000:  BranchingRatio(0.0106875, 0.993565, 138.334),
-            -200:  BranchingRatio(0.00532298, 0.993847, 138.334),
-            200:  BranchingRatio(0.00374725, 0.993873, 138.334),
-            1000:  BranchingRatio(0.00243834, 0.993874, 138.334)
-        },
-        28: {
-            -1000:  BranchingRatio(0.0119446, 0.993511, 138.334),
-            -200:  BranchingRatio(0.00573878, 0.99385, 138.334),
-            200:  BranchingRatio(0.00398389, 0.993878, 138.334),
-            1000:  BranchingRatio(0.00255534, 0.99388, 138.334)
-        },
-        29: {
-            -1000:  BranchingRatio(0.0133329, 0.993435, 138.334),
-            -200:  BranchingRatio(0.00617447, 0.993852, 138.334),
-            200:  BranchingRatio(0.00422707, 0.993883, 138.334),
-            1000:  BranchingRatio(0.00267331, 0.993886, 138.334)
-        },
-        30: {
-            -1000:  BranchingRatio(0.0148663, 0.993329, 138.334),
-            -200:  BranchingRatio(0.00663039, 0.993853, 138.334),
-            200:  BranchingRatio(0.00447662, 0.993886, 138.334),
-            1000:  BranchingRatio(0.00279213, 0.993892, 138.334)
-        },
-        31: {
-            -1000:  BranchingRatio(0.0165603, 0.993178, 138.334),
-            -200:  BranchingRatio(0.00710689, 0.993853, 138.334),
-            200:  BranchingRatio(0.00473239, 0.99389, 138.334),
-            1000:  BranchingRatio(0.00291165, 0.993896, 138.334)
-        },
-        32: {
-            -1000:  BranchingRatio(0.0184324, 0.99296, 138.334),
-            -200:  BranchingRatio(0.00760433, 0.993852, 138.334),
-            200:  BranchingRatio(0.00499422, 0.993893, 138.334),
-            1000:  BranchingRatio(0.00303176, 0.993901, 138.334)
-        },
-        33: {
-            -1000:  BranchingRatio(0.0205023, 0.992631, 138.334),
-            -200:  BranchingRatio(0.00812307, 0.993851, 138.334),
-            200:  BranchingRatio(0.00526196, 0.993895, 138.334),
-            1000:  BranchingRatio(0.00315235, 0.993904, 138.334)
-        },
-        34: {
-            -1000:  BranchingRatio(0.0227924, 0.992109, 138.334),
-            -200:  BranchingRatio(0.00866352, 0.993849, 138.334),
-            200:  BranchingRatio(0.00553546, 0.993897, 138.334),
-            1000:  BranchingRatio(0.00327333, 0.993908, 138.334)
-        },
-        35: {
-            -1000:  BranchingRatio(0.0253283, 0.99122, 138.334),
-            -200:  BranchingRatio(0.00922601, 0.993846, 138.334),
-            200:  BranchingRatio(0.00581459, 0.993899, 138.334),
-            1000:  BranchingRatio(0.00339459, 0.993911, 138.334)
-        },
-        36: {
-            -1000:  BranchingRatio(0.0281389, 0.989489, 138.334),
-            -200:  BranchingRatio(0.00981095, 0.993842, 138.334),
-            200:  BranchingRatio(0.00609921, 0.9939, 138.334),
-            1000:  BranchingRatio(0.00351606, 0.993913, 138.334)
-        },
-        37: {
-            -1000:  BranchingRatio(0.0312576, 0.984689, 138.334),
-            -200:  BranchingRatio(0.0104187, 0.993838, 138.334),
-            200:  BranchingRatio(0.00638918, 0.993901, 138.334),
-            1000:  BranchingRatio(0.00363765, 0.993916, 138.334)
-        },
-        38: {
-            -1000:  BranchingRatio(0.0347224, 0.911978, 138.334),
-            -200:  BranchingRatio(0.0110498, 0.993832, 138.334),
-            200:  BranchingRatio(0.00668439, 0.993902, 138.334),
-            1000:  BranchingRatio(0.0037593, 0.993918, 138.334)
-        },
-        39: {
-            -1000:  BranchingRatio(0.0385776, 0.722055, 138.334),
-            -200:  BranchingRatio(0.0117045, 0.993826, 138.334),
-            200:  BranchingRatio(0.00698469, 0.993903, 138.334),
-            1000:  BranchingRatio(0.00388094, 0.99392, 138.334)
-        },
-        40: {
-            -1000:  BranchingRatio(0.0428744, 0.567352, 138.334),
-            -200:  BranchingRatio(0.0123833, 0.993819, 138.334),
-            200:  BranchingRatio(0.00728997, 0.993904, 138.334),
-            1000:  BranchingRatio(0.0040025, 0.993922, 138.334)
-        },
-        41: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0130866, 0.993811, 138.334),
-            200:  BranchingRatio(0.0076001, 0.993904, 138.334),
-            1000:  BranchingRatio(0.00412394, 0.993924, 138.334)
-        },
-        42: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0138149, 0.993802, 138.334),
-            200:  BranchingRatio(0.00791498, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00424519, 0.993926, 138.334)
-        },
-        43: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0145685, 0.993793, 138.334),
-            200:  BranchingRatio(0.00823448, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00436621, 0.993927, 138.334)
-        },
-        44: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0153479, 0.993782, 138.334),
-            200:  BranchingRatio(0.0085585, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00448696, 0.993929, 138.334)
-        },
-        45: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0161536, 0.99377, 138.334),
-            200:  BranchingRatio(0.00888692, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00460739, 0.99393, 138.334)
-        },
-        46: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0169861, 0.993757, 138.334),
-            200:  BranchingRatio(0.00921964, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00472747, 0.993931, 138.334)
-        },
-        47: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0178458, 0.993742, 138.334),
-            200:  BranchingRatio(0.00955655, 0.993905, 138.334),
-            1000:  BranchingRatio(0.00484715, 0.993932, 138.334)
-        },
-        48: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0187331, 0.993724, 138.334),
-            200:  BranchingRatio(0.00989755, 0.993904, 138.334),
-            1000:  BranchingRatio(0.00496642, 0.993933, 138.334)
-        },
-        49: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0196486, 0.993705, 138.334),
-            200:  BranchingRatio(0.0102425, 0.993904, 138.334),
-            1000:  BranchingRatio(0.00508523, 0.993935, 138.334)
-        },
-        50: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0205927, 0.993683, 138.334),
-            200:  BranchingRatio(0.0105914, 0.993903, 138.334),
-            1000:  BranchingRatio(0.00520356, 0.993936, 138.334)
-        },
-        51: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0215659, 0.993658, 138.334),
-            200:  BranchingRatio(0.0109441, 0.993903, 138.334),
-            1000:  BranchingRatio(0.00532138, 0.993937, 138.334)
-        },
-        52: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0225687, 0.99363, 138.334),
-            200:  BranchingRatio(0.0113005, 0.993902, 138.334),
-            1000:  BranchingRatio(0.00543868, 0.993938, 138.334)
-        },
-        53: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0236016, 0.993599, 138.334),
-            200:  BranchingRatio(0.0116604, 0.993901, 138.334),
-            1000:  BranchingRatio(0.00555543, 0.993938, 138.334)
-        },
-        54: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0246652, 0.993563, 138.334),
-            200:  BranchingRatio(0.0120239, 0.9939, 138.334),
-            1000:  BranchingRatio(0.00567161, 0.993939, 138.334)
-        },
-        55: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0257599, 0.993523, 138.334),
-            200:  BranchingRatio(0.0123908, 0.993899, 138.334),
-            1000:  BranchingRatio(0.0057872, 0.99394, 138.334)
-        },
-        56: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0268863, 0.993477, 138.334),
-            200:  BranchingRatio(0.0127611, 0.993898, 138.334),
-            1000:  BranchingRatio(0.00590218, 0.99394, 138.334)
-        },
-        57: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0280448, 0.993424, 138.334),
-            200:  BranchingRatio(0.0131346, 0.993897, 138.334),
-            1000:  BranchingRatio(0.00601655, 0.993941, 138.334)
-        },
-        58: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.029236, 0.993365, 138.334),
-            200:  BranchingRatio(0.0135112, 0.993895, 138.334),
-            1000:  BranchingRatio(0.00613029, 0.993942, 138.334)
-        },
-        59: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0304605, 0.993296, 138.334),
-            200:  BranchingRatio(0.013891, 0.993894, 138.334),
-            1000:  BranchingRatio(0.00624338, 0.993942, 138.334)
-        },
-        60: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0317188, 0.993217, 138.334),
-            200:  BranchingRatio(0.0142737, 0.993892, 138.334),
-            1000:  BranchingRatio(0.00635581, 0.993943, 138.334)
-        },
-        61: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0330114, 0.993125, 138.334),
-            200:  BranchingRatio(0.0146594, 0.99389, 138.334),
-            1000:  BranchingRatio(0.00646758, 0.993943, 138.334)
-        },
-        62: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.034339, 0.993018, 138.334),
-            200:  BranchingRatio(0.0150479, 0.993889, 138.334),
-            1000:  BranchingRatio(0.00657868, 0.993944, 138.334)
-        },
-        63: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.035702, 0.992891, 138.334),
-            200:  BranchingRatio(0.0154392, 0.993886, 138.334),
-            1000:  BranchingRatio(0.00668909, 0.993944, 138.334)
-        },
-        64: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.037101, 0.99274, 138.334),
-            200:  BranchingRatio(0.0158332, 0.993884, 138.334),
-            1000:  BranchingRatio(0.00679881, 0.993945, 138.334)
-        },
-        65: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0385366, 0.992556, 138.334),
-            200:  BranchingRatio(0.0162298, 0.993882, 138.334),
-            1000:  BranchingRatio(0.00690784, 0.993945, 138.334)
-        },
-        66: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0400094, 0.992329, 138.334),
-            200:  BranchingRatio(0.016629, 0.99388, 138.334),
-            1000:  BranchingRatio(0.00701616, 0.993946, 138.334)
-        },
-        67: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0415199, 0.992037, 138.334),
-            200:  BranchingRatio(0.0170306, 0.993878, 138.334),
-            1000:  BranchingRatio(0.00712378, 0.993946, 138.334)
-        },
-        68: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0430688, 0.991643, 138.334),
-            200:  BranchingRatio(0.0174346, 0.993876, 138.334),
-            1000:  BranchingRatio(0.00723069, 0.993946, 138.334)
-        },
-        69: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0446566, 0.99105, 138.334),
-            200:  BranchingRatio(0.017841, 0.993875, 138.334),
-            1000:  BranchingRatio(0.00733688, 0.993947, 138.334)
-        },
-        70: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0462839, 0.990467, 138.334),
-            200:  BranchingRatio(0.0182496, 0.993874, 138.334),
-            1000:  BranchingRatio(0.00744236, 0.993947, 138.334)
-        },
-        71: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0479513, 0.989636, 138.334),
-            200:  BranchingRatio(0.0186605, 0.993872, 138.334),
-            1000:  BranchingRatio(0.00754712, 0.993947, 138.334)
-        },
-        72: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0496595, 0.981797, 138.334),
-            200:  BranchingRatio(0.0190735, 0.993871, 138.334),
-            1000:  BranchingRatio(0.00765116, 0.993948, 138.334)
-        },
-        73: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.051409, 0.971886, 138.334),
-            200:  BranchingRatio(0.0194886, 0.993869, 138.334),
-            1000:  BranchingRatio(0.00775448, 0.993948, 138.334)
-        },
-        74: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0532005, 0.960593, 138.334),
-            200:  BranchingRatio(0.0199056, 0.993867, 138.334),
-            1000:  BranchingRatio(0.00785708, 0.993948, 138.334)
-        },
-        75: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0550346, 0.948365, 138.334),
-            200:  BranchingRatio(0.0203247, 0.993865, 138.334),
-            1000:  BranchingRatio(0.00795896, 0.993949, 138.334)
-        },
-        76: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0569118, 0.935536, 138.334),
-            200:  BranchingRatio(0.0207456, 0.993862, 138.334),
-            1000:  BranchingRatio(0.00806011, 0.993949, 138.334)
-        },
-        77: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0588329, 0.922376, 138.334),
-            200:  BranchingRatio(0.0211684, 0.99386, 138.334),
-            1000:  BranchingRatio(0.00816054, 0.993949, 138.334)
-        },
-        78: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0607984, 0.909119, 138.334),
-            200:  BranchingRatio(0.021593, 0.993858, 138.334),
-            1000:  BranchingRatio(0.00826026, 0.993949, 138.334)
-        },
-        79: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.062809, 0.895968, 138.334),
-            200:  BranchingRatio(0.0220193, 0.993855, 138.334),
-            1000:  BranchingRatio(0.00835925, 0.99395, 138.334)
-        },
-        80: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0648652, 0.883219, 138.334),
-            200:  BranchingRatio(0.0224472, 0.993852, 138.334),
-            1000:  BranchingRatio(0.00845753, 0.99395, 138.334)
-        },
-        81: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0669678, 0.87147, 138.334),
-            200:  BranchingRatio(0.0228768, 0.993849, 138.334),
-            1000:  BranchingRatio(0.00855509, 0.99395, 138.334)
-        },
-        82: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0691174, 0.85853, 138.334),
-            200:  BranchingRatio(0.0233079, 0.993846, 138.334),
-            1000:  BranchingRatio(0.00865193, 0.99395, 138.334)
-        },
-        83: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(0.0713146, 0.846608, 138.334),
-            200:  BranchingRatio(0.0237405, 0.993843, 138.334),
-            1000:  BranchingRatio(0.00874807, 0.993951, 138.334)
-        },
-        84: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0241746, 0.99384, 138.334),
-            1000:  BranchingRatio(0.0088435, 0.993951, 138.334)
-        },
-        85: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0246102, 0.993836, 138.334),
-            1000:  BranchingRatio(0.00893822, 0.993951, 138.334)
-        },
-        86: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.025047, 0.993833, 138.334),
-            1000:  BranchingRatio(0.00903224, 0.993951, 138.334)
-        },
-        87: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0254852, 0.993829, 138.334),
-            1000:  BranchingRatio(0.00912556, 0.993951, 138.334)
-        },
-        88: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0259247, 0.993825, 138.334),
-            1000:  BranchingRatio(0.00921818, 0.993952, 138.334)
-        },
-        89: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0263653, 0.993822, 138.334),
-            1000:  BranchingRatio(0.00931011, 0.993952, 138.334)
-        },
-        90: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0268072, 0.993818, 138.334),
-            1000:  BranchingRatio(0.00940134, 0.993952, 138.334)
-        },
-        91: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0272501, 0.993813, 138.334),
-            1000:  BranchingRatio(0.0094919, 0.993952, 138.334)
-        },
-        92: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0276942, 0.993809, 138.334),
-            1000:  BranchingRatio(0.00958177, 0.993952, 138.334)
-        },
-        93: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0281393, 0.993805, 138.334),
-            1000:  BranchingRatio(0.00967096, 0.993952, 138.334)
-        },
-        94: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0285854, 0.9938, 138.334),
-            1000:  BranchingRatio(0.00975948, 0.993952, 138.334)
-        },
-        95: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0290324, 0.993795, 138.334),
-            1000:  BranchingRatio(0.00984733, 0.993953, 138.334)
-        },
-        96: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0294804, 0.99379, 138.334),
-            1000:  BranchingRatio(0.00993451, 0.993953, 138.334)
-        },
-        97: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0299292, 0.993785, 138.334),
-            1000:  BranchingRatio(0.010021, 0.993953, 138.334)
-        },
-        98: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0303789, 0.99378, 138.334),
-            1000:  BranchingRatio(0.0101069, 0.993953, 138.334)
-        },
-        99: {
-            -1000:  BranchingRatio(-1, -1, -1),
-            -200:  BranchingRatio(-1, -1, -1),
-            200:  BranchingRatio(0.0308294, 0.993775, 138.334),
-            1000:  BranchingRatio(0.0101921, 0.993953, 138.334)
-        }
-    }
-}
+hplusBranchingRatio = _TableView(brTable, [])
@@ -63,13 +63,15 @@ def PrintFlushed(msg, printHeader=True):
     sys.stdout.flush()
     return
 
-def createBinByBinStatUncertHistograms(hRate, xmin=None, xmax=None, binByBinLabel=""):
+def createBinByBinStatUncertVariations(hRate, xmin=None, xmax=None, binByBinLabel=""):
     '''
-    Creates and returns a list of bin-by-bin stat. uncert. histograms
+    Creates and returns a list of bin-by-bin stat. uncert. variations as (name, bin, up, down) tuples
+    Only the varied bin content is stored, the histograms are created with
+    createBinByBinStatUncertHistograms() or writeBinByBinStatUncertHistograms()
     Inputs:
     hRate  rate histogram
-    xmin   float, specifies minimum value for which bin-by-bin histograms are created (default: all)
-    xmax   float, specifies maximum value for which bin-by-bin histograms are created (default: all)
+    xmin   float, specifies minimum value for which bin-by-bin variations are created (default: all)
+    xmax   float, specifies maximum value for which bin-by-bin variations are created (default: all)
     binByBinLabel string, specifies an optional postfix used to name bin-by-bin stat. nuisances (default: "")
     '''
     myList = []
@@ -85,52 +87,29 @@ def createBinByBinStatUncertHistograms(hRate, xmin=None, xmax=None, binByBinLabe
     nNegativeRate = 0
     nBelowMinStatUncert = 0
     nEmptyDownHistograms = 0
-
-#   TEST PRINT
-#    print "Contents of histogram %s:"%hRate.GetTitle()
-#    for i in range(1, hRate.GetNbinsX()+1):
-#        print "bin %d (from %f to %f): %f +- %f"%(i,hRate.GetXaxis().GetBinLowEdge(i),hRate.GetXaxis().GetBinUpEdge(i),hRate.GetBinContent(i),hRate.GetBinError(i))
-         
+    myIntegral = hRate.Integral()
 
     # For-loop: All histogram bins
     for i in range(1, hRate.GetNbinsX()+1):
-        #print hRate.GetXaxis().GetBinLowEdge(i), xmin, hRate.GetXaxis().GetBinUpEdge(i), xmax
-        
         if hRate.GetXaxis().GetBinLowEdge(i) > myRangeMin-0.0001 and hRate.GetXaxis().GetBinUpEdge(i) < myRangeMax+0.0001:
 
             # Make sure that there are no negative rates in nominal histogram (hRate)
-            if hRate.GetBinContent(i) < 0.0:
+            myRate = hRate.GetBinContent(i)
+            if myRate < 0.0:
                 nNegativeRate += 1
 
-            # Clone hRate histogram to hUp and hDown
-            hUp   = aux.Clone(hRate, "%s_%s_statBin%s%dUp"  % (myName, myName,binByBinLabel,i) )
-            hDown = aux.Clone(hRate, "%s_%s_statBin%s%dDown"% (myName, myName,binByBinLabel,i) )
-            hUp.SetTitle(hUp.GetName())
-            hDown.SetTitle(hDown.GetName())
-
             # The stat. uncerntainties are set and stored as errors to the nominal histogram in DatacardColumn.py
-
-            # Set hUp rate
-            hUp.SetBinContent(i, hUp.GetBinContent(i) + hUp.GetBinError(i))
-            # Set hDown rate
-            statBinDown = hDown.GetBinContent(i)-hDown.GetBinError(i)
-            # hDown.SetBinContent(i, statBinDown) # Bug fix (8Nov2017)
-            hDown.SetBinContent(i, max(0.0, statBinDown)) # make sure hDown rate is not negative
+            myUp = myRate + hRate.GetBinError(i)
+            statBinDown = myRate - hRate.GetBinError(i)
+            myDown = max(0.0, statBinDown) # make sure hDown rate is not negative
 
             # Varying dowards can in rare cases lead to a completely empty hDown histo, not accepted as input by Combine
             # To prevent this from happening, we do as follows:
-            if hDown.Integral() <= 0:
-                 hDown.SetBinContent(i, max(0.00001, statBinDown))
-                 nEmptyDownHistograms += 1
-                    
-            # Clear uncertainty bins, because they have no effect on LandS/Combine
-            for j in range(1, hRate.GetNbinsX()+1):
-                hUp.SetBinError(j, 0.0)
-                hDown.SetBinError(j, 0.0)
+            if myIntegral - myRate + myDown <= 0:
+                myDown = max(0.00001, statBinDown)
+                nEmptyDownHistograms += 1
 
-            # Append to list before returning it
-            myList.append(hUp)
-            myList.append(hDown)
+            myList.append(("%s_%s_statBin%s%d" % (myName, myName, binByBinLabel, i), i, myUp, myDown))
 
     # Print summarty of warnings/errors (if any)
     if nNegativeRate > 0:
@@ -147,6 +126,54 @@ def createBinByBinStatUncertHistograms(hRate, xmin=None, xmax=None, binByBinLabe
 
     return myList
 
+def _getBinByBinStatUncertTemplate(hRate):
+    '''
+    Returns a copy of the rate histogram without the bin errors
+    '''
+    h = aux.Clone(hRate)
+    # Clear uncertainty bins, because they have no effect on LandS/Combine
+    for j in range(1, hRate.GetNbinsX()+1):
+        h.SetBinError(j, 0.0)
+    return h
+
+def createBinByBinStatUncertHistograms(hRate, xmin=None, xmax=None, binByBinLabel=""):
+    '''
+    Creates and returns a list of bin-by-bin stat. uncert. histograms (Up and Down for each bin)
+    Inputs: see createBinByBinStatUncertVariations()
+    '''
+    myList = []
+    hTemplate = _getBinByBinStatUncertTemplate(hRate)
+    for (myName, i, myUp, myDown) in createBinByBinStatUncertVariations(hRate, xmin, xmax, binByBinLabel):
+        for mySuffix, myValue in [("Up", myUp), ("Down", myDown)]:
+            h = aux.Clone(hTemplate, myName+mySuffix)
+            h.SetTitle(h.GetName())
+            h.SetBinContent(i, myValue)
+            myList.append(h)
+    hTemplate.Delete()
+    return myList
+
+def writeBinByBinStatUncertHistograms(rootFile, hRate, variations):
+    '''
+    Writes the Up and Down histograms of bin-by-bin stat. uncert. variations to a root file
+    The histograms are written one at a time from a single copy of the rate histogram
+    Inputs:
+    rootFile    output TFile
+    hRate       rate histogram
+    variations  list of variations from createBinByBinStatUncertVariations()
+    '''
+    h = _getBinByBinStatUncertTemplate(hRate)
+    myEntries = h.GetEntries()
+    for (myName, i, myUp, myDown) in variations:
+        myRate = h.GetBinContent(i)
+        for mySuffix, myValue in [("Up", myUp), ("Down", myDown)]:
+            h.SetBinContent(i, myValue)
+            h.SetEntries(myEntries)
+            h.SetNameTitle(myName+mySuffix, myName+mySuffix)
+            rootFile.WriteTObject(h, myName+mySuffix)
+        h.SetBinContent(i, myRate)
+    h.Delete()
+    return
+
 def createBinByBinStatUncertNames(hRate,binByBinLabel=""):
     '''
     Creates and returns a list of bin-by-bin stat. uncert. name strings
@@ -218,6 +245,9 @@ class TableProducer:
         self._binByBinLabel = ""
         if hasattr(self._config, 'OptionBinByBinLabel'):
             self._binByBinLabel = self._config.OptionBinByBinLabel
+        self._autoMCStatsThreshold = None
+        if hasattr(self._config, 'OptionAutoMCStats'):
+            self._autoMCStatsThreshold = self._config.OptionAutoMCStats
         self._outputPrefix = outputPrefix
         self._luminosity = luminosity
         self._observation = observation
@@ -464,7 +494,10 @@ class TableProducer:
             myCard += getTableOutput(myWidths,myNuisanceTable)
             if self._opts.combine:
                 myCard += mySeparatorLine
-                myCard += getTableOutput(myWidths,myBinByBinStatUncertTable)
+                if self._autoMCStatsThreshold != None:
+                    myCard += "* autoMCStats %s\n" % (self._autoMCStatsThreshold)
+                else:
+                    myCard += getTableOutput(myWidths,myBinByBinStatUncertTable)
 
             # Print datacard to screen if requested
             if self._opts.showDatacard:
@@ -762,6 +795,9 @@ class TableProducer:
         Generates nuisance table as list
         '''
         myTable = []
+        # With autoMCStats, combine creates the bin-wise stat. nuisances from the rate histogram errors
+        if self._autoMCStatsThreshold != None:
+            return myTable
         # Loop over columns
         for c in sorted(self._datasetGroups, key=lambda x: x.getLandsProcess()):
             if c.isActiveForMass(mass,self._config):
@@ -877,12 +913,12 @@ class TableProducer:
         for c in sorted(self._datasetGroups, key=lambda x: x.getLandsProcess()):
             if c.isActiveForMass(mass,self._config):
                 c.setResultHistogramsToRootFile(rootFile)
-                # Add bin-by-bin stat.uncert.
+                # Add bin-by-bin stat.uncert. (not needed with autoMCStats)
+                if self._autoMCStatsThreshold != None:
+                    continue
                 hRate = c._rateResult.getHistograms()[0]
-                myHistos = createBinByBinStatUncertHistograms(hRate, binByBinLabel=binByBinLabel)
-                for h in myHistos:
-                    h.SetDirectory(rootFile)
-                c._rateResult._tempHistos.extend(myHistos)
+                myVariations = createBinByBinStatUncertVariations(hRate, binByBinLabel=binByBinLabel)
+                writeBinByBinStatUncertHistograms(rootFile, hRate, myVariations)
         return
 
     def makeShapeVariationTable(self):
@@ -9,6 +9,7 @@ import inspect
 import math
 import array
 import HiggsAnalysis.NtupleAnalysis.tools.aux as aux
+import HiggsAnalysis.NtupleAnalysis.tools.fitHelper as fitHelper
 import HiggsAnalysis.NtupleAnalysis.tools.plots as plots
 import HiggsAnalysis.NtupleAnalysis.tools.histograms as histograms
 import HiggsAnalysis.NtupleAnalysis.tools.tdrstyle as tdrstyle
@@ -31,6 +32,8 @@ _fitOptions = "WL R B S"
 
 #================================================================================================  
 # Fitting function definitions
+# Each function gives also a TFormula expression of __call__, so that the fit is done
+# with a compiled function instead of calling back to python for every point
 #================================================================================================
 
 # Base class
@@ -43,6 +46,13 @@ class FitFuncBase:
     def getNparam(self):
         return self._npar
 
+    # TFormula expression of the function (None: the function is evaluated in python)
+    def getFormula(self):
+        return None
+
+    def createTF1(self, name, fitmin, fitmax):
+        return fitHelper.createTF1(name, self.getFormula(), self, fitmin, fitmax, self._npar)
+
 # Simple exponential function A*exp(-Bx)
 class FitFuncSimpleExp(FitFuncBase):
     def __init__(self, fitmin, scalefactor):
@@ -51,6 +61,9 @@ class FitFuncSimpleExp(FitFuncBase):
     def __call__(self, x, par):
         return par[0]*ROOT.TMath.Exp(-x[0] * par[1])
 
+    def getFormula(self):
+        return "[0]*TMath::Exp(-x*[1])"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,1,100000)
         fit.SetParLimits(1,1e-10,1)
@@ -65,6 +78,9 @@ class FitFuncGausExpTail(FitFuncBase):
     def __call__(self, x, par):
         return par[0]*ROOT.TMath.Exp(-x[0] * par[1])*ROOT.TMath.Exp(-(x[0]-par[2])**2 / par[3])
 
+    def getFormula(self):
+        return "[0]*TMath::Exp(-x*[1])*TMath::Exp(-TMath::Power(x-[2],2)/[3])"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,1,10000)
         fit.SetParLimits(1,1e-10,0.1)
@@ -83,6 +99,9 @@ class FitFuncExpTailExo(FitFuncBase):
     def __call__(self, x, par):
         return par[0]*ROOT.TMath.Exp(-x[0] * par[1] - (x[0]**2*par[2]))
 
+    def getFormula(self):
+        return "[0]*TMath::Exp(-x*[1]-(TMath::Power(x,2)*[2]))"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,1,100000)
         fit.SetParLimits(1,1e-10,0.1)
@@ -102,6 +121,9 @@ class FitFuncPreFitForIntegral(FitFuncBase):
         #return par[0]*ROOT.TMath.Exp(-m * (par[1] + m / par[2]))
         #return par[0]*ROOT.TMath.Exp(-(x[0]-par[3]) * (par[1] + (x[0]-par[3]) / par[2]))
 
+    def getFormula(self):
+        return "[0]*TMath::Exp(-(x-%s)*([1]))"%fitHelper.formulaConstant(self._fitmin)
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.001,10)
         fit.SetParLimits(1,0.001,10)
@@ -122,6 +144,9 @@ class FitFuncExpTailTauTauAlternate(FitFuncBase):
         #return par[0]*ROOT.TMath.Exp(-m * (par[1] + m / par[2]))
         #return par[0]*ROOT.TMath.Exp(-(x[0]-par[3]) * (par[1] + (x[0]-par[3]) / par[2]))
 
+    def getFormula(self):
+        return "%(sf)s*[0]*TMath::Exp(-(x-%(m)s)/([1]-(x-%(m)s)*0.001*[2]))"%{"sf": fitHelper.formulaConstant(self._scalefactor), "m": fitHelper.formulaConstant(self._fitmin)}
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.001,1000)
         fit.SetParLimits(1,0.001,10000)
@@ -142,6 +167,9 @@ class FitFuncExpTailExoAlternate2(FitFuncBase):
         #return par[0]*ROOT.TMath.Exp(-m * (par[1] + m / par[2]))
         #return par[0]*ROOT.TMath.Exp(-(x[0]-par[3]) * (par[1] + (x[0]-par[3]) / par[2]))
 
+    def getFormula(self):
+        return "%(sf)s*[0]*TMath::Exp(-(x-%(m)s)*([1]-(x-%(m)s)*([2])))"%{"sf": fitHelper.formulaConstant(self._scalefactor), "m": fitHelper.formulaConstant(self._fitmin)}
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.001,1000)
         fit.SetParLimits(1,0.00001,10000)
@@ -162,6 +190,9 @@ class FitFuncExpTailExoAlternate(FitFuncBase):
         #return par[0]*ROOT.TMath.Exp(-m * (par[1] + m / par[2]))
         #return par[0]*ROOT.TMath.Exp(-(x[0]-par[3]) * (par[1] + (x[0]-par[3]) / par[2]))
 
+    def getFormula(self):
+        return "%(sf)s*[0]*TMath::Exp(-(x-%(m)s)*([1]))"%{"sf": fitHelper.formulaConstant(self._scalefactor), "m": fitHelper.formulaConstant(self._fitmin)}
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.001,10)
         fit.SetParLimits(1,0.001,10)
@@ -178,6 +209,9 @@ class FitFuncExpTailThreeParam(FitFuncBase):
     def __call__(self, x, par):
         return par[0]*ROOT.TMath.Exp(-x[0] / (par[1] + x[0]*par[2]))
 
+    def getFormula(self):
+        return "[0]*TMath::Exp(-x/([1]+x*[2]))"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,1,100000)
         fit.SetParLimits(1,0.1,200)
@@ -194,6 +228,9 @@ class FitFuncExpTailFourParam(FitFuncBase):
     def __call__(self, x, par):
         return par[3]*ROOT.TMath.Exp(-(x[0]-par[2]) / (par[0] + (x[0]-par[2])*par[1]))
 
+    def getFormula(self):
+        return "[3]*TMath::Exp(-(x-[2])/([0]+(x-[2])*[1]))"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.1,2000)
         fit.SetParLimits(1,0.000001,2.0)
@@ -212,6 +249,9 @@ class FitFuncExpTailFourParamAlternate(FitFuncBase):
     def __call__(self, x, par):
         return par[3]*ROOT.TMath.Exp(-(x[0]-par[2]) / (par[0] + (x[0]-par[2])/par[1]))
 
+    def getFormula(self):
+        return "[3]*TMath::Exp(-(x-[2])/([0]+(x-[2])/[1]))"
+
     def setParamLimits(self, fit):
         fit.SetParLimits(0,0.1,2000)
         fit.SetParLimits(1,0.001,10000000)
@@ -324,7 +364,7 @@ class TailFitter:
 
         # Do fit
         print "... Fitting tail for shape: %s, function=%s, range = %d-%d"%(self._label, fitFuncName, fitmin, fitmax)
-        self._fittedRate = ROOT.TF1(self._label+"myFit", self._myFitFuncObject, fitmin, fitmax, self._myFitFuncObject.getNparam())
+        self._fittedRate = self._myFitFuncObject.createTF1(self._label+"myFit", fitmin, fitmax)
         self._myFitFuncObject.setParamLimits(self._fittedRate)
         myFitResult = h.Fit(self._fittedRate, _fitOptions)
 
@@ -619,3 +659,25 @@ class TailFitter:
 	myParams["xlabel"] = "m_{T} (GeV)"
         myDrawer = plots.PlotDrawer()
         myDrawer(plot, myName, **myParams)
+
+# Unit tests
+if __name__ == "__main__":
+    import unittest
+    class TestFitFunc(unittest.TestCase):
+        def testFormula(self):
+            # Compiled and python functions agree at the ends of the fit range, with the initial parameters
+            fitmin = 180.0
+            fitmax = 800.0
+            for cls in [FitFuncSimpleExp, FitFuncGausExpTail, FitFuncExpTailExo, FitFuncPreFitForIntegral,
+                        FitFuncExpTailTauTauAlternate, FitFuncExpTailExoAlternate2, FitFuncExpTailExoAlternate,
+                        FitFuncExpTailThreeParam, FitFuncExpTailFourParam, FitFuncExpTailFourParamAlternate]:
+                func = cls(fitmin, 0.8)
+                self.assertNotEqual(func.getFormula(), None)
+                tf1 = func.createTF1("test"+cls.__name__, fitmin, fitmax)
+                func.setParamLimits(tf1)
+                par = [tf1.GetParameter(i) for i in range(func.getNparam())]
+                for x in [fitmin, fitmax]:
+                    expected = func([x], par)
+                    self.assertAlmostEqual(tf1.Eval(x), expected, delta=1e-12*abs(expected))
+
+    unittest.main()
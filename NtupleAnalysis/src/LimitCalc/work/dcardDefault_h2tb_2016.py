@@ -124,6 +124,7 @@ BlindAnalysis                          = True  # [default: True]   (True, unless
 OptionBlindThreshold                   = None  # [default: 0.2]    (If signal exceeds this fraction of expected events, data is blinded; set to None to disable)
 MinimumStatUncertainty                 = 0.5   # [default: 0.5]    (Minimum stat. uncertainty to set to bins with zero events)
 UseAutomaticMinimumStatUncertainty     = False # Do NOT use the MinimumStatUncertainty value above for ~empty bins, but determine the value from the lowest non-zero rate for each dataset   
+OptionAutoMCStats                      = None  # [default: None]   (Threshold of the combine autoMCStats line replacing the bin-by-bin stat. histograms; None for bin-by-bin histograms)
 OptionCombineSingleColumnUncertainties = False # [default: False]  (Approxmation that makes limit running faster)
 OptionDisplayEventYieldSummary         = False # [default: False]  (Print "Event yield summary", using the TableProducer.py)
 OptionDoWithoutSignal                  = False # [default: False]  (Also do control plots without any signal present)
@@ -141,6 +141,7 @@ BlindAnalysis                          = False        # [default: True]   (Chang
 OptionBlindThreshold                   = None         # [default: None]   (If signal exceeds this fraction of expected events, data is blinded)
 MinimumStatUncertainty                 = 0.5          # [default: 0.5]    (min. stat. uncert. to set to bins with zero events)
 UseAutomaticMinimumStatUncertainty     = False        # [default: False]  (Do NOT use the MinimumStatUncertainty; determine value from lowest non-zero rate for each dataset   )
+OptionAutoMCStats                      = None         # [default: None]   (threshold of combine autoMCStats line replacing bin-by-bin stat. histograms; None for bin-by-bin)
 OptionCombineSingleColumnUncertainties = False        # [default: False]  (Merge nuisances with quadratic sum using the TableProducer.py Only applied to nuisances with one column)
 OptionDisplayEventYieldSummary         = False        # [default: False]  (Print "Event yield summary", using the TableProducer.py)
 OptionDoWithoutSignal                  = False        # [default: False]  (Also do control plots without any signal present)
@@ -27,6 +27,8 @@ EXAMPLES:
 ./dcardGenerator.py -x <datacard-config-file> -d <dir-with-results>
 ./dcardGenerator_v2.py -x dcardDefault_h2tb_2016.py -d limits2016/ --h2tb
 ./dcardGenerator_v2.py -x dcardDefault_h2tb_2016.py -d limits2016/ --h2tb --tarball
+./dcardGenerator_v2.py -x dcardDefault_h2tb_2016.py -d limits2016/ --h2tb -j 8
+./dcardGenerator_v2.py -x dcardDefault_h2tb_2016.py -d limits2016/ --h2tb --miningCache
 
 LAST USED:
 ./dcardGenerator_v2.py -x dcardDefault_h2tb_2016.py -d limits2016/ --h2tb
@@ -421,6 +423,8 @@ if __name__ == "__main__":
     HToTB         = False
     TARBALL       = False
     PYVALIDATE    = False
+    NPROCESSES    = 1 # 0 for all cores
+    MININGCACHE   = False
 
     # Object for selecting data eras, search modes, and optimization modes
     myModuleSelector = analysisModuleSelector.AnalysisModuleSelector() 
@@ -485,6 +489,12 @@ if __name__ == "__main__":
 
     parser.add_option("--h2tb", dest="h2tb", action="store_true", default=HToTB,
                       help="Flag to indicate that settings should reflect h2tb analysis [default: %s]" % (HToTB) )
+
+    parser.add_option("-j", "--nProcesses", dest="nProcesses", type=int, default=NPROCESSES,
+                      help="Number of processes for the data mining of the datacard columns (0 for all cores) [default: %s]" % (NPROCESSES) )
+
+    parser.add_option("--miningCache", dest="miningCache", action="store_true", default=MININGCACHE,
+                      help="Reuse the data mining results of the columns whose inputs have not changed since the previous run (cached in the input directory) [default: %s]" % (MININGCACHE) )
     
     (opts, args) = parser.parse_args()
 
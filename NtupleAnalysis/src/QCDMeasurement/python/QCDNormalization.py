@@ -9,6 +9,7 @@
 # Instructions for using, call the following methods:
 # 1) create manager (each algorithm has it's own manager inheriting from a base class)
 # 2) create templates (createTemplate()) and add fit functions to them (template::setFitter)
+# 2b) optionally, fit the templates of all bins concurrently (fitTemplatesForAllBins())
 # 3) loop over bins and start by calling resetBinResults()
 # 4) for each bin, add histogram to templates (template::setHistogram)
 # 5) for each bin, plot templates (plotTemplates())
@@ -30,6 +31,7 @@ import shutil
 import array
 import sys
 import datetime
+import multiprocessing
 
 ## Helper class for merging fit functions
 class FunctionSum:
@@ -39,6 +41,48 @@ class FunctionSum:
     def __call__(self, x):
         return self._f1.Eval(x[0]) + self._f2.Eval(x[0])
 
+## Compiled (TFormula) expressions of the fit functions, giving the same values as the python methods of FitFunction
+# {factor} is replaced by the additional normalization factor, {norm} and {boundary} by the function arguments.
+# Functions not listed here (e.g. ExpFunction, which rejects points) are evaluated by calling back to python.
+# Branches are written as (cond)?(expr1):(expr2), so that only the branch taken by the python method is
+# evaluated (multiplying by a 0/1 condition gives NaN if the other branch is not finite)
+_rayleighFormula = "((([0]+[1]*x)==0)?0:([1]*x/(([0])*([0]))*TMath::Exp(-x*x/(2*([0])*([0])))))"
+_rayleighShiftedFormula = "((([0]+[1]*x)==0)?0:([1]*x/(([0])*([0]))*TMath::Exp(-x*x/(2*([0]*[0]+2*[2]*[0]*x+[2]*[2]*x*x)))))"
+_formulas = {
+    "Linear": "[0]*x+[1]",
+    "ErrorFunction": "0.5*(1+TMath::Erf([0]*(x-[1])))",
+    "Gaussian": "[0]*TMath::Gaus(x,[1],[2],1)",
+    "DoubleGaussian": "[0]*TMath::Gaus(x,[1],[2],1)+[3]*TMath::Gaus(x,[4],[5],1)",
+    "SumFunction": "[0]*TMath::Gaus(x,[1],[2],1)+[3]*TMath::Exp(-x*[4])",
+    "RayleighFunction": "{norm}*"+_rayleighFormula,
+    "RayleighFunctionShifted": "{norm}*"+_rayleighShiftedFormula,
+    "QCDFunction": "{factor}*{norm}*("+_rayleighFormula+"+[2]*TMath::Gaus(x,[3],[4],1)+[5]*TMath::Exp(-[6]*x))",
+    "QCDFunctionWithPeakShift": "{factor}*{norm}*("+_rayleighShiftedFormula+"+[3]*TMath::Gaus(x,[4],[5],1)+[6]*TMath::Exp(-[7]*x))",
+    "QCDFunctionWithPeakShiftClear": "{factor}*{norm}*("+_rayleighShiftedFormula+"+[3]*TMath::Gaus(x,[4],[5],1)+[6]*TMath::Exp(-[7]*x))",
+    "RayleighShiftedPlusGaussian": "{factor}*{norm}*("+_rayleighShiftedFormula+"+[3]*TMath::Gaus(x,[4],[5],1))",
+    "EWKFunction": "((x<{boundary})?({factor}*{norm}*[0]*TMath::Gaus(x,[1],[2],1)):"+
+                   "({factor}*{norm}*[0]*TMath::Gaus({boundary},[1],[2],1)*TMath::Exp({boundary}*[3])*TMath::Exp(-x*[3])))",
+    "EWKFunctionInv": "((x<{boundary})?({factor}*{norm}*([0]*TMath::Landau(x,[1],[2]))):"+
+                      "({factor}*{norm}*([0]*TMath::Landau({boundary},[1],[2]))*TMath::Exp({boundary}*[3])*TMath::Exp(-x*[3])))",
+    "QCDEWKFunction": "((([0]+[1]*x)==0)?0:({factor}*{norm}*([1]*x/(([0])*([0]))*TMath::Exp(-x*x/(2*([0])*([0])))+[2]*TMath::Gaus(x,[3],[4],1)+[5]*TMath::Exp(-[6]*x))))",
+    "QCDFunctionFixed": "{factor}*[0]*(TMath::Gaus(x,[1],[2],1)+[3]*TMath::Gaus(x,[4],[5],1)+[6]*TMath::Exp(-[7]*x))",
+}
+
+## Composite functions for fitting data: expression with the template functions inserted as %s,
+# and the (function, parameters, normalization) arguments of each template function
+_compositeFormulas = {
+    "FitDataWithQCDAndFakesAndGenuineTaus": ("[0]*([1]*(%s)+[2]*(%s)+(1.0-[1]-[2])*(%s))",
+        [("QCDFitFunction", "parQCD", "QCDnorm"),
+         ("EWKFakeTausFitFunction", "parEWKFakeTaus", "EWKFakeTausNorm"),
+         ("EWKGenuineTausFitFunction", "parEWKGenuineTaus", "EWKGenuineTausNorm")]),
+    "FitDataWithQCDAndInclusiveEWK": ("[0]*([1]*(%s)+(1.0-[1])*(%s))",
+        [("QCDFitFunction", "parQCD", "QCDnorm"),
+         ("EWKInclusiveFunction", "parEWK", "EWKNorm")]),
+    "FitDataWithFakesAndGenuineTaus": ("[0]*([1]*(%s)+(1.0-[1])*(%s))",
+        [("QCDAndFakesFitFunction", "parQCDAndFakes", "QCDAndFakesnorm"),
+         ("EWKGenuineTausFitFunction", "parEWKGenuineTaus", "EWKGenuineTausNorm")]),
+}
+
 ## Container class for fit functions
 class FitFunction:
     def __init__(self, functionName, **kwargs):
@@ -82,16 +126,53 @@ class FitFunction:
         self._additionalNormFactor = factor
     
     def __call__(self, x, par, **kwargs):
-        args = {}
-        for k in self._args.keys():
-            args[k] = self._args[k]
-        for k in kwargs:
-            args[k] = kwargs[k]
+        if len(kwargs) == 0:
+            return getattr(self, self._functionName)(x, par, **self._args)
+        args = dict(self._args)
+        args.update(kwargs)
         return getattr(self, self._functionName)(x, par, **args)
 
     def getNParam(self):
         return self._nParam
 
+    ## Returns the TFormula expression of the function, or None if it can only be evaluated in python
+    # \param parameters  if given, the parameters are inserted as constants
+    # \param kwargs      function arguments overriding the ones given in the constructor
+    def getFormula(self, parameters=None, **kwargs):
+        args = dict(self._args)
+        args.update(kwargs)
+        try:
+            if self._functionName in _compositeFormulas:
+                (formula, templates) = _compositeFormulas[self._functionName]
+                subFormulas = []
+                for (functionKey, parKey, normKey) in templates:
+                    if not isinstance(args.get(functionKey, None), FitFunction) or not parKey in args or not normKey in args:
+                        return None
+                    subFormula = args[functionKey].getFormula(parameters=args[parKey], norm=args[normKey])
+                    if subFormula == None:
+                        return None
+                    subFormulas.append(subFormula)
+                formula = formula%tuple(subFormulas)
+            elif self._functionName in _formulas:
+                formula = _formulas[self._functionName].replace("{factor}", fitHelper.formulaConstant(self._additionalNormFactor))
+                for key in ["norm", "boundary"]:
+                    if "{%s}"%key in formula:
+                        if not key in args:
+                            return None
+                        formula = formula.replace("{%s}"%key, fitHelper.formulaConstant(args[key]))
+            else:
+                return None
+            if parameters != None:
+                formula = fitHelper.substituteFormulaParameters(formula, parameters)
+        except (TypeError, ValueError):
+            # Non-numeric arguments
+            return None
+        return formula
+
+    ## Returns a TF1 of the function, compiled from its formula if the function has one
+    def createTF1(self, name, xmin, xmax):
+        return fitHelper.createTF1(name, self.getFormula(), self, xmin, xmax, self._nParam)
+
     #===== Primitive functions
     def Linear(self,x,par):
         return par[0]*x[0] + par[1]
@@ -244,6 +325,78 @@ def getFormattedTemplateName(name):
     else:
         return name
 
+## Converts the negative bins of a template histogram to zero and normalizes it to unit area (in place)
+# Returns the normalization factor (the original integral)
+def normalizeTemplateHistogram(histogram, name, quietMode=False):
+    # Convert negative bins to zero but leave errors intact
+    convertedBins = 0
+    for k in range(0, histogram.GetNbinsX()+2):
+        if histogram.GetBinContent(k) < 0.0:
+            histogram.SetBinContent(k, 0.0)
+            histogram.SetBinError(k, 1.0)
+            convertedBins += 1
+    if convertedBins > 0 and not quietMode:
+        print "template '%s': %d negative value bins were converted to zero (%d bins in total)"%(name, convertedBins, histogram.GetNbinsX())
+    # Calculate normalization factor and normalize the histogram to area = 1
+    integral = histogram.Integral()
+    if integral == 0.0:
+        return 1.0
+    histogram.Scale(1.0 / integral)
+    return integral
+
+## Result of a template fit (plain python objects, so that it can be passed between processes)
+class TemplateFitResult:
+    def __init__(self, parameters, parErrors, covariance, nEventsFromFit, nEventsTotalErrorUp, nEventsTotalErrorDown, chi2, ndf, prob):
+        self.parameters = parameters
+        self.parErrors = parErrors
+        self.covariance = covariance
+        self.nEventsFromFit = nEventsFromFit
+        self.nEventsTotalErrorUp = nEventsTotalErrorUp
+        self.nEventsTotalErrorDown = nEventsTotalErrorDown
+        self.chi2 = chi2
+        self.ndf = ndf
+        self.prob = prob
+
+## Fits a template histogram (normalized to unit area) and returns a TemplateFitResult
+# This is a module level function, so that the fits can be done in a process pool
+#
+# \param initialValues  initial fit parameter values (or None)
+# \param lowerLimits    lower limits of the fit parameters (or None)
+# \param upperLimits    upper limits of the fit parameters (or None)
+def fitTemplate(fitName, histo, fitFunction, fitRangeMin, fitRangeMax, initialValues, lowerLimits, upperLimits, fitOptions, normalizationFactor):
+    # Define fit object
+    fit = fitFunction.createTF1(fitName, fitRangeMin, fitRangeMax)
+    # Set initial fit parameter values
+    if initialValues != None:
+        for i in range(len(initialValues)):
+            fit.SetParameter(i, initialValues[i])
+    # Set fit parameter ranges
+    if lowerLimits != None:
+        for i in range(len(lowerLimits)):
+            fit.SetParLimits(i, lowerLimits[i], upperLimits[i])
+            # Make sure that central value is inside the limits
+            if initialValues == None:
+                fit.SetParameter(i, (lowerLimits[i] + upperLimits[i]) / 2.0)
+    # Clone the histogram (it is normalized to unity, note also the under/overflow bins)
+    h = aux.Clone(histo)
+    if not "S" in fitOptions:
+        fitOptions += " S" # To return fit results
+    canvas = ROOT.TCanvas() # Create explicitly canvas to get rid of warning message
+    fitResultObject = h.Fit(fit, fitOptions)
+    # Store the parameters before the orthogonalizer varies them
+    parameters = [fit.GetParameter(i) for i in range(fit.GetNpar())]
+    parErrors = [fit.GetParError(i) for i in range(fit.GetNpar())]
+    covMatrix = fitResultObject.GetCovarianceMatrix()
+    covariance = [[covMatrix(i, j) for j in range(covMatrix.GetNcols())] for i in range(covMatrix.GetNrows())]
+    # Note: need to divide the TF1 integral by histogram bin width
+    xmin = histo.GetXaxis().GetXmin()
+    xmax = histo.GetXaxis().GetXmax()
+    nEventsFromFit = fit.Integral(xmin, xmax)*normalizationFactor / histo.GetXaxis().GetBinWidth(1)
+    orthogonalizer = fitHelper.FitParameterOrthogonalizer(fit, fitResultObject, xmin, xmax)
+    return TemplateFitResult(parameters, parErrors, covariance, nEventsFromFit,
+                             orthogonalizer.getTotalFitParameterUncertaintyUp(), orthogonalizer.getTotalFitParameterUncertaintyDown(),
+                             fitResultObject.Chi2(), fitResultObject.Ndf(), fitResultObject.Prob())
+
 ## Template holder for QCD measurement normalization
 class QCDNormalizationTemplate:
     def __init__(self, name, plotDirName, quietMode=False):
@@ -413,7 +566,7 @@ class QCDNormalizationTemplate:
         f = self._fitFunction.clone()
         f.setAdditionalNormalization(normalizationFactor)
         # Obtain function  
-        func = ROOT.TF1(self._name+"_"+self._binLabel, f, FITMIN, FITMAX, self._fitFunction.getNParam())
+        func = f.createTF1(self._name+"_"+self._binLabel, FITMIN, FITMAX)
         for k in range(self._fitFunction.getNParam()):
             func.SetParameter(k, self._fitParameters[k])
         func.SetLineWidth(2)
@@ -423,28 +576,40 @@ class QCDNormalizationTemplate:
     ## Call once for every bin
     def setHistogram(self, histogram, binLabel):
         self._histo = histogram
-        self._binLabel = binLabel
-        # Convert negative bins to zero but leave errors intact
-        convertedBins = 0
-        for k in range(0, self._histo.GetNbinsX()+2):
-            if self._histo.GetBinContent(k) < 0.0:
-                self._histo.SetBinContent(k, 0.0)
-                self._histo.SetBinError(k, 1.0)
-                convertedBins += 1
-#                print "template '%s': converted in bin %d a negative value (%f) to zero."%(self._name, k, self._histo.GetBinContent(k))
-        if convertedBins > 0:
-            print "template '%s': %d negative value bins were converted to zero (%d bins in total)"%(self._name, convertedBins, self._histo.GetNbinsX())
-
         # Format bin label string
         self._binLabel = getModifiedBinLabelString(binLabel)
-        # Calculate normalization factor and store the histogram normalized as area = 1
-        integral = self._histo.Integral()
-        if integral == 0.0:
-            self._normalizationFactor = 1.0
-        else:
-            self._normalizationFactor = integral
-            self._histo.Scale(1.0 / self._normalizationFactor)
-        
+        # Store the histogram normalized as area = 1
+        self._normalizationFactor = normalizeTemplateHistogram(self._histo, self._name)
+
+    ## Returns the arguments of fitTemplate() for fitting a histogram in a given bin
+    # The histogram is not modified
+    def getFitArguments(self, histogram, binLabel, fitOptions):
+        modifiedBinLabel = getModifiedBinLabelString(binLabel)
+        h = aux.Clone(histogram)
+        normalizationFactor = normalizeTemplateHistogram(h, self._name, quietMode=True)
+        (initialValues, lowerLimits, upperLimits) = self._getFitParamSettings(modifiedBinLabel)
+        return ("fit"+self._name+modifiedBinLabel, h, self._fitFunction, self._fitRangeMin, self._fitRangeMax,
+                initialValues, lowerLimits, upperLimits, fitOptions, normalizationFactor)
+
+    ## Returns the initial values, lower limits, and upper limits of the fit parameters for a bin (None if not set)
+    def _getFitParamSettings(self, binLabel):
+        initialValues = None
+        if binLabel in self._fitParamInitialValues.keys():
+            initialValues = self._fitParamInitialValues[binLabel]
+        if "default" in self._fitParamInitialValues.keys():
+            initialValues = self._fitParamInitialValues["default"]
+        lowerLimits = None
+        upperLimits = None
+        key = None
+        if binLabel in self._fitParamLowerLimits.keys():
+            key = binLabel
+        if "default" in self._fitParamLowerLimits.keys():
+            key = "default"
+        if key != None:
+            lowerLimits = self._fitParamLowerLimits[key]
+            upperLimits = self._fitParamUpperLimits[key]
+        return (initialValues, lowerLimits, upperLimits)
+
     ## Make a plot of the MET histogram
     def plot(self):
         if self._histo == None:
@@ -507,7 +672,9 @@ class QCDNormalizationTemplate:
             self._fitParamLowerLimits[modifiedBinLabel] = lowerLimit
             self._fitParamUpperLimits[modifiedBinLabel] = upperLimit
 
-    def doFit(self, fitOptions="S", createPlot=True):
+    ## Fits the template histogram
+    # \param fitResult  TemplateFitResult of this template and bin obtained beforehand (e.g. in a process pool); if None, the fit is done here
+    def doFit(self, fitOptions="S", createPlot=True, fitResult=None):
         if self._histo == None:
             raise Exception("Error: Please provide first the histogram with the 'setHistogram' method")
         if self._histo.Integral(1, self._histo.GetNbinsX()+1) == 0.0:
@@ -518,61 +685,37 @@ class QCDNormalizationTemplate:
             if not self._quietMode:
                 print "\n\033[1mFitting %s in bin %s\033[0m"%(self._name, self._binLabel)
                 self.printFitParamSettings(self._binLabel)
-            # Define fit object
-            fit = ROOT.TF1("fit"+self._name+self._binLabel, self._fitFunction, self._fitRangeMin, self._fitRangeMax, self._fitFunction.getNParam())
-            # Set initial fit parameter values
-            centralKey = None
-            if self._binLabel in self._fitParamInitialValues.keys():
-                centralKey = self._binLabel
-            if "default" in self._fitParamInitialValues.keys():
-                centralKey = "default"
-            if centralKey != None:
-                for i in range(len(self._fitParamInitialValues[centralKey])):
-                    fit.SetParameter(i, self._fitParamInitialValues[centralKey][i])
-            # Set fit parameter ranges
-            key = None
-            if self._binLabel in self._fitParamLowerLimits.keys():
-                key = self._binLabel
-            if "default" in self._fitParamLowerLimits.keys():
-                key = "default"
-            if key != None:
-                for i in range(len(self._fitParamLowerLimits[key])):
-                    fit.SetParLimits(i, self._fitParamLowerLimits[key][i], self._fitParamUpperLimits[key][i])
-                    # Make sure that central value is inside the limits
-                    if centralKey == None:
-                        fit.SetParameter(i, (self._fitParamLowerLimits[key][i] + self._fitParamUpperLimits[key][i]) / 2.0)
-            # Clone the histogram and normalize its area to unity (note also the under/overflow bins)
-            h = aux.Clone(self._histo)
-            #h.Scale(1.0 / h.Integral(1, h.GetNbinsX()+1))
-            # Do the fit
-            if not self._quietMode:
-                print "-Using fit options:",fitOptions
-            elif not "Q" in fitOptions:
-                fitOptions += " Q" # To suppress output
-            if not "S" in fitOptions:
-                fitOptions += " S" # To return fit results
-            canvas = ROOT.TCanvas() # Create explicitly canvas to get rid of warning message
-            fitResultObject = h.Fit(fit, fitOptions)
-            self._fitParameters = fit.GetParameters()
-            self._fitParErrors = fit.GetParErrors()
-            # Note: need to divide the TF1 integral by histogram bin width
-            self._nEventsFromFit = fit.Integral(self._histo.GetXaxis().GetXmin(), self._histo.GetXaxis().GetXmax())*self._normalizationFactor / self._histo.GetXaxis().GetBinWidth(1)
-            orthogonalizer = fitHelper.FitParameterOrthogonalizer(fit, fitResultObject, self._histo.GetXaxis().GetXmin(), self._histo.GetXaxis().GetXmax())
-            self._nEventsTotalErrorFromFitUp = orthogonalizer.getTotalFitParameterUncertaintyUp()
-            self._nEventsTotalErrorFromFitDown = orthogonalizer.getTotalFitParameterUncertaintyDown()
+            if fitResult == None:
+                # Do the fit
+                if not self._quietMode:
+                    print "-Using fit options:",fitOptions
+                elif not "Q" in fitOptions:
+                    fitOptions += " Q" # To suppress output
+                (initialValues, lowerLimits, upperLimits) = self._getFitParamSettings(self._binLabel)
+                fitResult = fitTemplate("fit"+self._name+self._binLabel, self._histo, self._fitFunction, self._fitRangeMin, self._fitRangeMax,
+                                        initialValues, lowerLimits, upperLimits, fitOptions, self._normalizationFactor)
+            self._fitParameters = fitResult.parameters
+            self._fitParErrors = fitResult.parErrors
+            self._nEventsFromFit = fitResult.nEventsFromFit
+            self._nEventsTotalErrorFromFitUp = fitResult.nEventsTotalErrorUp
+            self._nEventsTotalErrorFromFitDown = fitResult.nEventsTotalErrorDown
             if not self._quietMode:
                 print "\033[1mSummary of fit results:"
                 ratio = self.getNeventsFromHisto(False) / self._nEventsFromFit
                 print "    Nevents_fitted = %.1f + %.1f - %.1f"%(self._nEventsFromFit, self._nEventsTotalErrorFromFitUp, self._nEventsTotalErrorFromFitDown)
                 print "    Nevents_histo  = %.1f +- %.1f"%(self.getNeventsFromHisto(False), self.getNeventsErrorFromHisto(False))
                 print "    Ratio          = %.3f"%ratio
-                print "    Chi2 / NDf     = %.2f"%(fitResultObject.Chi2()/fitResultObject.Ndf())  
-                print "    P-value of fit = %.3e"%fitResultObject.Prob()   
+                print "    Chi2 / NDf     = %.2f"%(fitResult.chi2/fitResult.ndf)
+                print "    P-value of fit = %.3e"%fitResult.prob
                 print "\033[0m"
-                                                                                                                    # Do a plot of the fit
+            # Do a plot of the fit
             if createPlot:
                 ROOT.gStyle.SetOptFit(0)
                 ROOT.gStyle.SetOptStat(0)
+                h = aux.Clone(self._histo)
+                fit = self._fitFunction.createTF1("fit"+self._name+self._binLabel, self._fitRangeMin, self._fitRangeMax)
+                for i in range(len(self._fitParameters)):
+                    fit.SetParameter(i, self._fitParameters[i])
                 h.SetLineColor(ROOT.kBlack)
                 # fit QCD plots with blue, EWK+ttbar with green, everything else with red
                 if "EWK" in h.GetName():
@@ -598,7 +741,9 @@ class QCDNormalizationTemplate:
 
 ## Base class for QCD measurement normalization from which specialized algorithm classes inherit
 class QCDNormalizationManagerBase:
-    def __init__(self, binLabels, resultDirName, moduleInfoString):
+    ## Constructor
+    # \param nProcesses  number of processes used by fitTemplatesForAllBins()
+    def __init__(self, binLabels, resultDirName, moduleInfoString, nProcesses=1):
         self._templates = {}
         self._binLabels = binLabels
         if not os.path.exists("%s/normalisationPlots"%resultDirName):
@@ -622,6 +767,8 @@ class QCDNormalizationManagerBase:
         self._combinedFakesNormalizationDown = {}
         self._dqmKeys = OrderedDict()
         self._totalErrorRelativeForDatacards = -1.0
+        self._nProcesses = nProcesses
+        self._pendingFits = {} # (bin label, template name) -> AsyncResult of fitTemplate
         
         if not isinstance(binLabels, list):
             raise Exception("Error: binLabels needs to be a list of strings")
@@ -634,6 +781,29 @@ class QCDNormalizationManagerBase:
         self._templates[name] = q
         return q
    
+    ## Fits the templates of all bins concurrently in a pool of processes
+    # Call after the fitters and fit parameters of the templates have been set and before the loop over the bins.
+    # The results are collected in the bin loop by calculateNormalizationCoefficients(), i.e. in the same order
+    # as without this call.
+    #
+    # Does nothing if the manager was created with nProcesses=1, i.e. the templates are then fitted in the bin loop.
+    #
+    # \param binHistograms  list of (bin label, {template name: histogram}) pairs; the histograms are not modified
+    def fitTemplatesForAllBins(self, binHistograms, fitOptions):
+        if self._nProcesses <= 1:
+            return
+        if not "Q" in fitOptions:
+            fitOptions += " Q" # Do not mix the output of the fits
+        pool = multiprocessing.Pool(self._nProcesses)
+        for binLabel, histograms in binHistograms:
+            for name in sorted(histograms.keys()):
+                template = self._templates[name]
+                if template.isFittable():
+                    key = (getModifiedBinLabelString(binLabel), name)
+                    self._pendingFits[key] = pool.apply_async(fitTemplate, template.getFitArguments(histograms[name], binLabel, fitOptions))
+        pool.close()
+        print "Submitted %d template fits to %d processes"%(len(self._pendingFits), self._nProcesses)
+
     ## Plots shapes of templates
     def plotTemplates(self):
         for k in self._templates.keys():
@@ -987,7 +1157,11 @@ class QCDNormalizationManagerBase:
         for key in self._templates.keys():
             item = self._templates[key]
             if item != None and item.isFittable():
-                item.doFit(fitOptions=fitOptions, createPlot=True)
+                # Use the result of fitTemplatesForAllBins() if available
+                fitResult = self._pendingFits.pop((item.getBinLabel(), key), None)
+                if fitResult != None:
+                    fitResult = fitResult.get()
+                item.doFit(fitOptions=fitOptions, createPlot=True, fitResult=fitResult)
 
     ## Helper method to plot fitted templates (called from parent class when calculating norm.coefficients)
     def _makePlot(self, binLabel, histogramDictionary={}):
@@ -1062,8 +1236,8 @@ class QCDNormalizationManagerBase:
 #  3) w_combined = a*w_QCD + (1-a)*w_EWKfake, a determined with MC for EWK fakes
 #  N_QCD can then be obtained with w_combined*(N_data - N_EWKtau)
 class QCDNormalizationManagerDefault(QCDNormalizationManagerBase):
-    def __init__(self, binLabels, resultDirName, moduleInfoString):
-        QCDNormalizationManagerBase.__init__(self, binLabels, resultDirName, moduleInfoString)
+    def __init__(self, binLabels, resultDirName, moduleInfoString, nProcesses=1):
+        QCDNormalizationManagerBase.__init__(self, binLabels, resultDirName, moduleInfoString, nProcesses)
         self._requiredTemplateList = ["EWKFakeTaus_Baseline", "EWKFakeTaus_Inverted",
                                       "EWKGenuineTaus_Baseline", "EWKGenuineTaus_Inverted",
                                       "EWKInclusive_Baseline", "EWKInclusive_Inverted",
@@ -1181,6 +1355,44 @@ if __name__ == "__main__":
         def testGaussian(self):
             f = FitFunction("Gaussian")
             self.assertEqual(f([0],[1,0,1]), 0.3989422804014327)
+
+        def testFormula(self):
+            def check(f, par):
+                tf1 = f.createTF1("test"+f._functionName, 0, 500)
+                self.assertNotEqual(f.getFormula(), None)
+                self.assertEqual(tf1.GetNpar(), f.getNParam())
+                for x in [0.0, 40.0, 85.5, 120.0, 300.0]:
+                    self.assertAlmostEqual(tf1.EvalPar(array.array("d",[x]), array.array("d",par)), f([x], par), delta=1e-12*abs(f([x], par)))
+            qcd = FitFunction("QCDFunctionWithPeakShift", norm=1)
+            qcd.setAdditionalNormalization(0.7)
+            qcdPar = [50.0, 1.2, 0.01, 0.1, 120.0, 30.0, 0.02, 0.01]
+            check(qcd, qcdPar)
+            ewk = FitFunction("EWKFunction", boundary=150, norm=1, rejectPoints=1)
+            ewkPar = [1.0, 80.0, 40.0, 0.02]
+            check(ewk, ewkPar)
+            check(FitFunction("FitDataWithFakesAndGenuineTaus",
+                              QCDAndFakesFitFunction=qcd, parQCDAndFakes=qcdPar, QCDAndFakesnorm=1.0,
+                              EWKGenuineTausFitFunction=ewk, parEWKGenuineTaus=ewkPar, EWKGenuineTausNorm=1.0), [1.1, 0.8])
+            self.assertEqual(FitFunction("ExpFunction").getFormula(), None)
+
+        def testFormulaBranches(self):
+            # Compiled and python functions agree at the boundaries of their branches, also
+            # when the branch not taken is not finite (e.g. 0/0 or exp overflow)
+            def check(f, par, xvalues):
+                tf1 = f.createTF1("test"+f._functionName, 0, 500)
+                for x in xvalues:
+                    self.assertAlmostEqual(tf1.EvalPar(array.array("d",[x]), array.array("d",par)), f([x], par), delta=1e-12*abs(f([x], par)))
+            ewkPar = [1.0, 80.0, 40.0, 5.0] # exp(boundary*par[3]) overflows
+            check(FitFunction("EWKFunction", boundary=150, norm=1), ewkPar, [0.0, 100.0, 149.999])
+            check(FitFunction("EWKFunction", boundary=150, norm=1), [1.0, 80.0, 40.0, 0.02], [0.0, 149.999, 150.0, 150.001, 500.0])
+            check(FitFunction("EWKFunctionInv", boundary=150, norm=1), ewkPar, [0.0, 100.0, 149.999])
+            check(FitFunction("EWKFunctionInv", boundary=150, norm=1), [1.0, 80.0, 40.0, 0.02], [0.0, 149.999, 150.0, 150.001, 500.0])
+            # Rayleigh term: 0/0 at x=0 with par[0]=0, and par[0]+par[1]*x=0 at x=50
+            check(FitFunction("QCDFunction", norm=1), [0.0, 1.2, 0.1, 120.0, 30.0, 0.02, 0.01], [0.0])
+            check(FitFunction("QCDFunction", norm=1), [-60.0, 1.2, 0.1, 120.0, 30.0, 0.02, 0.01], [0.0, 50.0, 500.0])
+            check(FitFunction("QCDFunctionWithPeakShift", norm=1), [0.0, 1.2, 0.0, 0.1, 120.0, 30.0, 0.02, 0.01], [0.0])
+            check(FitFunction("QCDEWKFunction", norm=1), [0.0, 1.2, 0.1, 120.0, 30.0, 0.02, 0.01], [0.0])
+            check(FitFunction("RayleighFunction", norm=1), [0.0, 1.2], [0.0])
             
     class TestQCDNormalizationTemplate(unittest.TestCase):
         def _getGaussianHisto(self):
@@ -1320,4 +1532,20 @@ if __name__ == "__main__":
             self.assertLess(abs(q.getNeventsTotalErrorFromFit()[1]-1.003), 0.1)
             #q.printResults()
 
+        def testFitArguments(self):
+            import pickle
+            q = QCDNormalizationTemplate("EWK testline", "dummy",quietMode=True)
+            q.setFitter(FitFunction("Gaussian"), 0, 10)
+            q.setFitParamForBin("Inclusive bin", initialValue=[1,4,2], lowerLimit=[0.01, 0, 0], upperLimit=[100, 10, 10])
+            h = self._getGaussianHisto()
+            # The result of a fit done elsewhere (e.g. in a process pool) is the same as from doFit()
+            args = pickle.loads(pickle.dumps(q.getFitArguments(h, "Inclusive bin", "S R L Q")))
+            self.assertEqual(h.GetBinContent(4), 213) # histogram not modified
+            result = pickle.loads(pickle.dumps(fitTemplate(*args)))
+            q.setHistogram(h, "Inclusive bin")
+            q.doFit(fitOptions="S R L Q", createPlot=False)
+            self.assertEqual(q.getFittedParameters(), result.parameters)
+            self.assertEqual(q.getNeventsFromFit(), result.nEventsFromFit)
+            self.assertEqual(len(result.covariance), 3)
+
     unittest.main()
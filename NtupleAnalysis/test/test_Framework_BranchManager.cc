@@ -69,6 +69,25 @@ TEST_CASE("BranchManager works", "[Framework]") {
     CHECK( b_event2->value() == 2 );
   }
 
+  SECTION("Enabled branches") {
+    const Branch<unsigned long long> *b_event = nullptr;
+    const Branch<std::vector<int> > *b_num1 = nullptr;
+    const Branch<int> *b_missing = nullptr;
+
+    CHECK( mgr.getEnabledBranchNames().empty() );
+    CHECK( mgr.getEnabledBytesPerEntry() == 0 );
+
+    mgr.book("num1", &b_num1);
+    mgr.book("event", &b_event);
+    mgr.book("missing", &b_missing);
+    REQUIRE( !b_missing->isValid() );
+
+    std::vector<std::string> names = mgr.getEnabledBranchNames();
+    REQUIRE( names.size() == 2 );
+    CHECK( names[0] == "event" );
+    CHECK( names[1] == "num1" );
+  }
+
   SECTION("Incorrect type throws exception") {
     const Branch<unsigned long long> *event1 = nullptr;
     const Branch<int> *event2 = nullptr;
@@ -0,0 +1,109 @@
+#include "catch.hpp"
+
+#include "Framework/interface/SharedSelections.h"
+#include "Framework/interface/EventWeight.h"
+#include "Framework/interface/EventCounter.h"
+#include "Framework/interface/HistoWrapper.h"
+
+#include "TDirectory.h"
+#include "TH1F.h"
+
+namespace {
+  // Histograms and counters of one analyzer with a selection stage
+  struct Module {
+    Module(const std::string& key, double weight)
+    : ec(fWeight), wrapper(fWeight, "Vital"), dir("rootdir", "rootdir"), client("Stage", key),
+      cAll(ec.addCounter("all")), cPassed(ec.addCounter("passed")), nEvaluations(0) {
+      fWeight.multiplyWeight(weight);
+      hValue = wrapper.makeTH<TH1F>(HistoLevel::kVital, &dir, "value", "value", 10, 0, 10);
+    }
+
+    int analyze(int value) {
+      return client.analyze<int>([&]() {
+          ++nEvaluations;
+          cAll.increment();
+          hValue->Fill(value);
+          if (value > 4)
+            cPassed.increment();
+          return 2*value;
+        });
+    }
+
+    EventWeight fWeight;
+    EventCounter ec;
+    HistoWrapper wrapper;
+    TDirectory dir;
+    SharedSelections::Client client;
+    Count cAll;
+    Count cPassed;
+    WrappedTH1 *hValue;
+    int nEvaluations;
+  };
+}
+
+TEST_CASE("SharedSelections works", "[Framework]") {
+  SharedSelections::clear();
+
+  SECTION("Identical stages are evaluated once") {
+    SharedSelections::setEnabled(true);
+    Module a("Stage|1", 1.0);
+    Module b("Stage|1", 2.0);
+    Module c("Stage|2", 1.0);
+
+    // All fills and counts of the stage happen in the first event
+    int values[] = {5, 3, 7};
+    for (int value: values) {
+      SharedSelections::beginEvent();
+      CHECK( a.analyze(value) == 2*value );
+      CHECK( b.analyze(value) == 2*value );
+      CHECK( c.analyze(value) == 2*value );
+    }
+    // b evaluates the stage itself only in the first event to learn the matching of the histograms and counters
+    CHECK( a.nEvaluations == 3 );
+    CHECK( b.nEvaluations == 1 );
+    CHECK( c.nEvaluations == 3 );
+
+    CHECK( b.ec.getValueByName("all") == 3 );
+    CHECK( b.ec.getValueByName("passed") == 2 );
+    // Replayed fills use the event weight of b
+    CHECK( b.hValue->getHisto()->GetBinContent(4) == 2.0 );
+    CHECK( b.hValue->getHisto()->GetBinContent(6) == 2.0 );
+    CHECK( b.hValue->getHisto()->GetBinContent(8) == 2.0 );
+    CHECK( a.hValue->getHisto()->GetBinContent(8) == 1.0 );
+  }
+
+  SECTION("Objects not seen yet are learned") {
+    SharedSelections::setEnabled(true);
+    Module a("Stage|1", 1.0);
+    Module b("Stage|1", 1.0);
+
+    // The first event does not increment cPassed, so b evaluates the stage again in the second event
+    int values[] = {3, 5, 7};
+    for (int value: values) {
+      SharedSelections::beginEvent();
+      a.analyze(value);
+      b.analyze(value);
+    }
+    CHECK( a.nEvaluations == 3 );
+    CHECK( b.nEvaluations == 2 );
+    CHECK( b.ec.getValueByName("all") == 3 );
+    CHECK( b.ec.getValueByName("passed") == 2 );
+  }
+
+  SECTION("Disabled sharing") {
+    SharedSelections::setEnabled(false);
+    Module a("Stage|1", 1.0);
+    Module b("Stage|1", 1.0);
+    for (int value = 0; value < 3; ++value) {
+      SharedSelections::beginEvent();
+      a.analyze(value);
+      b.analyze(value);
+    }
+    CHECK( a.nEvaluations == 3 );
+    CHECK( b.nEvaluations == 3 );
+    CHECK( b.ec.getValueByName("all") == 3 );
+  }
+
+  SharedSelections::setEnabled(false);
+  SharedSelections::clear();
+}